@@ -302,6 +302,72 @@ export const transcribeImage = async (imageId, modelName, ignoreEdges = true, ad
   }
 };
 
+// Server-Sent Events from a fetch() response; EventSource can't POST a form.
+const readServerSentEvents = async (response, onEvent) => {
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = "";
+  for (;;) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+    let boundary;
+    while ((boundary = buffer.indexOf("\n\n")) !== -1) {
+      const block = buffer.slice(0, boundary);
+      buffer = buffer.slice(boundary + 2);
+      let event = "message";
+      const data = [];
+      for (const line of block.split("\n")) {
+        if (line.startsWith("event:")) event = line.slice(6).trim();
+        else if (line.startsWith("data:")) data.push(line.slice(5).trimStart());
+      }
+      if (data.length) onEvent(event, JSON.parse(data.join("\n")));
+    }
+  }
+};
+
+// Same as transcribeImage, but reports the page as it is transcribed:
+// onEvent(event, data) gets "segmentation", one "line" per recognised piece,
+// "text" after recognition and each correction, then "done" or "error".
+// Resolves with the "done" data, like transcribeImage resolves with its JSON.
+export const transcribeImageStream = async (imageId, modelName, ignoreEdges = true, addPageBreak = false, redThreshold = 5.0, enhancedMultiColumn = false, columnGapRatio = 0.045, autofixErrors = true, aiCorrect = false, onEvent = () => {}) => {
+  try {
+    const formData = new FormData();
+    formData.append("modelName", modelName);
+    formData.append("ignoreEdges", ignoreEdges);
+    formData.append("addPageBreak", addPageBreak);
+    formData.append("redThreshold", redThreshold);
+    formData.append("enhancedMultiColumn", enhancedMultiColumn);
+    formData.append("columnGapRatio", columnGapRatio);
+    formData.append("autofixErrors", autofixErrors);
+    formData.append("aiCorrect", aiCorrect);
+    const response = await apiRequest(`${SERVER_URL}/api/transcribe/${imageId}/stream`, {
+      method: "POST",
+      body: formData,
+    });
+    if (!response.ok) {
+      const errorData = await response.json();
+      throw new Error(errorData.message || "Transcription failed");
+    }
+    let result = null;
+    await readServerSentEvents(response, (event, data) => {
+      if (event === "done") result = data;
+      else if (event === "error") throw new Error(data.message || "Transcription failed");
+      onEvent(event, data);
+    });
+    if (!result) throw new Error("Transcription stream ended early");
+    return result;
+  } catch (error) {
+    toaster.create({
+      title: "Error",
+      description: error.message || "Failed to transcribe image",
+      type: "error",
+      duration: 3000,
+    });
+    throw error;
+  }
+};
+
 export const fetchProjectContent = async (projectId) => {
   try {
     const response = await apiRequest(
@@ -17,7 +17,7 @@ import {
   Checkbox,
 } from "@chakra-ui/react";
 import { toaster } from "@/components/ui/toaster";
-import { transcribeImage } from "../apiUtils";
+import { transcribeImageStream } from "../apiUtils";
 import RedSensitivitySlider from "./RedSensitivitySlider";
 import ColumnSensitivitySlider from "./ColumnSensitivitySlider";
 import {
@@ -73,6 +73,8 @@ const Transcribe = ({
   const [progress, setProgress] = useState({ current: 0, total: 0 });
   const [totalLines, setTotalLines] = useState(0);
   const [stopRequested, setStopRequested] = useState(false);
+  // The page being transcribed, as the server reports it
+  const [pageProgress, setPageProgress] = useState(null);
 
   // Update page count and end page when images change
   useEffect(() => {
@@ -108,7 +110,8 @@ const Transcribe = ({
         }
 
         try {
-          const result = await transcribeImage(
+          setPageProgress({ lines: [], total: 0, stage: "segmentation" });
+          const result = await transcribeImageStream(
             imageId,
             model,
             ignoreEdges,
@@ -117,7 +120,18 @@ const Transcribe = ({
             enhancedMultiColumn,
             sensitivityToColumnGapRatio(columnSensitivity),
             autofixErrors,
-            aiCorrect
+            aiCorrect,
+            (event, data) => {
+              if (event === "line") {
+                setPageProgress((current) => {
+                  const lines = [...current.lines];
+                  lines[data.order] = data;
+                  return { ...current, lines, total: data.total, stage: "recognition" };
+                });
+              } else if (event === "text") {
+                setPageProgress((current) => ({ ...current, stage: data.stage }));
+              }
+            }
           );
           if (result.status === "success") {
             transcribedCount += 1;
@@ -168,6 +182,7 @@ const Transcribe = ({
     } finally {
       setIsTranscribing(false);
       setStopRequested(false);
+      setPageProgress(null);
     }
   };
 
@@ -328,6 +343,26 @@ const Transcribe = ({
                   </HStack>
                 </Progress.Root>
                 <Text>Total lines transcribed: {totalLines}</Text>
+                {pageProgress && (
+                  <Box>
+                    <Text fontSize="sm" color="gray.600">
+                      {pageProgress.stage === "segmentation" && "Finding lines…"}
+                      {pageProgress.stage === "recognition" &&
+                        `Recognised ${pageProgress.lines.filter(Boolean).length}/${pageProgress.total} lines`}
+                      {pageProgress.stage === "autofix" && (aiCorrect ? "Correcting with AI…" : "Saving…")}
+                      {pageProgress.stage === "ai_correct" && "Saving…"}
+                    </Text>
+                    <Box maxH="40" overflowY="auto" fontSize="sm" borderWidth="1px" borderRadius="md" p="2">
+                      {pageProgress.lines.map((line) =>
+                        line ? (
+                          <Text key={line.order} color={line.color === "red" ? "red.600" : undefined}>
+                            {line.text}
+                          </Text>
+                        ) : null
+                      )}
+                    </Box>
+                  </Box>
+                )}
               </>
             )}
           </Stack>
@@ -40,6 +40,9 @@ const UserDetails = () => {
   const [currentPassword, setCurrentPassword] = useState("");
   const [domainConfig, setDomainConfig] = useState({});
   const [transcriptionWorkers, setTranscriptionWorkers] = useState(1);
+  // Server-wide settings in domain_config.json that aren't per-domain entries
+  // (recognition_batch_size, model_cache_size, ...); kept as-is on save.
+  const [serverSettings, setServerSettings] = useState({});
   const [newDomain, setNewDomain] = useState({ domain: "", sleep_seconds: 0, timeout: 60 });
   const [domainConfigSaving, setDomainConfigSaving] = useState(false);
   const navigate = useNavigate();
@@ -49,8 +52,18 @@ const UserDetails = () => {
     if (currentUser?.is_admin) {
       fetchUsers().then(setUsers);
       getDomainConfig().then((cfg) => {
-        const { transcription_workers, ...domainOnly } = cfg;
+        const { transcription_workers, ...rest } = cfg;
+        const domainOnly = {};
+        const settings = {};
+        Object.entries(rest).forEach(([key, value]) => {
+          if (value && typeof value === "object" && !Array.isArray(value)) {
+            domainOnly[key] = value;
+          } else {
+            settings[key] = value;
+          }
+        });
         setTranscriptionWorkers(transcription_workers ?? 1);
+        setServerSettings(settings);
         setDomainConfig(domainOnly);
       }).catch(() => {});
     }
@@ -62,7 +75,7 @@ const UserDetails = () => {
   const handleSaveDomainConfig = async () => {
     setDomainConfigSaving(true);
     try {
-      await saveDomainConfig({ transcription_workers: Number(transcriptionWorkers), ...domainConfig });
+      await saveDomainConfig({ ...serverSettings, transcription_workers: Number(transcriptionWorkers), ...domainConfig });
     } catch (e) {
       console.error("Failed to save domain config:", e);
     } finally {
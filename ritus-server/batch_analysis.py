@@ -1,15 +1,20 @@
 import os
 import re
 import json
+import numpy as np
 import pandas as pd
 from rapidfuzz import process, fuzz
 import logging
 from models import db, Content, BatchProcessing
+from progress_writer import DEFAULT_INTERVAL_SECONDS, ProgressWriter
 from threading import Thread
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
+# Score cells per process.cdist call in best_matches(), ~8 MB of float64
+CDIST_CHUNK_CELLS = 1 << 20
+
 # --- Utility Functions ---
 
 def tokenize(text):
@@ -58,11 +63,11 @@ def build_phrases_tokens(phrases, phrases_conc_by_word):
     logger.info("Built tokens")
     return phrases_tokens
 
-def build_text_tokens(content_rows, batch_process):
+def build_text_tokens(content_rows, progress):
     text_tokens = []
     word_global_counter = 0
     total_rows = len(content_rows)
-    batch_process.total_rows = total_rows
+    progress.update(total_rows=total_rows)
     for i, row in enumerate(content_rows):
         try:
             if isinstance(row.data, str):
@@ -90,46 +95,78 @@ def build_text_tokens(content_rows, batch_process):
                 "corcordance_id": None,
                 "content_data": content_data.copy()  # Deep copy to preserve source fields
             })
-        batch_process.processed_rows = i + 1
-        batch_process.progress = 5 + min(((i + 1) / total_rows) * 5, 5)  # 5-10%
-        db.session.commit()
+        progress.update(processed_rows=i + 1, progress=5 + min(((i + 1) / total_rows) * 5, 5))  # 5-10%
         logger.info(f"Processed row {row.id}: {len(words)} tokens")
     logger.info(f"Built {len(text_tokens)} tokens")
     return text_tokens
 
-def annotate_text_tokens(text_tokens, phrases_conc_by_word, similarity_threshold=75, batch_process=None):
+def best_matches(words, choices, score_cutoff, workers=-1, on_chunk=None):
+    """Best fuzz.ratio match among choices of each distinct word, as {word: (choice, score)}.
+
+    Same result as process.extractOne(word, choices, scorer=fuzz.ratio,
+    score_cutoff=score_cutoff) per word, but every word is scored once, in
+    process.cdist calls on `workers` threads (-1: all cores). Words without
+    a match are left out. on_chunk(done, total) is called after each call.
+    """
+    distinct = list(dict.fromkeys(words))
+    matches = {}
+    if not distinct or not choices:
+        return matches
+    rows = max(1, CDIST_CHUNK_CELLS // len(choices))
+    for start in range(0, len(distinct), rows):
+        chunk = distinct[start:start + rows]
+        # float64 keeps the scores extractOne gives
+        scores = process.cdist(chunk, choices, scorer=fuzz.ratio, score_cutoff=score_cutoff,
+                               dtype=np.float64, workers=workers)
+        # argmax takes the first best choice, as extractOne does
+        best = scores.argmax(axis=1)
+        for word, index, row in zip(chunk, best, scores):
+            if row[index] >= score_cutoff:
+                matches[word] = (choices[index], float(row[index]))
+        if on_chunk:
+            on_chunk(start + len(chunk), len(distinct))
+    return matches
+
+def annotate_text_tokens(text_tokens, phrases_conc_by_word, similarity_threshold=75, progress=None, workers=-1):
     choices = list(phrases_conc_by_word.keys())
     if not choices:
         logger.error("No phrases available for annotation")
         raise ValueError("No phrases available for matching")
-    total_tokens = len(text_tokens)
-    for i, token in enumerate(text_tokens):
-        try:
-            match = process.extractOne(token["original_word"], choices, scorer=fuzz.ratio, score_cutoff=similarity_threshold)
-            if match:
-                token["corcordance_id"] = phrases_conc_by_word[match[0]]["id"]
-                token["corcordance_similarity"] = match[1]
-            else:
-                token["corcordance_id"] = None
-                token["corcordance_similarity"] = 0
-        except Exception as e:
-            logger.error(f"Error annotating token '{token['original_word']}': {e}")
+
+    def on_chunk(done, total):
+        if progress:
+            progress.update(progress=10 + min((done / total) * 5, 5))  # 10-15%
+
+    matches = best_matches((token["original_word"] for token in text_tokens), choices, similarity_threshold,
+                           workers=workers, on_chunk=on_chunk)
+    for token in text_tokens:
+        match = matches.get(token["original_word"])
+        if match:
+            token["corcordance_id"] = phrases_conc_by_word[match[0]]["id"]
+            token["corcordance_similarity"] = match[1]
+        else:
             token["corcordance_id"] = None
             token["corcordance_similarity"] = 0
-        if batch_process and total_tokens > 0:
-            batch_process.progress = 10 + min(((i + 1) / total_tokens) * 5, 5)  # 10-15%
-            db.session.commit()
-    logger.info("Completed annotating tokens")
+    logger.info(f"Completed annotating tokens ({len(text_tokens)} tokens, {len(matches)} distinct words matched)")
     return text_tokens
 
-def refine_text_tokens(text_tokens, phrases_conc_by_word, similarity_threshold=75, batch_process=None):
+def refine_text_tokens(text_tokens, phrases_conc_by_word, similarity_threshold=75, progress=None, workers=-1):
     refined_tokens = []
     choices = list(phrases_conc_by_word.keys())
     if not choices:
         logger.error("No phrases available for refinement")
         raise ValueError("No phrases available for refinement")
+
+    def on_chunk(done, total):
+        if progress:
+            progress.update(progress=15 + min((done / total) * 5, 5))  # 15-20%
+
+    # Every adjacent pair is a merge candidate; score them all up front
+    combined_matches = best_matches(
+        (text_tokens[i]["original_word"] + text_tokens[i + 1]["original_word"] for i in range(len(text_tokens) - 1)),
+        choices, 80, workers=workers, on_chunk=on_chunk,
+    )
     word_global_counter = 0
-    total_tokens = len(text_tokens)
     i = 0
     while i < len(text_tokens):
         token = text_tokens[i]
@@ -139,30 +176,24 @@ def refine_text_tokens(text_tokens, phrases_conc_by_word, similarity_threshold=7
         if i < len(text_tokens) - 1:
             next_token = text_tokens[i + 1]
             combined_word = current_word + next_token["original_word"]
-            try:
-                combined_match = process.extractOne(combined_word, choices, scorer=fuzz.ratio, score_cutoff=80)
-                combined_similarity = combined_match[1] if combined_match else 0
-                if combined_similarity > max(current_similarity, next_token["corcordance_similarity"]) and combined_similarity > 80:
-                    word_global_counter += 1
-                    refined_tokens.append({
-                        "page_name": token["page_name"],
-                        "original_word": combined_word,
-                        "word_number": str(word_global_counter),
-                        "corcordance_id": phrases_conc_by_word[combined_match[0]]["id"] if combined_match else None,
-                        "corcordance_similarity": combined_similarity,
-                        "content_data": content_data.copy()  # Preserve source fields
-                    })
-                    logger.info(f"Merged: {current_word} ({current_similarity}) + {next_token['original_word']} -> {combined_word} ({combined_similarity})")
-                    i += 2
-                    continue
-            except Exception as e:
-                logger.error(f"Error refining token pair '{combined_word}': {e}")
+            combined_match = combined_matches.get(combined_word)
+            combined_similarity = combined_match[1] if combined_match else 0
+            if combined_similarity > max(current_similarity, next_token["corcordance_similarity"]) and combined_similarity > 80:
+                word_global_counter += 1
+                refined_tokens.append({
+                    "page_name": token["page_name"],
+                    "original_word": combined_word,
+                    "word_number": str(word_global_counter),
+                    "corcordance_id": phrases_conc_by_word[combined_match[0]]["id"] if combined_match else None,
+                    "corcordance_similarity": combined_similarity,
+                    "content_data": content_data.copy()  # Preserve source fields
+                })
+                logger.info(f"Merged: {current_word} ({current_similarity}) + {next_token['original_word']} -> {combined_word} ({combined_similarity})")
+                i += 2
+                continue
         word_global_counter += 1
         token["word_number"] = str(word_global_counter)
         refined_tokens.append(token)
-        if batch_process and total_tokens > 0:
-            batch_process.progress = 15 + min(((i + 1) / total_tokens) * 5, 5)  # 15-20%
-            db.session.commit()
         i += 1
     logger.info(f"Refined {len(refined_tokens)} tokens")
     return refined_tokens
@@ -250,7 +281,7 @@ def reassign_data(results, text_tokens):
         r += 1
     return results
 
-def search_phrases_in_text_by_fragment(text_tokens, phrases, similarity_threshold=80, batch_process=None):
+def search_phrases_in_text_by_fragment(text_tokens, phrases, similarity_threshold=80, progress=None):
     FRAGMENT_LEN = 5674
     words = text_tokens
     choices = {k: v for k, v in phrases.items()}
@@ -303,20 +334,16 @@ def search_phrases_in_text_by_fragment(text_tokens, phrases, similarity_threshol
             part1, part2 = cut_text_on_space(text_fragment)
             smart_append_unfound_result(part1, results, content_data.copy())
             text_fragment = part2
-        if batch_process and total_words > 0:
-            batch_process.progress = 20 + min((w / total_words) * 10, 10)  # 20-30%
-            batch_process.processed_rows = len(results)
-            db.session.commit()
+        if progress and total_words > 0:
+            progress.update(progress=20 + min((w / total_words) * 10, 10), processed_rows=len(results))  # 20-30%
     if text_fragment:
         smart_append_unfound_result(text_fragment, results, content_data.copy())
-    if batch_process:
-        batch_process.progress = 80
-        batch_process.processed_rows = len(results)
-        db.session.commit()
+    if progress:
+        progress.update(progress=80, processed_rows=len(results))
     logger.info(f"Content search completed with {len(results)} rows")
     return results
 
-def research_unfound_phrases(results, phrases, similarity_threshold=50, batch_process=None, is_rite=False, progress_min=0, progress_max=100):
+def research_unfound_phrases(results, phrases, similarity_threshold=50, progress=None, is_rite=False, progress_min=0, progress_max=100):
     total_results = len(results)
     choices = {k: v for k, v in phrases.items()}
     if not choices:
@@ -389,60 +416,71 @@ def research_unfound_phrases(results, phrases, similarity_threshold=50, batch_pr
             result["check_again"] = "0"
             result["similarity_percentage"] = 0
             updated_results.append(result)
-        if batch_process and total_results > 0:
-            batch_process.progress = min(progress_min+ ((i + 1) / total_results) * (progress_max-progress_min), progress_max)  # 80-90%
-            batch_process.processed_rows = len(updated_results)
-            db.session.commit()
+        if progress and total_results > 0:
+            progress.update(
+                progress=min(progress_min+ ((i + 1) / total_results) * (progress_max-progress_min), progress_max),  # 80-90%
+                processed_rows=len(updated_results),
+            )
     logger.info(f"Processed {len(updated_results)} entries")
     return updated_results
 
 # --- Main Processing Function ---
 
-def batch_process_project(project_id, similarity_threshold, phrases_csv="static/data/formulas.csv", phrases2_csv="static/data/rite_names.csv"):
+def progress_writer(batch_process, interval_seconds=DEFAULT_INTERVAL_SECONDS):
+    """ProgressWriter setting the fields of batch_process and committing the session.
+
+    Each write also reloads batch_process, so a cancellation shows up in its
+    status at the next write.
+    """
+    def write(values):
+        for name, value in values.items():
+            setattr(batch_process, name, value)
+        db.session.commit()
+
+    return ProgressWriter(write, interval_seconds)
+
+
+def batch_process_project(project_id, similarity_threshold, phrases_csv="static/data/formulas.csv", phrases2_csv="static/data/rite_names.csv", progress_interval_seconds=DEFAULT_INTERVAL_SECONDS, match_workers=-1):
 
     logger.info(f"STARTING Full Automatic Lookup and Split : Bath Process with similarity_threshold: {similarity_threshold}")
 
     batch_process = db.session.query(BatchProcessing).filter_by(project_id=project_id).first()
     if not batch_process or batch_process.status != "running":
         return None
+    # Progress is written at most every progress_interval_seconds
+    progress = progress_writer(batch_process, progress_interval_seconds)
 
     try:
         # Load phrases
         formula_phrases = load_phrases(phrases_csv)
         phrases_conc_by_id, phrases_conc_by_word = build_phrases_concordance(formula_phrases)
         phrases_tokens = build_phrases_tokens(formula_phrases, phrases_conc_by_word)
-        batch_process.progress = 2.5
-        db.session.commit()
+        progress.update(progress=2.5)
 
         rite_phrases = load_phrases(phrases2_csv)
-        batch_process.progress = 5  # After 12 formula passes (12 * 6.67 = 80.04) + initialization
-        db.session.commit()
+        progress.update(progress=5)  # After 12 formula passes (12 * 6.67 = 80.04) + initialization
 
         # Load content rows
         content_rows = db.session.query(Content).filter_by(project_id=project_id).all()
         if not content_rows:
             logger.warning(f"No content rows for project {project_id}")
-            batch_process.status = "completed"
-            batch_process.progress = 100
-            db.session.commit()
+            progress.state(status="completed", progress=100)
             return None
 
         # Build text tokens
-        text_tokens = build_text_tokens(content_rows, batch_process)#5-10%
+        text_tokens = build_text_tokens(content_rows, progress)#5-10%
         if not text_tokens:
             logger.warning(f"No text tokens for {project_id}")
-            batch_process.status = "completed"
-            batch_process.progress = 100
-            db.session.commit()
+            progress.state(status="completed", progress=100)
             return None
 
         # Annotate and refine tokens
-        text_tokens = annotate_text_tokens(text_tokens, phrases_conc_by_word, similarity_threshold, batch_process=batch_process)#10-15%
-        text_tokens_refined = refine_text_tokens(text_tokens, phrases_conc_by_word, similarity_threshold, batch_process=batch_process)#15%-20%
+        text_tokens = annotate_text_tokens(text_tokens, phrases_conc_by_word, similarity_threshold, progress=progress, workers=match_workers)#10-15%
+        text_tokens_refined = refine_text_tokens(text_tokens, phrases_conc_by_word, similarity_threshold, progress=progress, workers=match_workers)#15%-20%
 
         # Search phrases
         logger.info("Searching phrases...")
-        results = search_phrases_in_text_by_fragment(text_tokens_refined, formula_phrases, similarity_threshold, batch_process=batch_process)#20-30%
+        results = search_phrases_in_text_by_fragment(text_tokens_refined, formula_phrases, similarity_threshold, progress=progress)#20-30%
 
         # Iterative refinement for formulas
         new_results = []
@@ -454,7 +492,7 @@ def batch_process_project(project_id, similarity_threshold, phrases_csv="static/
                 logger.info(f"Batch process cancelled for project {project_id}")
                 return None
             logger.info(f"Pass {passes_cntr}/{max_passes}, detected {changes} items")
-            new_results = research_unfound_phrases(results, formula_phrases, similarity_threshold, batch_process=batch_process, is_rite=False, progress_min=30+((passes_cntr+1)/(max_passes+2))*40,progress_max=30+((passes_cntr+2)/(max_passes+2))*40 )#30%-70%
+            new_results = research_unfound_phrases(results, formula_phrases, similarity_threshold, progress=progress, is_rite=False, progress_min=30+((passes_cntr+1)/(max_passes+2))*40,progress_max=30+((passes_cntr+2)/(max_passes+2))*40 )#30%-70%
             passes_cntr += 1
             changes = len(new_results) - len(results)
             results = new_results.copy()
@@ -478,7 +516,7 @@ def batch_process_project(project_id, similarity_threshold, phrases_csv="static/
                 logger.info(f"Batch process cancelled for project {project_id}")
                 return None
             logger.info(f"Pass {passes_cntr}/{max_passes}, detected {changes} items")
-            new_results = research_unfound_phrases(results, rite_phrases, similarity_threshold, batch_process=batch_process, is_rite=True, progress_min=70+((passes_cntr+1)/(max_passes+2))*20,progress_max=70+((passes_cntr+2)/(max_passes+2))*20 )#70%-90%
+            new_results = research_unfound_phrases(results, rite_phrases, similarity_threshold, progress=progress, is_rite=True, progress_min=70+((passes_cntr+1)/(max_passes+2))*20,progress_max=70+((passes_cntr+2)/(max_passes+2))*20 )#70%-90%
             passes_cntr += 1
             changes = len(new_results) - len(results)
             results = new_results.copy()
@@ -486,8 +524,7 @@ def batch_process_project(project_id, similarity_threshold, phrases_csv="static/
 
         # Reassign data
         results = reassign_data(results, text_tokens_refined)
-        batch_process.progress = 90
-        db.session.commit()
+        progress.state(progress=90)
 
         # Clear existing content
         db.session.query(Content).filter_by(project_id=project_id).delete()
@@ -498,6 +535,7 @@ def batch_process_project(project_id, similarity_threshold, phrases_csv="static/
         for i, result in enumerate(results):
             if batch_process.status != "running":
                 logger.info(f"Batch process cancelled for {project_id}")
+                progress.flush()  # Keep the rows saved so far
                 return None
             content_data = result["content_data"].copy()  # Preserve source fields
             logger.info("PRE:")
@@ -511,18 +549,18 @@ def batch_process_project(project_id, similarity_threshold, phrases_csv="static/
             logger.info(json.dumps(content_data))
             content = Content(project_id=project_id, data=json.dumps(content_data))
             db.session.add(content)
-            batch_process.processed_rows = i + 1
-            batch_process.progress = 90 + min((i + 1) / total_rows * 10, 10) if total_rows > 0 else 100
-            db.session.commit()
+            # The rows are committed with the progress
+            progress.update(
+                processed_rows=i + 1,
+                progress=90 + min((i + 1) / total_rows * 10, 10) if total_rows > 0 else 100,
+            )
 
-        batch_process.status = "completed"
-        batch_process.progress = 100.0
-        db.session.commit()
+        progress.state(status="completed", progress=100.0)
         logger.info(f"Batch process completed for project {project_id}")
+        logger.info(f"Batch process progress: {progress.updates} updates in {progress.writes} writes")
 
     except Exception as e:
-        batch_process.status = "failed"
-        batch_process.error_message = str(e)
-        db.session.commit()
+        db.session.rollback()
+        progress.state(status="failed", error_message=str(e))
         logger.error(f"Batch process failed for project {project_id}: {e}")
         raise
\ No newline at end of file
@@ -0,0 +1,167 @@
+"""
+batch_recognition.py
+
+Batched text recognition for baseline-segmented lines.
+
+``kraken.rpred.rpred`` recognises one line per forward pass. That is fine for
+a handful of lines, but ``transcribe_image_by_id`` splits every segmented
+line into red/black pieces first, so a 40-line page with rubrics easily
+turns into 60-100 tiny forward passes, each paying the full per-call
+overhead of the network.
+
+``recognize_lines`` does the same work as ``rpred`` for a whole list of
+lines at once:
+
+1. Every line is extracted and converted to a tensor exactly the way
+   ``rpred`` does it (same polygon extractor, same ``ImageInputTransforms``,
+   same padding), so each line's input is bit-for-bit what ``rpred`` would
+   have fed the network.
+2. Lines are sorted by width and grouped into mini-batches of
+   ``batch_size``; each batch is right-padded with zeros (the background
+   value after kraken's inversion) to its widest line and run through the
+   recognizer in one forward pass, with the true per-line widths passed as
+   sequence lengths so the decoder never reads into the padding.
+3. Results are returned in the original line order, as the same
+   ``BaselineOCRRecord`` objects ``rpred`` yields, so callers can keep using
+   ``str(record)``.
+
+A line that cannot be extracted or converted produces an empty record (as in
+``rpred``); if a whole batch fails its lines are retried one at a time so one
+bad line can never cost the rest of the page.
+"""
+
+import dataclasses
+import logging
+
+import torch
+import torch.nn.functional as F
+
+from kraken.containers import BaselineOCRRecord
+from kraken.lib.dataset import ImageInputTransforms
+from kraken.lib.exceptions import KrakenInputException
+from kraken.lib.segmentation import extract_polygons
+
+logger = logging.getLogger(__name__)
+
+# Lines per forward pass when nothing else is configured (see
+# "recognition_batch_size" in domain_config.json).
+DEFAULT_BATCH_SIZE = 16
+
+
+def _empty_record(line):
+    return BaselineOCRRecord('', [], [], line)
+
+
+def _line_tensor(network, image, seg, line, transforms):
+    """Extract one line and convert it to the network's input tensor.
+
+    Mirrors ``kraken.rpred.mm_rpred._recognize_baseline_line`` up to (but
+    not including) the forward pass. Returns ``None`` when ``rpred`` would
+    have emitted an empty record for this line.
+    """
+    line_seg = dataclasses.replace(seg, lines=[line])
+    try:
+        box, _coords = next(extract_polygons(image, line_seg, legacy=network.nn.use_legacy_polygons))
+    except KrakenInputException as e:
+        logger.warning(f"Extracting line failed: {e}")
+        return None, None
+    if 0 in box.size:
+        logger.warning(f"{line.id} with zero dimension. Emitting empty record.")
+        return None, None
+    try:
+        ts_box = transforms(box)
+    except Exception as e:
+        logger.warning(f"Tensor conversion failed with {e}. Emitting empty record.")
+        return None, None
+    if ts_box.max() == ts_box.min():
+        logger.warning("Empty line after tensor conversion. Emitting empty record.")
+        return None, None
+    return ts_box, box
+
+
+def _to_record(preds, line, box_width, input_width, output_width, pad):
+    """Build the same record ``rpred`` builds from one decoded sequence."""
+    net_scale = input_width / output_width
+    in_scale = box_width / (input_width - 2 * pad)
+
+    def scale(val):
+        return int(round(min(max(((val * net_scale) - pad) * in_scale, 0), box_width - 1)))
+
+    prediction = ''.join(x[0] for x in preds)
+    cuts = [[scale(start), scale(end)] for _, start, end, _ in preds]
+    confidences = [c for _, _, _, c in preds]
+    return BaselineOCRRecord(prediction, cuts, confidences, line).logical_order(base_dir=None)
+
+
+def _predict_batch(network, items, pad):
+    """Run one padded mini-batch. ``items`` is a list of (index, tensor, box, line)."""
+    widths = [tensor.shape[2] for _, tensor, _, _ in items]
+    max_width = max(widths)
+    batch = torch.stack([F.pad(tensor, pad=(0, max_width - tensor.shape[2])) for _, tensor, _, _ in items])
+    # Same decoding as TorchSeqRecognizer.predict(), but keeping the output
+    # lengths: they are needed to map character positions back per line.
+    outputs, output_lens = network.forward(batch, torch.LongTensor(widths))
+    records = []
+    for (index, tensor, box, line), seq, seq_len in zip(items, outputs, output_lens):
+        preds = network.codec.decode(network.decoder(seq[:, :seq_len]))
+        records.append((index, _to_record(preds, line, box.size[0], tensor.shape[2], int(seq_len), pad)))
+    return records
+
+
+def recognize_lines(network, image, seg, lines, batch_size=DEFAULT_BATCH_SIZE, pad=16, on_records=None):
+    """Recognise ``lines`` of ``image`` in padded mini-batches.
+
+    Args:
+        network: A loaded ``TorchSeqRecognizer`` (``kraken.lib.models.load_any``).
+        image: PIL image the lines were segmented on (same image ``rpred``
+            would be given).
+        seg: The page ``Segmentation``; used as a template for per-line
+            extraction, its own ``lines`` are ignored.
+        lines: ``BaselineLine`` objects to recognise, in reading order.
+        batch_size: Maximum lines per forward pass.
+        pad: Horizontal padding around each line, as in ``rpred``.
+        on_records: Optional callable, called with a list of (index, record)
+            pairs as soon as those lines are done - lines that could not be
+            extracted first, then one call per mini-batch.
+
+    Returns:
+        A list of ``BaselineOCRRecord``, one per input line, in input order.
+    """
+    _batch, channels, height, width = network.nn.input
+    transforms = ImageInputTransforms(_batch, height, width, channels, (pad, 0), valid_norm=False)
+
+    records = [None] * len(lines)
+    pending = []
+    for index, line in enumerate(lines):
+        tensor, box = _line_tensor(network, image, seg, line, transforms)
+        if tensor is None:
+            records[index] = _empty_record(line)
+        else:
+            pending.append((index, tensor, box, line))
+    if on_records is not None:
+        empty = [(index, record) for index, record in enumerate(records) if record is not None]
+        if empty:
+            on_records(empty)
+
+    # Sorting by width keeps lines of similar length together, so the
+    # padding each batch carries stays small.
+    pending.sort(key=lambda item: item[1].shape[2], reverse=True)
+    batch_size = max(1, int(batch_size))
+    for start in range(0, len(pending), batch_size):
+        items = pending[start:start + batch_size]
+        try:
+            results = _predict_batch(network, items, pad)
+        except Exception:
+            logger.exception("Batched recognition failed for %d lines; retrying one by one", len(items))
+            results = []
+            for item in items:
+                try:
+                    results.extend(_predict_batch(network, [item], pad))
+                except Exception as e:
+                    logger.error(f"Recognition failed for line {item[3].id}: {e}")
+                    results.append((item[0], _empty_record(item[3])))
+        for index, record in results:
+            records[index] = record
+        if on_records is not None:
+            on_records(results)
+    return records
@@ -6,6 +6,8 @@ Provides:
   - get_labels_and_urls(manifest) – extract ordered list of (label, image_url, service_url)
   - run_iiif_download(...)        – full background download with retry, progress
                                     callback and cancellation support
+  - choose_start_page(...)        – first page of a download started by the user
+  - resume_page(...)              – first page of a (re)started download job
 """
 
 import os
@@ -141,6 +143,33 @@ def get_labels_and_urls(manifest):
     return pages
 
 
+# ---------------------------------------------------------------------------
+# Start and resume points
+# ---------------------------------------------------------------------------
+
+def choose_start_page(image_count, confirm=None, cancelled_at=None):
+    """
+    1-based first page of a download the user starts, or None when the
+    project already has images and the user has to choose first.
+
+    confirm      : "append" | "restart" | None
+    cancelled_at : last saved page of the project's cancelled download, if
+                   any; without a confirm choice it resumes after that page
+    """
+    if cancelled_at is not None and confirm is None:
+        return cancelled_at + 1
+    if image_count > 0 and confirm is None:
+        return None
+    if confirm == "append":
+        return image_count + 1
+    return 1
+
+
+def resume_page(start_page, current_page):
+    """1-based page a download job (re)starts from: after the last saved page, never before start_page."""
+    return max(start_page or 1, (current_page or 0) + 1)
+
+
 # ---------------------------------------------------------------------------
 # Image download with retry
 # ---------------------------------------------------------------------------
@@ -0,0 +1,253 @@
+"""
+fair_scheduler.py
+
+Shares the OCR slots of batch transcription between projects.
+
+Batch transcriptions used to run one project at a time, so a 900-page
+manuscript kept every other project "pending" for hours. Now several
+projects transcribe at once, and each page asks one FairShareScheduler for
+a slot before it is recognised:
+
+    with scheduler.slot(project_id, user_id, stop_event=stop_event) as granted:
+        if granted:
+            result = ocr_page(...)
+
+There are as many slots as OCR workers, so total throughput is what one
+project alone would get. A slot that frees up goes round-robin to the
+projects with pages waiting: a grant moves the project to the back of the
+line. A 10-page project started next to a big one therefore gets every
+second slot and is done in minutes.
+
+Caps limit the slots one project (transcription_project_slots in
+domain_config.json) or all projects of one user (transcription_user_slots)
+hold at once; 0 means no cap. A slot a capped project can't take goes to
+the next project in line, so no slot idles while anyone can use it.
+
+Pages a user is waiting for in the browser (POST /api/transcribe) ask with
+priority=INTERACTIVE. They are served before every batch page, in the order
+they came, and no cap applies to them. So that they need not wait for a
+whole batch page to finish, a batch page can call yield_to_interactive()
+between its line batches. If interactive work is waiting, the page hands
+over its slot and continues once it gets one back, ahead of the other batch
+pages. How long each class waited for a slot goes to the
+ritus_ocr_slot_wait_seconds histogram and to stats().
+"""
+
+import threading
+import time
+from collections import Counter, OrderedDict, deque
+from contextlib import contextmanager
+
+import metrics
+
+INTERACTIVE = "interactive"
+BATCH = "batch"
+
+# How often a waiting page checks its stop_event
+_STOP_POLL_SECONDS = 0.5
+# Recent waits per priority class kept for the percentiles in stats()
+_RECENT_WAITS = 1000
+
+
+class _Ticket:
+    __slots__ = ("project_id", "user_id", "priority", "granted", "queued_at")
+
+    def __init__(self, project_id, user_id, priority):
+        self.project_id = project_id
+        self.user_id = user_id
+        self.priority = priority
+        self.granted = False
+        self.queued_at = time.monotonic()
+
+
+def _percentile(ordered, share):
+    return ordered[min(len(ordered) - 1, int(share * len(ordered)))]
+
+
+class FairShareScheduler:
+    """Round-robin grants of a fixed number of slots to the projects waiting for one.
+
+    Args:
+        slots: Pages recognised at the same time, over all projects.
+        project_slots: Most slots one project holds at once (0 = no cap).
+        user_slots: Most slots the projects of one user hold at once (0 = no cap).
+    """
+
+    def __init__(self, slots=1, project_slots=0, user_slots=0):
+        self._cond = threading.Condition()
+        self._waiting = OrderedDict()  # project_id -> deque of batch tickets; iteration order is the line
+        self._interactive = deque()  # interactive tickets, first come first served
+        self._project_use = Counter()  # batch slots held per project
+        self._user_use = Counter()  # batch slots held per user
+        self._granted = Counter()  # project_id -> batch slots granted so far
+        self._interactive_use = 0
+        self._in_use = 0
+        self._waits = {INTERACTIVE: deque(maxlen=_RECENT_WAITS), BATCH: deque(maxlen=_RECENT_WAITS)}
+        self.preemptions = 0
+        self.configure(slots, project_slots, user_slots)
+
+    def configure(self, slots, project_slots=0, user_slots=0):
+        """Change the slot count and caps; slots already held are kept."""
+        with self._cond:
+            self.slots = max(1, int(slots))
+            self.project_slots = max(0, int(project_slots or 0))
+            self.user_slots = max(0, int(user_slots or 0))
+            self._dispatch()
+
+    def acquire(self, project_id, user_id=None, stop_event=None, priority=BATCH):
+        """Wait for a slot for project_id; False if stop_event was set first."""
+        ticket = _Ticket(project_id, user_id, priority)
+        with self._cond:
+            if priority == INTERACTIVE:
+                self._interactive.append(ticket)
+            else:
+                self._waiting.setdefault(project_id, deque()).append(ticket)
+            self._dispatch()
+            return self._wait(ticket, stop_event)
+
+    def release(self, project_id, user_id=None, priority=BATCH):
+        """Give back a slot acquire() granted."""
+        with self._cond:
+            self._release(project_id, user_id, priority)
+            self._dispatch()
+
+    @contextmanager
+    def slot(self, project_id, user_id=None, stop_event=None, priority=BATCH):
+        """Hold a slot for the enclosed block; yields False (and holds none) if stopped while waiting."""
+        granted = self.acquire(project_id, user_id, stop_event, priority)
+        try:
+            yield granted
+        finally:
+            if granted:
+                self.release(project_id, user_id, priority)
+
+    def yield_to_interactive(self, project_id, user_id=None):
+        """Lend a held batch slot to waiting interactive work; returns once the slot is back.
+
+        Returns at once if no interactive work is waiting, so it is cheap to
+        call often. The page gets the next free slot after the interactive
+        ones, before any other batch page.
+        """
+        if not self._interactive:
+            return False
+        with self._cond:
+            if not self._interactive:
+                return False
+            self._release(project_id, user_id, BATCH)
+            self.preemptions += 1
+            metrics.OCR_SLOT_PREEMPTIONS.inc()
+            ticket = _Ticket(project_id, user_id, BATCH)
+            self._waiting.setdefault(project_id, deque()).appendleft(ticket)
+            self._waiting.move_to_end(project_id, last=False)
+            self._dispatch()
+            # The page is part-way through its work, so it is not abandoned
+            # on cancellation; it finishes and the batch stops after it.
+            self._wait(ticket, None)
+        return True
+
+    def forget(self, project_id):
+        """Drop the per-project counters of a finished project from stats()."""
+        with self._cond:
+            if project_id not in self._waiting and not self._project_use[project_id]:
+                self._granted.pop(project_id, None)
+
+    def stats(self):
+        """Slots in use, per-project batch counts and slot waits per priority class (recent percentiles)."""
+        with self._cond:
+            projects = {}
+            for project_id in set(self._waiting) | set(self._project_use) | set(self._granted):
+                projects[project_id] = {
+                    "running": self._project_use[project_id],
+                    "waiting": len(self._waiting.get(project_id, ())),
+                    "granted": self._granted[project_id],
+                }
+            waits = {priority: sorted(recent) for priority, recent in self._waits.items()}
+            result = {
+                "slots": self.slots,
+                "in_use": self._in_use,
+                "project_slots": self.project_slots,
+                "user_slots": self.user_slots,
+                "interactive": {"running": self._interactive_use, "waiting": len(self._interactive)},
+                "preemptions": self.preemptions,
+                "projects": projects,
+            }
+        result["wait_seconds"] = {
+            priority: {
+                "count": len(ordered),
+                "p50": round(_percentile(ordered, 0.50), 4),
+                "p95": round(_percentile(ordered, 0.95), 4),
+                "max": round(ordered[-1], 4),
+            } if ordered else {"count": 0}
+            for priority, ordered in waits.items()
+        }
+        return result
+
+    def _wait(self, ticket, stop_event):
+        """Block until ticket is granted; call with the lock held."""
+        while not ticket.granted:
+            if stop_event is not None and stop_event.is_set():
+                self._withdraw(ticket)
+                return False
+            self._cond.wait(_STOP_POLL_SECONDS if stop_event is not None else None)
+        return True
+
+    def _release(self, project_id, user_id, priority):
+        self._in_use -= 1
+        if priority == INTERACTIVE:
+            self._interactive_use -= 1
+            return
+        self._project_use[project_id] -= 1
+        if not self._project_use[project_id]:
+            del self._project_use[project_id]
+        if user_id is not None:
+            self._user_use[user_id] -= 1
+            if not self._user_use[user_id]:
+                del self._user_use[user_id]
+
+    def _eligible(self, ticket):
+        if self.project_slots and self._project_use[ticket.project_id] >= self.project_slots:
+            return False
+        if self.user_slots and ticket.user_id is not None and self._user_use[ticket.user_id] >= self.user_slots:
+            return False
+        return True
+
+    def _dispatch(self):
+        """Hand free slots to interactive work, then to the first eligible projects in line; call with the lock held."""
+        granted = False
+        while self._in_use < self.slots:
+            if self._interactive:
+                ticket = self._interactive.popleft()
+                self._interactive_use += 1
+            else:
+                for project_id, tickets in self._waiting.items():
+                    if self._eligible(tickets[0]):
+                        break
+                else:
+                    break
+                ticket = tickets.popleft()
+                self._project_use[project_id] += 1
+                if ticket.user_id is not None:
+                    self._user_use[ticket.user_id] += 1
+                self._granted[project_id] += 1
+                # To the back of the line
+                del self._waiting[project_id]
+                if tickets:
+                    self._waiting[project_id] = tickets
+            ticket.granted = True
+            self._in_use += 1
+            waited = time.monotonic() - ticket.queued_at
+            self._waits[ticket.priority].append(waited)
+            metrics.OCR_SLOT_WAIT_SECONDS.observe(waited, priority=ticket.priority)
+            granted = True
+        if granted:
+            self._cond.notify_all()
+
+    def _withdraw(self, ticket):
+        if ticket.priority == INTERACTIVE:
+            self._interactive.remove(ticket)
+            return
+        tickets = self._waiting.get(ticket.project_id)
+        if tickets is not None:
+            tickets.remove(ticket)
+            if not tickets:
+                del self._waiting[ticket.project_id]
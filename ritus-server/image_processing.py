@@ -5,9 +5,11 @@ from PIL import Image as PILImage
 import matplotlib.pyplot as plt
 from matplotlib.patches import Rectangle
 import logging
+from collections import OrderedDict
 from copy import deepcopy
 from kraken.containers import BaselineLine
-from shapely.geometry import Polygon, box
+
+from page_image import PageImage
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -54,6 +56,10 @@ def rgb_to_hsl(rgb):
     h = h / 360.0
     return np.stack([h, s, l], axis=2)
 
+def hsl_lightness(rgb):
+    """The L plane of rgb_to_hsl(rgb), bit for bit, without hue and saturation."""
+    return (rgb.max(axis=2) / 255.0 + rgb.min(axis=2) / 255.0) / 2.0
+
 def hsl_to_rgb(hsl):
     """
     Convert an HSL image (NumPy array) to RGB.
@@ -97,18 +103,457 @@ def hsl_to_rgb(hsl):
     
     return (rgb * 255).astype(np.uint8)
 
-def split_line_boundary_by_color(color_image, line, line_index, window_size=80, red_threshold=5.0, debug_dir=None):
+# Parameters of the redness score: Gaussian widths around pure red hue,
+# mid lightness and full saturation.
+REDNESS_SIGMA_H = 0.05
+REDNESS_SIGMA_L = 0.15
+REDNESS_SIGMA_S = 0.2
+
+# Narrower colour regions are merged into their neighbour (Kraken cannot
+# recognise a line piece only a few pixels wide).
+MIN_REGION_WIDTH = 5
+
+
+def column_redness_scores(hues, saturations, lightnesses, block_width=512):
+    """Score every pixel column of an HSL crop for red ink, all at once.
+
+    Args:
+        hues, saturations, lightnesses: 2-D arrays (height, width) in [0, 1].
+        block_width: Columns scored per array pass. Columns are independent,
+            so this only bounds the size of the float64 temporaries.
+
+    Returns:
+        (redness_scores, peak_saturations): 1-D float arrays of length width.
+        Element-for-element the same values as
+        column_redness_scores_reference(), which computes one column at a time.
+    """
+    width = hues.shape[1]
+    if width > block_width:
+        blocks = [
+            _block_redness_scores(hues[:, x:x + block_width], saturations[:, x:x + block_width],
+                                  lightnesses[:, x:x + block_width])
+            for x in range(0, width, block_width)
+        ]
+        return tuple(np.concatenate(parts) for parts in zip(*blocks))
+    return _block_redness_scores(hues, saturations, lightnesses)
+
+
+def pixel_redness(hues, saturations, lightnesses):
+    """Redness of every pixel of HSL planes: the values column_redness_scores() averages."""
+    # Hue: Distance to nearest red (0.0 or 1.0)
+    hue_distance = np.minimum(np.abs(hues), np.abs(hues - 1))
+    hue_mask = (hues <= 0.1) | (hues >= 0.91)
+    hue_weight = np.where(hue_mask, np.exp(-(hue_distance ** 2) / (2 * REDNESS_SIGMA_H ** 2)), 0)
+
+    # Lightness: Distance to 0.5, within [0.25, 0.8]
+    lightness_mask = (lightnesses >= 0.25) & (lightnesses <= 0.8)
+    lightness_distance = np.abs(lightnesses - 0.5)
+    lightness_weight = np.where(lightness_mask, np.exp(-(lightness_distance ** 2) / (2 * REDNESS_SIGMA_L ** 2)), 0)
+
+    # Saturation: Distance to 1.0, within [0.3, 1.0]
+    saturation_mask = (saturations >= 0.3) & (saturations <= 1.0)
+    saturation_distance = np.abs(saturations - 1.0)
+    saturation_weight = np.where(saturation_mask, np.exp(-(saturation_distance ** 2) / (2 * REDNESS_SIGMA_S ** 2)), 0)
+
+    return hue_weight * lightness_weight * saturation_weight * 100
+
+
+def _block_redness_scores(hues, saturations, lightnesses):
+    redness = pixel_redness(hues, saturations, lightnesses)
+
+    width = redness.shape[1]
+    if redness.shape[0] == 0:
+        return np.zeros(width), np.zeros(width)
+    # Reduce along a contiguous last axis so each column is summed in the same
+    # order as a 1-D np.mean() over that column would sum it.
+    avg_redness = np.ascontiguousarray(redness.T).mean(axis=1) * 100
+    peak_saturation = saturations.max(axis=0)
+    return avg_redness.astype(float), peak_saturation.astype(float)
+
+
+def column_redness_scores_reference(hues, saturations, lightnesses):
+    """Column-by-column version of column_redness_scores().
+
+    This is the original per-column loop, kept as the reference the
+    vectorised implementation is tested against. Not used in production.
+    """
+    width = hues.shape[1]
+    redness_scores = []
+    peak_saturations = []
+
+    # Analyze each column (x-axis)
+    for x in range(width):
+        column_h = hues[:, x]
+        column_s = saturations[:, x]
+        column_l = lightnesses[:, x]
+
+        # Hue: Distance to nearest red (0.0 or 1.0)
+        hue_distance = np.minimum(np.abs(column_h), np.abs(column_h - 1))
+        hue_mask = (column_h <= 0.1) | (column_h >= 0.91)
+        hue_weight = np.where(hue_mask, np.exp(-(hue_distance ** 2) / (2 * REDNESS_SIGMA_H ** 2)), 0)
+
+        # Lightness: Distance to 0.5, within [0.25, 0.8]
+        lightness_mask = (column_l >= 0.25) & (column_l <= 0.8)
+        lightness_distance = np.abs(column_l - 0.5)
+        lightness_weight = np.where(lightness_mask, np.exp(-(lightness_distance ** 2) / (2 * REDNESS_SIGMA_L ** 2)), 0)
+
+        # Saturation: Distance to 1.0, within [0.3, 1.0]
+        saturation_mask = (column_s >= 0.3) & (column_s <= 1.0)
+        saturation_distance = np.abs(column_s - 1.0)
+        saturation_weight = np.where(saturation_mask, np.exp(-(saturation_distance ** 2) / (2 * REDNESS_SIGMA_S ** 2)), 0)
+
+        # Redness score: Multiply weights and scale
+        redness = hue_weight * lightness_weight * saturation_weight * 100
+
+        # Average redness score for the column
+        avg_redness = np.mean(redness) * 100 if column_h.size > 0 else 0
+        peak_saturation = np.max(column_s) if column_s.size > 0 else 0
+
+        redness_scores.append(float(avg_redness))
+        peak_saturations.append(float(peak_saturation))
+    return np.array(redness_scores, dtype=float), np.array(peak_saturations, dtype=float)
+
+
+def find_color_regions(denoised_redness, red_threshold, min_width=MIN_REGION_WIDTH):
+    """Split a row of denoised redness scores into red/black regions.
+
+    Returns a list of {'start': x, 'above_threshold': bool} dicts in
+    left-to-right order. A region ends where the next kept region starts (or
+    at the end of the row); runs narrower than min_width are dropped, which
+    folds them into the region before them. Same result as
+    find_color_regions_reference(), computed from run boundaries instead of
+    a per-pixel loop.
+    """
+    above = np.asarray(denoised_redness) >= red_threshold
+    width = above.shape[0]
+    if width == 0:
+        return []
+    changes = np.flatnonzero(above[1:] != above[:-1]) + 1
+    starts = np.concatenate(([0], changes))
+    ends = np.concatenate((changes, [width]))
+    keep = (ends - starts) >= min_width
+    return [
+        {'start': int(start), 'above_threshold': bool(above[start])}
+        for start in starts[keep]
+    ]
+
+
+def find_color_regions_reference(denoised_redness, red_threshold, min_width=MIN_REGION_WIDTH):
+    """Pixel-by-pixel version of find_color_regions(), kept as its test reference."""
+    width = len(denoised_redness)
+    regions = []
+    current_region = {'start': None, 'above_threshold': None}
+    for x in range(width):
+        above_threshold = denoised_redness[x] >= red_threshold
+        if current_region['start'] is None:
+            current_region = {'start': x, 'above_threshold': above_threshold}
+        elif current_region['above_threshold'] != above_threshold:
+            # Ensure region is at least 5 pixels wide to avoid Kraken error
+            if x - current_region['start'] >= min_width:
+                regions.append(current_region)
+            current_region = {'start': x, 'above_threshold': above_threshold}
+    if current_region['start'] is not None and width - current_region['start'] >= min_width:
+        regions.append(current_region)
+    return regions
+
+
+def _insert_crossings(points, cuts, closed):
+    """points (N x 2) with the points where its edges cross the vertical lines x = cuts added, in order."""
+    following = np.roll(points, -1, axis=0) if closed else points[1:]
+    starts = points[:len(following)]
+    low = np.minimum(starts[:, 0], following[:, 0])
+    high = np.maximum(starts[:, 0], following[:, 0])
+    # Crossings strictly inside an edge; a vertex on a cut is already there
+    edge, cut = np.nonzero((low[:, None] < cuts) & (cuts < high[:, None]))
+    t = (cuts[cut] - starts[edge, 0]) / (following[edge, 0] - starts[edge, 0])
+    crossings = starts[edge] + t[:, None] * (following[edge] - starts[edge])
+    crossings[:, 0] = cuts[cut]
+    # Each vertex, then the crossings of the edge it starts, in the order the
+    # edge runs through them
+    order = np.lexsort((np.concatenate((np.zeros(len(points)), t)),
+                        np.concatenate((np.arange(len(points)), edge))))
+    return np.concatenate((points, crossings))[order]
+
+
+def _drop_repeated_points(points, closed):
+    if len(points) < 2:
+        return points
+    following = np.roll(points, -1, axis=0) if closed else points[1:]
+    keep = np.any(points[:len(following)] != following, axis=1)
+    if not closed:
+        keep = np.append(keep, True)
+    return points[keep]
+
+
+def clip_polygon_to_slabs(points, edges):
+    """The parts of a polygon between consecutive x positions in edges.
+
+    Returns one (N x 2) float array per slab [edges[i], edges[i + 1]]. The
+    polygon is cut at every edge once; a slab's part is then the vertices
+    that lie in it, in order - what clipping against the slab's two sides
+    (Sutherland-Hodgman) gives, so a slab that cuts a concave polygon in two
+    gets one outline joined along its side rather than two pieces. Slabs
+    with less than a triangle of the polygon get an empty array.
+    """
+    points = np.asarray(points, dtype=float).reshape(-1, 2)
+    edges = np.asarray(edges, dtype=float)
+    if len(points) < 3:
+        return [np.empty((0, 2)) for _ in range(len(edges) - 1)]
+    cut = _insert_crossings(points, np.unique(edges), closed=True)
+    parts = []
+    for x0, x1 in zip(edges[:-1], edges[1:]):
+        part = _drop_repeated_points(cut[(cut[:, 0] >= x0) & (cut[:, 0] <= x1)], closed=True)
+        if len(part) < 3 or part[:, 0].min() == part[:, 0].max():
+            part = np.empty((0, 2))
+        parts.append(part)
+    return parts
+
+
+def clip_polyline_to_slabs(points, edges):
+    """The parts of a polyline (a baseline) between consecutive x positions in edges.
+
+    Returns one (N x 2) float array per slab: the polyline's vertices in the
+    slab plus the points where it crosses the slab's sides, in the
+    polyline's order.
+    """
+    points = np.asarray(points, dtype=float).reshape(-1, 2)
+    edges = np.asarray(edges, dtype=float)
+    cut = _insert_crossings(points, np.unique(edges), closed=False) if len(points) else points
+    return [_drop_repeated_points(cut[(cut[:, 0] >= x0) & (cut[:, 0] <= x1)], closed=False)
+            for x0, x1 in zip(edges[:-1], edges[1:])]
+
+
+# Block size (pixels) of the red-ink prefilter's map of possible redness.
+PREFILTER_BLOCK = 8
+# Lines are only prefiltered when their redness bound stays this far below
+# the threshold, so float rounding can never flip a decision.
+PREFILTER_MARGIN = 1.001
+# Strips of the prefilter map a ColorAnalysisContext keeps; lines are
+# analysed top to bottom, so a few more than a line spans is plenty.
+PREFILTER_STRIPS = 16
+
+
+def redness_upper_bounds(rgb):
+    """Per-pixel upper bound of a pixel's share of a column redness score.
+
+    column_redness_scores() averages hue * lightness * saturation weights
+    (times 100 * 100) down each column. CLAHE changes the lightness before
+    that, so only the lightness weight cannot be known in advance; it is at
+    most 1, which leaves hue weight * saturation weight * 10000. The hue and
+    saturation are computed exactly as rgb_to_hsl() does. rgb is a (height, width, 3) uint8
+    array; the result is a float64 array of (height, width), zero wherever
+    red is impossible (red is not the single largest channel).
+    """
+    bounds = np.zeros(rgb.shape[:2])
+    r, g, b = (rgb[:, :, i] for i in range(3))
+    candidates = (r > g) & (r > b)
+    if not candidates.any():
+        return bounds
+    hsl = rgb_to_hsl(rgb[candidates].reshape(-1, 1, 3))[:, 0, :]
+    hues, saturations = hsl[:, 0], hsl[:, 1]
+    hue_distance = np.minimum(np.abs(hues), np.abs(hues - 1))
+    hue_weight = np.where((hues <= 0.1) | (hues >= 0.91),
+                          np.exp(-(hue_distance ** 2) / (2 * REDNESS_SIGMA_H ** 2)), 0)
+    saturation_weight = np.where((saturations >= 0.3) & (saturations <= 1.0),
+                                 np.exp(-(np.abs(saturations - 1.0) ** 2) / (2 * REDNESS_SIGMA_S ** 2)), 0)
+    bounds[candidates] = hue_weight * saturation_weight * 100 * 100
+    return bounds
+
+
+# Columns of a band converted to HSL at a time, bounding the float64
+# temporaries of rgb_to_hsl() on wide scans. A multiple of PREFILTER_BLOCK,
+# so no prefilter block straddles two chunks.
+BAND_CHUNK_COLUMNS = 512
+
+
+class ColorAnalysisContext:
+    """Redness map of one page, shared by all lines of that page.
+
+    split_line_boundary_by_color() used to crop every line, convert it to
+    float64 HSL, equalise its lightness with CLAHE and score it, so pixels
+    covered by overlapping line boundaries were converted several times and
+    each line carried a dozen full-size float64 temporaries. The context
+    computes each pixel's redness (pixel_redness()) once, as float32, and a
+    line only masks its polygon and sums the columns of its crop.
+
+    The map is built lazily in full-width bands of band_height rows, aligned
+    to the page's top, when a line first needs them; the least recently used
+    bands are dropped once more than max_bytes are held, so memory stays
+    bounded even on 6000x8000 scans. Lightness is equalised by CLAHE on each
+    band with the tile grid the per-line code used on a line's crop (8
+    columns, tiles of 8 rows). Bands do not depend on the region, so every
+    context of a page gives the same redness.
+
+    Only 3-channel RGB images are analysed (available is False otherwise),
+    matching the per-line code, which could not split other modes either.
+    color_image may be a PIL image or a PageImage; bands of a PageImage are
+    read straight from its decoded pixel buffer.
+
+    Most pages have no red ink at all. With prefilter on, lines also build
+    a map of how much redness each 8x8 block of the region could at most
+    contribute (redness_upper_bounds()), in strips of band_height rows kept
+    like the bands (at most PREFILTER_STRIPS of them). A line whose crop
+    cannot reach red_threshold anywhere on that map is emitted black
+    without converting its pixels to HSL or running CLAHE; the bound never
+    underestimates, so such a line would not have been split anyway.
+    lines_prefiltered and lines_analysed count the two outcomes.
+    """
+
+    def __init__(self, color_image, region=None, band_height=64, max_bytes=4 * 1024 * 1024, prefilter=True):
+        self.image = color_image
+        image_width, image_height = color_image.size
+        if region is None:
+            region = (0, 0, image_width, image_height)
+        left, top, right, bottom = region
+        self.left = max(0, int(left))
+        self.top = max(0, int(top))
+        self.right = min(image_width, int(right))
+        self.bottom = min(image_height, int(bottom))
+        self.band_height = max(1, int(band_height))
+        self.available = color_image.mode == 'RGB'
+        self._page = color_image if isinstance(color_image, PageImage) else None
+        self._bands = OrderedDict()
+        self._band_bytes = max(1, image_width) * self.band_height * 4
+        self._max_bands = max(1, int(max_bytes) // self._band_bytes)
+        self.bands_converted = 0
+        self.prefilter = prefilter
+        self._strip_height = PREFILTER_BLOCK * max(1, self.band_height // PREFILTER_BLOCK)
+        self._strips = OrderedDict()
+        self.lines_prefiltered = 0
+        self.lines_analysed = 0
+
+    @classmethod
+    def for_lines(cls, color_image, lines, padding=10, **kwargs):
+        """Context covering the padded bounding boxes of all lines."""
+        xs, ys = [], []
+        for line in lines:
+            if getattr(line, 'boundary', None):
+                line_xs, line_ys = zip(*line.boundary)
+                xs.extend(line_xs)
+                ys.extend(line_ys)
+        if not xs:
+            return cls(color_image, region=(0, 0, 0, 0), **kwargs)
+        region = (min(xs) - padding, min(ys) - padding, max(xs) + padding, max(ys) + padding)
+        return cls(color_image, region=region, **kwargs)
+
+    def contains(self, left, top, right, bottom):
+        return self.left <= left and self.top <= top and right <= self.right and bottom <= self.bottom
+
+    def _band(self, index):
+        band = self._bands.get(index)
+        if band is not None:
+            self._bands.move_to_end(index)
+            return band
+        image_width, image_height = self.image.size
+        y0 = index * self.band_height
+        y1 = min(image_height, y0 + self.band_height)
+        boxes = [(x0, y0, min(image_width, x0 + BAND_CHUNK_COLUMNS), y1)
+                 for x0 in range(0, image_width, BAND_CHUNK_COLUMNS)]
+        # CLAHE needs the lightness of the whole band first; hue and
+        # saturation are converted a chunk at a time afterwards, so no
+        # full-width float64 plane is ever held.
+        l_scaled = np.empty((y1 - y0, image_width), dtype=np.uint8)
+        for box in boxes:
+            l_scaled[:, box[0]:box[2]] = (hsl_lightness(self._pixels(box)) * 255).astype(np.uint8)
+        clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, max(1, self.band_height // 8)))
+        l_enhanced = clahe.apply(l_scaled)
+        band = np.empty((y1 - y0, image_width), dtype=np.float32)
+        for box in boxes:
+            x0, _, x1, _ = box
+            hsl = rgb_to_hsl(self._pixels(box))
+            band[:, x0:x1] = pixel_redness(hsl[:, :, 0], hsl[:, :, 1], l_enhanced[:, x0:x1].astype(float) / 255.0)
+        self.bands_converted += 1
+        self._bands[index] = band
+        while len(self._bands) > self._max_bands:
+            self._bands.popitem(last=False)
+        return band
+
+    def _pixels(self, box):
+        return self._page.crop_pixels(box) if self._page is not None else np.asarray(self.image.crop(box))
+
+    def _red_mass_strip(self, index):
+        """Redness bound summed per PREFILTER_BLOCK block, over one strip of the region's columns.
+
+        Strips are _strip_height rows aligned to the page's top. float32: a
+        block's sum is positive and rounds by far less than PREFILTER_MARGIN
+        allows for.
+        """
+        strip = self._strips.get(index)
+        if strip is not None:
+            self._strips.move_to_end(index)
+            return strip
+        block = PREFILTER_BLOCK
+        y0 = index * self._strip_height
+        y1 = min(self.image.size[1], y0 + self._strip_height)
+        strip = np.zeros((-(-(y1 - y0) // block), -(-(self.right - self.left) // block)), dtype=np.float32)
+        for x0 in range(self.left, self.right, BAND_CHUNK_COLUMNS):
+            bounds = redness_upper_bounds(self._pixels((x0, y0, min(self.right, x0 + BAND_CHUNK_COLUMNS), y1)))
+            ys, xs = np.nonzero(bounds)
+            if ys.size:
+                np.add.at(strip, (ys // block, (xs + x0 - self.left) // block), bounds[ys, xs])
+        self._strips[index] = strip
+        while len(self._strips) > PREFILTER_STRIPS:
+            self._strips.popitem(last=False)
+        return strip
+
+    def redness_bound(self, left, top, right, bottom, window_size):
+        """Upper bound of the denoised redness split_line_boundary_by_color() can find in a crop.
+
+        The denoised score of a column is the mean of window_size (or crop
+        width) column scores, and a column score is at most the sum of the
+        column's redness_upper_bounds() over the crop height. So it is at
+        most the bound mass of the blocks covering any window_size columns,
+        divided by window * height.
+        """
+        width, height = right - left, bottom - top
+        window = min(window_size, width)
+        block = PREFILTER_BLOCK
+        x0, x1 = (left - self.left) // block, -(-(right - self.left) // block)
+        column_mass = np.zeros(x1 - x0)
+        for index in range(top // self._strip_height, (bottom - 1) // self._strip_height + 1):
+            strip_top = index * self._strip_height
+            y0 = (max(top, strip_top) - strip_top) // block
+            y1 = -(-(min(bottom, strip_top + self._strip_height) - strip_top) // block)
+            column_mass += self._red_mass_strip(index)[y0:y1, x0:x1].sum(axis=0, dtype=float)
+        # window consecutive pixel columns touch at most this many blocks
+        span = min(column_mass.size, (window - 1) // block + 2)
+        sums = np.convolve(column_mass, np.ones(span), mode='valid')
+        return float(sums.max()) / (window * height) if sums.size else 0.0
+
+    def redness(self, left, top, right, bottom):
+        """float32 pixel_redness() of a crop of the page.
+
+        The array may be a view into a cached band; callers must copy
+        before modifying it.
+        """
+        first = top // self.band_height
+        last = (bottom - 1) // self.band_height
+        pieces = []
+        for index in range(first, last + 1):
+            band_top = index * self.band_height
+            y0 = max(top, band_top) - band_top
+            y1 = min(bottom, band_top + self.band_height) - band_top
+            pieces.append(self._band(index)[y0:y1, left:right])
+        if len(pieces) == 1:
+            return pieces[0]
+        return np.concatenate(pieces, axis=0)
+
+
+def split_line_boundary_by_color(color_image, line, line_index, window_size=80, red_threshold=5.0, debug_dir=None, color_context=None):
     """
     Crop, preprocess with polygon mask, split line into red/black segments based on redness,
     and generate images with baseline/boundary outlines and a histogram plot.
     
     Args:
-        color_image: PIL Image in original color mode (e.g., RGB).
+        color_image: PIL Image in original color mode (e.g., RGB), or the
+            PageImage of the page.
         line: BaselineLine object with boundary and baseline coordinates.
         line_index: Index of the line (for naming output files).
         debug_dir: Optional directory to save debug images and histogram plots.
         window_size: Size of the moving average window for denoising (default: 80).
         red_threshold: Threshold for redness score to split lines (default: 5.0, ~80% UI sensitivity).
+        color_context: Optional ColorAnalysisContext of color_image, shared by all
+            lines of the page. Without one, only the bands this line covers are converted.
     
     Returns:
         List of new BaselineLine objects with cropped coordinates and added 'color' attribute.
@@ -141,11 +586,32 @@ def split_line_boundary_by_color(color_image, line, line_index, window_size=80,
     right = min(color_image.width, max(x_coords) + padding)
     bottom = min(color_image.height, max(y_coords) + padding)
 
-    # Crop the image around the boundary
-    # Crop the image around the boundary
-    cropped_image = color_image.crop((left, top, right, bottom))
-    color_array = np.array(cropped_image)
-    height, width = color_array.shape[:2]
+    if color_context is None or not color_context.contains(left, top, right, bottom):
+        color_context = ColorAnalysisContext(color_image, region=(left, top, right, bottom))
+    if not color_context.available:
+        logger.debug(f"Color analysis skipped for line {line_index + 1}: image mode {color_image.mode} is not RGB")
+        return [line]
+
+    if (color_context.prefilter and right > left and bottom > top
+            and color_context.redness_bound(left, top, right, bottom, window_size) * PREFILTER_MARGIN < red_threshold):
+        # No column can reach the threshold: one black region, exactly what
+        # the full analysis below would find.
+        color_context.lines_prefiltered += 1
+        width, height = right - left, bottom - top
+        regions = find_color_regions(np.zeros(width), red_threshold)
+    else:
+        color_context.lines_analysed += 1
+        regions, width, height = _analyse_line_colors(color_context, line, line_index, left, top, right, bottom,
+                                                      window_size, red_threshold, debug_dir)
+    return _split_line_at_regions(color_image, line, line_index, regions, left, top, width, height)
+
+
+def _analyse_line_colors(color_context, line, line_index, left, top, right, bottom, window_size, red_threshold,
+                         debug_dir):
+    """Red/black regions of a line's crop, with the crop's width and height."""
+    # Crop the page's redness map around the boundary
+    redness = color_context.redness(left, top, right, bottom)
+    height, width = redness.shape
     logger.debug(f"Cropped image for line {line_index + 1}: width={width}, height={height}")
 
     # Create polygon mask in cropped image coordinates
@@ -160,108 +626,14 @@ def split_line_boundary_by_color(color_image, line, line_index, window_size=80,
         logger.warning(f"Invalid boundary for line {line_index + 1}, using full cropped image")
         mask[:] = 255
 
-    # Apply mask: keep pixels inside polygon, set others to gray (128, 128, 128)
-    gray = np.array([128, 128, 128], dtype=np.uint8)
-    masked_image = color_array.copy()
-    masked_image[mask == 0] = gray
-
-    # Apply light Gaussian blur to reduce noise
-    #denoised = cv2.GaussianBlur(masked_image, (3, 3), 0)
-    denoised = masked_image
-
-    # Convert to HSL
-    hsl_array = rgb_to_hsl(denoised)
-
-    # Apply CLAHE to the lightness channel
-    h, s, l = hsl_array[:, :, 0], hsl_array[:, :, 1], hsl_array[:, :, 2]
-    l_scaled = (l * 255).astype(np.uint8)
-    clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
-    l_enhanced = clahe.apply(l_scaled)
-    l_enhanced = l_enhanced.astype(float) / 255.0
-
-    # Merge back and convert to RGB
-    hsl_enhanced = np.stack([h, s, l_enhanced], axis=2)
-    #enhanced_array = hsl_to_rgb(hsl_enhanced)
-
-    #SIMPLER, FASTER:
-    #hsl_enhanced = masked_image
-
-    # Convert to PIL image for saving
-    #enhanced_image = PILImage.fromarray(enhanced_array)
-
-    #SIMPLER, FASTER:
-    #enhanced_image = masked_image
-
-    # enhanced_array_cv = cv2.cvtColor(np.array(enhanced_image), cv2.COLOR_RGB2BGR)
-
-    # Save enhanced image (debug only)
     if debug_dir:
         image_path = os.path.join(debug_dir, f"line_{line_index + 1}.png")
-        #enhanced_image.save(image_path)
         logger.info(f"Saved enhanced color image for line {line_index + 1} to {image_path}")
 
-    # Verify hsl_enhanced dimensions
-    hues, saturations, lightnesses = hsl_enhanced[:, :, 0], hsl_enhanced[:, :, 1], hsl_enhanced[:, :, 2]
-    enhanced_height, enhanced_width = hsl_enhanced.shape[:2]
-    if enhanced_width != width:
-        logger.warning(f"Dimension mismatch for line {line_index + 1}: cropped width={width}, hsl_enhanced width={enhanced_width}")
-        width = enhanced_width  # Use actual width from hsl_enhanced
-    logger.debug(f"hsl_enhanced for line {line_index + 1}: width={width}, height={enhanced_height}")
-
-    # Initialize lists for histogram data
-    redness_scores = []
-    peak_saturations = []
-
-    # Analyze each column (x-axis)
-    for x in range(width):
-        try:
-            column_h = hues[:, x]
-            column_s = saturations[:, x]
-            column_l = lightnesses[:, x]
-
-            # Redness score based on hue, saturation, and lightness distances
-            sigma_h = 0.05
-            sigma_l = 0.15
-            sigma_s = 0.2
-
-            # Hue: Distance to nearest red (0.0 or 1.0)
-            hue_distance = np.minimum(np.abs(column_h), np.abs(column_h - 1))
-            hue_mask = (column_h <= 0.1) | (column_h >= 0.91)
-            hue_weight = np.where(hue_mask, np.exp(-(hue_distance ** 2) / (2 * sigma_h ** 2)), 0)
-
-            # Lightness: Distance to 0.5, within [0.25, 0.8]
-            lightness_mask = (column_l >= 0.25) & (column_l <= 0.8)
-            lightness_distance = np.abs(column_l - 0.5)
-            lightness_weight = np.where(lightness_mask, np.exp(-(lightness_distance ** 2) / (2 * sigma_l ** 2)), 0)
-
-            # Saturation: Distance to 1.0, within [0.3, 1.0]
-            saturation_mask = (column_s >= 0.3) & (column_s <= 1.0)
-            saturation_distance = np.abs(column_s - 1.0)
-            saturation_weight = np.where(saturation_mask, np.exp(-(saturation_distance ** 2) / (2 * sigma_s ** 2)), 0)
-
-            # Redness score: Multiply weights and scale
-            redness = hue_weight * lightness_weight * saturation_weight * 100
-
-            # Average redness score for the column
-            avg_redness = np.mean(redness) * 100 if column_h.size > 0 else 0
-            peak_saturation = np.max(column_s) if column_s.size > 0 else 0
-
-            redness_scores.append(float(avg_redness))
-            peak_saturations.append(float(peak_saturation))
-        except Exception as e:
-            logger.warning(f"Error processing column {x} for line {line_index + 1}: {str(e)}")
-            redness_scores.append(0.0)
-            peak_saturations.append(0.0)
-
-    # Ensure arrays match width
-    if len(redness_scores) != width or len(peak_saturations) != width:
-        logger.warning(f"Dimension mismatch for line {line_index + 1}: redness_scores={len(redness_scores)}, peak_saturations={len(peak_saturations)}, width={width}")
-        while len(redness_scores) < width:
-            redness_scores.append(0.0)
-        while len(peak_saturations) < width:
-            peak_saturations.append(0.0)
-        redness_scores = redness_scores[:width]
-        peak_saturations = peak_saturations[:width]
+    # Mean redness of every column, times 100 as in column_redness_scores();
+    # pixels outside the polygon count as gray, which has no redness
+    column_sums = np.where(mask != 0, redness, 0).sum(axis=0, dtype=float)
+    redness_scores = column_sums / height * 100 if height else np.zeros(width)
 
     # Denoise redness scores with moving average
     kernel = np.ones(min(window_size, width)) / min(window_size, width)  # Adjust window_size if width is smaller
@@ -287,23 +659,7 @@ def split_line_boundary_by_color(color_image, line, line_index, window_size=80,
     # ax2.legend(loc='upper right')
 
     # Identify regions based on denoised redness threshold
-    regions = []
-    current_region = {'start': None, 'above_threshold': None}
-    for x in range(width):
-        above_threshold = denoised_redness[x] >= red_threshold
-        if current_region['start'] is None:
-            current_region = {'start': x, 'above_threshold': above_threshold}
-        elif current_region['above_threshold'] != above_threshold:
-            # Ensure region is at least 5 pixels wide to avoid Kraken error
-            if x - current_region['start'] >= 5:
-                regions.append(current_region)
-            else:
-                logger.debug(f"Skipping narrow region for line {line_index + 1}: {current_region['start']} to {x}")
-            current_region = {'start': x, 'above_threshold': above_threshold}
-    if current_region['start'] is not None and width - current_region['start'] >= 5:
-        regions.append(current_region)
-    elif current_region['start'] is not None:
-        logger.debug(f"Skipping narrow final region for line {line_index + 1}: {current_region['start']} to {width}")
+    regions = find_color_regions(denoised_redness, red_threshold)
 
     # Plot rectangular outlines for regions
     # for region in regions:
@@ -323,139 +679,86 @@ def split_line_boundary_by_color(color_image, line, line_index, window_size=80,
     #plt.close()
     #logger.info(f"Saved histogram plot for line {line_index + 1} to {histogram_path}")
 
-    # Convert original boundary to cropped coordinates for intersection
-    cropped_boundary = [(x - left, y - top) for x, y in line.boundary]
-    orig_boundary_polygon = Polygon(cropped_boundary) if len(cropped_boundary) >= 3 else None
+    return regions, width, height
+
+
+def _split_line_at_regions(color_image, line, line_index, regions, left, top, width, height):
+    """New BaselineLines for the regions of a line's crop, each with its 'color'."""
+    # Original boundary and baseline in cropped coordinates
+    offset = np.array((left, top), dtype=float)
+    cropped_boundary = np.asarray(line.boundary, dtype=float).reshape(-1, 2) - offset
+    cropped_baseline = np.asarray(line.baseline or [], dtype=float).reshape(-1, 2) - offset
+    page_width, page_height = color_image.size
 
     # Initialize debug image
     # debug_image = enhanced_array_cv.copy()
     new_lines = []
 
     # Draw original boundary for debugging
-    #if orig_boundary_polygon:
+    #if len(cropped_boundary) >= 3:
     #    cv2.polylines(debug_image, [shifted_boundary], True, (128, 128, 128), 1)
 
+    # Clip the original boundary and baseline to the regions' full-height
+    # slabs, all regions at once
+    edges = [region['start'] for region in regions] + [width]
+    boundaries = clip_polygon_to_slabs(cropped_boundary, edges)
+    baselines = clip_polyline_to_slabs(cropped_baseline, edges)
+
     for idx, region in enumerate(regions):
-        start_x_crop = region['start']
-        end_x_crop = width if region is regions[-1] else regions[regions.index(region) + 1]['start']
+        start_x_crop, end_x_crop = edges[idx], edges[idx + 1]
         color = "red" if region['above_threshold'] else "black"
         logger.debug(f"Processing region {idx} for line {line_index + 1}, color {color}, x-range: {start_x_crop} to {end_x_crop}")
 
-        # Create a full-height rectangular box in cropped coordinates
-        rect_box = box(start_x_crop, 0, end_x_crop, height)
-
-        # Intersect with original boundary
-        if orig_boundary_polygon and orig_boundary_polygon.is_valid:
-            try:
-                # Buffer slightly to fix degenerate cases
-                buffered_polygon = orig_boundary_polygon.buffer(0.01, resolution=1)
-                intersection = buffered_polygon.intersection(rect_box)
-                if intersection.is_empty or not intersection.is_valid:
-                    logger.warning(f"Intersection empty or invalid for line {line_index + 1}, region {idx}, color {color}")
-                    new_boundary_crop = [
-                        (start_x_crop, 0),
-                        (start_x_crop, height),
-                        (end_x_crop, height),
-                        (end_x_crop, 0)
-                    ]
-                else:
-                    # Handle Polygon or MultiPolygon
-                    if isinstance(intersection, Polygon):
-                        new_boundary_crop = list(intersection.exterior.coords)[:-1]
-                    else:
-                        logger.warning(f"Non-polygon intersection for line {line_index + 1}, region {idx}, color {color}")
-                        new_boundary_crop = [
-                            (start_x_crop, 0),
-                            (start_x_crop, height),
-                            (end_x_crop, height),
-                            (end_x_crop, 0)
-                        ]
-            except Exception as e:
-                logger.warning(f"Intersection failed for line {line_index + 1}, region {idx}, color {color}: {str(e)}")
-                new_boundary_crop = [
-                    (start_x_crop, 0),
-                    (start_x_crop, height),
-                    (end_x_crop, height),
-                    (end_x_crop, 0)
-                ]
-        else:
-            logger.warning(f"Invalid original boundary for line {line_index + 1}, region {idx}, color {color}")
-            new_boundary_crop = [
+        new_boundary_crop = boundaries[idx]
+        if len(new_boundary_crop) == 0:
+            logger.warning(f"Empty boundary for line {line_index + 1}, region {idx}, color {color}")
+            new_boundary_crop = np.array([
                 (start_x_crop, 0),
                 (start_x_crop, height),
                 (end_x_crop, height),
                 (end_x_crop, 0)
-            ]
-
-        # Interpolate baseline in cropped coordinates
-        new_baseline_crop = []
-        baseline_x, baseline_y = zip(*line.baseline) if line.baseline else ([], [])
-        for i in range(len(baseline_x)):
-            x = baseline_x[i] - left
-            y = baseline_y[i] - top
-            if start_x_crop <= x < end_x_crop:
-                new_baseline_crop.append((x, y))
-            elif i < len(baseline_x) - 1:
-                x_next = baseline_x[i + 1] - left
-                y_next = baseline_y[i + 1] - top
-                if (x < start_x_crop <= x_next) or (x < end_x_crop <= x_next):
-                    t = (start_x_crop - x) / (x_next - x) if x_next != x else 0
-                    y_interp = y + t * (y_next - y)
-                    new_baseline_crop.append((start_x_crop, y_interp))
-                if (start_x_crop <= x < end_x_crop) and (x_next >= end_x_crop):
-                    t = (end_x_crop - x) / (x_next - x) if x_next != x else 0
-                    y_interp = y + t * (y_next - y)
-                    new_baseline_crop.append((end_x_crop, y_interp))
+            ], dtype=float)
+
+        new_baseline_crop = baselines[idx]
 
         # Ensure baseline is at least 5 pixels wide
-        if new_baseline_crop:
-            min_x = min(x for x, y in new_baseline_crop)
-            max_x = max(x for x, y in new_baseline_crop)
-            if max_x - min_x < 5:
+        if len(new_baseline_crop):
+            if np.ptp(new_baseline_crop[:, 0]) < 5:
                 logger.debug(f"Extending baseline for line {line_index + 1}, region {idx}, color {color}")
-                mid_y = sum(y for x, y in new_baseline_crop) / len(new_baseline_crop) if new_baseline_crop else (height / 2)
-                new_baseline_crop = [(start_x_crop, mid_y), (end_x_crop, mid_y)]
+                mid_y = new_baseline_crop[:, 1].mean()
+                new_baseline_crop = np.array([(start_x_crop, mid_y), (end_x_crop, mid_y)])
         else:
             logger.debug(f"No baseline points for line {line_index + 1}, region {idx}, color {color}, creating default")
             mid_y = height / 2
-            new_baseline_crop = [(start_x_crop, mid_y), (end_x_crop, mid_y)]
+            new_baseline_crop = np.array([(start_x_crop, mid_y), (end_x_crop, mid_y)])
 
         # Draw baseline and boundary on debug image
-        color_bgr = (0, 0, 255) if color == "red" else (0, 0, 0)
-        if new_baseline_crop:
-            baseline_pts = np.array(new_baseline_crop, dtype=np.int32)
-            #cv2.polylines(debug_image, [baseline_pts], False, color_bgr, 1)
-        if new_boundary_crop:
-            boundary_pts = np.array(new_boundary_crop, dtype=np.int32)
-            #cv2.polylines(debug_image, [boundary_pts], True, color_bgr, 1)
-
-        # Map back to original coordinates for BaselineLine
-        new_baseline_orig = [(x + left, y + top) for x, y in new_baseline_crop]
-        new_boundary_orig = [(x + left, y + top) for x, y in new_boundary_crop]
-
-        # Clip coordinates to image bounds
-        width, height = color_image.size
-        new_baseline_orig = [(max(0, min(width - 1, x)), max(0, min(height - 1, y))) for x, y in new_baseline_orig]
-        new_boundary_orig = [(max(0, min(width - 1, x)), max(0, min(height - 1, y))) for x, y in new_boundary_orig]
+        #color_bgr = (0, 0, 255) if color == "red" else (0, 0, 0)
+        #cv2.polylines(debug_image, [new_baseline_crop.astype(np.int32)], False, color_bgr, 1)
+        #cv2.polylines(debug_image, [new_boundary_crop.astype(np.int32)], True, color_bgr, 1)
+
+        # Map back to original coordinates, clipped to the image bounds
+        upper = (page_width - 1, page_height - 1)
+        new_baseline_orig = [tuple(point) for point in np.clip(new_baseline_crop + offset, 0, upper).tolist()]
+        new_boundary_orig = [tuple(point) for point in np.clip(new_boundary_crop + offset, 0, upper).tolist()]
 
         # Create new BaselineLine object
-        if new_baseline_orig and new_boundary_orig:
-            new_line = BaselineLine(
-                id=f"{line_index + 1}_{idx}",
-                baseline=new_baseline_orig,
-                boundary=new_boundary_orig,
-                tags=deepcopy(line.tags) if hasattr(line, 'tags') else {},
-                regions=deepcopy(line.regions) if hasattr(line, 'regions') else [],
-                text=line.text if hasattr(line, 'text') else None,
-                imagename=line.imagename if hasattr(line, 'imagename') else None,
-                base_dir=line.base_dir if hasattr(line, 'base_dir') else None,
-                split=line.split if hasattr(line, 'split') else None,
-                type=line.type if hasattr(line, 'type') else 'baselines'
-            )
-            new_line.color = color
-            new_line.segmentation_type = getattr(line, 'segmentation_type', 'baselines')
-            new_lines.append(new_line)
-            logger.debug(f"Created new line {new_line.id}, color {color}, baseline length={max(x for x, y in new_baseline_orig) - min(x for x, y in new_baseline_orig) if new_baseline_orig else 0}")
+        new_line = BaselineLine(
+            id=f"{line_index + 1}_{idx}",
+            baseline=new_baseline_orig,
+            boundary=new_boundary_orig,
+            tags=deepcopy(line.tags) if hasattr(line, 'tags') else {},
+            regions=deepcopy(line.regions) if hasattr(line, 'regions') else [],
+            text=line.text if hasattr(line, 'text') else None,
+            imagename=line.imagename if hasattr(line, 'imagename') else None,
+            base_dir=line.base_dir if hasattr(line, 'base_dir') else None,
+            split=line.split if hasattr(line, 'split') else None,
+            type=line.type if hasattr(line, 'type') else 'baselines'
+        )
+        new_line.color = color
+        new_line.segmentation_type = getattr(line, 'segmentation_type', 'baselines')
+        new_lines.append(new_line)
+        logger.debug(f"Created new line {new_line.id}, color {color}, baseline length={np.ptp(new_baseline_crop[:, 0])}")
 
     # Save debug image with outlines
     #debug_image_pil = PILImage.fromarray(cv2.cvtColor(debug_image, cv2.COLOR_BGR2RGB))
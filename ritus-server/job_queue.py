@@ -0,0 +1,563 @@
+"""
+job_queue.py
+
+A persistent queue for the server's background work (IIIF downloads, batch
+transcription and batch analysis), kept in the QueuedJob table of the
+application's SQLite database.
+
+That work used to run in daemon Threads started by the request handlers and
+controlled through module dicts of stop events, so a restart lost it and
+left its progress row "running" for good. Now each piece of work is a row:
+
+    job_queue.register("iiif_download", run_download, on_status=follow_row)
+    job_queue.enqueue("iiif_download", {"iiif_url": url}, project_id=7,
+                      concurrency_key="iiif:gallica.bnf.fr")
+    job_queue.start()
+
+A pool of worker threads claims queued rows under a lease, and a heartbeat
+thread renews the lease while the handler runs. When a process dies its
+leases stop being renewed. Once a lease has expired, another worker (after a
+restart, one in the new process) claims the job again. A failed attempt is
+retried with exponential backoff until max_attempts is reached. Jobs that
+share a concurrency_key run one at a time, in the order they were enqueued.
+A kind registered with max_running takes at most that many of a process's
+workers, so long jobs of one kind can't keep the other kinds from starting.
+A claim is a single UPDATE, so several processes on one database never run
+the same job twice.
+
+Handlers are called as handler(job, stop_event) with a ClaimedJob. They
+return when their work is done, and return early once stop_event is set,
+which happens on cancellation, on shutdown or when the lease was lost. They
+raise to fail the attempt; JobFailed(message, retry=False) fails the job for
+good. When the queue itself moves a job on (back to "queued" for a retry, or
+to "failed" or "cancelled" for good), it calls on_status(job, status,
+message) inside an app context, so the kind's own progress row can follow.
+
+Several web processes (Gunicorn workers) can share one database. All of
+them enqueue and cancel, and a cancellation reaches the process running the
+job within cancel_poll_seconds. With runner_slots set, only that many
+processes run jobs: each one takes a JobRunnerLease slot at start-up and
+renews it with its heartbeat. A process that dies frees its slot, and the
+next process to look takes it over along with the dead one's orphaned jobs.
+The processes that hold no slot just serve requests, so per-process state of
+the handlers (OCR slots, loaded models) doesn't multiply. A runner publishes
+what state_provider returns with its lease, so any process can show it
+(runner_states()).
+"""
+
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from collections import Counter, namedtuple
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, func, insert, or_, select, update
+from sqlalchemy.exc import IntegrityError
+
+from models import db, JobRunnerLease, QueuedJob
+
+logger = logging.getLogger(__name__)
+
+# Worker threads and attempts per job when nothing else is configured (see
+# "job_workers" in domain_config.json).
+DEFAULT_WORKERS = 4
+DEFAULT_MAX_ATTEMPTS = 3
+ACTIVE_STATUSES = ("queued", "running")
+
+ClaimedJob = namedtuple("ClaimedJob", "id kind project_id payload attempt max_attempts")
+
+
+class JobFailed(Exception):
+    """Fails the current attempt of a job with a message; with retry=False the job fails for good."""
+
+    def __init__(self, message, retry=True):
+        super().__init__(message)
+        self.retry = retry
+
+
+class JobQueue:
+    """Worker threads running the QueuedJob rows of the registered kinds.
+
+    Args:
+        app: The Flask app, for the database sessions of the worker threads.
+        workers: Jobs run at the same time by this process.
+        lease_seconds: How long a claim holds without a heartbeat; a job
+            whose process died is claimed again this long after its last one.
+        heartbeat_seconds: Interval of lease renewal.
+        poll_seconds: How often idle workers look for jobs enqueued elsewhere.
+        retry_delay_seconds: Wait before the first retry; doubled for each
+            further one, up to max_retry_delay_seconds.
+        cancel_poll_seconds: How often running jobs are checked for a
+            cancellation requested in another process.
+        runner_slots: Processes that run jobs at the same time (0 = every
+            process that starts its queue).
+    """
+
+    def __init__(self, app, workers=DEFAULT_WORKERS, lease_seconds=60, heartbeat_seconds=10, poll_seconds=1.0,
+                 retry_delay_seconds=30, max_retry_delay_seconds=900, cancel_poll_seconds=2.0, runner_slots=0):
+        self.app = app
+        self.workers = max(1, int(workers))
+        self.lease_seconds = lease_seconds
+        self.heartbeat_seconds = heartbeat_seconds
+        self.poll_seconds = poll_seconds
+        self.retry_delay_seconds = retry_delay_seconds
+        self.max_retry_delay_seconds = max_retry_delay_seconds
+        self.cancel_poll_seconds = min(cancel_poll_seconds, heartbeat_seconds)
+        self.runner_slots = max(0, int(runner_slots))
+        # Called in an app context each time this process becomes a runner
+        self.on_runner_start = None
+        # Returns this process's runtime stats (JSON-able) to publish with its runner lease
+        self.state_provider = None
+        self.holder = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._runner_slot = None
+        self._handlers = {}  # kind -> (handler, on_status, max_attempts, max_running)
+        self._running = {}  # lease token -> (job id, stop event) of the jobs running here
+        self._running_kinds = Counter()  # kind -> jobs claimed or running here
+        self._claim_lock = threading.Lock()
+        self._threads = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition()
+        self._stopping = threading.Event()
+
+    def register(self, kind, handler, on_status=None, max_attempts=DEFAULT_MAX_ATTEMPTS, max_running=None):
+        """Run jobs of kind with handler(job, stop_event), at most max_running of them at once in this process."""
+        max_running = None if max_running is None else max(1, int(max_running))
+        self._handlers[kind] = (handler, on_status, max(1, int(max_attempts)), max_running)
+
+    def enqueue(self, kind, payload=None, project_id=None, concurrency_key=None):
+        """Add a job and commit the current session; returns the job's id."""
+        if kind not in self._handlers:
+            raise ValueError(f"Unknown job kind {kind!r}")
+        now = datetime.utcnow()
+        job = QueuedJob(
+            kind=kind,
+            project_id=project_id,
+            payload=json.dumps(payload or {}),
+            status="queued",
+            concurrency_key=concurrency_key,
+            max_attempts=self._handlers[kind][2],
+            available_at=now,
+            created_at=now,
+        )
+        db.session.add(job)
+        db.session.commit()
+        self._notify()
+        return job.id
+
+    def active_jobs(self, kind=None, project_id=None, concurrency_key=None):
+        """Queued and running jobs, optionally only those of a kind, project or concurrency key."""
+        query = QueuedJob.query.filter(QueuedJob.status.in_(ACTIVE_STATUSES))
+        if kind is not None:
+            query = query.filter(QueuedJob.kind == kind)
+        if project_id is not None:
+            query = query.filter(QueuedJob.project_id == project_id)
+        if concurrency_key is not None:
+            query = query.filter(QueuedJob.concurrency_key == concurrency_key)
+        return query.order_by(QueuedJob.id).all()
+
+    def cancel(self, kind, project_id):
+        """Cancel the project's queued and running jobs of kind; returns how many there were.
+
+        Queued jobs are cancelled right away. Running ones are flagged and
+        their stop_event set, at once in this process and within
+        cancel_poll_seconds in another one; they end "cancelled" when the
+        handler returns.
+        """
+        jobs = self.active_jobs(kind=kind, project_id=project_id)
+        now = datetime.utcnow()
+        for job in jobs:
+            job.cancel_requested = True
+            if job.status == "queued":
+                job.status = "cancelled"
+                job.finished_at = now
+        db.session.commit()
+        ids = {job.id for job in jobs}
+        with self._lock:
+            for job_id, stop_event in self._running.values():
+                if job_id in ids:
+                    stop_event.set()
+        return len(jobs)
+
+    def start(self):
+        """Start the worker and heartbeat threads; False if they are already running."""
+        with self._lock:
+            if self._threads:
+                return False
+            self._stopping.clear()
+            self._threads = [
+                threading.Thread(target=self._work, name=f"job-worker-{i}", daemon=True)
+                for i in range(self.workers)
+            ]
+            self._threads.append(threading.Thread(target=self._heartbeat, name="job-heartbeat", daemon=True))
+            threads = list(self._threads)
+        for thread in threads:
+            thread.start()
+        logger.info(f"Job queue started with {self.workers} workers for {', '.join(sorted(self._handlers))}")
+        return True
+
+    def stop(self, timeout=None):
+        """Stop the threads; jobs still running are put back in the queue for the next start.
+
+        The runner slot is given up, so another process takes over at once.
+        """
+        self._stopping.set()
+        with self._lock:
+            for _, stop_event in self._running.values():
+                stop_event.set()
+            threads, self._threads = self._threads, []
+        self._notify(everyone=True)
+        for thread in threads:
+            thread.join(timeout)
+        if self._runner_slot is not None:
+            self._release_runner_slot()
+
+    @property
+    def is_runner(self):
+        """Whether this process runs jobs (holds a runner slot)."""
+        return self._runner_slot is not None
+
+    def runner_states(self):
+        """The runner processes with a live lease: [{"slot", "holder", "state"}], this one included."""
+        table = JobRunnerLease.__table__
+        with self.app.app_context():
+            rows = db.session.execute(
+                select(table.c.slot, table.c.holder, table.c.state)
+                .where(table.c.holder.is_not(None), table.c.expires_at >= datetime.utcnow())
+                .order_by(table.c.slot)
+            ).all()
+        return [{"slot": slot, "holder": holder, "state": json.loads(state) if state else None}
+                for slot, holder, state in rows]
+
+    def stats(self):
+        """Jobs per kind and status, and the jobs running in this process."""
+        with self.app.app_context():
+            rows = db.session.execute(
+                select(QueuedJob.kind, QueuedJob.status, func.count()).group_by(QueuedJob.kind, QueuedJob.status)
+            ).all()
+        jobs = {}
+        for kind, status, count in rows:
+            jobs.setdefault(kind, {})[status] = count
+        with self._lock:
+            running = len(self._running)
+        return {
+            "workers": self.workers,
+            "running_here": running,
+            "runner": self.is_runner,
+            "runners": [{"slot": r["slot"], "holder": r["holder"]} for r in self.runner_states()],
+            "jobs": jobs,
+        }
+
+    # --- worker side -------------------------------------------------------
+
+    def _notify(self, everyone=False):
+        with self._wakeup:
+            if everyone:
+                self._wakeup.notify_all()
+            else:
+                self._wakeup.notify()
+
+    def _work(self):
+        while not self._stopping.is_set():
+            try:
+                claimed = self._claim()
+            except Exception:
+                logger.exception("Claiming a job failed")
+                claimed = None
+            if claimed is None:
+                with self._wakeup:
+                    self._wakeup.wait(self.poll_seconds)
+                continue
+            self._run(*claimed)
+
+    def _claim(self):
+        """Lease the oldest runnable job; returns (lease token, ClaimedJob) or None."""
+        if self._stopping.is_set() or not self.is_runner:
+            return None
+        # One claim at a time, so no kind goes over its max_running
+        with self._claim_lock:
+            with self._lock:
+                kinds = [kind for kind, (_, _, _, max_running) in self._handlers.items()
+                         if max_running is None or self._running_kinds[kind] < max_running]
+            if not kinds:
+                return None
+            claimed = self._claim_kinds(kinds)
+            if claimed is not None:
+                with self._lock:
+                    self._running_kinds[claimed[1].kind] += 1
+            return claimed
+
+    def _claim_kinds(self, kinds):
+        table = QueuedJob.__table__
+        candidate = table.alias("candidate")
+        other = table.alias("other")
+        token = uuid.uuid4().hex
+        with self.app.app_context():
+            now = datetime.utcnow()
+            key_busy = select(other.c.id).where(
+                other.c.concurrency_key == candidate.c.concurrency_key,
+                other.c.id != candidate.c.id,
+                other.c.status == "running",
+                other.c.lease_expires_at >= now,
+            ).exists()
+            runnable = or_(
+                and_(candidate.c.status == "queued", candidate.c.available_at <= now),
+                # Orphaned: whoever ran it stopped renewing the lease
+                and_(candidate.c.status == "running", candidate.c.lease_expires_at < now,
+                     candidate.c.attempts < candidate.c.max_attempts),
+            )
+            pick = (
+                select(candidate.c.id)
+                .where(
+                    candidate.c.kind.in_(kinds),
+                    runnable,
+                    candidate.c.cancel_requested.is_(False),
+                    or_(candidate.c.concurrency_key.is_(None), ~key_busy),
+                )
+                .order_by(candidate.c.id)
+                .limit(1)
+                .scalar_subquery()
+            )
+            result = db.session.execute(
+                update(table)
+                .where(table.c.id == pick)
+                .values(
+                    status="running",
+                    lease_token=token,
+                    lease_expires_at=now + timedelta(seconds=self.lease_seconds),
+                    heartbeat_at=now,
+                    attempts=table.c.attempts + 1,
+                    updated_at=now,
+                )
+            )
+            db.session.commit()
+            if result.rowcount != 1:
+                return None
+            row = QueuedJob.query.filter_by(lease_token=token).one()
+            logger.info(f"Job {row.id} ({row.kind}, project {row.project_id}) claimed, attempt "
+                        f"{row.attempts}/{row.max_attempts}")
+            job = ClaimedJob(row.id, row.kind, row.project_id, json.loads(row.payload or "{}"),
+                             row.attempts, row.max_attempts)
+        return token, job
+
+    def _run(self, token, job):
+        handler = self._handlers[job.kind][0]
+        stop_event = threading.Event()
+        with self._lock:
+            self._running[token] = (job.id, stop_event)
+        error, retry = None, True
+        try:
+            handler(job, stop_event)
+        except JobFailed as e:
+            error, retry = str(e), e.retry
+        except Exception as e:
+            logger.exception(f"Job {job.id} ({job.kind}) failed")
+            error = str(e) or type(e).__name__
+        finally:
+            with self._lock:
+                self._running.pop(token, None)
+                self._running_kinds[job.kind] -= 1
+        try:
+            self._finish(token, job, error, retry, stop_event.is_set())
+        except Exception:
+            logger.exception(f"Recording the outcome of job {job.id} ({job.kind}) failed")
+        # A concurrency key may have become free
+        self._notify(everyone=True)
+
+    def _finish(self, token, job, error, retry, stopped):
+        with self.app.app_context():
+            row = QueuedJob.query.filter_by(id=job.id, lease_token=token).first()
+            if row is None:
+                logger.warning(f"Job {job.id} ({job.kind}) lost its lease while running; leaving it to its new owner")
+                return
+            now = datetime.utcnow()
+            message = None
+            if row.cancel_requested:
+                row.status = "cancelled"
+            elif stopped and self._stopping.is_set():
+                # Interrupted by stop(), which is no fault of the job
+                row.status = "queued"
+                row.attempts = max(0, row.attempts - 1)
+                row.available_at = now
+            elif error is None:
+                row.status = "completed"
+            elif retry and row.attempts < row.max_attempts:
+                delay = min(self.max_retry_delay_seconds, self.retry_delay_seconds * 2 ** (row.attempts - 1))
+                row.status = "queued"
+                row.available_at = now + timedelta(seconds=delay)
+                message = f"{error} (attempt {row.attempts}/{row.max_attempts}, retrying in {delay:.0f}s)"
+                logger.warning(f"Job {job.id} ({job.kind}) failed: {message}")
+            else:
+                row.status = "failed"
+                message = error
+            row.error_message = message if message is not None else row.error_message
+            row.lease_token = None
+            row.lease_expires_at = None
+            row.updated_at = now
+            if row.status not in ACTIVE_STATUSES:
+                row.finished_at = now
+            status = row.status
+            db.session.commit()
+            if status != "completed":
+                self._report(job, status, message)
+
+    def _report(self, job, status, message):
+        """Tell the kind's on_status about a status the queue decided; call inside an app context."""
+        on_status = self._handlers[job.kind][1]
+        if on_status is None:
+            return
+        try:
+            on_status(job, status, message)
+        except Exception:
+            db.session.rollback()
+            logger.exception(f"on_status of job {job.id} ({job.kind}) failed")
+
+    # --- heartbeat side ----------------------------------------------------
+
+    def _heartbeat(self):
+        next_beat = 0.0
+        while True:
+            try:
+                if time.monotonic() >= next_beat:
+                    next_beat = time.monotonic() + self.heartbeat_seconds
+                    self._hold_runner_slot()
+                    self._renew_leases()
+                    if self.is_runner:
+                        self._reap_orphans()
+                self._check_running()
+            except Exception:
+                logger.exception("Job queue heartbeat failed")
+            if self._stopping.wait(self.cancel_poll_seconds):
+                return
+
+    def _hold_runner_slot(self):
+        """Renew this process's runner slot, or take a free one; publishes state_provider()."""
+        table = JobRunnerLease.__table__
+        state = None
+        if self.state_provider is not None:
+            try:
+                state = json.dumps(self.state_provider())
+            except Exception:
+                logger.exception("Job runner state_provider failed")
+        with self.app.app_context():
+            now = datetime.utcnow()
+            lease = dict(expires_at=now + timedelta(seconds=self.lease_seconds), heartbeat_at=now, state=state)
+            if self._runner_slot is not None:
+                renewed = db.session.execute(
+                    update(table).where(table.c.slot == self._runner_slot, table.c.holder == self.holder)
+                    .values(**lease)
+                )
+                db.session.commit()
+                if renewed.rowcount == 1:
+                    return
+                logger.warning(f"Job runner slot {self._runner_slot} was taken over; no longer claiming jobs")
+                self._runner_slot = None
+            existing = db.session.execute(select(table.c.slot)).scalars().all()
+            slots = range(self.runner_slots) if self.runner_slots else range(len(existing) + 1)
+            for slot in slots:
+                if slot not in existing:
+                    try:
+                        db.session.execute(insert(table).values(slot=slot))
+                        db.session.commit()
+                    except IntegrityError:
+                        db.session.rollback()  # Created by another process meanwhile
+                took = db.session.execute(
+                    update(table)
+                    .where(table.c.slot == slot, or_(table.c.holder.is_(None), table.c.expires_at < now))
+                    .values(holder=self.holder, acquired_at=now, **lease)
+                )
+                db.session.commit()
+                if took.rowcount == 1:
+                    self._runner_slot = slot
+                    break
+            else:
+                return
+            logger.info(f"Process {self.holder} runs jobs (runner slot {self._runner_slot})")
+            if self.on_runner_start is not None:
+                try:
+                    self.on_runner_start()
+                except Exception:
+                    db.session.rollback()
+                    logger.exception("Job queue on_runner_start failed")
+        self._notify(everyone=True)
+
+    def _release_runner_slot(self):
+        table = JobRunnerLease.__table__
+        with self.app.app_context():
+            db.session.execute(
+                update(table).where(table.c.slot == self._runner_slot, table.c.holder == self.holder)
+                .values(holder=None, expires_at=None, state=None)
+            )
+            db.session.commit()
+        logger.info(f"Process {self.holder} gave up runner slot {self._runner_slot}")
+        self._runner_slot = None
+
+    def _renew_leases(self):
+        """Extend the leases of the jobs running here."""
+        with self._lock:
+            running = dict(self._running)
+        if not running:
+            return
+        table = QueuedJob.__table__
+        with self.app.app_context():
+            now = datetime.utcnow()
+            db.session.execute(
+                update(table)
+                .where(table.c.lease_token.in_(list(running)), table.c.status == "running")
+                .values(lease_expires_at=now + timedelta(seconds=self.lease_seconds), heartbeat_at=now)
+            )
+            db.session.commit()
+
+    def _check_running(self):
+        """Stop the jobs running here that were cancelled, deleted or claimed by someone else."""
+        with self._lock:
+            running = dict(self._running)
+        if not running:
+            return
+        table = QueuedJob.__table__
+        with self.app.app_context():
+            held = dict(db.session.execute(
+                select(table.c.lease_token, table.c.cancel_requested).where(table.c.lease_token.in_(list(running)))
+            ).all())
+        for token, (job_id, stop_event) in running.items():
+            if token not in held:
+                # Deleted with its project, or claimed by someone else after
+                # the lease ran out
+                logger.warning(f"Job {job_id} lost its lease; stopping it")
+                stop_event.set()
+            elif held[token]:
+                stop_event.set()
+
+    def _reap_orphans(self):
+        """End orphaned jobs that are cancelled or out of attempts, which no claim would pick up."""
+        table = QueuedJob.__table__
+        with self.app.app_context():
+            now = datetime.utcnow()
+            rows = QueuedJob.query.filter(
+                QueuedJob.kind.in_(list(self._handlers)),
+                QueuedJob.status == "running",
+                QueuedJob.lease_expires_at < now,
+                or_(QueuedJob.cancel_requested.is_(True), QueuedJob.attempts >= QueuedJob.max_attempts),
+            ).all()
+            for row in rows:
+                if row.cancel_requested:
+                    status, message = "cancelled", None
+                else:
+                    status = "failed"
+                    message = f"Interrupted by a server stop on its last attempt ({row.attempts}/{row.max_attempts})"
+                # Conditional on the lease, in case another process reaps it too
+                result = db.session.execute(
+                    update(table)
+                    .where(table.c.id == row.id, table.c.lease_token == row.lease_token)
+                    .values(status=status, error_message=message or row.error_message, lease_token=None,
+                            lease_expires_at=None, updated_at=now, finished_at=now)
+                )
+                db.session.commit()
+                if result.rowcount == 1:
+                    logger.warning(f"Orphaned job {row.id} ({row.kind}) marked {status}")
+                    job = ClaimedJob(row.id, row.kind, row.project_id, json.loads(row.payload or "{}"),
+                                     row.attempts, row.max_attempts)
+                    self._report(job, status, message)
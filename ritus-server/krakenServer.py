@@ -1,44 +1,35 @@
 import sys
 import argparse
+import atexit
 import os
-import hashlib
 import logging
 import logging.handlers
 import json
-import re
-from dataclasses import replace
 import cv2
 import torch
 import numpy as np
 import webbrowser
 from urllib.parse import urlparse
-from flask import Flask, request, jsonify, send_from_directory, Response
+from flask import Flask, request, jsonify, send_from_directory, Response, g
 from flask_cors import CORS
 from flask_jwt_extended import JWTManager, jwt_required, create_access_token, get_jwt_identity
 from PIL import Image as PILImage
 from PIL import ImageFile
+import queue
 import threading
 from threading import Timer, Thread
-from concurrent.futures import ThreadPoolExecutor
 from flask_caching import Cache
 from config import SERVER_URL, ADMIN_USERNAME, ADMIN_PASSWORD, SECRET_KEY
 
 # Importy lokalne
-from models import db, User, Project, ProjectSharing, Image, Content, BatchProcessing, IiifDownloadJob, BatchTranscribeJob
-from download_iiif import run_iiif_download
+from models import db, User, Project, ProjectSharing, Image, Content, BatchProcessing, IiifDownloadJob, BatchTranscribeJob, TranscriptionLine, TranscriptionRun
+from download_iiif import choose_start_page, resume_page, run_iiif_download
+from job_queue import JobQueue, JobFailed, DEFAULT_WORKERS as DEFAULT_JOB_WORKERS
+from progress_writer import ProgressWriter, DEFAULT_INTERVAL_SECONDS as DEFAULT_PROGRESS_INTERVAL
 from transcription_autofix import apply_autofix
 
-# Registry of stop events keyed by project_id for IIIF background downloads
-_iiif_stop_events = {}
-# Domain-based serialisation: only one download per domain at a time
-_iiif_running_by_domain = {}  # domain -> project_id currently running
-
-# Registry of stop events for background transcription jobs
-_transcribe_stop_events = {}  # project_id -> threading.Event
-# Global serialisation lock: one project transcribes at a time (others wait as "pending")
-_transcribe_lock = threading.Lock()
-# Lock protecting OCR/baseline model loading; inference itself is read-only (thread-safe)
-_ocr_model_lock = threading.Lock()
+# Pipeline of the running batch transcription, for stage occupancy in the status
+_transcribe_pipelines = {}  # project_id -> StagedPipeline
 
 
 def _iiif_domain(url):
@@ -49,88 +40,112 @@ def _iiif_domain(url):
         return url
 
 
+DOMAIN_CONFIG_PATH = os.path.join(os.path.dirname(__file__), "domain_config.json")
+
+
 def _load_domain_config():
     """Load domain_config.json from the server directory. Returns empty dict if missing."""
-    config_path = os.path.join(os.path.dirname(__file__), "domain_config.json")
     try:
-        with open(config_path) as f:
+        with open(DOMAIN_CONFIG_PATH) as f:
             return json.load(f)
     except Exception:
         return {}
 
 
-def _launch_iiif_thread(project_id, job_id, iiif_url, upload_folder, start_page):
-    """Create stop-event, register the domain as busy, and start the download thread."""
-    domain = _iiif_domain(iiif_url)
-    _iiif_running_by_domain[domain] = project_id
+def _domain_config_mtime():
+    """Modification time (and size) of domain_config.json, or None if it is missing."""
+    try:
+        stat = os.stat(DOMAIN_CONFIG_PATH)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
 
-    # Read per-domain sleep/timeout from domain_config.json
-    domain_cfg = _load_domain_config().get(domain, {})
-    sleep_seconds = domain_cfg.get("sleep_seconds", 0)
-    request_timeout = domain_cfg.get("timeout", 60)
 
-    stop_event = threading.Event()
-    _iiif_stop_events[project_id] = stop_event
+def _run_iiif_job(job, stop_event):
+    """job_queue handler of an IIIF download; a retry resumes after the last saved page."""
+    iiif_url = job.payload["iiif_url"]
+    with app.app_context():
+        record = IiifDownloadJob.query.filter_by(project_id=job.project_id).first()
+        if record is None:
+            # Reset while it was queued
+            return
+        start_page = resume_page(record.start_page, record.current_page)
 
-    def on_progress(current_page, total_pages, status, error=None):
+    # Read per-domain sleep/timeout from domain_config.json
+    domain_cfg = _load_domain_config().get(_iiif_domain(iiif_url), {})
+    outcome = {}
+
+    def write(values):
         with app.app_context():
-            j = IiifDownloadJob.query.get(job_id)
+            j = IiifDownloadJob.query.filter_by(project_id=job.project_id).first()
             if j is None:
                 return
-            j.current_page = current_page
-            j.total_pages = total_pages
-            j.status = status
-            if error:
-                j.error_message = error
+            for name, value in values.items():
+                setattr(j, name, value)
             db.session.commit()
-        if status in ("completed", "failed", "cancelled"):
-            _iiif_stop_events.pop(project_id, None)
-            _iiif_running_by_domain.pop(domain, None)
-            _promote_waiting_domain(domain)
-
-    thread = Thread(
-        target=run_iiif_download,
-        kwargs=dict(
-            project_id=project_id,
-            iiif_url=iiif_url,
-            upload_folder=upload_folder,
-            start_page=start_page,
-            flask_app=app,
-            on_progress=on_progress,
-            stop_event=stop_event,
-            sleep_seconds=sleep_seconds,
-            request_timeout=request_timeout,
-        ),
-        daemon=True,
+
+    progress = ProgressWriter(write, _progress_interval())
+
+    def on_progress(current_page, total_pages, status, error=None):
+        outcome["status"], outcome["error"] = status, error
+        if status == "failed":
+            # Retry or give up is up to the queue (_iiif_job_status)
+            progress.state(error_message=error)
+        elif total_pages:
+            # current_page is where a retry resumes, so it is written with
+            # the page it counts; total_pages is 0 before the manifest is
+            # read, and the resume point is kept then.
+            progress.state(current_page=current_page, total_pages=total_pages, status=status)
+        else:
+            progress.state(status=status)
+
+    run_iiif_download(
+        project_id=job.project_id,
+        iiif_url=iiif_url,
+        upload_folder=app.config["UPLOAD_FOLDER"],
+        start_page=start_page,
+        flask_app=app,
+        on_progress=on_progress,
+        stop_event=stop_event,
+        sleep_seconds=domain_cfg.get("sleep_seconds", 0),
+        request_timeout=domain_cfg.get("timeout", 60),
+    )
+    if outcome.get("status") == "failed":
+        raise JobFailed(outcome["error"])
+
+
+def _iiif_job_status(job, status, message):
+    """Follow a retry ("queued") or the end of an IIIF download job in its IiifDownloadJob row."""
+    j = IiifDownloadJob.query.filter_by(project_id=job.project_id).first()
+    if j is None:
+        return
+    j.status = "pending" if status == "queued" else status
+    if message:
+        j.error_message = message
+    db.session.commit()
+
+
+def _enqueue_iiif_download(project):
+    """Queue the download of project's manifest; one download per IIIF domain runs at a time."""
+    return job_queue.enqueue(
+        "iiif_download",
+        {"iiif_url": project.iiif_url},
+        project_id=project.id,
+        concurrency_key=f"iiif:{_iiif_domain(project.iiif_url)}",
     )
-    thread.start()
 
 
-def _promote_waiting_domain(domain):
-    """Find the oldest waiting job for *domain* and start it."""
-    with app.app_context():
-        waiting = (
-            IiifDownloadJob.query
-            .filter_by(status="waiting")
-            .order_by(IiifDownloadJob.id.asc())
-            .all()
-        )
-        for job in waiting:
-            project = Project.query.get(job.project_id)
-            if project and project.iiif_url and _iiif_domain(project.iiif_url) == domain:
-                job.status = "pending"
-                db.session.commit()
-                logger.info(f"Promoting waiting IIIF job for project {project.id} (domain {domain})")
-                _launch_iiif_thread(
-                    project.id, job.id, project.iiif_url,
-                    app.config["UPLOAD_FOLDER"], job.start_page
-                )
-                return
 from batch_analysis import batch_process_project
-from image_processing import split_line_boundary_by_color
-from multi_column_layout import reorder_lines_for_multi_column, detect_column_bands
+from multi_column_layout import reorder_lines_for_multi_column
 import layout_parser_preprocessing
+import metrics
 from ai_tools import gpt_autofix
+from model_registry import ModelRegistry, DEFAULT_CAPACITY as DEFAULT_MODEL_CACHE_SIZE
+from ocr_workers import OcrWorkerPool
+from page_image import PageImage
+from staged_pipeline import Stage, StagedPipeline
+from fair_scheduler import FairShareScheduler, INTERACTIVE
+import page_tasks
 from secret_user_api_key import user_api_key
 from cache_config import cache, init_cache
 
@@ -201,6 +216,10 @@ parser = argparse.ArgumentParser()
 parser.add_argument('--no-kraken', action='store_true', help='Disable kraken OCR')
 args, unknown = parser.parse_known_args()
 NO_KRAKEN = args.no_kraken
+# Inference worker processes (ocr_workers.py) are started with "spawn", which
+# re-imports this file in each of them as __mp_main__. They load their own
+# models, so the start-up model loading below is skipped there.
+IN_INFERENCE_WORKER = __name__ == "__mp_main__"
 
 def get_model_path(model_name):
     local_path = os.path.join("models", model_name)
@@ -210,10 +229,16 @@ def get_model_path(model_name):
     return app_support_path if os.path.exists(app_support_path) else None
 
 if not NO_KRAKEN:
-    from kraken import binarization, rpred, pageseg, blla
+    from kraken import binarization, pageseg, blla
     from kraken.lib import vgsl
     from kraken.lib.models import load_any
     from kraken.containers import BaselineLine, Segmentation
+    from batch_recognition import DEFAULT_BATCH_SIZE as DEFAULT_RECOGNITION_BATCH_SIZE
+    from page_transcription import (
+        LINE_WRAP_HYPHEN, should_ignore_line, recognize_page_lines, transcribe_page,
+    )
+    from segmentation_cache import SegmentationCache, model_fingerprint
+    from segmentation_map import DEFAULT_CAPACITY as DEFAULT_SEGMENTATION_MAP_CACHE_SIZE, SegmentationMapCache
 
 # --- INICJALIZACJA FLASK ---
 app = Flask(__name__, static_folder="static", static_url_path="/")
@@ -246,6 +271,55 @@ app.config["MAX_CONTENT_LENGTH"] = 1024 * 1024 * 1024
 db.init_app(app)
 cache = init_cache(app)
 
+
+def _job_workers():
+    """Background jobs run at the same time (job_workers in domain_config.json)."""
+    try:
+        return max(1, int(_load_domain_config().get("job_workers", DEFAULT_JOB_WORKERS)))
+    except (TypeError, ValueError):
+        return DEFAULT_JOB_WORKERS
+
+
+def _job_runner_processes():
+    """Web processes that run background jobs (job_runner_processes in domain_config.json, 0 = all)."""
+    try:
+        return max(0, int(_load_domain_config().get("job_runner_processes", 1)))
+    except (TypeError, ValueError):
+        return 1
+
+
+def _progress_interval():
+    """Least seconds between two progress writes of a job (progress_flush_ms in domain_config.json)."""
+    try:
+        return max(0, int(_load_domain_config().get("progress_flush_ms", DEFAULT_PROGRESS_INTERVAL * 1000))) / 1000
+    except (TypeError, ValueError):
+        return DEFAULT_PROGRESS_INTERVAL
+
+
+def _analysis_workers():
+    """Threads of the fuzzy word matching in batch analysis (analysis_workers in domain_config.json, 0 = all cores)."""
+    try:
+        workers = int(_load_domain_config().get("analysis_workers", 0))
+    except (TypeError, ValueError):
+        workers = 0
+    return workers if workers > 0 else -1
+
+
+def _prefetch_workers():
+    """Threads reading pages ahead of the OCR in batch transcription (prefetch_workers in domain_config.json)."""
+    try:
+        return max(1, int(_load_domain_config().get("prefetch_workers", 2)))
+    except (TypeError, ValueError):
+        return 2
+
+
+# IIIF downloads, batch transcription and batch analysis run as rows of the
+# QueuedJob table (job_queue.py), so a restart resumes them; the worker
+# threads are started by _start_job_queue() at the end of this module.
+# Under Gunicorn only job_runner_processes of the workers run them, the
+# rest serve requests.
+job_queue = JobQueue(app, workers=_job_workers(), runner_slots=_job_runner_processes())
+
 def init_database():
     """Initialize database tables and create admin user if needed."""
     with app.app_context():
@@ -276,9 +350,42 @@ def enable_wal(app):
 # --- MODELE KRAKEN (Globalne ładowanie) ---
 selected_device = "cuda:0" if torch.cuda.is_available() else "cpu"
 baseline_model = None
-ocr_model = None
-last_ocr_model_name = None
 MODEL_PATHS = {}
+# Segmentations of already seen pages (segmentation_cache.py), keyed by the
+# fingerprint of the baseline model loaded at startup; None when disabled.
+SEGMENTATION_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "segmentation_cache")
+segmentation_cache = None
+# blla network output of recently segmented pages (segmentation_map.py), so
+# changing layout options only re-vectorizes; None when disabled.
+segmentation_maps = None
+
+
+def _load_ocr_model(model_name):
+    metrics.MODEL_LOADS.inc(model=model_name)
+    with metrics.span("model_load"):
+        return load_any(MODEL_PATHS[model_name], device=selected_device)
+
+
+def _model_registry_from_config():
+    """Recognition model pool sized by domain_config.json.
+
+    model_cache_size: how many models stay loaded (LRU);
+    model_cache_max_mb: optional budget for their summed size (0 = none).
+    """
+    cfg = _load_domain_config()
+    try:
+        capacity = max(1, int(cfg.get("model_cache_size", DEFAULT_MODEL_CACHE_SIZE)))
+    except (TypeError, ValueError):
+        capacity = DEFAULT_MODEL_CACHE_SIZE
+    try:
+        max_bytes = int(float(cfg.get("model_cache_max_mb") or 0) * 1024 * 1024)
+    except (TypeError, ValueError):
+        max_bytes = 0
+    return ModelRegistry(_load_ocr_model, capacity=capacity, max_bytes=max_bytes)
+
+
+# Loaded recognition models, shared by all request and batch worker threads
+ocr_models = _model_registry_from_config()
 
 if not NO_KRAKEN:
     MODEL_PATHS = {
@@ -295,6 +402,8 @@ if not NO_KRAKEN:
         "en_best.mlmodel": get_model_path("en_best.mlmodel"),
         "blla.mlmodel": get_model_path("blla.mlmodel"),
     }
+
+if not NO_KRAKEN and not IN_INFERENCE_WORKER:
     # Uwaga: Ładowanie ciężkich modeli lepiej robić wewnątrz pierwszej prośby 
     # lub użyć preload_app w Gunicorn, aby nie dublować RAM-u
     baseline_model_path = MODEL_PATHS.get("blla.mlmodel")
@@ -305,12 +414,13 @@ if not NO_KRAKEN:
         # Log its fingerprint so the two environments can be diffed directly.
         try:
             _stat = os.stat(baseline_model_path)
-            with open(baseline_model_path, "rb") as _f:
-                _sha256 = hashlib.sha256(_f.read()).hexdigest()
+            _sha256 = model_fingerprint(baseline_model_path)
             logger.info(
                 "blla.mlmodel fingerprint: size=%d sha256=%s mtime=%s",
                 _stat.st_size, _sha256, _stat.st_mtime,
             )
+            if _load_domain_config().get("segmentation_cache", True):
+                segmentation_cache = SegmentationCache(SEGMENTATION_CACHE_DIR, _sha256)
         except Exception:
             logger.exception("Failed to fingerprint baseline model file")
 
@@ -331,66 +441,106 @@ if not NO_KRAKEN:
     else:
         logger.error("Baseline model path not found! 'models/blla.mlmodel' is missing.")
 
+    try:
+        _map_cache_size = int(_load_domain_config().get("segmentation_map_cache_size",
+                                                        DEFAULT_SEGMENTATION_MAP_CACHE_SIZE))
+    except (TypeError, ValueError):
+        _map_cache_size = DEFAULT_SEGMENTATION_MAP_CACHE_SIZE
+    if _map_cache_size > 0:
+        segmentation_maps = SegmentationMapCache(_map_cache_size)
+
+    # Warm the recognition model pool with the models listed in
+    # preload_models (domain_config.json), so first requests don't wait.
+    _preload = [name for name in _load_domain_config().get("preload_models", []) if MODEL_PATHS.get(name)]
+    if _preload:
+        ocr_models.preload(_preload)
+
+# Optional process-based inference backend (inference_processes in
+# domain_config.json); started on first use, None while disabled.
+_inference_pool = None
+_inference_pool_lock = threading.Lock()
+
+
+def _inference_processes():
+    """Worker processes for OCR (inference_processes in domain_config.json, 0 = in-process)."""
+    try:
+        return max(0, int(_load_domain_config().get("inference_processes", 0)))
+    except (TypeError, ValueError):
+        return 0
+
+
+def _get_inference_pool():
+    """The OcrWorkerPool when inference_processes > 0, else None."""
+    global _inference_pool
+    if NO_KRAKEN or IN_INFERENCE_WORKER:
+        return None
+    processes = _inference_processes()
+    with _inference_pool_lock:
+        if _inference_pool is not None and _inference_pool.processes != processes:
+            _inference_pool.shutdown()
+            _inference_pool = None
+        if _inference_pool is None and processes > 0:
+            cfg = _load_domain_config()
+            _inference_pool = OcrWorkerPool(
+                processes,
+                {name: path for name, path in MODEL_PATHS.items() if path},
+                MODEL_PATHS.get("blla.mlmodel"),
+                device=selected_device,
+                model_cache_size=ocr_models.capacity,
+                model_cache_max_bytes=ocr_models.max_bytes,
+                preload_models=[name for name in cfg.get("preload_models", []) if MODEL_PATHS.get(name)],
+                segmentation_cache_dir=SEGMENTATION_CACHE_DIR if segmentation_cache is not None else None,
+                segmentation_map_cache_size=segmentation_maps.capacity if segmentation_maps is not None else 0,
+            )
+        return _inference_pool
+
+# OCR slots shared by the batch transcriptions of all projects (fair_scheduler.py)
+transcription_scheduler = FairShareScheduler()
+# (domain_config.json mtime, worker processes) the scheduler was last
+# configured for, and the OCR threads a project needs under it
+_scheduler_configured = {"key": None, "threads": 1}
+_scheduler_config_lock = threading.Lock()
+
+
+def _configure_transcription_scheduler(pool):
+    """Apply the slot settings of domain_config.json; returns the OCR threads a project needs.
+
+    Slots are transcription_workers, but with worker processes the OCR
+    threads only wait on them, so at least one per process to keep every
+    process busy. transcription_project_slots and transcription_user_slots
+    cap one project and one user (0 = no cap). The file is only read again
+    when it has changed since the last call.
+    """
+    key = (_domain_config_mtime(), pool.processes if pool is not None else 0)
+    with _scheduler_config_lock:
+        if _scheduler_configured["key"] == key:
+            return _scheduler_configured["threads"]
+        cfg = _load_domain_config()
+        try:
+            slots = max(1, int(cfg.get("transcription_workers", 1)))
+        except (TypeError, ValueError):
+            slots = 1
+        if pool is not None:
+            slots = max(slots, pool.processes)
+        try:
+            project_slots = max(0, int(cfg.get("transcription_project_slots", 0) or 0))
+        except (TypeError, ValueError):
+            project_slots = 0
+        try:
+            user_slots = max(0, int(cfg.get("transcription_user_slots", 0) or 0))
+        except (TypeError, ValueError):
+            user_slots = 0
+        transcription_scheduler.configure(slots, project_slots, user_slots)
+        threads = min(slots, project_slots) if project_slots else slots
+        _scheduler_configured.update(key=key, threads=threads)
+        return threads
+
 ### Color separation: #######################################################
 
 ################################### START OF SERVER:############################
 
 # Only define kraken-dependent functions if not NO_KRAKEN
 if not NO_KRAKEN:
-    def segment_detected_columns_independently(image, initial_lines, column_gap_ratio=0.045):
-        """Re-run blla on two body-column crops when it joined their text.
-
-        Line reordering cannot undo an OCR crop that already contains both
-        columns.  This keeps a centred title from the full-page pass, then
-        segments the body in independent left/right image crops.
-        """
-        bands = detect_column_bands(initial_lines, image.width, column_gap_ratio=column_gap_ratio)
-        if len(bands) != 2:
-            return None
-        (left_edge, left_right), (right_left, right_edge) = bands
-        gutter = int(round((left_right + right_left) / 2.0))
-        if gutter <= 0 or gutter >= image.width:
-            return None
-
-        def bbox(line):
-            points = getattr(line, "boundary", None) or getattr(line, "baseline", None)
-            xs = [point[0] for point in points]
-            ys = [point[1] for point in points]
-            return min(xs), min(ys), max(xs), max(ys)
-
-        first = min(initial_lines, key=lambda line: bbox(line)[1])
-        x0, _y0, x1, title_bottom = bbox(first)
-        # Preserve only a genuinely centred header. A normal first body line
-        # should not be removed before column segmentation.
-        is_centered_header = (
-            x0 > left_edge + 0.15 * (left_right - left_edge)
-            and x1 < right_edge - 0.15 * (right_edge - right_left)
-            and x0 < gutter < x1
-        )
-        body_top = max(0, int(title_bottom) - 2) if is_centered_header else 0
-        result = [first] if is_centered_header else []
-
-        for side, crop_box, offset in (
-            ("left", (0, body_top, gutter, image.height), (0, body_top)),
-            ("right", (gutter, body_top, image.width, image.height), (gutter, body_top)),
-        ):
-            column_segmentation = blla.segment(
-                image.crop(crop_box), model=baseline_model, device=selected_device,
-                text_direction="horizontal-tb",
-            )
-            for line in sorted(column_segmentation.lines, key=lambda item: bbox(item)[1]):
-                result.append(replace(
-                    line,
-                    id=f"{line.id}:{side}",
-                    baseline=[(x + offset[0], y + offset[1]) for x, y in line.baseline],
-                    boundary=[(x + offset[0], y + offset[1]) for x, y in line.boundary],
-                ))
-        logger.info(
-            "Segmented two detected body columns independently: %d -> %d lines",
-            len(initial_lines), len(result),
-        )
-        return result
-
     def serialize_segmentation(segmentation):
         serialized_lines = []
         if segmentation is None:
@@ -412,12 +562,6 @@ if not NO_KRAKEN:
             })
         return serialized_lines
 
-    # The recognition models mark a genuine end-of-line word-wrap (a word
-    # broken across a physical printed line) with a trailing "¬". That's a
-    # print-layout artifact, not part of the word, so fold it back into a
-    # single continuous word rather than showing it in the transcription.
-    LINE_WRAP_HYPHEN = "¬"
-
     def dehyphenate_line_texts(texts):
         """Merge consecutive line texts split by a genuine line-wrap hyphen.
 
@@ -440,23 +584,8 @@ if not NO_KRAKEN:
             merged.append(pending)
         return merged
 
-    def should_ignore_line(line, width, ignore_edges):
-        if not ignore_edges:
-            return False
-        if not line.baseline:
-            return True
-        xs = [p[0] for p in line.baseline]
-        min_x = min(xs)
-        max_x = max(xs)
-        line_width = max_x - min_x
-        
-        is_short = line_width < (0.25 * width)
-        near_edge = (min_x < 0.05 * width) or (max_x > 0.95 * width)
-        
-        return is_short and near_edge
-
     def transcribe_image(image_file, model_name, ignore_edges=False, enhanced_multi_column=False, column_gap_ratio=0.045):
-        global baseline_model, last_ocr_model_name, ocr_model, selected_device
+        global baseline_model, selected_device
 
         import time
         start_time = time.time()
@@ -465,15 +594,11 @@ if not NO_KRAKEN:
             logger.error(f"Model not found: {model_name}")
             return "Model not found", 400
 
-        if model_name != last_ocr_model_name or ocr_model is None:
-            logger.info(f"Loading model: {model_name}")
-            ocr_model = load_any(model_path, device=selected_device)
-            last_ocr_model_name = model_name
-
         logger.info("Image processing...")
-        image = PILImage.open(image_file)
-        if image.mode != "L":
-            image = image.convert("L")
+        with metrics.span("decode"):
+            image = PILImage.open(image_file)
+            if image.mode != "L":
+                image = image.convert("L")
 
         logger.info("Baseline segmentation...")
         if baseline_model is None:
@@ -504,7 +629,14 @@ if not NO_KRAKEN:
             logger.error("Baseline model is not loaded! Please check if 'models/blla.mlmodel' exists.")
             return "Baseline model is not loaded", 500
 
-        seg = blla.segment(image, model=baseline_model, device=selected_device)
+        def segment():
+            with metrics.span("segment"):
+                return blla.segment(image, model=baseline_model, device=selected_device)
+
+        if segmentation_cache is not None:
+            seg = segmentation_cache.segment(image_file, segment, "horizontal-lr")
+        else:
+            seg = segment()
 
         # Optionally re-sort lines so a centered title is followed by the
         # left column top-to-bottom, then the right column top-to-bottom.
@@ -534,7 +666,13 @@ if not NO_KRAKEN:
         logger.info(lines)
 
         logger.info("Recognition...")
-        predictions = rpred.rpred(ocr_model, image, seg)
+        with ocr_models.acquire(model_name) as ocr_model, metrics.span("recognition"):
+            predictions = [
+                record
+                for records in recognize_page_lines(ocr_model, image, seg, list(seg.lines), batch_size=_recognition_batch_size())
+                if records
+                for record in records
+            ]
         line_texts = [str(record) for record in predictions if len(str(record)) > 2]
         line_texts = dehyphenate_line_texts(line_texts)
         transcribed_text = "".join(text + "\n" for text in line_texts)
@@ -684,260 +822,235 @@ def ai_autofix_best_effort(text):
     return fixed
 
 
-def transcribe_image_by_id(image_id, model_name, ignore_edges=False, add_page_break=False, red_threshold=5.0, enhanced_multi_column=False, column_gap_ratio=0.045, autofix_errors=True, ai_correct=False):
-    global baseline_model, last_ocr_model_name, ocr_model, selected_device
-    model_path = MODEL_PATHS.get(model_name)
-    if not model_path:
-        logger.error(f"Model not found: {model_name}")
-        return "Model not found", 400
+def _recognition_batch_size():
+    """Lines per recognition forward pass (recognition_batch_size in domain_config.json)."""
+    try:
+        return max(1, int(_load_domain_config().get("recognition_batch_size", DEFAULT_RECOGNITION_BATCH_SIZE)))
+    except (TypeError, ValueError):
+        return DEFAULT_RECOGNITION_BATCH_SIZE
 
-    image_record = Image.query.get_or_404(image_id)
-    image_path = image_record.original
-    if not os.path.exists(image_path):
-        logger.error(f"Image file not found at {image_path}")
-        return f"Image file not found at {image_path}", 404
 
-    with _ocr_model_lock:
-        if model_name != last_ocr_model_name or ocr_model is None:
-            logger.info(f"Loading model: {model_name}")
-            ocr_model = load_any(model_path, device=selected_device)
-            last_ocr_model_name = model_name
-
-    logger.info("Image processing...")
-    # Load color image for cropping and analysis
-    color_image = PILImage.open(image_path)
-    # Load grayscale image for OCR
-    ocr_image = PILImage.open(image_path)
-    if ocr_image.mode != "L":
-        ocr_image = ocr_image.convert("L")
-
-    logger.info("Baseline segmentation...")
-    if baseline_model is None:
-        logger.warning("Baseline model was not loaded at startup. Attempting to load now...")
-        path = MODEL_PATHS.get("blla.mlmodel")
-        if path:
-            try:
-                temp_model = vgsl.TorchVGSLModel.load_model(path)
-                logger.info(f"Raw baseline model type: {type(temp_model)}")
-                
-                if temp_model is not None:
-                    if hasattr(temp_model, 'to'):
-                        converted_model = temp_model.to(device=selected_device)
-                        # If .to() returns None (in-place modification), use temp_model
-                        baseline_model = converted_model if converted_model is not None else temp_model
-                    else:
-                        baseline_model = temp_model
-                    
-                    logger.info(f"Baseline model loaded successfully on demand. Final Type: {type(baseline_model)}")
-                else:
-                    raise ValueError("vgsl.TorchVGSLModel.load_model returned None")
+def _segmentation_max_side():
+    """Longer side pages are scaled down to for segmentation (segmentation_max_side in domain_config.json; 0 = off)."""
+    try:
+        return max(0, int(_load_domain_config().get("segmentation_max_side", 0) or 0))
+    except (TypeError, ValueError):
+        return 0
 
-            except Exception as e:
-                logger.error(f"Failed to load baseline model on demand: {e}")
-                return f"Failed to load baseline model: {e}", 500
-        else:
-            logger.error("Baseline model path not found! 'models/blla.mlmodel' is missing.")
-            return "Baseline model path not found", 500
 
-    if baseline_model is None:
-        logger.error("Baseline model is not loaded! Please check if 'models/blla.mlmodel' exists.")
-        return "Baseline model is not loaded", 500
-        
-    seg = blla.segment(ocr_image, model=baseline_model, device=selected_device, text_direction='horizontal-tb')
-
-    # Optionally re-sort lines into a sensible reading order for multi-
-    # column pages (title/subtitle, then each column top-to-bottom). blla
-    # tends to interleave column lines when a title or a marginalia strip
-    # confuses its own column-detection heuristics.
-    #
-    # Preferred path: run LayoutParser on the page to actually detect the
-    # title/column/figure regions and use those (see
-    # layout_parser_preprocessing.py) - this is the only approach that can
-    # correctly keep a column's reading order intact when an inline
-    # illustration splits it into a "before" and "after" piece, since it
-    # sees the illustration as a region even though kraken never produces
-    # OCR lines over it.
-    #
-    # Fallback path: if layoutparser (or its model) isn't installed/usable,
-    # fall back to the purely geometric line-based heuristic in
-    # multi_column_layout.py, which needs no extra dependencies.
-    if enhanced_multi_column:
-        independently_segmented = segment_detected_columns_independently(
-            ocr_image, seg.lines, column_gap_ratio
-        )
-        if independently_segmented is not None:
-            seg.lines = independently_segmented
-        else:
-            reordered_lines = None
-        if independently_segmented is None and not layout_parser_preprocessing.ENABLE_LAYOUTPARSER:
-            logger.info(
-                "enhanced_multi_column: LayoutParser is disabled by default "
-                "(set RITUS_ENABLE_LAYOUTPARSER=1 to opt in) - using geometric "
-                "fallback (multi_column_layout.py) on %d lines", len(seg.lines),
-            )
-        elif independently_segmented is None and not layout_parser_preprocessing.LAYOUTPARSER_AVAILABLE:
-            logger.info(
-                "enhanced_multi_column: layoutparser not importable in this "
-                "environment (import_error=%r) - using geometric fallback "
-                "(multi_column_layout.py) on %d lines",
-                layout_parser_preprocessing._import_error, len(seg.lines),
-            )
-        try:
-            if independently_segmented is not None:
-                raise RuntimeError("independent column segmentation already used")
-            reordered_lines = layout_parser_preprocessing.reorder_lines_using_layout_parser(
-                seg.lines, color_image
-            )
-        except RuntimeError:
-            reordered_lines = seg.lines
-        except Exception:
-            logger.exception("LayoutParser-based reordering raised unexpectedly")
-            reordered_lines = None
-
-        if reordered_lines is not None:
-            if independently_segmented is not None:
-                logger.info(
-                    "enhanced_multi_column: used independent body-column segmentation "
-                    "on %d lines", len(seg.lines),
-                )
-            else:
-                logger.info(
-                    "enhanced_multi_column: used LayoutParser-based reordering "
-                    "(layout_parser_preprocessing.py) on %d lines", len(seg.lines),
-                )
-            seg.lines = reordered_lines
-        else:
-            if layout_parser_preprocessing.ENABLE_LAYOUTPARSER and layout_parser_preprocessing.LAYOUTPARSER_AVAILABLE:
-                logger.info(
-                    "enhanced_multi_column: LayoutParser returned no usable "
-                    "result (model unavailable, or fewer than 2 regions "
-                    "detected) - using geometric fallback (multi_column_layout.py) "
-                    "on %d lines", len(seg.lines),
-                )
-            page_width, page_height = ocr_image.size
-            seg.lines = reorder_lines_for_multi_column(seg.lines, page_width, page_height, column_gap_ratio=column_gap_ratio)
+def _column_segmentation_workers():
+    """Threads segmenting right-hand column crops concurrently (column_segmentation_workers in domain_config.json; 0 = off)."""
+    try:
+        return max(0, int(_load_domain_config().get("column_segmentation_workers", 2)))
+    except (TypeError, ValueError):
+        return 0
 
-    # Filter lines based on width/edge proximity
-    if ignore_edges:
-        width, _ = ocr_image.size
-        valid_lines = []
-        for line in seg.lines:
-            if not should_ignore_line(line, width, ignore_edges):
-                valid_lines.append(line)
-        seg.lines = valid_lines
-
-
-    transcribed_text = ""
-    new_lines = []
-    original_lines = seg.lines
-    if not original_lines:
-        logger.info("No lines detected in image")
-        return "", 200
 
-    previous_color = None  # Track color of previous non-whitespace record
-    buffered_text = []     # Buffer for accumulating text of the same color
-    pending_hyphen = None  # Word fragment left by a genuine line-wrap hyphen
+def ocr_page(image_path, model_name, ignore_edges=False, red_threshold=5.0, enhanced_multi_column=False, column_gap_ratio=0.045, page=None, previous=None, progress=None):
+    """OCR one page image, in a worker process if inference_processes is set.
 
-    for i, line in enumerate(original_lines):
-        logger.info(f"Processing line {i + 1}")
-        logger.info(f"Baseline: {line.baseline}")
-        logger.info(f"Boundary: {line.boundary}")
-        
-        # Split line by color and get new line segments
+    page: The PageImage of image_path when the page was already decoded
+    (used only in-process). previous: the page's stored result from
+    previous_transcription(), so only changed stages are redone. progress:
+    transcribe_page()'s progress callback, called in this thread; a worker
+    process sends its events over a queue as they happen. Returns
+    {"text", "lines", "memo", "options"}, or an (error message, HTTP status)
+    tuple.
+    """
+    global baseline_model, selected_device
+    options = _ocr_options(ignore_edges, red_threshold, enhanced_multi_column, column_gap_ratio)
+    pool = _get_inference_pool()
+    if pool is not None:
+        # The OCR runs in a worker process; this thread only waits for it.
         try:
-             split_lines = split_line_boundary_by_color(color_image, line, i, window_size=80, red_threshold=red_threshold)
-        except Exception as e:
-             logger.error(f"Failed to split line {i+1}: {e}")
-             split_lines = [line]
-
-        # Process each split line for OCR
-        for split_line in split_lines:
-            seg.lines = [split_line]
-            line_color = getattr(split_line, 'color', 'black')
-            logger.info(f"Recognition for line {i + 1}, color {line_color}...")
-            try:
-                predictions = rpred.rpred(ocr_model, ocr_image, seg)
-                for record in predictions:
-                    record_text = str(record).strip()
-                    if pending_hyphen is not None:
-                        record_text = pending_hyphen + record_text
-                        pending_hyphen = None
-                    # Skip if record is empty or contains only non-letter characters
-                    if not record_text or not re.search(r'[a-zA-Z]', record_text):
-                        logger.debug(f"Skipping record for line {i + 1}, color {line_color}: '{record_text}' (empty or non-letter)")
-                        continue
-                    if record_text.endswith(LINE_WRAP_HYPHEN):
-                        # A genuine end-of-line word-wrap - hold this fragment
-                        # back and glue it onto the next line's text instead
-                        # of emitting the print-layout hyphen mark.
-                        pending_hyphen = record_text[:-1]
-                        continue
-
-                    current_color = line_color.upper()
-                    if current_color == "RED":
-                        if previous_color == "RED":
-                            # Append to buffered text without closing/opening tags
-                            buffered_text.append(record_text)
+            transcribed_text, new_lines, memo = pool.transcribe(
+                image_path, model_name, previous=previous, progress=progress, **options
+            )
+        except Exception:
+            metrics.PAGES.inc(status="failed")
+            raise
+    else:
+        if baseline_model is None:
+            logger.warning("Baseline model was not loaded at startup. Attempting to load now...")
+            path = MODEL_PATHS.get("blla.mlmodel")
+            if path:
+                try:
+                    temp_model = vgsl.TorchVGSLModel.load_model(path)
+                    logger.info(f"Raw baseline model type: {type(temp_model)}")
+                
+                    if temp_model is not None:
+                        if hasattr(temp_model, 'to'):
+                            converted_model = temp_model.to(device=selected_device)
+                            # If .to() returns None (in-place modification), use temp_model
+                            baseline_model = converted_model if converted_model is not None else temp_model
                         else:
-                            # Close previous red text if open, start new red text
-                            if buffered_text and previous_color == "RED":
-                                transcribed_text += " ".join(buffered_text) + "</red> "
-                                buffered_text = []
-                            elif buffered_text:
-                                transcribed_text += " ".join(buffered_text) + " "
-                                buffered_text = []
-                            buffered_text.append(record_text)
-                            if not transcribed_text.endswith("<red> "):
-                                transcribed_text += "<red> "
-                    else:  # BLACK (default)
-                        if buffered_text and previous_color == "RED":
-                            # Close red text and append buffered text
-                            transcribed_text += " ".join(buffered_text) + "</red> "
-                            buffered_text = []
-                        elif buffered_text:
-                            # Append buffered black text
-                            transcribed_text += " ".join(buffered_text) + " "
-                            buffered_text = []
-                        buffered_text.append(record_text)
+                            baseline_model = temp_model
                     
-                    previous_color = current_color
-                    logger.info(f"Detected text ({current_color}): '{record_text}'")
-            except Exception as e:
-                logger.error(f"OCR failed for line {i + 1}, color {line_color}: {str(e)}")
+                        logger.info(f"Baseline model loaded successfully on demand. Final Type: {type(baseline_model)}")
+                    else:
+                        raise ValueError("vgsl.TorchVGSLModel.load_model returned None")
 
-        new_lines.extend(split_lines)
+                except Exception as e:
+                    logger.error(f"Failed to load baseline model on demand: {e}")
+                    return f"Failed to load baseline model: {e}", 500
+            else:
+                logger.error("Baseline model path not found! 'models/blla.mlmodel' is missing.")
+                return "Baseline model path not found", 500
 
-    if pending_hyphen is not None:
-        # Nothing followed the last line-wrap hyphen (e.g. end of page) -
-        # emit the fragment rather than silently dropping it.
-        buffered_text.append(pending_hyphen)
+        if baseline_model is None:
+            logger.error("Baseline model is not loaded! Please check if 'models/blla.mlmodel' exists.")
+            return "Baseline model is not loaded", 500
 
-    # Append any remaining buffered text
-    if buffered_text:
-        if previous_color == "RED":
-            transcribed_text += " ".join(buffered_text) + "</red>"
-        else:
-            transcribed_text += " ".join(buffered_text)
+        try:
+            transcribed_text, new_lines, memo = transcribe_page(
+                image_path, baseline_model, ocr_models, model_name, selected_device,
+                segmentation_cache=segmentation_cache, segmentation_maps=segmentation_maps, page=page,
+                previous=previous, progress=progress, **options
+            )
+        except Exception:
+            metrics.PAGES.inc(status="failed")
+            raise
+    _record_page_metrics(memo)
+    return {"text": transcribed_text, "lines": new_lines, "memo": memo, "options": options}
+
+
+def _ocr_options(ignore_edges, red_threshold, enhanced_multi_column, column_gap_ratio):
+    """transcribe_page()'s keyword arguments for a request, with the tuning of domain_config.json."""
+    return dict(
+        ignore_edges=ignore_edges,
+        red_threshold=red_threshold,
+        enhanced_multi_column=enhanced_multi_column,
+        column_gap_ratio=column_gap_ratio,
+        batch_size=_recognition_batch_size(),
+        segmentation_max_side=_segmentation_max_side(),
+        column_workers=_column_segmentation_workers(),
+    )
 
-    logger.info(f"Total transcribed text: '{transcribed_text}'")
 
+def _record_page_metrics(memo):
+    """Count a transcribed page and its lines by what transcribe_page() computed or reused."""
+    metrics.PAGES.inc(status="transcribed")
+    metrics.LINES.inc(memo["recognition"]["computed"], result="recognized")
+    metrics.LINES.inc(memo["recognition"]["reused"], result="reused")
+    if "columns" in memo:
+        metrics.COLUMN_RESEGMENTATIONS.inc(result=memo["columns"])
+    if "color_prefilter" in memo:
+        prefilter = memo["color_prefilter"]
+        metrics.COLOR_PREFILTER_LINES.inc(prefilter["skipped"], result="skipped")
+        metrics.COLOR_PREFILTER_LINES.inc(prefilter["analysed"], result="analysed")
+        metrics.COLOR_PREFILTER_PAGES.inc(result="black_only" if not prefilter["analysed"] else "analysed")
+
+
+def previous_transcription(image_id):
+    """An image's stored lines and the parameters they came from, for ocr_page(previous=...)."""
+    run = TranscriptionRun.query.filter_by(image_id=image_id).first()
+    if run is None:
+        return None
+    lines = TranscriptionLine.query.filter_by(image_id=image_id).order_by(TranscriptionLine.order.asc()).all()
+    return {
+        "model": run.model,
+        "red_threshold": run.red_threshold,
+        "segmentation_digest": run.segmentation_digest,
+        "lines": [line.to_dict() for line in lines],
+    }
+
+
+def save_transcription(image_record, transcribed_text, result, model_name):
+    """Store a page's text, its lines and the parameters of the run; the caller commits."""
+    image_record.transcribed_text = transcribed_text.strip()
+    TranscriptionLine.replace_for_image(image_record.id, result["lines"], model_name)
+    options = result["options"]
+    run = TranscriptionRun.query.filter_by(image_id=image_record.id).first()
+    if run is None:
+        run = TranscriptionRun(image_id=image_record.id)
+        db.session.add(run)
+    run.model = model_name
+    run.red_threshold = options["red_threshold"]
+    run.ignore_edges = options["ignore_edges"]
+    run.enhanced_multi_column = options["enhanced_multi_column"]
+    run.column_gap_ratio = options["column_gap_ratio"]
+    run.segmentation_max_side = options["segmentation_max_side"]
+    run.segmentation_digest = result["memo"].get("segmentation_digest")
+
+
+def finish_transcribed_text(transcribed_text, add_page_break=False, autofix_errors=True, ai_correct=False, progress=None):
+    """Apply the optional corrections and page break to a page's OCR text.
+
+    progress, if given, is called with ("text", {"stage", "text"}) after
+    each correction that ran ("autofix", "ai_correct").
+    """
     # The two corrections are independently switchable, but asking for the AI
     # pass implies the find/replace: it is cheap and deterministic, and doing
     # it first means the model only has to judge the errors that actually need
     # context instead of the ones the TSV already covers.
     if autofix_errors or ai_correct:
-        transcribed_text = apply_autofix(transcribed_text)
+        with metrics.span("autofix"):
+            transcribed_text = apply_autofix(transcribed_text)
+        if progress is not None:
+            progress("text", {"stage": "autofix", "text": transcribed_text})
 
     if ai_correct:
-        transcribed_text = ai_autofix_best_effort(transcribed_text)
+        with metrics.span("ai_autofix"):
+            transcribed_text = ai_autofix_best_effort(transcribed_text)
+        if progress is not None:
+            progress("text", {"stage": "ai_correct", "text": transcribed_text})
 
     if add_page_break:
         transcribed_text += "⏎"
+    return transcribed_text
 
-    image_record.transcribed_text = transcribed_text.strip()
-    db.session.commit()
 
-    return {"text": transcribed_text, "lines": new_lines}
+def transcribe_image_by_id(image_id, model_name, ignore_edges=False, add_page_break=False, red_threshold=5.0, enhanced_multi_column=False, column_gap_ratio=0.045, autofix_errors=True, ai_correct=False, progress=None):
+    """Transcribe a stored image and save its text and lines.
+
+    progress: Optional callable(event, data) that follows the page through
+    OCR (see transcribe_page()) and then gets ("text", {"stage", "text"})
+    for the recognised text ("recognition") and each correction
+    (finish_transcribed_text()). Returns {"text", "lines", "memo"}, or an
+    (error message, HTTP status) tuple.
+    """
+    model_path = MODEL_PATHS.get(model_name)
+    if not model_path:
+        logger.error(f"Model not found: {model_name}")
+        return "Model not found", 400
+
+    image_record = Image.query.get_or_404(image_id)
+    image_path = image_record.original
+    if not os.path.exists(image_path):
+        logger.error(f"Image file not found at {image_path}")
+        return f"Image file not found at {image_path}", 404
+
+    # Someone is waiting for this page: it gets the next OCR slot, ahead of
+    # batch pages (fair_scheduler.py)
+    _configure_transcription_scheduler(_get_inference_pool())
+    with transcription_scheduler.slot(image_record.project_id, priority=INTERACTIVE):
+        result = ocr_page(
+            image_path,
+            model_name,
+            ignore_edges=ignore_edges,
+            red_threshold=red_threshold,
+            enhanced_multi_column=enhanced_multi_column,
+            column_gap_ratio=column_gap_ratio,
+            previous=previous_transcription(image_record.id),
+            progress=progress,
+        )
+    if isinstance(result, tuple):
+        return result
+    if not result["lines"]:
+        return "", 200
+
+    if progress is not None:
+        progress("text", {"stage": "recognition", "text": result["text"]})
+    transcribed_text = finish_transcribed_text(
+        result["text"], add_page_break=add_page_break, autofix_errors=autofix_errors, ai_correct=ai_correct,
+        progress=progress,
+    )
+
+    with metrics.span("db_commit"):
+        save_transcription(image_record, transcribed_text, result, model_name)
+        db.session.commit()
+
+    return {"text": transcribed_text, "lines": result["lines"], "memo": result["memo"]}
 
 
 # Authentication middleware
@@ -1203,6 +1316,55 @@ def save_domain_config():
         return jsonify({"error": f"Failed to save config: {e}"}), 500
     return jsonify({"message": "Domain config saved"})
 
+@app.route("/api/metrics", methods=["GET"])
+def get_metrics():
+    """Stage timings and page/line/model-load counters for Prometheus."""
+    return Response(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
+
+@app.before_request
+def start_request_timing():
+    # Clients opt in to a per-request stage breakdown by sending X-Timing
+    if request.headers.get("X-Timing"):
+        g.timing_token = metrics.start_collecting()
+
+@app.after_request
+def add_timing_header(response):
+    token = g.pop("timing_token", None)
+    if token is not None:
+        response.headers["X-Timing"] = metrics.timing_header(metrics.stop_collecting(token))
+    return response
+
+@app.teardown_request
+def stop_request_timing(exc):
+    token = g.pop("timing_token", None)
+    if token is not None:
+        metrics.stop_collecting(token)
+
+@app.route("/api/model-registry/stats", methods=["GET"])
+@jwt_required()
+def get_model_registry_stats():
+    current_user = get_current_user()
+    if not current_user or not current_user.is_admin:
+        return jsonify({"error": "Admin access required"}), 403
+    return jsonify(ocr_models.stats())
+
+@app.route("/api/transcription-scheduler/stats", methods=["GET"])
+@jwt_required()
+def get_transcription_scheduler_stats():
+    """OCR slots in use per project and the slot wait percentiles of interactive and batch pages."""
+    current_user = get_current_user()
+    if not current_user or not current_user.is_admin:
+        return jsonify({"error": "Admin access required"}), 403
+    return jsonify(transcription_scheduler.stats())
+
+@app.route("/api/job-queue/stats", methods=["GET"])
+@jwt_required()
+def get_job_queue_stats():
+    current_user = get_current_user()
+    if not current_user or not current_user.is_admin:
+        return jsonify({"error": "Admin access required"}), 403
+    return jsonify({**job_queue.stats(), "page_tasks": page_tasks.stats(db.engine)})
+
 # Batch Processing Routes
 @app.route("/api/projects/<int:project_id>/batch-process", methods=["POST"])
 def start_batch_process(project_id):
@@ -1215,7 +1377,8 @@ def start_batch_process(project_id):
             logger.error(f"Invalid similarity threshold: {similarity_threshold}")
             return jsonify({"error": "Invalid similarity threshold (must be between 1 and 100)"}), 400
 
-        # Delete any existing batch process for this project
+        # Stop and delete any existing batch process for this project
+        job_queue.cancel("batch_analysis", project_id)
         BatchProcessing.query.filter_by(project_id=project_id).delete()
         db.session.commit()
 
@@ -1228,27 +1391,13 @@ def start_batch_process(project_id):
         db.session.add(batch_process)
         db.session.commit()
 
-        # Start processing in a background thread
-        def run_batch_process(batch_process_id):
-            with app.app_context():
-                logger.info("Inside app context, checking BatchProcessing")
-                try:
-                    batch_process_project(project_id, similarity_threshold)
-                    batch_process = db.session.get(BatchProcessing, batch_process_id)
-                    if batch_process:
-                        batch_process.status = "completed"
-                        db.session.commit()
-                        logger.info(f"Batch process completed for project ID {project_id}")
-                except Exception as e:
-                    logger.error(f"Batch process failed for project {project_id}: {str(e)}")
-                    batch_process = db.session.get(BatchProcessing, batch_process_id)
-                    if batch_process:
-                        batch_process.status = "failed"
-                        batch_process.error_message = str(e)
-                        db.session.commit()
-
         logger.info(f"Starting batch process for project ID {project_id}")
-        Thread(target=run_batch_process, args=(batch_process.id,), daemon=True).start()
+        job_queue.enqueue(
+            "batch_analysis",
+            {"batch_process_id": batch_process.id, "similarity_threshold": similarity_threshold},
+            project_id=project_id,
+            concurrency_key=f"batch_analysis:{project_id}",
+        )
         return jsonify({
             "message": "Batch process started",
             "process_id": batch_process.id,
@@ -1288,6 +1437,7 @@ def cancel_batch_process(project_id):
             return jsonify({"message": "No active batch process"}), 404
         batch_process.status = "canceled"
         db.session.commit()
+        job_queue.cancel("batch_analysis", project_id)
         logger.info(f"Canceled batch process for project ID {project_id}")
         return jsonify({"message": "Batch process canceled"})
     except Exception as e:
@@ -1324,48 +1474,42 @@ def start_iiif_download(project_id):
     # Count existing images
     image_count = Image.query.filter_by(project_id=project_id).count()
 
-    # Determine start_page
-    if existing_job and existing_job.status == "cancelled" and confirm is None:
-        # Resume from where we left off – no conflict dialog needed
-        start_page = (existing_job.current_page or 0) + 1
-    elif image_count > 0 and confirm is None:
+    # Determine start_page; a cancelled download resumes where it left off
+    cancelled_at = (existing_job.current_page or 0) if existing_job and existing_job.status == "cancelled" else None
+    start_page = choose_start_page(image_count, confirm, cancelled_at)
+    if start_page is None:
         # Images already present – ask front-end what to do
         return jsonify({
             "conflict": True,
             "image_count": image_count,
             "message": "Project already has images. Choose 'append' to add after them or 'restart' to start from page 1."
         }), 409
-    elif confirm == "append" or (existing_job and existing_job.status == "cancelled" and confirm == "append"):
-        start_page = image_count + 1
-    elif confirm == "restart":
-        start_page = 1
-    else:
-        start_page = 1
+
+    # A queued job left over from an earlier start is replaced
+    job_queue.cancel("iiif_download", project_id)
 
     # Upsert the job record
     if existing_job:
-        existing_job.current_page = start_page - 1
         existing_job.error_message = None
         job = existing_job
     else:
-        job = IiifDownloadJob(project_id=project_id, start_page=start_page)
+        job = IiifDownloadJob(project_id=project_id)
         db.session.add(job)
 
+    # The job resumes after current_page (resume_page())
     job.start_page = start_page
+    job.current_page = start_page - 1
 
     # Check if another project from the same domain is already downloading
     domain = _iiif_domain(project.iiif_url)
-    if domain in _iiif_running_by_domain:
+    if job_queue.active_jobs(kind="iiif_download", concurrency_key=f"iiif:{domain}"):
         job.status = "waiting"
-        db.session.commit()
+        _enqueue_iiif_download(project)
         logger.info(f"IIIF download for project {project_id} queued (domain {domain} busy)")
         return jsonify({"message": "Queued – waiting for same-domain download to finish", "start_page": start_page, "waiting": True}), 202
 
     job.status = "pending"
-    db.session.commit()
-    job_id = job.id
-
-    _launch_iiif_thread(project_id, job_id, project.iiif_url, app.config["UPLOAD_FOLDER"], start_page)
+    _enqueue_iiif_download(project)
 
     logger.info(f"Started IIIF background download for project {project_id} from page {start_page}")
     return jsonify({"message": "Download started", "start_page": start_page}), 202
@@ -1407,28 +1551,14 @@ def cancel_iiif_download(project_id):
 
     reset = request.args.get("reset") == "true"
 
-    stop_event = _iiif_stop_events.get(project_id)
-    if stop_event:
-        stop_event.set()
-    _iiif_stop_events.pop(project_id, None)
+    job_queue.cancel("iiif_download", project_id)
 
     job = IiifDownloadJob.query.filter_by(project_id=project_id).first()
     if job:
         if reset:
             db.session.delete(job)
         elif job.status in ("running", "pending", "waiting"):
-            if job.status == "waiting":
-                # Not running yet – cancel immediately without touching domain registry
-                job.status = "cancelled"
-            else:
-                job.status = "cancelled"
-                # Clean up domain registry if this was the active download
-                project = Project.query.get(project_id)
-                if project and project.iiif_url:
-                    domain = _iiif_domain(project.iiif_url)
-                    if _iiif_running_by_domain.get(domain) == project_id:
-                        _iiif_running_by_domain.pop(domain, None)
-                        _promote_waiting_domain(domain)
+            job.status = "cancelled"
         db.session.commit()
 
     return jsonify({"message": "Reset" if reset else "Cancellation requested"})
@@ -1438,6 +1568,73 @@ def cancel_iiif_download(project_id):
 # Background Transcription Runner
 # ---------------------------------------------------------------------------
 
+# How often a batch on remote workers looks for pages they finished
+REMOTE_POLL_SECONDS = 1.0
+
+
+def _remote_transcription_workers():
+    """Whether batch pages go to ritus_worker processes (remote_transcription_workers in domain_config.json)."""
+    return bool(_load_domain_config().get("remote_transcription_workers", False))
+
+
+def _transcribe_on_remote_workers(flask_app, project_id, batch_id, image_ids, image_paths, model_name, options,
+                                  finish_text, count_page, stop_event):
+    """Queue a batch's pages as PageTasks and save the results ritus_worker processes write back.
+
+    Tasks of batch_id left by an earlier attempt (the server restarted) are
+    kept, so pages a worker already did are not redone; those of the
+    project's earlier batches are dropped. finish_text applies the batch's
+    corrections to a page's OCR text; count_page is called for every page
+    saved or failed. Returns when every task is collected, or after deleting
+    the remaining ones once stop_event is set.
+    """
+    with flask_app.app_context():
+        page_tasks.discard_other_batches(db.engine, project_id, batch_id)
+        queued = page_tasks.batch_image_ids(db.engine, batch_id)
+        added = page_tasks.add_tasks(db.engine, batch_id, project_id, [
+            {
+                "image_id": image_id,
+                "image_path": image_paths[image_id],
+                "model_name": model_name,
+                "options": options,
+                "previous": previous_transcription(image_id),
+            }
+            for image_id in image_ids if image_id not in queued
+        ])
+    logger.info(f"Batch transcription of project {project_id}: {added} pages queued for remote workers, "
+                f"{len(queued)} already queued")
+
+    while not stop_event.is_set():
+        with flask_app.app_context():
+            finished = page_tasks.finished_tasks(db.engine, batch_id)
+            for task in finished:
+                if task.status == "failed":
+                    logger.error(f"Transcription failed for image {task.image_id} on {task.worker}: {task.error}")
+                    metrics.PAGES.inc(status="failed")
+                else:
+                    metrics.record_timings(task.result.get("timings", {}))
+                    _record_page_metrics(task.result["memo"])
+                    lines = page_tasks.result_lines(task.result)
+                    image_record = Image.query.get(task.image_id)
+                    if lines and image_record is not None:
+                        text = finish_text(task.result["text"])
+                        with metrics.span("db_commit"):
+                            save_transcription(image_record, text, {
+                                "lines": lines, "memo": task.result["memo"], "options": options,
+                            }, model_name)
+                            db.session.commit()
+                page_tasks.delete_tasks(db.engine, [task.id])
+                count_page()
+            if not finished and not page_tasks.remaining_tasks(db.engine, batch_id):
+                return
+        if not finished:
+            stop_event.wait(REMOTE_POLL_SECONDS)
+
+    with flask_app.app_context():
+        dropped = page_tasks.cancel_batch(db.engine, batch_id)
+    logger.info(f"Batch transcription of project {project_id} cancelled; {dropped} remote pages dropped")
+
+
 def run_batch_transcribe(
     project_id,
     job_id,
@@ -1454,13 +1651,24 @@ def run_batch_transcribe(
     column_gap_ratio=0.045,
     autofix_errors=True,
     ai_correct=False,
+    user_id=None,
+    batch_id=None,
 ):
     """
-    Transcribe all images in a project in a background thread.
-
-    Projects are serialised by _transcribe_lock: one project runs at a time,
-    others wait in "pending" status. Within a project, images are processed
-    in parallel using a ThreadPoolExecutor (transcription_workers in domain_config.json).
+    Transcribe all images in a project; the handler of batch_transcribe jobs.
+
+    Several projects transcribe at once (one job per project; more wait in
+    the job queue as "pending"). Within a project, images flow through a
+    staged pipeline (staged_pipeline.py): prefetch threads decode upcoming
+    pages (prefetch_workers), OCR threads segment and recognise them and a
+    single writer thread saves the results and the job progress. The OCR
+    threads of all projects share transcription_workers slots through
+    transcription_scheduler, round-robin between projects (see
+    fair_scheduler.py; with inference_processes set the OCR runs in worker
+    processes). user_id is who started the job, for the per-user cap.
+    With remote_transcription_workers set, the pages go to ritus_worker
+    processes instead, as PageTasks of batch_id (the QueuedJob's id; see
+    _transcribe_on_remote_workers()).
 
         mode:
             "skip"     – skip images that already have transcribed_text
@@ -1477,97 +1685,297 @@ def run_batch_transcribe(
                 db.session.commit()
         return
 
-    def update_job(current, total, status, error=None):
+    def write_job(values):
         with flask_app.app_context():
             j = BatchTranscribeJob.query.get(job_id)
             if j is None:
                 return
-            j.current_image = current
-            j.total_images = total
-            j.status = status
-            if error:
-                j.error_message = error
+            for name, value in values.items():
+                setattr(j, name, value)
             db.session.commit()
-        if status in ("completed", "failed", "cancelled"):
-            _transcribe_stop_events.pop(project_id, None)
 
-    # Sit in the queue as "pending" until the global lock is free
-    update_job(0, 0, "pending")
+    # Page counts are written at most every progress_flush_ms, status changes at once
+    progress = ProgressWriter(write_job, _progress_interval())
 
-    with _transcribe_lock:
-        # Was cancelled while waiting in the queue
-        if stop_event.is_set():
-            update_job(0, 0, "cancelled")
-            return
+    def update_job(current, total, status, error=None):
+        values = {"current_image": current, "total_images": total, "status": status}
+        if error:
+            values["error_message"] = error
+        if status == "running" and not error:
+            progress.update(**values)
+        else:
+            progress.state(**values)
+
+    remote = batch_id is not None and _remote_transcription_workers()
+    prefetch_workers = _prefetch_workers()
+    pool = None if remote else _get_inference_pool()
+    workers = _configure_transcription_scheduler(pool)
+    # In-process recognition lends its slot to waiting interactive pages
+    # between line batches; worker processes can only do that between pages.
+    yield_progress = None
+    if pool is None and _load_domain_config().get("batch_yield_between_line_batches", True):
+        def yield_progress(event, data):
+            if event == "line":
+                transcription_scheduler.yield_to_interactive(project_id, user_id)
 
-        workers = max(1, int(_load_domain_config().get("transcription_workers", 1)))
+    try:
+        with flask_app.app_context():
+            images = Image.query.filter_by(project_id=project_id).order_by(Image.id.asc()).all()
+            total = len(images)
+            image_paths = {img.id: img.original for img in images}
+
+            if mode == "skip":
+                to_process_ids = [img.id for img in images if not img.transcribed_text]
+            elif mode == "continue":
+                first_idx = next(
+                    (i for i, img in enumerate(images) if not img.transcribed_text),
+                    len(images)
+                )
+                to_process_ids = [img.id for img in images[first_idx:]]
+            elif mode == "range":
+                start_idx = max(0, (range_from or 1) - 1)
+                end_idx = min(total, range_to or total)
+                to_process_ids = [img.id for img in images[start_idx:end_idx]]
+            else:  # override
+                to_process_ids = [img.id for img in images]
+
+            total = len(to_process_ids)
+
+        update_job(0, total, "running")
+
+        completed_count = [0]
+        count_lock = threading.Lock()
+
+        def count_page():
+            with count_lock:
+                completed_count[0] += 1
+                cnt = completed_count[0]
+            update_job(cnt, total, "running")
+
+        if remote:
+            _transcribe_on_remote_workers(
+                flask_app, project_id, batch_id, to_process_ids, image_paths, model_name,
+                _ocr_options(ignore_edges, red_threshold, enhanced_multi_column, column_gap_ratio),
+                lambda text: finish_transcribed_text(
+                    text, add_page_break=add_page_break, autofix_errors=autofix_errors, ai_correct=ai_correct,
+                ),
+                count_page, stop_event,
+            )
+            if stop_event.is_set():
+                update_job(completed_count[0], total, "cancelled")
+            else:
+                update_job(len(to_process_ids), total, "completed")
+            return
 
-        try:
-            with flask_app.app_context():
-                images = Image.query.filter_by(project_id=project_id).order_by(Image.id.asc()).all()
-                total = len(images)
-
-                if mode == "skip":
-                    to_process_ids = [img.id for img in images if not img.transcribed_text]
-                elif mode == "continue":
-                    first_idx = next(
-                        (i for i, img in enumerate(images) if not img.transcribed_text),
-                        len(images)
-                    )
-                    to_process_ids = [img.id for img in images[first_idx:]]
-                elif mode == "range":
-                    start_idx = max(0, (range_from or 1) - 1)
-                    end_idx = min(total, range_to or total)
-                    to_process_ids = [img.id for img in images[start_idx:end_idx]]
-                else:  # override
-                    to_process_ids = [img.id for img in images]
-
-                total = len(to_process_ids)
-
-            update_job(0, total, "running")
-
-            completed_count = [0]
-            count_lock = threading.Lock()
-
-            def process_image(image_id):
-                if stop_event.is_set():
-                    return
-                with flask_app.app_context():
-                    try:
-                        result = transcribe_image_by_id(
-                            image_id,
+        def prefetch_page(image_id):
+            page = {"image_id": image_id, "path": image_paths.get(image_id)}
+            if not page["path"] or not os.path.exists(page["path"]):
+                page["error"] = f"Image file not found at {page['path']}"
+            elif pool is None:
+                with metrics.span("decode"):
+                    page["image"] = PageImage.open(page["path"])
+            else:
+                # Worker processes decode the page themselves; reading it
+                # here still gets it into the OS page cache.
+                with open(page["path"], "rb") as f:
+                    while f.read(1 << 20):
+                        pass
+            return page
+
+        def recognise_page(page):
+            if page.get("error"):
+                return page
+            with flask_app.app_context(), metrics.collect_timings():
+                try:
+                    # Pages of all running projects take turns for the OCR slots
+                    with transcription_scheduler.slot(project_id, user_id, stop_event=stop_event) as granted:
+                        if not granted:
+                            page["error"] = "Cancelled before recognition"
+                            return page
+                        result = ocr_page(
+                            page["path"],
                             model_name,
                             ignore_edges=ignore_edges,
-                            add_page_break=add_page_break,
                             red_threshold=red_threshold,
                             enhanced_multi_column=enhanced_multi_column,
                             column_gap_ratio=column_gap_ratio,
-                            autofix_errors=autofix_errors,
-                            ai_correct=ai_correct,
+                            page=page.pop("image", None),
+                            previous=previous_transcription(page["image_id"]),
+                            progress=yield_progress,
+                        )
+                    if isinstance(result, tuple):
+                        page["error"] = result[0]
+                    elif result["lines"]:
+                        page["result"] = result
+                        page["text"] = finish_transcribed_text(
+                            result["text"], add_page_break=add_page_break,
+                            autofix_errors=autofix_errors, ai_correct=ai_correct,
                         )
-                        if isinstance(result, tuple):
-                            logger.error(f"Transcription failed for image {image_id}: {result[0]}")
-                    except Exception as e:
-                        logger.error(f"Error transcribing image {image_id}: {e}")
-                with count_lock:
-                    completed_count[0] += 1
-                    cnt = completed_count[0]
-                update_job(cnt, total, "running")
-
-            with ThreadPoolExecutor(max_workers=workers) as executor:
-                for iid in to_process_ids:
-                    if stop_event.is_set():
-                        break
-                    executor.submit(process_image, iid)
+                except Exception as e:
+                    logger.error(f"Error transcribing image {page['image_id']}: {e}")
+                    page["error"] = str(e)
+            return page
+
+        def persist_page(page):
+            if page.get("error"):
+                logger.error(f"Transcription failed for image {page['image_id']}: {page['error']}")
+            elif "text" in page:
+                with flask_app.app_context(), metrics.span("db_commit"):
+                    image_record = Image.query.get(page["image_id"])
+                    if image_record is not None:
+                        save_transcription(image_record, page["text"], page["result"], model_name)
+                        db.session.commit()
+            count_page()
 
-            if stop_event.is_set():
-                update_job(completed_count[0], total, "cancelled")
-            else:
-                update_job(len(to_process_ids), total, "completed")
+        def page_failed(stage_name, item, error):
+            count_page()
 
-        except Exception as e:
-            logger.exception(f"Unexpected error in run_batch_transcribe: {e}")
-            update_job(0, 0, "failed", error=str(e))
+        pipeline = StagedPipeline([
+            Stage("prefetch", prefetch_page, workers=prefetch_workers),
+            Stage("ocr", recognise_page, workers=workers),
+            Stage("persist", persist_page, workers=1),
+        ], on_error=page_failed)
+        _transcribe_pipelines[project_id] = pipeline
+        try:
+            pipeline.run(to_process_ids, stop_event=stop_event)
+        finally:
+            # /status and the runner state show running pipelines only
+            _transcribe_pipelines.pop(project_id, None)
+            transcription_scheduler.forget(project_id)
+        logger.info(f"Batch transcription pipeline for project {project_id}: {pipeline.stats()}")
+
+        if stop_event.is_set():
+            update_job(completed_count[0], total, "cancelled")
+        else:
+            update_job(len(to_process_ids), total, "completed")
+
+    except Exception as e:
+        logger.exception(f"Unexpected error in run_batch_transcribe: {e}")
+        progress.flush()
+        # The queue retries it or marks the job failed (_transcribe_job_status)
+        raise JobFailed(str(e)) from e
+
+
+def _run_transcribe_job(job, stop_event):
+    """job_queue handler of a batch transcription."""
+    with app.app_context():
+        j = BatchTranscribeJob.query.filter_by(project_id=job.project_id).first()
+        if j is None:
+            return
+        job_id = j.id
+    run_batch_transcribe(job.project_id, job_id, flask_app=app, stop_event=stop_event, batch_id=job.id,
+                         **job.payload)
+
+
+def _transcribe_job_status(job, status, message):
+    """Follow a retry ("queued") or the end of a transcription job in its BatchTranscribeJob row."""
+    j = BatchTranscribeJob.query.filter_by(project_id=job.project_id).first()
+    if j is None:
+        return
+    j.status = "pending" if status == "queued" else status
+    if message:
+        j.error_message = message
+    db.session.commit()
+
+
+def _run_batch_analysis_job(job, stop_event):
+    """job_queue handler of a batch analysis; it stops when its BatchProcessing row is canceled."""
+    with app.app_context():
+        batch_process_project(job.project_id, job.payload["similarity_threshold"],
+                              progress_interval_seconds=_progress_interval(),
+                              match_workers=_analysis_workers())
+
+
+def _batch_analysis_job_status(job, status, message):
+    """Record a batch analysis the queue gave up on in its BatchProcessing row."""
+    batch_process = db.session.get(BatchProcessing, job.payload.get("batch_process_id"))
+    if batch_process is None or status == "queued":
+        return
+    if batch_process.status == "running":
+        batch_process.status = "canceled" if status == "cancelled" else status
+    if message:
+        batch_process.error_message = message
+    db.session.commit()
+
+
+job_queue.register("iiif_download", _run_iiif_job, on_status=_iiif_job_status)
+# Projects' batches run side by side but leave a job worker to IIIF downloads
+# and batch analyses, which would otherwise wait for hours-long batches.
+job_queue.register("batch_transcribe", _run_transcribe_job, on_status=_transcribe_job_status,
+                   max_running=max(1, job_queue.workers - 1))
+# A second run after a failure would work on content the first one already
+# rewrote, so batch analyses are not retried.
+job_queue.register("batch_analysis", _run_batch_analysis_job, on_status=_batch_analysis_job_status, max_attempts=1)
+
+
+def _adopt_unqueued_jobs():
+    """Deal with progress rows a server without the job queue left active.
+
+    IIIF downloads are queued again and resume after their last saved page;
+    transcriptions and analyses did not store their options and are marked
+    failed so they can be started again.
+    """
+    with app.app_context():
+        queued = {(j.kind, j.project_id) for j in job_queue.active_jobs()}
+        interrupted = "Interrupted by a server restart; please start it again."
+        for j in IiifDownloadJob.query.filter(IiifDownloadJob.status.in_(("pending", "running", "waiting"))).all():
+            if ("iiif_download", j.project_id) in queued:
+                continue
+            project = db.session.get(Project, j.project_id)
+            if project is None or not project.iiif_url:
+                j.status = "failed"
+                j.error_message = interrupted
+                db.session.commit()
+                continue
+            logger.info(f"Resuming the IIIF download of project {j.project_id} after page {j.current_page}")
+            j.status = "pending"
+            _enqueue_iiif_download(project)
+        for j in BatchTranscribeJob.query.filter(BatchTranscribeJob.status.in_(("pending", "running"))).all():
+            if ("batch_transcribe", j.project_id) not in queued:
+                j.status = "failed"
+                j.error_message = interrupted
+        for batch_process in BatchProcessing.query.filter(BatchProcessing.status.in_(("pending", "running"))).all():
+            if ("batch_analysis", batch_process.project_id) not in queued:
+                batch_process.status = "failed"
+                batch_process.error_message = interrupted
+        db.session.commit()
+
+
+def _job_runner_state():
+    """What the status routes of the other web processes need from the one running the jobs."""
+    pipelines = list(_transcribe_pipelines.items())
+    return {
+        "scheduler": transcription_scheduler.stats(),
+        "pipelines": {str(project_id): pipeline.stats() for project_id, pipeline in pipelines},
+    }
+
+
+def _batch_runtime_stats(project_id):
+    """Pipeline stats and OCR slots of a project's batch transcription, from whichever process runs it."""
+    if project_id in _transcribe_pipelines:
+        return _transcribe_pipelines[project_id].stats(), transcription_scheduler.stats()["projects"].get(project_id)
+    for runner in job_queue.runner_states():
+        state = runner["state"] or {}
+        pipeline = state.get("pipelines", {}).get(str(project_id))
+        if pipeline is not None:
+            return pipeline, state.get("scheduler", {}).get("projects", {}).get(str(project_id))
+    return None, None
+
+
+job_queue.on_runner_start = _adopt_unqueued_jobs
+job_queue.state_provider = _job_runner_state
+
+
+def _start_job_queue():
+    """Start the job workers, once, in the process that serves requests.
+
+    They only claim jobs while the process holds a runner slot; on exit the
+    running jobs are put back and the slot is handed over.
+    """
+    if IN_INFERENCE_WORKER:
+        return
+    if job_queue.start():
+        atexit.register(job_queue.stop, timeout=10)
 
 
 # ---------------------------------------------------------------------------
@@ -1616,28 +2024,6 @@ def start_batch_transcribe(project_id):
         if range_from > image_count or range_to > image_count:
             return jsonify({"error": f"Page range must be within 1-{image_count}"}), 400
 
-    if existing:
-        existing.status = "pending"
-        existing.current_image = 0
-        existing.total_images = 0
-        existing.model_name = model_name
-        existing.mode = mode
-        existing.error_message = None
-        job = existing
-    else:
-        job = BatchTranscribeJob(
-            project_id=project_id,
-            status="pending",
-            model_name=model_name,
-            mode=mode,
-        )
-        db.session.add(job)
-    db.session.commit()
-    job_id = job.id
-
-    stop_event = threading.Event()
-    _transcribe_stop_events[project_id] = stop_event
-    
     ignore_edges = body.get("ignore_edges", False)
     if isinstance(ignore_edges, str):
         ignore_edges = ignore_edges.lower() == "true"
@@ -1680,11 +2066,39 @@ def start_batch_transcribe(project_id):
     else:
         ai_correct = bool(ai_correct)
 
-    Thread(
-        target=run_batch_transcribe,
-        args=(project_id, job_id, model_name, mode, app, stop_event, ignore_edges, range_from, range_to, add_page_break, red_threshold, enhanced_multi_column, column_gap_ratio, autofix_errors, ai_correct),
-        daemon=True,
-    ).start()
+    # A queued job left over from an earlier start is replaced
+    job_queue.cancel("batch_transcribe", project_id)
+
+    if existing:
+        existing.status = "pending"
+        existing.current_image = 0
+        existing.total_images = 0
+        existing.model_name = model_name
+        existing.mode = mode
+        existing.error_message = None
+        job = existing
+    else:
+        job = BatchTranscribeJob(
+            project_id=project_id,
+            status="pending",
+            model_name=model_name,
+            mode=mode,
+        )
+        db.session.add(job)
+    db.session.commit()
+    job_id = job.id
+
+    job_queue.enqueue(
+        "batch_transcribe",
+        dict(
+            model_name=model_name, mode=mode, ignore_edges=ignore_edges, range_from=range_from, range_to=range_to,
+            add_page_break=add_page_break, red_threshold=red_threshold,
+            enhanced_multi_column=enhanced_multi_column, column_gap_ratio=column_gap_ratio,
+            autofix_errors=autofix_errors, ai_correct=ai_correct, user_id=current_user.id,
+        ),
+        project_id=project_id,
+        concurrency_key=f"batch_transcribe:{project_id}",
+    )
 
     logger.info(
         f"Started batch transcription for project {project_id} "
@@ -1708,6 +2122,7 @@ def get_batch_transcribe_status(project_id):
     job = BatchTranscribeJob.query.filter_by(project_id=project_id).first()
     if not job:
         return jsonify({"status": "none"})
+    pipeline, scheduler = _batch_runtime_stats(project_id)
     return jsonify({
         "status": job.status,
         "current_image": job.current_image,
@@ -1716,6 +2131,9 @@ def get_batch_transcribe_status(project_id):
         "mode": job.mode,
         "error_message": job.error_message,
         "updated_at": job.updated_at.isoformat() if job.updated_at else None,
+        "pipeline": pipeline,
+        # This project's OCR slots in use, pages waiting for one, and slots granted so far
+        "scheduler": scheduler,
     })
 
 
@@ -1728,10 +2146,7 @@ def cancel_batch_transcribe(project_id):
     if not check_project_access(project_id, current_user):
         return jsonify({"error": "Access denied"}), 403
 
-    stop_event = _transcribe_stop_events.get(project_id)
-    if stop_event:
-        stop_event.set()
-    _transcribe_stop_events.pop(project_id, None)
+    job_queue.cancel("batch_transcribe", project_id)
 
     job = BatchTranscribeJob.query.filter_by(project_id=project_id).first()
     if job and job.status in ("running", "pending"):
@@ -2094,6 +2509,25 @@ def delete_image(image_id):
         logger.error(f"Error in delete_image for ID {image_id}: {str(e)}")
         return jsonify({"error": "Internal server error"}), 500
 
+@app.route("/api/images/<int:image_id>/lines", methods=["GET"])
+@jwt_required()
+def get_image_lines(image_id):
+    """Stored line geometry and recognition results of an image, in reading order."""
+    try:
+        current_user = get_current_user()
+        if not current_user:
+            return jsonify({"error": "Authentication required"}), 401
+
+        image = Image.query.get_or_404(image_id)
+        if not check_project_access(image.project_id, current_user):
+            return jsonify({"error": "Access denied"}), 403
+
+        lines = TranscriptionLine.query.filter_by(image_id=image_id).order_by(TranscriptionLine.order.asc()).all()
+        return jsonify({"image_id": image_id, "lines": [line.to_dict() for line in lines]})
+    except Exception as e:
+        logger.error(f"Error in get_image_lines for ID {image_id}: {str(e)}")
+        return jsonify({"error": "Internal server error"}), 500
+
 @app.route("/api/images/<int:image_id>", methods=["PUT"])
 @jwt_required()
 def update_image(image_id):
@@ -2324,21 +2758,8 @@ if not NO_KRAKEN:
             logger.error(f"Error in transcribe: {str(e)}")
             return jsonify({"status": "error", "text": str(e)}), 500
 
-# Transcribe by image ID route (always available, even without kraken)
-@app.route("/api/transcribe/<int:image_id>", methods=["POST"])
-@jwt_required()
-def transcribe_by_id(image_id):
-    current_user = get_current_user()
-    if not current_user:
-        return jsonify({"error": "Authentication required"}), 401
-
-    image = Image.query.get_or_404(image_id)
-    if not check_project_access(image.project_id, current_user):
-        return jsonify({"error": "Access denied"}), 403
-
-    if NO_KRAKEN:
-        return jsonify({"status": "error", "message": "Transcription service is not available (Kraken OCR is disabled)"}), 503
-
+def _transcribe_by_id_options():
+    """transcribe_image_by_id() keyword arguments from the request form, or an (error message, HTTP status) tuple."""
     model_name = request.form.get("modelName", "Tridis_Medieval_EarlyModern.mlmodel")
     ignore_edges_str = request.form.get("ignoreEdges", "false")
     ignore_edges = (ignore_edges_str.lower() == 'true')
@@ -2349,43 +2770,147 @@ def transcribe_by_id(image_id):
     try:
         red_threshold = float(request.form.get("redThreshold", 5.0))
     except (TypeError, ValueError):
-        return jsonify({"status": "error", "message": "redThreshold must be a number", "line_count": 0}), 400
+        return "redThreshold must be a number", 400
     red_threshold = max(0.0, min(1_000_000.0, red_threshold))
     try:
         column_gap_ratio = float(request.form.get("columnGapRatio", 0.045))
     except (TypeError, ValueError):
-        return jsonify({"status": "error", "message": "columnGapRatio must be a number", "line_count": 0}), 400
+        return "columnGapRatio must be a number", 400
     column_gap_ratio = max(0.015, min(0.165, column_gap_ratio))
     autofix_errors_str = request.form.get("autofixErrors", "true")
     autofix_errors = (autofix_errors_str.lower() == 'true')
     ai_correct_str = request.form.get("aiCorrect", "false")
     ai_correct = (ai_correct_str.lower() == 'true')
+    return dict(
+        model_name=model_name,
+        ignore_edges=ignore_edges,
+        add_page_break=add_page_break,
+        red_threshold=red_threshold,
+        enhanced_multi_column=enhanced_multi_column,
+        column_gap_ratio=column_gap_ratio,
+        autofix_errors=autofix_errors,
+        ai_correct=ai_correct,
+    )
+
+
+def _transcribed_response(result):
+    return {
+        "status": "success",
+        "message": "Image transcribed and text saved",
+        "line_count": len(result["lines"]),
+        "stages": result["memo"],
+    }
+
+
+# Transcribe by image ID route (always available, even without kraken)
+@app.route("/api/transcribe/<int:image_id>", methods=["POST"])
+@jwt_required()
+def transcribe_by_id(image_id):
+    current_user = get_current_user()
+    if not current_user:
+        return jsonify({"error": "Authentication required"}), 401
+
+    image = Image.query.get_or_404(image_id)
+    if not check_project_access(image.project_id, current_user):
+        return jsonify({"error": "Access denied"}), 403
+
+    if NO_KRAKEN:
+        return jsonify({"status": "error", "message": "Transcription service is not available (Kraken OCR is disabled)"}), 503
+
+    options = _transcribe_by_id_options()
+    if isinstance(options, tuple):
+        return jsonify({"status": "error", "message": options[0], "line_count": 0}), options[1]
 
     try:
-        result = transcribe_image_by_id(
-            image_id,
-            model_name,
-            ignore_edges=ignore_edges,
-            add_page_break=add_page_break,
-            red_threshold=red_threshold,
-            enhanced_multi_column=enhanced_multi_column,
-            column_gap_ratio=column_gap_ratio,
-            autofix_errors=autofix_errors,
-            ai_correct=ai_correct,
-        )
+        result = transcribe_image_by_id(image_id, **options)
         if isinstance(result, tuple):
             logger.error(f"Error in transcribe_by_id for ID {image_id}: {result[0]}")
             return jsonify({"status": "error", "message": result[0], "line_count": 0}), result[1]
         logger.info(f"Transcribed image with ID {image_id} by user {current_user.username}")
-        return jsonify({
-            "status": "success",
-            "message": "Image transcribed and text saved",
-            "line_count": len(result["lines"])
-        })
+        return jsonify(_transcribed_response(result))
     except Exception as e:
         logger.error(f"Error in transcribe_by_id for ID {image_id}: {str(e)}")
         return jsonify({"status": "error", "message": str(e), "line_count": 0}), 500
 
+
+# Seconds without an event after which the stream sends an SSE comment, so
+# proxies don't drop the connection during a long AI correction.
+STREAM_KEEPALIVE_SECONDS = 15
+
+
+def _sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@app.route("/api/transcribe/<int:image_id>/stream", methods=["POST"])
+@jwt_required()
+def transcribe_by_id_stream(image_id):
+    """transcribe_by_id() as Server-Sent Events, so the page can be shown while it is transcribed.
+
+    Events, in order: "segmentation" ({"line_count", "lines"}), one "line"
+    per recognised piece (see page_transcription.line_event(); not
+    necessarily in reading order), "text" ({"stage", "text"}) for the
+    recognised text and after each correction, then "done" with the body
+    transcribe_by_id() would have returned plus the final "text" - or
+    "error" ({"message", "status"}). The page is saved before "done" and
+    finishes even if the client goes away.
+    """
+    current_user = get_current_user()
+    if not current_user:
+        return jsonify({"error": "Authentication required"}), 401
+
+    image = Image.query.get_or_404(image_id)
+    if not check_project_access(image.project_id, current_user):
+        return jsonify({"error": "Access denied"}), 403
+
+    if NO_KRAKEN:
+        return jsonify({"status": "error", "message": "Transcription service is not available (Kraken OCR is disabled)"}), 503
+
+    options = _transcribe_by_id_options()
+    if isinstance(options, tuple):
+        return jsonify({"status": "error", "message": options[0], "line_count": 0}), options[1]
+
+    events = queue.Queue()
+    username = current_user.username
+    flask_app = app
+
+    def run():
+        with flask_app.app_context():
+            try:
+                result = transcribe_image_by_id(image_id, progress=lambda event, data: events.put((event, data)),
+                                                **options)
+                if isinstance(result, tuple):
+                    if result[1] >= 400:
+                        logger.error(f"Error in transcribe_by_id_stream for ID {image_id}: {result[0]}")
+                        events.put(("error", {"message": result[0], "status": result[1]}))
+                    else:
+                        events.put(("done", {"status": "success", "message": "No lines detected",
+                                             "line_count": 0, "stages": {}, "text": result[0]}))
+                else:
+                    logger.info(f"Transcribed image with ID {image_id} by user {username}")
+                    events.put(("done", dict(_transcribed_response(result), text=result["text"])))
+            except Exception as e:
+                logger.error(f"Error in transcribe_by_id_stream for ID {image_id}: {str(e)}")
+                events.put(("error", {"message": str(e), "status": 500}))
+            finally:
+                events.put(None)
+
+    Thread(target=run, daemon=True).start()
+
+    def generate():
+        while True:
+            try:
+                item = events.get(timeout=STREAM_KEEPALIVE_SECONDS)
+            except queue.Empty:
+                yield ": keep-alive\n\n"
+                continue
+            if item is None:
+                return
+            yield _sse_event(*item)
+
+    return Response(generate(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 # Static File Serving
 @app.route("/project/<path:path>")
 @app.route("/new-project")
@@ -2450,6 +2975,13 @@ def open_browser():
     if not os.environ.get("WERKZEUG_RUN_MAIN"):
         webbrowser.open_new("http://127.0.0.1:5000")
 
+# Start the job queue once the whole module is set up, so its threads never
+# see a half-defined app: in every Gunicorn worker (each imports the app)
+# and, for `python3 krakenServer.py`, in the reloader's serving process
+# rather than the one watching the files.
+if __name__ != "__main__" or os.environ.get("WERKZEUG_RUN_MAIN"):
+    _start_job_queue()
+
 if __name__ == "__main__":
     open_browser()
     app.run(host="127.0.0.1", port=5000, debug=True)
@@ -0,0 +1,244 @@
+"""
+metrics.py
+
+Per-stage timing of the OCR path, exported in the Prometheus text format.
+
+The only timing the server used to have was one "Transcription operation
+took" log line in ``transcribe_image``, so nobody could tell whether a slow
+page spent its time decoding, segmenting, splitting colours, recognising or
+waiting on SQLite. The transcription code now wraps each stage in a
+``span()``:
+
+    with metrics.span("segment"):
+        seg = blla.segment(...)
+
+Spans feed the ``ritus_stage_duration_seconds`` histogram (one series per
+stage), served with the counters below by ``/api/metrics``. Inside
+``collect_timings()`` - one page of a batch, or one HTTP request that asked
+for an ``X-Timing`` breakdown - the spans of a stage are summed first and
+observed once when the block ends, so the histogram describes time per page
+and stage rather than per call.
+
+Inference worker processes (ocr_workers.py) have their own copy of this
+module; they collect each page's timings and send them back with the
+result, and the web process records them with ``record_timings()``.
+
+Only the standard library is used; no Prometheus client is needed.
+"""
+
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds (seconds) of the stage histogram buckets
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _label_text(names, values):
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """A monotonically increasing count, optionally split by labels."""
+
+    kind = "counter"
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, "") for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(tuple(labels.get(name, "") for name in self.labels), 0)
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            yield f"{self.name}{_label_text(self.labels, key)} {_number(value)}"
+
+
+class Histogram:
+    """Counts of observations per bucket, with their sum, optionally split by labels."""
+
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=STAGE_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # label values -> [bucket counts..., count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, "") for name in self.labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * len(self.buckets) + [0, 0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += 1
+            series[-1] += value
+
+    def count(self, **labels):
+        series = self._series.get(tuple(labels.get(name, "") for name in self.labels))
+        return series[-2] if series else 0
+
+    def samples(self):
+        with self._lock:
+            items = sorted((key, list(series)) for key, series in self._series.items())
+        for key, series in items:
+            for bound, count in zip(self.buckets + (float("inf"),), series[:len(self.buckets)] + [series[-2]]):
+                labels = _label_text(self.labels + ("le",), key + (_number(bound),))
+                yield f"{self.name}_bucket{labels} {count}"
+            labels = _label_text(self.labels, key)
+            yield f"{self.name}_sum{labels} {_number(series[-1])}"
+            yield f"{self.name}_count{labels} {series[-2]}"
+
+
+class MetricsRegistry:
+    """A named set of counters and histograms rendered together."""
+
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name, help_text, labels=()):
+        metric = Counter(name, help_text, labels)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help_text, labels=(), buckets=STAGE_BUCKETS):
+        metric = Histogram(name, help_text, labels, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format (version 0.0.4)."""
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+STAGE_SECONDS = REGISTRY.histogram(
+    "ritus_stage_duration_seconds", "Time spent in one OCR pipeline stage for one page.", ("stage",)
+)
+PAGES = REGISTRY.counter("ritus_pages_total", "Pages run through the OCR pipeline.", ("status",))
+LINES = REGISTRY.counter(
+    "ritus_line_pieces_total", "Colour-split line pieces, recognised or reused from a stored run.", ("result",)
+)
+COLUMN_RESEGMENTATIONS = REGISTRY.counter(
+    "ritus_column_resegmentations_total",
+    "Two-column pages whose columns were re-segmented separately (changed/unchanged lines) or not (skipped).",
+    ("result",),
+)
+COLOR_PREFILTER_LINES = REGISTRY.counter(
+    "ritus_color_prefilter_lines_total",
+    "Lines the red-ink prefilter emitted black without colour analysis (skipped) or passed on (analysed).",
+    ("result",),
+)
+COLOR_PREFILTER_PAGES = REGISTRY.counter(
+    "ritus_color_prefilter_pages_total",
+    "Colour-split pages on which no line needed colour analysis (black_only), or some did (analysed).",
+    ("result",),
+)
+MODEL_LOADS = REGISTRY.counter("ritus_model_loads_total", "Recognition models loaded from disk.", ("model",))
+OCR_SLOT_WAIT_SECONDS = REGISTRY.histogram(
+    "ritus_ocr_slot_wait_seconds",
+    "Time a page waited for an OCR slot (fair_scheduler.py), by priority class (interactive/batch).",
+    ("priority",),
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0),
+)
+OCR_SLOT_PREEMPTIONS = REGISTRY.counter(
+    "ritus_ocr_slot_preemptions_total", "Batch pages that lent their OCR slot to interactive work between line batches."
+)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_timings = contextvars.ContextVar("ritus_timings", default=None)
+# A collection is shared with the threads its context is copied to
+_timings_lock = threading.Lock()
+
+
+def record_timings(timings):
+    """Add {stage: seconds} to the current collection, or observe them right away."""
+    current = _timings.get()
+    for stage, seconds in timings.items():
+        if current is not None:
+            with _timings_lock:
+                current[stage] = current.get(stage, 0.0) + seconds
+        else:
+            STAGE_SECONDS.observe(seconds, stage=stage)
+
+
+@contextmanager
+def span(stage):
+    """Time the enclosed block as one run of stage."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_timings({stage: time.perf_counter() - start})
+
+
+def start_collecting():
+    """Begin summing spans per stage; returns a token for stop_collecting()."""
+    timings = {}
+    return timings, _timings.set(timings)
+
+
+def stop_collecting(token):
+    """Observe and return the {stage: seconds} summed since start_collecting()."""
+    timings, reset_token = token
+    try:
+        _timings.reset(reset_token)
+    except ValueError:
+        # Stopped from another context than it was started in
+        _timings.set(None)
+    for stage, seconds in timings.items():
+        STAGE_SECONDS.observe(seconds, stage=stage)
+    return timings
+
+
+@contextmanager
+def collect_timings():
+    """Sum the spans of the enclosed block per stage; yields the {stage: seconds} dict."""
+    token = start_collecting()
+    try:
+        yield token[0]
+    finally:
+        stop_collecting(token)
+
+
+def timing_header(timings):
+    """X-Timing header value: stage=milliseconds pairs, slowest first."""
+    return ", ".join(
+        f"{stage}={seconds * 1000:.1f}ms"
+        for stage, seconds in sorted(timings.items(), key=lambda item: -item[1])
+    )
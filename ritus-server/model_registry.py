@@ -0,0 +1,212 @@
+"""
+model_registry.py
+
+A small LRU pool of loaded recognition models.
+
+krakenServer.py used to keep exactly one ``ocr_model`` and reload it with
+``load_any`` whenever a request asked for a different model than the last
+one. Two users working with different models (e.g. Tridis and
+catmus-medieval) made the server reload on every request, and batch
+transcription worker threads could read the global while another thread
+was swapping it.
+
+``ModelRegistry`` keeps up to ``capacity`` models loaded (and, optionally,
+no more than ``max_bytes`` of their parameters), evicting the least recently
+used one first. Models are handed out with ``acquire()``, a context manager
+that counts references, so a model that some thread is still recognising
+with is never evicted. Only one thread loads a given model; others asking
+for it at the same time wait for that load instead of starting their own.
+
+    registry = ModelRegistry(lambda name: load_any(MODEL_PATHS[name]), capacity=2)
+    with registry.acquire("catmus-medieval.mlmodel") as model:
+        ...
+
+``stats()`` returns hit/miss/eviction counters and the total time spent
+loading, for the admin stats route.
+"""
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Models kept loaded when nothing else is configured (see "model_cache_size"
+# in domain_config.json).
+DEFAULT_CAPACITY = 2
+
+
+def estimate_model_bytes(model):
+    """Bytes held by the parameters and buffers of a loaded model.
+
+    Understands kraken's ``TorchSeqRecognizer`` (``model.nn.nn`` is the torch
+    module) as well as plain torch modules. Returns 0 when the size cannot be
+    determined, so such models only count towards ``capacity``.
+    """
+    module = model
+    while not hasattr(module, "parameters") and hasattr(module, "nn"):
+        module = module.nn
+    if not hasattr(module, "parameters"):
+        return 0
+    try:
+        tensors = list(module.parameters())
+        if hasattr(module, "buffers"):
+            tensors.extend(module.buffers())
+        return sum(t.numel() * t.element_size() for t in tensors)
+    except Exception:
+        logger.debug("Could not estimate size of model %r", model, exc_info=True)
+        return 0
+
+
+class _Entry:
+    __slots__ = ("model", "nbytes", "refs")
+
+    def __init__(self, model, nbytes):
+        self.model = model
+        self.nbytes = nbytes
+        self.refs = 0
+
+
+class ModelRegistry:
+    """Thread-safe LRU pool of loaded models, keyed by model name.
+
+    Args:
+        loader: Callable taking a model name and returning the loaded model.
+        capacity: Maximum number of models kept loaded.
+        max_bytes: Optional budget for the summed size of loaded models
+            (as measured by size_of); None or 0 means no budget.
+        size_of: Callable returning the size of a loaded model in bytes.
+
+    Models in use are never evicted, so while every loaded model is in use
+    the pool can temporarily hold more than capacity/max_bytes allow; it
+    shrinks back as soon as they are released.
+    """
+
+    def __init__(self, loader, capacity=DEFAULT_CAPACITY, max_bytes=None, size_of=estimate_model_bytes):
+        self._loader = loader
+        self._size_of = size_of
+        self.capacity = max(1, int(capacity))
+        self.max_bytes = int(max_bytes) if max_bytes else None
+        self._entries = OrderedDict()  # name -> _Entry, least recently used first
+        self._loading = set()
+        self._cond = threading.Condition()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.load_failures = 0
+        self.load_seconds = 0.0
+
+    @contextmanager
+    def acquire(self, name):
+        """Yield the model called name, loading it if needed.
+
+        The model cannot be evicted until the with block exits. Exceptions
+        raised by the loader propagate to the caller.
+        """
+        model = self._checkout(name)
+        try:
+            yield model
+        finally:
+            self._release(name)
+
+    def preload(self, names):
+        """Load each of names now, so the first request does not wait for it.
+
+        Failures are logged and skipped; preloading more models than capacity
+        allows just keeps the last ones.
+        """
+        for name in names:
+            try:
+                with self.acquire(name):
+                    pass
+                logger.info(f"Preloaded model: {name}")
+            except Exception as e:
+                logger.error(f"Failed to preload model {name}: {e}")
+
+    def loaded_models(self):
+        """Names of the loaded models, least recently used first."""
+        with self._cond:
+            return list(self._entries)
+
+    def stats(self):
+        """Counters and the current contents of the pool, as a plain dict."""
+        with self._cond:
+            return {
+                "capacity": self.capacity,
+                "max_bytes": self.max_bytes,
+                "loaded_bytes": self._loaded_bytes(),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "load_failures": self.load_failures,
+                "load_seconds": round(self.load_seconds, 3),
+                "models": [
+                    {"name": name, "bytes": entry.nbytes, "in_use": entry.refs}
+                    for name, entry in self._entries.items()
+                ],
+            }
+
+    def _loaded_bytes(self):
+        return sum(entry.nbytes for entry in self._entries.values())
+
+    def _checkout(self, name):
+        with self._cond:
+            while name in self._loading:
+                self._cond.wait()
+            entry = self._entries.get(name)
+            if entry is not None:
+                self.hits += 1
+                entry.refs += 1
+                self._entries.move_to_end(name)
+                return entry.model
+            self.misses += 1
+            self._loading.add(name)
+
+        # Load outside the lock so requests for other models are not blocked.
+        start = time.perf_counter()
+        try:
+            logger.info(f"Loading model: {name}")
+            model = self._loader(name)
+            nbytes = self._size_of(model)
+        except BaseException:
+            with self._cond:
+                self.load_failures += 1
+                self._loading.discard(name)
+                self._cond.notify_all()
+            raise
+        elapsed = time.perf_counter() - start
+        logger.info(f"Loaded model {name} in {elapsed:.2f}s ({nbytes / 2**20:.1f} MB)")
+
+        with self._cond:
+            self.load_seconds += elapsed
+            entry = _Entry(model, nbytes)
+            entry.refs = 1
+            self._entries[name] = entry
+            self._loading.discard(name)
+            self._evict()
+            self._cond.notify_all()
+        return model
+
+    def _release(self, name):
+        with self._cond:
+            entry = self._entries.get(name)
+            if entry is not None:
+                entry.refs -= 1
+            self._evict()
+
+    def _over_budget(self):
+        if len(self._entries) > self.capacity:
+            return True
+        return self.max_bytes is not None and self._loaded_bytes() > self.max_bytes
+
+    def _evict(self):
+        """Drop least recently used idle models until the pool fits. Caller holds the lock."""
+        while self._over_budget():
+            idle = next((name for name, entry in self._entries.items() if entry.refs <= 0), None)
+            if idle is None:
+                return
+            del self._entries[idle]
+            self.evictions += 1
+            logger.info(f"Evicted model: {idle}")
@@ -1,6 +1,7 @@
 from flask_sqlalchemy import SQLAlchemy
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime
+import json
 
 # Initialize SQLAlchemy (will be bound to app in krakenServer.py)
 db = SQLAlchemy()
@@ -33,6 +34,8 @@ class Project(db.Model):
     images = db.relationship('Image', backref='project', cascade='all, delete-orphan')
     iiif_download_job = db.relationship('IiifDownloadJob', backref='project', cascade='all, delete-orphan', uselist=False)
     batch_transcribe_job = db.relationship('BatchTranscribeJob', backref='project', cascade='all, delete-orphan', uselist=False)
+    queued_jobs = db.relationship('QueuedJob', backref='project', cascade='all, delete-orphan')
+    page_tasks = db.relationship('PageTask', backref='project', cascade='all, delete-orphan')
 
 class ProjectSharing(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -46,6 +49,73 @@ class Image(db.Model):
     name = db.Column(db.String(100), nullable=False)
     original = db.Column(db.String(200), nullable=False)
     transcribed_text = db.Column(db.Text)
+    lines = db.relationship('TranscriptionLine', backref='image', cascade='all, delete-orphan',
+                            order_by='TranscriptionLine.order', lazy=True)
+    transcription_run = db.relationship('TranscriptionRun', backref='image', cascade='all, delete-orphan',
+                                        uselist=False)
+    page_tasks = db.relationship('PageTask', backref='image', cascade='all, delete-orphan')
+
+
+def _points_json(points):
+    return json.dumps([[int(x), int(y)] for x, y in points]) if points else None
+
+
+class TranscriptionLine(db.Model):
+    """One recognised line piece of an image, in reading order.
+
+    Written alongside Image.transcribed_text so later operations (reordering,
+    re-colouring, re-recognising, highlighting a line) don't need to segment
+    the page again.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    image_id = db.Column(db.Integer, db.ForeignKey('image.id', ondelete='CASCADE'), nullable=False, index=True)
+    order = db.Column(db.Integer, nullable=False)
+    source_order = db.Column(db.Integer)  # Index of the segmented line this piece was split from
+    baseline = db.Column(db.Text)  # JSON list of [x, y] points
+    boundary = db.Column(db.Text)  # JSON list of [x, y] points
+    color = db.Column(db.String(10), default='black')
+    text = db.Column(db.Text)
+    confidence = db.Column(db.Float)
+    model = db.Column(db.String(100))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    @classmethod
+    def replace_for_image(cls, image_id, lines, model_name):
+        """Replace an image's stored lines with lines, in one bulk insert.
+
+        lines are the BaselineLine pieces from transcribe_page(), in reading
+        order. The caller commits.
+        """
+        cls.query.filter_by(image_id=image_id).delete(synchronize_session=False)
+        created_at = datetime.utcnow()
+        db.session.bulk_insert_mappings(cls, [
+            {
+                "image_id": image_id,
+                "order": order,
+                "source_order": getattr(line, 'source_order', None),
+                "baseline": _points_json(getattr(line, 'baseline', None)),
+                "boundary": _points_json(getattr(line, 'boundary', None)),
+                "color": getattr(line, 'color', None) or 'black',
+                "text": getattr(line, 'text', None),
+                "confidence": getattr(line, 'confidence', None),
+                "model": model_name,
+                "created_at": created_at,
+            }
+            for order, line in enumerate(lines)
+        ])
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "order": self.order,
+            "source_order": self.source_order,
+            "baseline": json.loads(self.baseline) if self.baseline else [],
+            "boundary": json.loads(self.boundary) if self.boundary else [],
+            "color": self.color,
+            "text": self.text,
+            "confidence": self.confidence,
+            "model": self.model,
+        }
 
 class Content(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -86,4 +156,93 @@ class BatchTranscribeJob(db.Model):
     mode = db.Column(db.String(20), default='skip')  # skip/continue/override
     error_message = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=db.func.now())
-    updated_at = db.Column(db.DateTime, default=db.func.now(), onupdate=db.func.now())
\ No newline at end of file
+    updated_at = db.Column(db.DateTime, default=db.func.now(), onupdate=db.func.now())
+
+
+class QueuedJob(db.Model):
+    """A unit of background work run by job_queue.JobQueue.
+
+    The kind's own table (IiifDownloadJob, BatchTranscribeJob,
+    BatchProcessing) still holds the progress shown to users; this row holds
+    what is needed to run, retry and recover the work after a restart.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(40), nullable=False, index=True)  # iiif_download/batch_transcribe/batch_analysis
+    project_id = db.Column(db.Integer, db.ForeignKey('project.id', ondelete='CASCADE'), index=True)
+    payload = db.Column(db.Text)  # JSON arguments of the handler
+    status = db.Column(db.String(20), nullable=False, default='queued', index=True)  # queued/running/completed/failed/cancelled
+    concurrency_key = db.Column(db.String(200), index=True)  # jobs sharing a key run one at a time
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=3)
+    available_at = db.Column(db.DateTime, default=datetime.utcnow)  # not claimed before this (retry backoff)
+    lease_token = db.Column(db.String(32), index=True)  # set while a worker holds the job
+    lease_expires_at = db.Column(db.DateTime)
+    heartbeat_at = db.Column(db.DateTime)
+    cancel_requested = db.Column(db.Boolean, nullable=False, default=False)
+    error_message = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+
+
+class JobRunnerLease(db.Model):
+    """A slot for a server process that runs queued jobs (job_queue.JobQueue).
+
+    With several web processes (Gunicorn workers) only the holders of these
+    slots run background jobs; the others just serve requests. The holder
+    publishes its runtime stats in state for the other processes' status
+    routes.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    slot = db.Column(db.Integer, nullable=False, unique=True)
+    holder = db.Column(db.String(200))  # host-pid-id of the process, None while free
+    acquired_at = db.Column(db.DateTime)
+    expires_at = db.Column(db.DateTime)
+    heartbeat_at = db.Column(db.DateTime)
+    state = db.Column(db.Text)  # JSON from JobQueue.state_provider
+
+
+class PageTask(db.Model):
+    """One page of a batch transcription, for a ritus_worker on another machine.
+
+    run_batch_transcribe adds a row per page when remote_transcription_workers
+    is set, workers claim the rows under a lease and write their result back,
+    and the batch saves it and deletes the row (see page_tasks.py).
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    batch_id = db.Column(db.Integer, db.ForeignKey('queued_job.id', ondelete='CASCADE'), nullable=False, index=True)
+    project_id = db.Column(db.Integer, db.ForeignKey('project.id', ondelete='CASCADE'), nullable=False, index=True)
+    image_id = db.Column(db.Integer, db.ForeignKey('image.id', ondelete='CASCADE'), nullable=False)
+    image_path = db.Column(db.String(500), nullable=False)  # Image.original, relative to the server's directory
+    model_name = db.Column(db.String(100), nullable=False)
+    options = db.Column(db.Text)  # JSON keyword arguments of transcribe_page
+    previous = db.Column(db.Text)  # JSON of previous_transcription(), or null
+    status = db.Column(db.String(20), nullable=False, default='queued', index=True)  # queued/running/done/failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=3)
+    worker = db.Column(db.String(200))  # name of the worker that holds or finished it
+    lease_token = db.Column(db.String(32), index=True)
+    lease_expires_at = db.Column(db.DateTime)
+    result = db.Column(db.Text)  # JSON {"text", "lines", "memo", "timings"} once done
+    error_message = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+
+
+class TranscriptionRun(db.Model):
+    """The parameters an image's stored TranscriptionLines were produced with.
+
+    transcribe_image_by_id compares a new request against these to redo only
+    the stages whose inputs changed (see page_transcription.transcribe_page).
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    image_id = db.Column(db.Integer, db.ForeignKey('image.id', ondelete='CASCADE'), nullable=False, unique=True)
+    model = db.Column(db.String(100))
+    red_threshold = db.Column(db.Float)
+    ignore_edges = db.Column(db.Boolean)
+    enhanced_multi_column = db.Column(db.Boolean)
+    column_gap_ratio = db.Column(db.Float)
+    segmentation_max_side = db.Column(db.Integer)
+    segmentation_digest = db.Column(db.String(64))  # page_transcription.segmentation_digest() of the page
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
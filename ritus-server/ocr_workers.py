@@ -0,0 +1,169 @@
+"""
+ocr_workers.py
+
+Optional process-based inference backend.
+
+Transcription normally runs in Flask request threads and in the
+ThreadPoolExecutor of ``run_batch_transcribe``. Recognition itself releases
+the GIL inside torch, but colour splitting and line reordering are plain
+Python/numpy and serialise on it, so raising
+``transcription_workers`` stops paying off long before the cores run out.
+
+``OcrWorkerPool`` starts N long-lived worker processes. Each loads its own
+blla segmentation model and its own ``ModelRegistry`` of recognition models
+once, at start-up, and then takes page jobs from the pool's queue:
+``page_transcription.transcribe_page`` runs entirely inside the worker and
+only the image path goes in and the text and line pieces come back out. The
+web process keeps the database lookups and writes, the autofix passes and
+the HTTP handling.
+
+Enabled with ``inference_processes`` in domain_config.json (0, the default,
+keeps everything in-process). Workers use the "spawn" start method, so they
+never inherit the web process's threads, sockets or CUDA state.
+"""
+
+import logging
+import multiprocessing
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# How often a caller waiting for a page's events checks whether it finished
+EVENT_POLL_SECONDS = 0.1
+
+# Per-process state, set by _init_worker in each worker process
+_worker = {}
+
+
+def _init_worker(model_paths, baseline_model_path, device, model_cache_size, model_cache_max_bytes, preload_models,
+                 segmentation_cache_dir, segmentation_map_cache_size):
+    # Imported here: the parent only needs them when it runs pages itself.
+    from kraken.lib.models import load_any
+    from model_registry import ModelRegistry
+    from page_transcription import load_baseline_model
+    from segmentation_cache import SegmentationCache, model_fingerprint
+    from segmentation_map import SegmentationMapCache
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [ocr-worker %(process)d] %(levelname)s %(message)s")
+    _worker["device"] = device
+    _worker["baseline_model"] = load_baseline_model(baseline_model_path, device) if baseline_model_path else None
+    _worker["ocr_models"] = ModelRegistry(
+        lambda name: load_any(model_paths[name], device=device),
+        capacity=model_cache_size,
+        max_bytes=model_cache_max_bytes,
+    )
+    _worker["ocr_models"].preload(preload_models)
+    _worker["segmentation_cache"] = (
+        SegmentationCache(segmentation_cache_dir, model_fingerprint(baseline_model_path))
+        if segmentation_cache_dir and baseline_model_path else None
+    )
+    _worker["segmentation_maps"] = (
+        SegmentationMapCache(segmentation_map_cache_size) if segmentation_map_cache_size > 0 else None
+    )
+    logger.info("OCR worker ready")
+
+
+def _transcribe_in_worker(image_path, model_name, options, events=None):
+    """transcribe_page() in this worker; returns (result, stage timings).
+
+    events: Optional queue that gets transcribe_page()'s progress events as
+    (event, data) tuples, as they happen.
+    """
+    from page_transcription import transcribe_page
+
+    if _worker.get("baseline_model") is None:
+        raise RuntimeError("Baseline model is not loaded in the OCR worker")
+    progress = (lambda event, data: events.put((event, data))) if events is not None else None
+    # The stage timings go back with the result; this process's own metrics
+    # are never scraped.
+    with metrics.collect_timings() as timings:
+        result = transcribe_page(
+            image_path, _worker["baseline_model"], _worker["ocr_models"], model_name, _worker["device"],
+            segmentation_cache=_worker["segmentation_cache"], segmentation_maps=_worker["segmentation_maps"],
+            progress=progress, **options
+        )
+    return result, timings
+
+
+class OcrWorkerPool:
+    """A fixed set of worker processes running transcribe_page().
+
+    Args:
+        processes: Number of worker processes.
+        model_paths: Recognition model name -> file path.
+        baseline_model_path: Path of blla.mlmodel.
+        device: Torch device the workers load their models onto.
+        model_cache_size, model_cache_max_bytes: ModelRegistry limits, per worker.
+        preload_models: Recognition models each worker loads at start-up.
+        segmentation_cache_dir: Directory of the shared SegmentationCache,
+            or None to segment every page.
+        segmentation_map_cache_size: Pages whose blla network output each
+            worker keeps in memory (SegmentationMapCache); 0 keeps none.
+    """
+
+    def __init__(self, processes, model_paths, baseline_model_path, device="cpu",
+                 model_cache_size=2, model_cache_max_bytes=None, preload_models=(), segmentation_cache_dir=None,
+                 segmentation_map_cache_size=0):
+        self.processes = max(1, int(processes))
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.processes,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(dict(model_paths), baseline_model_path, device,
+                      model_cache_size, model_cache_max_bytes, list(preload_models), segmentation_cache_dir,
+                      segmentation_map_cache_size),
+        )
+        # Started with the first page that reports progress
+        self._manager = None
+        self._manager_lock = threading.Lock()
+        logger.info(f"Started OCR worker pool with {self.processes} processes")
+
+    def _event_queue(self):
+        with self._manager_lock:
+            if self._manager is None:
+                self._manager = multiprocessing.get_context("spawn").Manager()
+            return self._manager.Queue()
+
+    def transcribe(self, image_path, model_name, progress=None, **options):
+        """Run transcribe_page() for one page in a worker; blocks until done.
+
+        options are transcribe_page()'s keyword arguments (ignore_edges,
+        red_threshold, previous, ...). Exceptions raised in the worker are
+        re-raised here. The worker's stage timings are recorded in this
+        process's metrics. progress gets transcribe_page()'s events while
+        the page runs: the worker puts them on a Manager queue, which the
+        calling thread drains.
+        """
+        if progress is None:
+            result, timings = self._executor.submit(_transcribe_in_worker, image_path, model_name, options).result()
+        else:
+            events = self._event_queue()
+            future = self._executor.submit(_transcribe_in_worker, image_path, model_name, options, events)
+            while True:
+                try:
+                    event, data = events.get(timeout=EVENT_POLL_SECONDS)
+                except queue.Empty:
+                    # The worker's puts return only once queued, so a finished
+                    # page has nothing left in flight.
+                    if future.done():
+                        break
+                    continue
+                progress(event, data)
+            while True:
+                try:
+                    event, data = events.get_nowait()
+                except queue.Empty:
+                    break
+                progress(event, data)
+            result, timings = future.result()
+        metrics.record_timings(timings)
+        return result
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        if self._manager is not None:
+            self._manager.shutdown()
@@ -0,0 +1,84 @@
+"""
+page_image.py
+
+One decoded page image, shared by every stage of a page's transcription.
+
+A page used to be decoded and converted several times over: once as the
+colour image and once more as the grayscale OCR image, then every line's
+colour analysis cropped the PIL image and converted the crop to a numpy
+array again, and the independent-column segmentation cropped the page once
+per column. ``PageImage`` reads the file once (the same bytes give the
+SHA-256 the segmentation cache is keyed by), decodes it once into a numpy
+pixel buffer and converts it to grayscale once. Colour crops are numpy views
+into that buffer, so they cost no copy at all.
+
+    page = PageImage.open(path)
+    page.gray                        # PIL "L" image for blla and rpred
+    page.crop_pixels((l, t, r, b))   # view of the decoded pixels
+    page.color                       # PIL image, built only when asked for
+"""
+
+import hashlib
+import io
+
+import numpy as np
+from PIL import Image as PILImage
+
+
+class PageImage:
+    """A page image decoded once.
+
+    Args:
+        image: A PIL image of the page; it is loaded and not kept.
+        path: Where the image was read from, if anywhere.
+        sha256: Hex SHA-256 of the file's bytes, if known.
+
+    Attributes:
+        pixels: Read-only numpy array of the decoded pixels in the image's
+            own mode (H x W x 3 for RGB).
+        gray: The page converted to a PIL "L" image, as used for OCR.
+        mode, size, width, height: As on the PIL image.
+    """
+
+    def __init__(self, image, path=None, sha256=None):
+        image.load()
+        self.path = path
+        self.sha256 = sha256
+        self.mode = image.mode
+        self.size = image.size
+        self.width, self.height = image.size
+        self.gray = image if image.mode == "L" else image.convert("L")
+        self.pixels = np.asarray(image)
+        self.pixels.flags.writeable = False
+        # Only modes numpy round-trips unambiguously are rebuilt from the
+        # buffer; anything else (palette, CMYK, ...) is kept as decoded.
+        self._color = None if image.mode in ("RGB", "RGBA") else image
+
+    @classmethod
+    def open(cls, path):
+        """Read and decode the image file at path."""
+        with open(path, "rb") as f:
+            data = f.read()
+        return cls(PILImage.open(io.BytesIO(data)), path=path, sha256=hashlib.sha256(data).hexdigest())
+
+    @property
+    def color(self):
+        """The page as a PIL image in its original mode.
+
+        Only LayoutParser and debugging need one, so it is rebuilt from the
+        pixel buffer on demand rather than held for every page.
+        """
+        if self._color is not None:
+            return self._color
+        return PILImage.fromarray(self.pixels)
+
+    def crop_pixels(self, box):
+        """View of the pixels inside box = (left, top, right, bottom), clipped to the page."""
+        left, top, right, bottom = (int(v) for v in box)
+        left, top = max(0, left), max(0, top)
+        right, bottom = min(self.width, right), min(self.height, bottom)
+        return self.pixels[top:max(top, bottom), left:max(left, right)]
+
+    def crop_gray(self, box):
+        """PIL grayscale crop of box, e.g. for segmenting part of the page."""
+        return self.gray.crop(box)
@@ -0,0 +1,248 @@
+"""
+page_tasks.py
+
+Page-level transcription tasks in the PageTask table, shared by the server
+and the ritus_worker processes on other machines.
+
+With remote_transcription_workers set in domain_config.json, a batch
+transcription no longer recognises its pages itself. run_batch_transcribe
+adds a task per page (add_tasks) and then collects the results the workers
+wrote back (finished_tasks), saves them like its own and deletes the tasks.
+A worker (ritus_worker.py) only needs the database and the page images:
+
+    task = claim_task(engine, "ocr-2")
+    ... while recognising: renew_lease(engine, task, 120) ...
+    complete_task(engine, task, {"text": ..., "lines": [...], "memo": {...}})
+
+Everything here is plain SQLAlchemy Core on an Engine, so workers use it
+without the Flask app; the server passes db.engine. As in job_queue.py a
+claim is a single UPDATE, so two workers never get the same task, and a task
+whose worker stopped renewing its lease is claimed again by another one
+until it runs out of attempts. Workers take the oldest task of the project
+with the fewest pages running, so several projects' batches share them.
+Cancelling a batch deletes its tasks; the
+worker of a running one finds out when its lease renewal or result matches
+no row, and drops the page.
+"""
+
+import json
+import uuid
+from collections import namedtuple
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from sqlalchemy import and_, delete, func, insert, or_, select, update
+
+from models import PageTask
+
+DEFAULT_LEASE_SECONDS = 120
+DEFAULT_MAX_ATTEMPTS = 3
+# Error of a task whose last attempt's worker stopped renewing the lease
+LOST_WORKER_MESSAGE = "The worker stopped responding"
+
+ClaimedTask = namedtuple(
+    "ClaimedTask",
+    "id batch_id project_id image_id image_path model_name options previous attempt max_attempts lease_token",
+)
+FinishedTask = namedtuple("FinishedTask", "id image_id status result error worker")
+
+_table = PageTask.__table__
+
+
+def line_dict(line):
+    """A recognised line piece (BaselineLine from transcribe_page()) as JSON-ready dict."""
+    return {
+        "source_order": getattr(line, 'source_order', None),
+        "baseline": [[int(x), int(y)] for x, y in line.baseline or ()],
+        "boundary": [[int(x), int(y)] for x, y in line.boundary or ()],
+        "color": getattr(line, 'color', None) or 'black',
+        "text": getattr(line, 'text', None),
+        "confidence": getattr(line, 'confidence', None),
+    }
+
+
+def result_lines(result):
+    """The line pieces of a worker's result, with the attributes save_transcription() reads."""
+    return [SimpleNamespace(**line) for line in result.get("lines", [])]
+
+
+def add_tasks(engine, batch_id, project_id, pages, max_attempts=DEFAULT_MAX_ATTEMPTS):
+    """Queue one task per page dict (image_id, image_path, model_name, options, previous)."""
+    now = datetime.utcnow()
+    rows = [
+        {
+            "batch_id": batch_id,
+            "project_id": project_id,
+            "image_id": page["image_id"],
+            "image_path": page["image_path"],
+            "model_name": page["model_name"],
+            "options": json.dumps(page.get("options") or {}),
+            "previous": json.dumps(page.get("previous")),
+            "status": "queued",
+            "attempts": 0,
+            "max_attempts": max_attempts,
+            "created_at": now,
+            "updated_at": now,
+        }
+        for page in pages
+    ]
+    if rows:
+        with engine.begin() as conn:
+            conn.execute(insert(_table), rows)
+    return len(rows)
+
+
+def batch_image_ids(engine, batch_id):
+    """Images that already have a task in batch_id, whatever its status."""
+    with engine.connect() as conn:
+        return set(conn.execute(select(_table.c.image_id).where(_table.c.batch_id == batch_id)).scalars())
+
+
+def discard_other_batches(engine, project_id, batch_id):
+    """Delete the tasks a project's earlier batches left behind; returns how many."""
+    with engine.begin() as conn:
+        return conn.execute(
+            delete(_table).where(_table.c.project_id == project_id, _table.c.batch_id != batch_id)
+        ).rowcount
+
+
+def claim_task(engine, worker, lease_seconds=DEFAULT_LEASE_SECONDS):
+    """Lease the oldest runnable task for worker; returns a ClaimedTask or None."""
+    token = uuid.uuid4().hex
+    now = datetime.utcnow()
+    candidate = _table.alias("candidate")
+    runnable = or_(
+        candidate.c.status == "queued",
+        # Orphaned: its worker stopped renewing the lease
+        and_(candidate.c.status == "running", candidate.c.lease_expires_at < now,
+             candidate.c.attempts < candidate.c.max_attempts),
+    )
+    # Like the local OCR slots (fair_scheduler.py), shared between projects
+    other = _table.alias("other")
+    project_running = (
+        select(func.count()).select_from(other)
+        .where(other.c.project_id == candidate.c.project_id, other.c.status == "running")
+        .scalar_subquery()
+    )
+    pick = (
+        select(candidate.c.id).where(runnable)
+        .order_by(project_running, candidate.c.id)
+        .limit(1)
+        .scalar_subquery()
+    )
+    with engine.begin() as conn:
+        result = conn.execute(
+            update(_table)
+            .where(_table.c.id == pick)
+            .values(
+                status="running",
+                worker=worker,
+                lease_token=token,
+                lease_expires_at=now + timedelta(seconds=lease_seconds),
+                attempts=_table.c.attempts + 1,
+                updated_at=now,
+            )
+        )
+        if result.rowcount != 1:
+            return None
+        row = conn.execute(select(_table).where(_table.c.lease_token == token)).one()
+    return ClaimedTask(
+        row.id, row.batch_id, row.project_id, row.image_id, row.image_path, row.model_name,
+        json.loads(row.options or "{}"), json.loads(row.previous or "null"), row.attempts, row.max_attempts, token,
+    )
+
+
+def _held(task):
+    return and_(_table.c.id == task.id, _table.c.lease_token == task.lease_token, _table.c.status == "running")
+
+
+def renew_lease(engine, task, lease_seconds=DEFAULT_LEASE_SECONDS):
+    """Extend the lease of a claimed task; False if the task was cancelled or taken over."""
+    now = datetime.utcnow()
+    with engine.begin() as conn:
+        result = conn.execute(
+            update(_table).where(_held(task))
+            .values(lease_expires_at=now + timedelta(seconds=lease_seconds), updated_at=now)
+        )
+    return result.rowcount == 1
+
+
+def complete_task(engine, task, result):
+    """Store the result of a claimed task; False if the lease was lost meanwhile."""
+    now = datetime.utcnow()
+    with engine.begin() as conn:
+        updated = conn.execute(
+            update(_table).where(_held(task))
+            .values(status="done", result=json.dumps(result), lease_token=None, lease_expires_at=None,
+                    error_message=None, updated_at=now, finished_at=now)
+        )
+    return updated.rowcount == 1
+
+
+def fail_task(engine, task, error, retry=True):
+    """Give a claimed task back for another attempt, or fail it once retry is off or attempts ran out."""
+    now = datetime.utcnow()
+    final = not retry or task.attempt >= task.max_attempts
+    with engine.begin() as conn:
+        conn.execute(
+            update(_table).where(_held(task))
+            .values(status="failed" if final else "queued", error_message=error, lease_token=None,
+                    lease_expires_at=None, updated_at=now, finished_at=now if final else None)
+        )
+    return final
+
+
+def finished_tasks(engine, batch_id, limit=50):
+    """Done and failed tasks of batch_id, oldest first, as FinishedTask.
+
+    A task still "running" whose lease expired on its last attempt counts as
+    failed: no worker will claim it again.
+    """
+    now = datetime.utcnow()
+    lost = and_(_table.c.status == "running", _table.c.lease_expires_at < now,
+                _table.c.attempts >= _table.c.max_attempts)
+    query = (
+        select(_table.c.id, _table.c.image_id, _table.c.status, _table.c.result, _table.c.error_message,
+               _table.c.worker)
+        .where(_table.c.batch_id == batch_id, or_(_table.c.status.in_(("done", "failed")), lost))
+        .order_by(_table.c.id)
+        .limit(limit)
+    )
+    with engine.connect() as conn:
+        rows = conn.execute(query).all()
+    return [
+        FinishedTask(row.id, row.image_id, "done", json.loads(row.result), None, row.worker)
+        if row.status == "done" else
+        FinishedTask(row.id, row.image_id, "failed", None, row.error_message or LOST_WORKER_MESSAGE, row.worker)
+        for row in rows
+    ]
+
+
+def delete_tasks(engine, task_ids):
+    """Delete collected tasks by id."""
+    task_ids = list(task_ids)
+    if task_ids:
+        with engine.begin() as conn:
+            conn.execute(delete(_table).where(_table.c.id.in_(task_ids)))
+
+
+def cancel_batch(engine, batch_id):
+    """Delete every task of batch_id; workers running one drop it. Returns how many."""
+    with engine.begin() as conn:
+        return conn.execute(delete(_table).where(_table.c.batch_id == batch_id)).rowcount
+
+
+def remaining_tasks(engine, batch_id):
+    """Tasks of batch_id not collected yet."""
+    with engine.connect() as conn:
+        return conn.execute(select(func.count()).select_from(_table).where(_table.c.batch_id == batch_id)).scalar()
+
+
+def stats(engine):
+    """Task counts by status, and the running ones by worker."""
+    with engine.connect() as conn:
+        statuses = dict(conn.execute(select(_table.c.status, func.count()).group_by(_table.c.status)).all())
+        workers = dict(conn.execute(
+            select(_table.c.worker, func.count()).where(_table.c.status == "running").group_by(_table.c.worker)
+        ).all())
+    return {"tasks": statuses, "running_by_worker": workers}
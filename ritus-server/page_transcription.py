@@ -0,0 +1,725 @@
+"""
+page_transcription.py
+
+The OCR part of transcribing one page: baseline segmentation, optional
+multi-column reordering, red/black colour splitting, recognition and the
+assembly of the ``<red>``-tagged text.
+
+This used to live inside ``krakenServer.transcribe_image_by_id``, mixed with
+database lookups and writes. It is kept free of Flask and the database so it
+can run both in the web process and in the inference worker processes of
+ocr_workers.py; ``transcribe_image_by_id`` now only looks the image up,
+hands its path to ``transcribe_page`` and post-processes/saves the result.
+
+Every step takes the page as one ``PageImage`` (page_image.py), decoded once
+per transcription.
+"""
+
+import contextvars
+import hashlib
+import json
+import logging
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import replace
+
+from PIL import Image as PILImage
+
+from kraken import rpred
+from kraken.lib import vgsl
+
+import layout_parser_preprocessing
+import metrics
+from batch_recognition import recognize_lines
+from image_processing import split_line_boundary_by_color, ColorAnalysisContext
+from multi_column_layout import reorder_lines_for_multi_column, detect_column_bands
+from page_image import PageImage
+from segmentation_map import compute_segmentation_map
+
+logger = logging.getLogger(__name__)
+
+# The recognition models mark a genuine end-of-line word-wrap (a word
+# broken across a physical printed line) with a trailing "¬". That's a
+# print-layout artifact, not part of the word, so fold it back into a
+# single continuous word rather than showing it in the transcription.
+LINE_WRAP_HYPHEN = "¬"
+
+# Two column crops match the lines of the full-page pass when every line has
+# a counterpart whose bounding box overlaps it by at least this IoU.
+SAME_LINE_IOU = 0.5
+
+# Threads segmenting right-hand column crops while the calling thread does
+# the left one; shared by every page of the process and started on first use.
+_column_pool = None
+_column_pool_lock = threading.Lock()
+
+
+def load_baseline_model(path, device):
+    """Load the blla segmentation model from path onto device."""
+    temp_model = vgsl.TorchVGSLModel.load_model(path)
+    if temp_model is None:
+        raise ValueError("vgsl.TorchVGSLModel.load_model returned None")
+    if hasattr(temp_model, 'to'):
+        # If .to() returns None (in-place modification), use temp_model
+        converted_model = temp_model.to(device=device)
+        return converted_model if converted_model is not None else temp_model
+    return temp_model
+
+
+def segment_image(image, baseline_model, device, text_direction='horizontal-tb', max_side=0):
+    """blla segmentation of image, optionally on a downscaled copy.
+
+    With max_side set and the image's longer side above it, blla's network
+    runs on a copy scaled down to max_side and the baselines, boundaries
+    and regions come out in image's coordinates, so colour splitting and
+    recognition still work on the full-resolution page. blla itself scales
+    its input to a fixed height internally, so pages far larger than that
+    mostly pay for the bigger resize and post-processing, not for accuracy.
+    max_side 0 (or None) segments the image as it is.
+
+    Runs the network and vectorizes its output in one go; transcribe_page()
+    keeps the SegmentationMap instead, to reuse it (segmentation_map.py).
+    """
+    return compute_segmentation_map(image, baseline_model, device, max_side=max_side).vectorize(text_direction)
+
+
+def should_ignore_line(line, width, ignore_edges):
+    if not ignore_edges:
+        return False
+    if not line.baseline:
+        return True
+    xs = [p[0] for p in line.baseline]
+    min_x = min(xs)
+    max_x = max(xs)
+    line_width = max_x - min_x
+
+    is_short = line_width < (0.25 * width)
+    near_edge = (min_x < 0.05 * width) or (max_x > 0.95 * width)
+
+    return is_short and near_edge
+
+
+def _column_executor(workers):
+    """The shared column thread pool resized to workers threads, or None when workers is 0."""
+    global _column_pool
+    if workers <= 0:
+        return None
+    with _column_pool_lock:
+        if _column_pool is not None and _column_pool[0] != workers:
+            _column_pool[1].shutdown(wait=False)
+            _column_pool = None
+        if _column_pool is None:
+            _column_pool = (workers, ThreadPoolExecutor(max_workers=workers, thread_name_prefix="column-segment"))
+        return _column_pool[1]
+
+
+def _line_bbox(line):
+    points = getattr(line, "boundary", None) or getattr(line, "baseline", None)
+    xs = [point[0] for point in points]
+    ys = [point[1] for point in points]
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+def _bbox_iou(a, b):
+    width = min(a[2], b[2]) - max(a[0], b[0])
+    height = min(a[3], b[3]) - max(a[1], b[1])
+    if width <= 0 or height <= 0:
+        return 0.0
+    overlap = width * height
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - overlap
+    return overlap / union if union > 0 else 0.0
+
+
+def _same_line_set(before, after):
+    """Whether after holds the lines of before, each matched by bounding box overlap."""
+    if len(before) != len(after):
+        return False
+    unmatched = [_line_bbox(line) for line in after]
+    for line in before:
+        box = _line_bbox(line)
+        match = next((i for i, other in enumerate(unmatched) if _bbox_iou(box, other) >= SAME_LINE_IOU), None)
+        if match is None:
+            return False
+        del unmatched[match]
+    return True
+
+
+def segment_detected_columns_independently(page, initial_lines, baseline_model, device, column_gap_ratio=0.045,
+                                           max_side=0, column_workers=0, memo=None, seg_map=None):
+    """Re-run blla on two body-column crops when it joined their text.
+
+    Line reordering cannot undo an OCR crop that already contains both
+    columns.  This keeps a centred title from the full-page pass, then
+    segments the body in independent left/right image crops.
+
+    The crops are only segmented when some line of the full-page pass runs
+    across the gutter; otherwise blla kept the columns apart and None is
+    returned, leaving the lines to the reordering fallbacks. With
+    column_workers the right crop is segmented on the shared column thread
+    pool while this thread does the left one. memo["columns"] records
+    "skipped", "changed" or "unchanged" (whether the crops gave different
+    lines than the full-page pass). With seg_map, the SegmentationMap of
+    the full-page pass, the crops are vectorized from its heatmaps instead
+    of running the network on them again.
+    """
+    bands = detect_column_bands(initial_lines, page.width, column_gap_ratio=column_gap_ratio)
+    if len(bands) != 2:
+        return None
+    (left_edge, left_right), (right_left, right_edge) = bands
+    gutter = int(round((left_right + right_left) / 2.0))
+    if gutter <= 0 or gutter >= page.width:
+        return None
+
+    bbox = _line_bbox
+    first = min(initial_lines, key=lambda line: bbox(line)[1])
+    x0, _y0, x1, title_bottom = bbox(first)
+    # Preserve only a genuinely centred header. A normal first body line
+    # should not be removed before column segmentation.
+    is_centered_header = (
+        x0 > left_edge + 0.15 * (left_right - left_edge)
+        and x1 < right_edge - 0.15 * (right_edge - right_left)
+        and x0 < gutter < x1
+    )
+    body_top = max(0, int(title_bottom) - 2) if is_centered_header else 0
+    result = [first] if is_centered_header else []
+
+    # A line starting left of the left column's right edge and ending right
+    # of the right column's left edge contains text of both columns.
+    merged = [
+        line for line in initial_lines
+        if not (is_centered_header and line is first)
+        and bbox(line)[0] < left_right and bbox(line)[2] > right_left
+    ]
+    if not merged:
+        logger.info("Two body columns detected but no line crosses the gutter; not re-segmenting them")
+        if memo is not None:
+            memo["columns"] = "skipped"
+        return None
+
+    def segment_column(crop_box):
+        with metrics.span("column_segment"):
+            if seg_map is not None:
+                return seg_map.crop(crop_box).vectorize("horizontal-tb")
+            return segment_image(
+                page.crop_gray(crop_box), baseline_model, device,
+                text_direction="horizontal-tb", max_side=max_side,
+            )
+
+    left_box = (0, body_top, gutter, page.height)
+    right_box = (gutter, body_top, page.width, page.height)
+    executor = _column_executor(column_workers)
+    if executor is not None:
+        # In the caller's context, so its span lands in the page's timings
+        right_future = executor.submit(contextvars.copy_context().run, segment_column, right_box)
+        left_segmentation = segment_column(left_box)
+        right_segmentation = right_future.result()
+    else:
+        left_segmentation = segment_column(left_box)
+        right_segmentation = segment_column(right_box)
+
+    for side, column_segmentation, offset in (
+        ("left", left_segmentation, (0, body_top)),
+        ("right", right_segmentation, (gutter, body_top)),
+    ):
+        for line in sorted(column_segmentation.lines, key=lambda item: bbox(item)[1]):
+            result.append(replace(
+                line,
+                id=f"{line.id}:{side}",
+                baseline=[(x + offset[0], y + offset[1]) for x, y in line.baseline],
+                boundary=[(x + offset[0], y + offset[1]) for x, y in line.boundary],
+            ))
+    changed = not _same_line_set(initial_lines, result)
+    logger.info(
+        "Segmented two detected body columns independently (%d merged lines): %d -> %d lines, %s",
+        len(merged), len(initial_lines), len(result), "changed" if changed else "unchanged",
+    )
+    if memo is not None:
+        memo["columns"] = "changed" if changed else "unchanged"
+    return result
+
+
+def recognize_page_lines(network, image, seg, lines, batch_size=1, on_line=None):
+    """Recognise every line of a page, returning one record list per line.
+
+    With batch_size > 1 the lines go through the recognizer in padded
+    mini-batches (batch_recognition.py); with 1 - or if the batched path
+    fails as a whole - each line gets its own rpred call as before. An entry
+    is None when recognition of that line failed. on_line, if given, is
+    called with (index, records) for each line as soon as it is done; with
+    batches that is not in line order.
+    """
+    if batch_size > 1:
+        on_records = None
+        if on_line is not None:
+            def on_records(results):
+                for index, record in results:
+                    on_line(index, [record])
+        try:
+            return [[record] for record in recognize_lines(network, image, seg, lines, batch_size=batch_size,
+                                                           on_records=on_records)]
+        except Exception:
+            logger.exception("Batched recognition failed; falling back to one rpred call per line")
+    results = []
+    for index, line in enumerate(lines):
+        seg.lines = [line]
+        try:
+            results.append(list(rpred.rpred(network, image, seg)))
+        except Exception as e:
+            logger.error(f"OCR failed for line {line.id}: {str(e)}")
+            results.append(None)
+        if on_line is not None:
+            on_line(index, results[-1])
+    return results
+
+
+def _order_multi_column_lines(seg, page, baseline_model, device, column_gap_ratio, max_side=0, column_workers=0,
+                              memo=None, seg_map=None):
+    """Re-sort seg.lines into a sensible reading order for multi-column pages."""
+    # Optionally re-sort lines into a sensible reading order for multi-
+    # column pages (title/subtitle, then each column top-to-bottom). blla
+    # tends to interleave column lines when a title or a marginalia strip
+    # confuses its own column-detection heuristics.
+    #
+    # Preferred path: run LayoutParser on the page to actually detect the
+    # title/column/figure regions and use those (see
+    # layout_parser_preprocessing.py) - this is the only approach that can
+    # correctly keep a column's reading order intact when an inline
+    # illustration splits it into a "before" and "after" piece, since it
+    # sees the illustration as a region even though kraken never produces
+    # OCR lines over it.
+    #
+    # Fallback path: if layoutparser (or its model) isn't installed/usable,
+    # fall back to the purely geometric line-based heuristic in
+    # multi_column_layout.py, which needs no extra dependencies.
+    independently_segmented = segment_detected_columns_independently(
+        page, seg.lines, baseline_model, device, column_gap_ratio, max_side=max_side,
+        column_workers=column_workers, memo=memo, seg_map=seg_map,
+    )
+    if independently_segmented is not None:
+        seg.lines = independently_segmented
+    else:
+        reordered_lines = None
+    if independently_segmented is None and not layout_parser_preprocessing.ENABLE_LAYOUTPARSER:
+        logger.info(
+            "enhanced_multi_column: LayoutParser is disabled by default "
+            "(set RITUS_ENABLE_LAYOUTPARSER=1 to opt in) - using geometric "
+            "fallback (multi_column_layout.py) on %d lines", len(seg.lines),
+        )
+    elif independently_segmented is None and not layout_parser_preprocessing.LAYOUTPARSER_AVAILABLE:
+        logger.info(
+            "enhanced_multi_column: layoutparser not importable in this "
+            "environment (import_error=%r) - using geometric fallback "
+            "(multi_column_layout.py) on %d lines",
+            layout_parser_preprocessing._import_error, len(seg.lines),
+        )
+    try:
+        if independently_segmented is not None:
+            raise RuntimeError("independent column segmentation already used")
+        with metrics.span("layout_reorder"):
+            reordered_lines = layout_parser_preprocessing.reorder_lines_using_layout_parser(
+                seg.lines, page.color
+            )
+    except RuntimeError:
+        reordered_lines = seg.lines
+    except Exception:
+        logger.exception("LayoutParser-based reordering raised unexpectedly")
+        reordered_lines = None
+
+    if reordered_lines is not None:
+        if independently_segmented is not None:
+            logger.info(
+                "enhanced_multi_column: used independent body-column segmentation "
+                "on %d lines", len(seg.lines),
+            )
+        else:
+            logger.info(
+                "enhanced_multi_column: used LayoutParser-based reordering "
+                "(layout_parser_preprocessing.py) on %d lines", len(seg.lines),
+            )
+        seg.lines = reordered_lines
+    else:
+        if layout_parser_preprocessing.ENABLE_LAYOUTPARSER and layout_parser_preprocessing.LAYOUTPARSER_AVAILABLE:
+            logger.info(
+                "enhanced_multi_column: LayoutParser returned no usable "
+                "result (model unavailable, or fewer than 2 regions "
+                "detected) - using geometric fallback (multi_column_layout.py) "
+                "on %d lines", len(seg.lines),
+            )
+        page_width, page_height = page.size
+        with metrics.span("layout_reorder"):
+            seg.lines = reorder_lines_for_multi_column(
+                seg.lines, page_width, page_height, column_gap_ratio=column_gap_ratio
+            )
+
+
+def _attach_records(line, records):
+    """Store a piece's recognised text and mean character confidence on the line itself."""
+    if records is None:
+        line.text, line.confidence = None, None
+        return
+    line.text = " ".join(text for text in (str(record).strip() for record in records) if text)
+    confidences = [float(c) for record in records for c in (getattr(record, 'confidences', None) or [])]
+    line.confidence = sum(confidences) / len(confidences) if confidences else None
+
+
+def _attach_recognition(split_units, unit_records):
+    for (_, line), records in zip(split_units, unit_records):
+        _attach_records(line, records)
+
+
+def _assemble_text(split_units, unit_records):
+    """Join recognised segments into text, wrapping red runs in <red>...</red>."""
+    transcribed_text = ""
+    previous_color = None  # Track color of previous non-whitespace record
+    buffered_text = []     # Buffer for accumulating text of the same color
+    pending_hyphen = None  # Word fragment left by a genuine line-wrap hyphen
+
+    # Process the recognised segments in reading order
+    for (i, split_line), records in zip(split_units, unit_records):
+        line_color = getattr(split_line, 'color', 'black')
+        if records is None:
+            logger.error(f"OCR failed for line {i + 1}, color {line_color}")
+            continue
+        try:
+            for record in records:
+                record_text = str(record).strip()
+                if pending_hyphen is not None:
+                    record_text = pending_hyphen + record_text
+                    pending_hyphen = None
+                # Skip if record is empty or contains only non-letter characters
+                if not record_text or not re.search(r'[a-zA-Z]', record_text):
+                    logger.debug(f"Skipping record for line {i + 1}, color {line_color}: '{record_text}' (empty or non-letter)")
+                    continue
+                if record_text.endswith(LINE_WRAP_HYPHEN):
+                    # A genuine end-of-line word-wrap - hold this fragment
+                    # back and glue it onto the next line's text instead
+                    # of emitting the print-layout hyphen mark.
+                    pending_hyphen = record_text[:-1]
+                    continue
+
+                current_color = line_color.upper()
+                if current_color == "RED":
+                    if previous_color == "RED":
+                        # Append to buffered text without closing/opening tags
+                        buffered_text.append(record_text)
+                    else:
+                        # Close previous red text if open, start new red text
+                        if buffered_text and previous_color == "RED":
+                            transcribed_text += " ".join(buffered_text) + "</red> "
+                            buffered_text = []
+                        elif buffered_text:
+                            transcribed_text += " ".join(buffered_text) + " "
+                            buffered_text = []
+                        buffered_text.append(record_text)
+                        if not transcribed_text.endswith("<red> "):
+                            transcribed_text += "<red> "
+                else:  # BLACK (default)
+                    if buffered_text and previous_color == "RED":
+                        # Close red text and append buffered text
+                        transcribed_text += " ".join(buffered_text) + "</red> "
+                        buffered_text = []
+                    elif buffered_text:
+                        # Append buffered black text
+                        transcribed_text += " ".join(buffered_text) + " "
+                        buffered_text = []
+                    buffered_text.append(record_text)
+
+                previous_color = current_color
+                logger.info(f"Detected text ({current_color}): '{record_text}'")
+        except Exception as e:
+            logger.error(f"OCR failed for line {i + 1}, color {line_color}: {str(e)}")
+
+    if pending_hyphen is not None:
+        # Nothing followed the last line-wrap hyphen (e.g. end of page) -
+        # emit the fragment rather than silently dropping it.
+        buffered_text.append(pending_hyphen)
+
+    # Append any remaining buffered text
+    if buffered_text:
+        if previous_color == "RED":
+            transcribed_text += " ".join(buffered_text) + "</red>"
+        else:
+            transcribed_text += " ".join(buffered_text)
+    return transcribed_text
+
+
+def _int_points(points):
+    return [[int(round(x)), int(round(y))] for x, y in points] if points else []
+
+
+def segmentation_digest(lines):
+    """Hash of the segmented lines' geometry.
+
+    Stored pieces refer to their source line by index (source_order); the
+    indices only mean the same lines when the page's digest is unchanged.
+    """
+    data = json.dumps([[_int_points(line.baseline), _int_points(line.boundary)] for line in lines])
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+def _stored_pieces(previous, digest):
+    """The previous run's pieces grouped by source line, or {} if they can't be reused."""
+    if not previous or previous.get("segmentation_digest") != digest:
+        return {}
+    pieces = {}
+    for piece in sorted(previous.get("lines") or [], key=lambda item: item["order"]):
+        if piece.get("source_order") is not None:
+            pieces.setdefault(piece["source_order"], []).append(piece)
+    return pieces
+
+
+def _same_geometry(line, piece):
+    return (_int_points(line.baseline) == _int_points(piece["baseline"])
+            and _int_points(line.boundary) == _int_points(piece["boundary"]))
+
+
+def _restore_piece(source_line, line_index, piece_index, piece):
+    """Rebuild a stored piece as a BaselineLine, like split_line_boundary_by_color() made it."""
+    line = replace(
+        source_line,
+        id=f"{line_index + 1}_{piece_index}",
+        baseline=[tuple(point) for point in piece["baseline"]],
+        boundary=[tuple(point) for point in piece["boundary"]],
+    )
+    line.color = piece.get("color") or "black"
+    return line
+
+
+def line_event(order, line, total):
+    """The "line" progress event of one recognised piece (see transcribe_page())."""
+    return {
+        "order": order,
+        "total": total,
+        "source_order": getattr(line, 'source_order', None),
+        "color": getattr(line, 'color', None) or 'black',
+        "text": getattr(line, 'text', None),
+        "confidence": getattr(line, 'confidence', None),
+        "baseline": _int_points(line.baseline),
+        "boundary": _int_points(line.boundary),
+    }
+
+
+def _image_width(page, image_path):
+    if page is not None:
+        return page.width
+    with PILImage.open(image_path) as image:  # Reads the header only
+        return image.width
+
+
+def transcribe_page(image_path, baseline_model, ocr_models, model_name, device, ignore_edges=False,
+                    red_threshold=5.0, enhanced_multi_column=False, column_gap_ratio=0.045, batch_size=1,
+                    segmentation_cache=None, page=None, segmentation_max_side=0, previous=None,
+                    column_workers=0, segmentation_maps=None, progress=None):
+    """Segment, colour-split and recognise one page image.
+
+    With previous - the stored result of an earlier run of the same page -
+    only the stages whose inputs changed are redone: lines are split again
+    only if red_threshold or the segmentation changed, and only pieces
+    without a stored recognition of the same geometry by the same model are
+    recognised. ignore_edges is always re-applied (it is just a filter).
+    The page image is decoded only if a stage actually needs its pixels.
+
+    Args:
+        image_path: Path of the page image.
+        baseline_model: Loaded blla segmentation model.
+        ocr_models: ModelRegistry the recognition model is acquired from.
+        model_name: Name of the recognition model in ocr_models.
+        device: Torch device for segmentation.
+        batch_size: Lines per recognition forward pass.
+        segmentation_cache: Optional SegmentationCache (segmentation_cache.py)
+            consulted before segmenting and reordering the page.
+        page: The PageImage of image_path, if it was already decoded;
+            otherwise image_path is decoded here when needed.
+        segmentation_max_side: If set, segment a copy of the page scaled
+            down to this longer side (see segment_image()).
+        previous: Optional dict with the "model", "red_threshold" and
+            "segmentation_digest" of an earlier run and its pieces under
+            "lines" (dicts with order, source_order, baseline, boundary,
+            color, text and confidence, as TranscriptionLine.to_dict()).
+        column_workers: Threads for segmenting the right-hand column crop
+            of enhanced_multi_column pages concurrently with the left one
+            (0 = one after the other).
+        segmentation_maps: Optional SegmentationMapCache
+            (segmentation_map.py) holding the network output of recently
+            segmented pages; a page found there is only re-vectorized.
+        progress: Optional callable(event, data) told about the page as it
+            goes: "segmentation" once the lines are known ({"line_count",
+            "lines": [{"source_order", "baseline", "boundary"}]}), then a
+            "line" (line_event()) for every piece once its text is known -
+            reused pieces right away, recognised ones as their batch
+            finishes, so not necessarily in reading order.
+
+    Returns:
+        (transcribed_text, lines, memo): the text with <red> tags, before any
+        autofix; the colour-split BaselineLine pieces in reading order, each
+        with its recognised text, mean character confidence (None if
+        recognition of the piece failed) and source_order; and a memo of
+        what was computed or reused per stage, which also carries the
+        page's segmentation_digest and, when the page was segmented here,
+        whether blla's network ran ("segmentation_map": "computed" or
+        "reused"); when enhanced_multi_column columns were looked at, what re-segmenting them did ("columns", see
+        segment_detected_columns_independently()); and, when lines were
+        colour-split, how many the red-ink prefilter let through black
+        ("color_prefilter": {"skipped", "analysed"}). Text and lines are
+        empty when no lines were detected.
+    """
+    memo = {
+        "segmentation": "cached",
+        "split": {"computed": 0, "reused": 0},
+        "recognition": {"computed": 0, "reused": 0},
+    }
+    pages = [page]
+
+    def get_page():
+        if pages[0] is None:
+            logger.info("Image processing...")
+            with metrics.span("decode"):
+                pages[0] = PageImage.open(image_path)
+        return pages[0]
+
+    def segment():
+        logger.info("Baseline segmentation...")
+        memo["segmentation"] = "computed"
+        memo["segmentation_map"] = "reused"
+        page = get_page()
+
+        def run_network():
+            memo["segmentation_map"] = "computed"
+            return compute_segmentation_map(page.gray, baseline_model, device, max_side=segmentation_max_side)
+
+        if segmentation_maps is not None:
+            seg_map = segmentation_maps.get(page.sha256, segmentation_max_side, run_network)
+        else:
+            seg_map = run_network()
+        with metrics.span("segment"):
+            seg = seg_map.vectorize('horizontal-tb')
+        if enhanced_multi_column:
+            _order_multi_column_lines(seg, page, baseline_model, device, column_gap_ratio,
+                                      max_side=segmentation_max_side, column_workers=column_workers, memo=memo,
+                                      seg_map=seg_map)
+        return seg
+
+    if segmentation_cache is not None:
+        seg = segmentation_cache.segment(
+            image_path, segment, 'horizontal-tb', enhanced_multi_column, column_gap_ratio,
+            image_sha256=pages[0].sha256 if pages[0] is not None else None, max_side=segmentation_max_side,
+        )
+    else:
+        seg = segment()
+
+    source_lines = list(seg.lines)
+    digest = memo["segmentation_digest"] = segmentation_digest(source_lines)
+    stored = _stored_pieces(previous, digest)
+    reuse_splits = bool(stored) and previous.get("red_threshold") == red_threshold
+    reuse_model = bool(stored) and previous.get("model") == model_name
+
+    # Filter lines based on width/edge proximity
+    kept = list(enumerate(source_lines))
+    if ignore_edges:
+        width = _image_width(pages[0], image_path)
+        kept = [(source, line) for source, line in kept if not should_ignore_line(line, width, ignore_edges)]
+    seg.lines = [line for _, line in kept]
+
+    if progress is not None:
+        progress("segmentation", {
+            "line_count": len(kept),
+            "lines": [{"source_order": source, "baseline": _int_points(line.baseline),
+                       "boundary": _int_points(line.boundary)} for source, line in kept],
+        })
+
+    new_lines = []
+    if not kept:
+        logger.info("No lines detected in image")
+        return "", [], memo
+
+    # Split every line by colour first and recognise all the pieces of the
+    # page afterwards, so recognition can run them through the model in
+    # mini-batches instead of one forward pass per piece.
+    split_units = []  # (index of the source line, split line), in reading order
+    color_context = None
+    for i, (source, line) in enumerate(kept):
+        logger.info(f"Processing line {i + 1}")
+        logger.info(f"Baseline: {line.baseline}")
+        logger.info(f"Boundary: {line.boundary}")
+
+        if reuse_splits and source in stored:
+            split_lines = [_restore_piece(line, i, k, piece) for k, piece in enumerate(stored[source])]
+            memo["split"]["reused"] += 1
+        else:
+            if color_context is None:
+                # Colour is analysed on a redness map computed once for the
+                # lines that need splitting.
+                color_context = ColorAnalysisContext.for_lines(
+                    get_page(), [l for s, l in kept if not (reuse_splits and s in stored)]
+                )
+            # Split line by color and get new line segments
+            page = get_page()
+            try:
+                with metrics.span("color_split"):
+                    split_lines = split_line_boundary_by_color(
+                        page, line, i, window_size=80, red_threshold=red_threshold,
+                        color_context=color_context,
+                    )
+            except Exception as e:
+                logger.error(f"Failed to split line {i+1}: {e}")
+                split_lines = [line]
+            memo["split"]["computed"] += 1
+
+        for split_line in split_lines:
+            split_line.source_order = source
+        split_units.extend((i, split_line) for split_line in split_lines)
+        new_lines.extend(split_lines)
+    if color_context is not None and color_context.lines_prefiltered + color_context.lines_analysed:
+        memo["color_prefilter"] = {
+            "skipped": color_context.lines_prefiltered,
+            "analysed": color_context.lines_analysed,
+        }
+
+    # Reuse the stored recognition of every piece the same model already read
+    unit_records = [None] * len(split_units)
+    pending = []
+    for n, (_, split_line) in enumerate(split_units):
+        match = None
+        if reuse_model:
+            match = next(
+                (piece for piece in stored.get(split_line.source_order, ())
+                 if piece.get("text") is not None and _same_geometry(split_line, piece)),
+                None,
+            )
+        if match is not None:
+            unit_records[n] = [match["text"]]
+            split_line.text, split_line.confidence = match["text"], match.get("confidence")
+        else:
+            pending.append(n)
+    memo["recognition"]["reused"] = len(split_units) - len(pending)
+    memo["recognition"]["computed"] = len(pending)
+    if progress is not None:
+        waiting = set(pending)
+        for n, (_, split_line) in enumerate(split_units):
+            if n not in waiting:
+                progress("line", line_event(n, split_line, len(split_units)))
+
+    if pending:
+        logger.info(f"Recognition of {len(pending)} of {len(split_units)} line segments...")
+        pending_units = [split_units[n] for n in pending]
+        on_line = None
+        if progress is not None:
+            def on_line(index, records):
+                split_line = pending_units[index][1]
+                _attach_records(split_line, records)
+                progress("line", line_event(pending[index], split_line, len(split_units)))
+        gray = get_page().gray
+        with ocr_models.acquire(model_name) as ocr_model, metrics.span("recognition"):
+            pending_records = recognize_page_lines(
+                ocr_model, gray, seg, [split_line for _, split_line in pending_units],
+                batch_size=batch_size, on_line=on_line,
+            )
+        _attach_recognition(pending_units, pending_records)
+        for n, records in zip(pending, pending_records):
+            unit_records[n] = records
+
+    transcribed_text = _assemble_text(split_units, unit_records)
+    logger.info(f"Total transcribed text: '{transcribed_text}'")
+    logger.info(f"Transcription stages: {memo}")
+    return transcribed_text, new_lines, memo
@@ -0,0 +1,78 @@
+"""
+progress_writer.py
+
+Coalesces the progress updates of a background job into few database writes.
+
+Batch analysis used to commit after every token just to move its progress
+bar, and batch transcription opened an app context and committed after
+every page. On a large project that is hundreds of thousands of fsync'd
+SQLite transactions, and they compete with the web requests for the
+database lock. A job now reports through a ProgressWriter:
+
+    progress = ProgressWriter(write_row, interval_seconds=0.5)
+    for i, token in enumerate(tokens):
+        ...
+        progress.update(progress=10 + 5 * (i + 1) / len(tokens))   # kept in memory
+    progress.state(status="completed", progress=100)               # written at once
+
+update() keeps the latest value of each field and calls write(values) once
+interval_seconds have passed since the last write. state() is for what must
+not wait: status changes, errors and resume points; it writes the pending
+updates along with its own values. There is no timer thread - a job that
+stops reporting must flush() - so write() runs in the thread of the job,
+with its database session.
+"""
+
+import threading
+import time
+
+# Default of progress_flush_ms in domain_config.json
+DEFAULT_INTERVAL_SECONDS = 0.5
+
+
+class ProgressWriter:
+    """In-memory progress of one job, written at most every interval_seconds.
+
+    Args:
+        write: callable(values) storing a dict of field -> value, e.g. on
+            the job's progress row, and committing.
+        interval_seconds: Least time between two writes of update()s.
+    """
+
+    def __init__(self, write, interval_seconds=DEFAULT_INTERVAL_SECONDS):
+        self._write = write
+        self.interval_seconds = max(0.0, float(interval_seconds))
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._last_write = None
+        self.updates = 0
+        self.writes = 0
+
+    def update(self, **values):
+        """Record progress; written now only if the last write is interval_seconds old."""
+        with self._lock:
+            self._pending.update(values)
+            self.updates += 1
+            now = time.monotonic()
+            if self._last_write is not None and now - self._last_write < self.interval_seconds:
+                return
+            self._flush(now)
+
+    def state(self, **values):
+        """Record and write at once, with any pending progress."""
+        with self._lock:
+            self._pending.update(values)
+            self.updates += 1
+            self._flush(time.monotonic())
+
+    def flush(self):
+        """Write the pending progress, if any."""
+        with self._lock:
+            if self._pending:
+                self._flush(time.monotonic())
+
+    def _flush(self, now):
+        values, self._pending = self._pending, {}
+        self._last_write = now
+        self.writes += 1
+        self._write(values)
@@ -0,0 +1,213 @@
+"""
+ritus_worker.py
+
+A transcription worker for other machines, run without the Flask app:
+
+    python -m ritus_worker --db "sqlite:////srv/ritus/instance/projects.db?timeout=20" \
+        --models models --uploads-root /srv/ritus
+
+With remote_transcription_workers set in domain_config.json, batch
+transcriptions put their pages in the PageTask table (page_tasks.py) instead
+of recognising them in the server. Each worker claims one page at a time
+under a lease, renews the lease while it recognises the page, and writes the
+text, the line pieces and the stage memo back to the task; the server saves
+them and moves the batch on. A worker that dies loses its lease and its page
+goes to another worker.
+
+The page images are read from --uploads-root, the directory the server runs
+in (images are stored as "uploads/project_<id>/..."), e.g. a network mount.
+Pages not found there are downloaded from --server-url, the main server's
+/uploads/ route. Each worker loads its own blla and recognition models from
+--models, as the OCR worker processes of ocr_workers.py do.
+
+Workers on one machine are just more processes; any number can share the
+database. Stop one with SIGTERM or Ctrl-C: it finishes its current page.
+"""
+
+import argparse
+import logging
+import os
+import signal
+import socket
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import quote
+
+import requests
+from sqlalchemy import create_engine
+
+import metrics
+import page_tasks
+
+logger = logging.getLogger("ritus_worker")
+
+DEFAULT_POLL_SECONDS = 2.0
+DOWNLOAD_TIMEOUT_SECONDS = 120
+
+
+class PageWorker:
+    """Claims PageTasks from the shared database and transcribes them one by one.
+
+    Args:
+        engine: SQLAlchemy Engine of the server's database.
+        transcribe: callable(image_path, model_name, options, previous)
+            returning transcribe_page()'s (text, lines, memo).
+        name: Shown in the task rows and page_tasks.stats().
+        lease_seconds: How long a claim holds without renewal; renewed at a
+            third of it while a page runs.
+        poll_seconds: Wait between claims while there is nothing to do.
+        uploads_root: Directory the tasks' image paths are relative to.
+        server_url: Main server to download images from when they are not
+            under uploads_root.
+    """
+
+    def __init__(self, engine, transcribe, name=None, lease_seconds=page_tasks.DEFAULT_LEASE_SECONDS,
+                 poll_seconds=DEFAULT_POLL_SECONDS, uploads_root=".", server_url=None):
+        self.engine = engine
+        self.transcribe = transcribe
+        self.name = name or f"{socket.gethostname()}-{os.getpid()}"
+        self.lease_seconds = lease_seconds
+        self.poll_seconds = poll_seconds
+        self.uploads_root = uploads_root
+        self.server_url = server_url.rstrip("/") if server_url else None
+        self.pages_done = 0
+
+    def run(self, stop_event=None, exit_when_idle=False):
+        """Work until stop_event is set (or, with exit_when_idle, until no task is left); returns pages done."""
+        stop_event = stop_event or threading.Event()
+        logger.info(f"Worker {self.name} started")
+        while not stop_event.is_set():
+            if self.run_one():
+                continue
+            if exit_when_idle:
+                break
+            stop_event.wait(self.poll_seconds)
+        logger.info(f"Worker {self.name} stopped after {self.pages_done} pages")
+        return self.pages_done
+
+    def run_one(self):
+        """Claim and transcribe one task; False if there was none."""
+        task = page_tasks.claim_task(self.engine, self.name, self.lease_seconds)
+        if task is None:
+            return False
+        logger.info(f"Page {task.image_id} of project {task.project_id}, attempt {task.attempt}/{task.max_attempts}")
+        lost = threading.Event()
+        finished = threading.Event()
+        heartbeat = threading.Thread(target=self._keep_lease, args=(task, lost, finished), daemon=True)
+        heartbeat.start()
+        try:
+            start = time.perf_counter()
+            with metrics.collect_timings() as timings, self._local_image(task) as image_path:
+                text, lines, memo = self.transcribe(image_path, task.model_name, task.options, task.previous)
+        except Exception as e:
+            logger.exception(f"Transcription of page {task.image_id} failed")
+            finished.set()
+            heartbeat.join()
+            page_tasks.fail_task(self.engine, task, str(e))
+            return True
+        finished.set()
+        heartbeat.join()
+        result = {
+            "text": text,
+            "lines": [page_tasks.line_dict(line) for line in lines],
+            "memo": memo,
+            "timings": timings,
+        }
+        if lost.is_set() or not page_tasks.complete_task(self.engine, task, result):
+            logger.warning(f"Dropped page {task.image_id}: its task was cancelled or taken over")
+        else:
+            self.pages_done += 1
+            logger.info(f"Page {task.image_id} done in {time.perf_counter() - start:.1f}s")
+        return True
+
+    def _keep_lease(self, task, lost, finished):
+        while not finished.wait(self.lease_seconds / 3):
+            if not page_tasks.renew_lease(self.engine, task, self.lease_seconds):
+                lost.set()
+                return
+
+    @contextmanager
+    def _local_image(self, task):
+        """Path of the task's image on this machine, downloading it if needed."""
+        path = task.image_path if os.path.isabs(task.image_path) else os.path.join(self.uploads_root, task.image_path)
+        if os.path.exists(path) or not self.server_url:
+            yield path
+            return
+        suffix = os.path.splitext(task.image_path)[1]
+        with metrics.span("download"), requests.get(
+            f"{self.server_url}/{quote(task.image_path)}", stream=True, timeout=DOWNLOAD_TIMEOUT_SECONDS
+        ) as response:
+            response.raise_for_status()
+            with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as f:
+                for chunk in response.iter_content(1 << 20):
+                    f.write(chunk)
+        try:
+            yield f.name
+        finally:
+            os.unlink(f.name)
+
+
+def kraken_transcriber(models_dir, device, model_cache_size=2, preload_models=(), segmentation_cache_dir=None,
+                       segmentation_map_cache_size=0):
+    """Load blla and the recognition models of models_dir; returns a PageWorker transcribe callable."""
+    from ocr_workers import _init_worker, _transcribe_in_worker
+
+    model_paths = {
+        name: os.path.join(models_dir, name) for name in os.listdir(models_dir) if name.endswith(".mlmodel")
+    }
+    baseline_model_path = model_paths.get("blla.mlmodel")
+    _init_worker(model_paths, baseline_model_path, device, model_cache_size, None, list(preload_models),
+                 segmentation_cache_dir, segmentation_map_cache_size)
+
+    def transcribe(image_path, model_name, options, previous):
+        if model_name not in model_paths:
+            raise ValueError(f"Model not found on this worker: {model_name}")
+        result, timings = _transcribe_in_worker(image_path, model_name, dict(options, previous=previous))
+        metrics.record_timings(timings)
+        return result
+
+    return transcribe
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Transcribe batch pages queued by the Ritus server")
+    parser.add_argument("--db", default=os.environ.get("RITUS_DATABASE_URL"),
+                        help="SQLAlchemy URL of the server's database (default: $RITUS_DATABASE_URL)")
+    parser.add_argument("--models", default="models", help="Directory with blla.mlmodel and the recognition models")
+    parser.add_argument("--uploads-root", default=".", help="Directory the server's uploads/ folder is in")
+    parser.add_argument("--server-url", help="Main server to download page images from when not under --uploads-root")
+    parser.add_argument("--device", help="Torch device (default: cuda:0 if available, else cpu)")
+    parser.add_argument("--name", help="Worker name shown in the task table (default: host-pid)")
+    parser.add_argument("--lease-seconds", type=float, default=page_tasks.DEFAULT_LEASE_SECONDS)
+    parser.add_argument("--poll-seconds", type=float, default=DEFAULT_POLL_SECONDS)
+    parser.add_argument("--model-cache-size", type=int, default=2)
+    parser.add_argument("--preload", action="append", default=[], help="Recognition model to load at start-up")
+    parser.add_argument("--segmentation-cache-dir", help="Directory of a SegmentationCache, e.g. shared with the server")
+    parser.add_argument("--segmentation-map-cache-size", type=int, default=4)
+    parser.add_argument("--exit-when-idle", action="store_true", help="Stop once no task is left")
+    args = parser.parse_args(argv)
+    if not args.db:
+        parser.error("--db or RITUS_DATABASE_URL is required")
+
+    if args.device is None:
+        import torch
+        args.device = "cuda:0" if torch.cuda.is_available() else "cpu"
+    transcribe = kraken_transcriber(
+        args.models, args.device, model_cache_size=args.model_cache_size, preload_models=args.preload,
+        segmentation_cache_dir=args.segmentation_cache_dir,
+        segmentation_map_cache_size=args.segmentation_map_cache_size,
+    )
+    worker = PageWorker(
+        create_engine(args.db), transcribe, name=args.name, lease_seconds=args.lease_seconds,
+        poll_seconds=args.poll_seconds, uploads_root=args.uploads_root, server_url=args.server_url,
+    )
+    stop_event = threading.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda signum, frame: stop_event.set())
+    worker.run(stop_event, exit_when_idle=args.exit_when_idle)
+
+
+if __name__ == "__main__":
+    main()
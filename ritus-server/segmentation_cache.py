@@ -0,0 +1,168 @@
+"""
+segmentation_cache.py
+
+Persistent cache of blla baseline segmentations.
+
+Segmentation does not depend on the recognition model, but re-transcribing
+a project with another model (``override`` / ``range`` mode) used to run
+``blla.segment`` on every page again - roughly half the time of a
+re-transcription. ``SegmentationCache`` stores each page's segmentation on
+disk, keyed by everything the segmentation does depend on:
+
+    (SHA-256 of the image file, fingerprint of blla.mlmodel, text_direction,
+     enhanced_multi_column, column_gap_ratio, segmentation max side)
+
+column_gap_ratio is only used with enhanced_multi_column on, so without it
+the ratio is left out of the key.
+
+Changing the image, swapping the baseline model file or changing the layout
+options therefore always misses. Entries are plain JSON files, one per key
+under ``<directory>/<first two hex digits>/``, written atomically so the web
+process and the inference worker processes (ocr_workers.py) can share one
+directory. Deleting the directory just empties the cache.
+"""
+
+import dataclasses
+import hashlib
+import json
+import logging
+import os
+import tempfile
+
+from kraken.containers import BaselineLine, Region, Segmentation
+
+logger = logging.getLogger(__name__)
+
+# Bump when the stored format changes; old entries then simply miss.
+CACHE_FORMAT = 1
+
+_fingerprints = {}  # (path, size, mtime) -> sha256
+
+
+def file_sha256(path, chunk_size=1 << 20):
+    """Hex SHA-256 of a file's contents."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def model_fingerprint(path):
+    """SHA-256 of a model file, hashed once per (size, mtime) of the file."""
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime)
+    if key not in _fingerprints:
+        _fingerprints[key] = file_sha256(path)
+    return _fingerprints[key]
+
+
+def _points(points):
+    return [(int(x), int(y)) for x, y in points] if points is not None else None
+
+
+def _to_json(value):
+    # Coordinates can come back from blla as numpy integers
+    if hasattr(value, "item"):
+        return value.item()
+    raise TypeError(f"Cannot store {type(value).__name__} in the segmentation cache")
+
+
+def serialize_segmentation(seg):
+    return {"format": CACHE_FORMAT, "segmentation": dataclasses.asdict(seg)}
+
+
+def deserialize_segmentation(data, imagename):
+    if data.get("format") != CACHE_FORMAT:
+        raise ValueError(f"unsupported cache format {data.get('format')!r}")
+    fields = dict(data["segmentation"])
+    fields["imagename"] = imagename
+    fields["lines"] = [
+        BaselineLine(**dict(line, baseline=_points(line["baseline"]), boundary=_points(line["boundary"])))
+        for line in fields.get("lines") or []
+    ]
+    fields["regions"] = {
+        region_type: [Region(**dict(region, boundary=_points(region["boundary"]))) for region in regions]
+        for region_type, regions in (fields.get("regions") or {}).items()
+    }
+    return Segmentation(**fields)
+
+
+class SegmentationCache:
+    """On-disk segmentation cache for one baseline model.
+
+    Args:
+        directory: Where entries are stored (created on first write).
+        model_fingerprint: Fingerprint of the baseline model (see
+            model_fingerprint()); part of every key.
+    """
+
+    def __init__(self, directory, model_fingerprint):
+        self.directory = directory
+        self.model_fingerprint = model_fingerprint
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, image_sha256, text_direction, enhanced_multi_column, column_gap_ratio, max_side=0):
+        parts = [image_sha256, self.model_fingerprint, text_direction, bool(enhanced_multi_column),
+                 round(float(column_gap_ratio), 6) if enhanced_multi_column else None]
+        if max_side:
+            # Only downscaled segmentations get the extra part, so entries
+            # written before it existed stay valid.
+            parts.append(int(max_side))
+        parts = json.dumps(parts)
+        return hashlib.sha256(parts.encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key + ".json")
+
+    def get(self, key, imagename):
+        """The cached Segmentation for key, or None. Unreadable entries count as misses."""
+        try:
+            with open(self._path(key), "r", encoding="utf-8") as f:
+                seg = deserialize_segmentation(json.load(f), imagename)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable segmentation cache entry {key}: {e}")
+            self.misses += 1
+            return None
+        self.hits += 1
+        return seg
+
+    def put(self, key, seg):
+        """Store seg under key. Failures are logged, never raised."""
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            try:
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    json.dump(serialize_segmentation(seg), f, default=_to_json)
+                os.replace(tmp_path, path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+        except Exception as e:
+            logger.warning(f"Could not write segmentation cache entry {key}: {e}")
+
+    def segment(self, image_path, segment, text_direction, enhanced_multi_column=False, column_gap_ratio=0.045,
+                image_sha256=None, max_side=0):
+        """Return the cached segmentation of image_path, or run segment() and cache it.
+
+        segment is a no-argument callable doing the actual (and, with
+        enhanced_multi_column, reordered) segmentation. image_sha256 saves
+        re-reading the file when the caller already hashed it; max_side is
+        the downscaling cap segment() applies, if any.
+        """
+        if image_sha256 is None:
+            image_sha256 = file_sha256(image_path)
+        key = self.key(image_sha256, text_direction, enhanced_multi_column, column_gap_ratio, max_side)
+        seg = self.get(key, image_path)
+        if seg is not None:
+            logger.info(f"Segmentation cache hit for {image_path} ({len(seg.lines)} lines)")
+            return seg
+        seg = segment()
+        self.put(key, seg)
+        return seg
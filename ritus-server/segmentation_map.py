@@ -0,0 +1,254 @@
+"""
+segmentation_map.py
+
+blla segmentation split into its two halves: the neural network pass that
+produces the heatmaps, and the vectorization of those heatmaps into
+baselines, line polygons and regions.
+
+``blla.segment`` always does both, so every full-page pass, both column
+crops of ``segment_detected_columns_independently`` and every change of
+``column_gap_ratio`` or ``enhanced_multi_column`` (which miss the
+SegmentationCache) ran the network again - on CPU the most expensive step
+of the whole transcription. Here the network runs once per page:
+
+    seg_map = compute_segmentation_map(page.gray, baseline_model, device)
+    seg = seg_map.vectorize()                       # the whole page
+    left = seg_map.crop((0, 0, gutter, h)).vectorize()   # a column
+
+A ``SegmentationMap`` is kept in page coordinates, so a crop only slices
+the heatmaps; its lines come out in the crop's coordinates, as if blla had
+segmented ``page.crop_gray(box)``. blla scales its input to a fixed height,
+so a full-height column crop would have been segmented at the same scale;
+only the context the network sees at the crop edges differs.
+
+``SegmentationMapCache`` keeps the maps of the last few pages in memory, so
+re-running a page with other layout options only re-vectorizes. Heatmaps
+are float32 and several tens of MB per page, which is why they are not
+written to the on-disk SegmentationCache.
+"""
+
+import logging
+import os
+import threading
+import uuid
+from collections import OrderedDict
+
+import numpy as np
+import shapely.geometry as geom
+from PIL import Image as PILImage
+
+from kraken import blla
+from kraken.containers import BaselineLine, Segmentation
+from kraken.lib import vgsl
+from kraken.lib.exceptions import KrakenInvalidModelException
+from kraken.lib.segmentation import is_in_region, neural_reading_order, polygonal_reading_order, scale_regions
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Heatmaps of this many pages are kept when nothing else is configured (see
+# "segmentation_map_cache_size" in domain_config.json).
+DEFAULT_CAPACITY = 4
+
+
+class SegmentationMap:
+    """blla's network output for an image, ready to be vectorized.
+
+    Args:
+        heatmap: The network's output, one plane per class (C x H x W).
+        scal_im: The grayscale network input the heatmap was computed on.
+        scale: (x, y) factors from heatmap pixels to image pixels.
+        size: (width, height) of the image.
+        model: The blla model, for its class mapping and options.
+        offset: (x, y) image position of the heatmap's first pixel; a
+            fraction of a heatmap pixel, non-zero only for crops.
+    """
+
+    def __init__(self, heatmap, scal_im, scale, size, model, offset=(0.0, 0.0)):
+        self.heatmap = heatmap
+        self.scal_im = scal_im
+        self.scale = np.asarray(scale, dtype=float)
+        self.size = tuple(size)
+        self.model = model
+        self.offset = tuple(offset)
+
+    @property
+    def nbytes(self):
+        return self.heatmap.nbytes + self.scal_im.nbytes
+
+    def crop(self, box):
+        """The map of the (left, upper, right, lower) box of the image, in the box's coordinates."""
+        width, height = self.size
+        x0, y0 = max(0, int(box[0])), max(0, int(box[1]))
+        x1, y1 = min(width, int(box[2])), min(height, int(box[3]))
+        sx, sy = self.scale
+        # Heatmap pixels covering the box; the first one may start a
+        # fraction of a pixel before it.
+        hx0, hy0 = int((x0 - self.offset[0]) // sx), int((y0 - self.offset[1]) // sy)
+        hx1, hy1 = int(np.ceil((x1 - self.offset[0]) / sx)), int(np.ceil((y1 - self.offset[1]) / sy))
+        hx0, hy0 = max(0, hx0), max(0, hy0)
+        return SegmentationMap(
+            np.ascontiguousarray(self.heatmap[:, hy0:hy1, hx0:hx1]),
+            np.ascontiguousarray(self.scal_im[hy0:hy1, hx0:hx1]),
+            self.scale,
+            (x1 - x0, y1 - y0),
+            self.model,
+            offset=(self.offset[0] + hx0 * sx - x0, self.offset[1] + hy0 * sy - y0),
+        )
+
+    def _to_image(self, points):
+        """Shift vectorized points by the crop offset and clip them to the image."""
+        if not points:
+            return points
+        width, height = self.size
+        ox, oy = self.offset
+        return [
+            (min(width - 1, max(0, int(round(x + ox)))), min(height - 1, max(0, int(round(y + oy)))))
+            for x, y in points
+        ]
+
+    def vectorize(self, text_direction='horizontal-tb', raise_on_error=False):
+        """Baselines, line polygons and regions of the map, as blla.segment() returns them."""
+        net = self.model
+        rets = {
+            'heatmap': self.heatmap,
+            'cls_map': net.user_metadata['class_mapping'],
+            'bounding_regions': net.user_metadata.get('bounding_regions'),
+            'scale': self.scale,
+            'scal_im': self.scal_im,
+        }
+        # What blla.segment() does after compute_segmentation_map() for a
+        # single model
+        regions = blla.vec_regions(**rets)
+        line_regs = []
+        suppl_obj = []
+        for cls, regs in regions.items():
+            line_regs.extend(regs)
+            if rets['bounding_regions'] is not None and cls in rets['bounding_regions']:
+                suppl_obj.extend(regs)
+        suppl_obj = scale_regions([x.boundary for x in suppl_obj], 1 / self.scale)
+        line_regs = scale_regions([x.boundary for x in line_regs], 1 / self.scale)
+
+        lines = blla.vec_lines(
+            **rets,
+            regions=line_regs,
+            text_direction=text_direction,
+            suppl_obj=suppl_obj,
+            topline=net.user_metadata.get('topline', False),
+            raise_on_error=raise_on_error,
+        )
+        order = None
+        if 'ro_model' in net.aux_layers:
+            order = neural_reading_order(
+                lines=lines, regions=regions, text_direction=text_direction[-2:],
+                model=net.aux_layers['ro_model'], im_size=self.size,
+                class_mapping=net.user_metadata['ro_class_mapping'],
+            )
+
+        shapes = {reg.id: geom.Polygon(reg.boundary) for regs in regions.values() for reg in regs}
+        basic_order = polygonal_reading_order(lines=lines, regions=shapes.values(), text_direction=text_direction[-2:])
+        baseline_lines = []
+        for line in (lines[idx] for idx in basic_order):
+            line_string = geom.LineString(line['baseline'])
+            baseline_lines.append(BaselineLine(
+                id=f'_{uuid.uuid4()}',
+                baseline=self._to_image(line['baseline']),
+                boundary=self._to_image(line['boundary']),
+                tags=line['tags'],
+                regions=[reg_id for reg_id, shape in shapes.items() if is_in_region(line_string, shape)],
+            ))
+        for regs in regions.values():
+            for region in regs:
+                region.boundary = self._to_image(region.boundary)
+
+        return Segmentation(
+            text_direction=text_direction,
+            imagename=None,
+            type='baselines',
+            lines=baseline_lines,
+            regions=regions,
+            script_detection=len(rets['cls_map']['baselines']) > 1,
+            line_orders=[order] if order is not None else [],
+        )
+
+
+def _default_model():
+    logger.info('No segmentation model given. Loading default model.')
+    return vgsl.TorchVGSLModel.load_model(os.path.join(os.path.dirname(blla.__file__), 'blla.mlmodel'))
+
+
+def compute_segmentation_map(image, baseline_model, device, max_side=0):
+    """Run blla's network on a grayscale PIL image.
+
+    With max_side set and the image's longer side above it, the network
+    runs on a copy scaled down to max_side; the map's scale still maps to
+    image's own pixels, so lines come out in full-resolution coordinates.
+    """
+    model = baseline_model if baseline_model is not None else _default_model()
+    if model.model_type != 'segmentation':
+        raise KrakenInvalidModelException(f'Invalid model type {model.model_type} for {model}')
+    if 'class_mapping' not in model.user_metadata:
+        raise KrakenInvalidModelException(f'Segmentation model {model} does not contain valid class mapping')
+
+    width, height = image.size
+    small = image
+    if max_side and max(width, height) > max_side:
+        factor = max_side / float(max(width, height))
+        small = image.resize((max(1, int(round(width * factor))), max(1, int(round(height * factor)))),
+                             PILImage.BOX)
+        logger.info(f"Segmenting at {small.width}x{small.height} (max side {max_side}) instead of {width}x{height}")
+
+    with metrics.span("segment_network"):
+        rets = blla.compute_segmentation_map(small, None, model, device)
+    # Per-axis factors of the rounded size take the scale back to image
+    scale = rets['scale'] * (width / float(small.width), height / float(small.height))
+    return SegmentationMap(rets['heatmap'], rets['scal_im'], scale, (width, height), model)
+
+
+class SegmentationMapCache:
+    """Thread-safe LRU of the SegmentationMaps of recently segmented pages.
+
+    Keys are (SHA-256 of the image, max side); one cache serves one blla
+    model. Pages of unknown hash are not cached.
+    """
+
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        self.capacity = max(0, int(capacity))
+        self._maps = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, image_sha256, max_side, compute):
+        """The cached map of the page, or compute() it (a no-argument callable) and cache it."""
+        if image_sha256 is None or not self.capacity:
+            return compute()
+        key = (image_sha256, int(max_side or 0))
+        with self._lock:
+            seg_map = self._maps.get(key)
+            if seg_map is not None:
+                self._maps.move_to_end(key)
+                self.hits += 1
+                logger.info("Reusing the segmentation heatmaps of this page")
+                return seg_map
+            self.misses += 1
+        # Computed outside the lock; two threads on the same new page both
+        # run the network, which is rare and harmless.
+        seg_map = compute()
+        with self._lock:
+            self._maps[key] = seg_map
+            self._maps.move_to_end(key)
+            while len(self._maps) > self.capacity:
+                self._maps.popitem(last=False)
+        return seg_map
+
+    def stats(self):
+        with self._lock:
+            return {
+                "pages": len(self._maps),
+                "capacity": self.capacity,
+                "bytes": sum(seg_map.nbytes for seg_map in self._maps.values()),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
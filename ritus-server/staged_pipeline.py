@@ -0,0 +1,181 @@
+"""
+staged_pipeline.py
+
+A small thread-based pipeline: items flow through a fixed list of stages,
+each with its own worker threads, connected by bounded queues.
+
+``run_batch_transcribe`` used to submit whole-page jobs that each decoded
+the image, segmented, split colours, recognised and committed to SQLite one
+after another, so the model stages sat idle while a page was read from disk
+or written to the database. With a ``StagedPipeline`` the I/O-bound stages
+(reading and decoding upcoming pages, persisting results) run in their own
+threads next to the compute stage, and the bounded queues keep only a few
+decoded pages in memory at a time.
+
+Each stage reports its occupancy (``stats()``): how many of its workers are
+busy, how full its input queue is, and the share of its workers' time spent
+working. The stage with the fullest input queue / highest utilisation is the
+bottleneck; a stage whose input queue is always empty is over-provisioned.
+
+    pipeline = StagedPipeline([
+        Stage("prefetch", load_page, workers=2),
+        Stage("ocr", recognise_page, workers=4),
+        Stage("persist", save_page, workers=1),
+    ])
+    pipeline.run(image_ids, stop_event=stop_event)
+
+A stage function takes one item and returns the item for the next stage;
+returning None drops it. Exceptions are logged, counted as failures and
+passed to ``on_error`` so callers can still account for the item.
+"""
+
+import logging
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+_DONE = object()  # End-of-input marker, one per worker of the receiving stage
+
+
+class Stage:
+    """One step of a StagedPipeline.
+
+    Args:
+        name: Shown in logs and stats().
+        func: Called with each item; returns the next stage's item or None.
+        workers: Number of threads running func.
+        queue_size: Capacity of the stage's input queue (default: 2 per worker).
+    """
+
+    def __init__(self, name, func, workers=1, queue_size=None):
+        self.name = name
+        self.func = func
+        self.workers = max(1, int(workers))
+        self.queue = queue.Queue(maxsize=queue_size or 2 * self.workers)
+        self._lock = threading.Lock()
+        self.busy = 0
+        self.processed = 0
+        self.failed = 0
+        self.busy_seconds = 0.0
+
+    def _begin(self):
+        with self._lock:
+            self.busy += 1
+        return time.perf_counter()
+
+    def _end(self, start, failed):
+        with self._lock:
+            self.busy -= 1
+            self.busy_seconds += time.perf_counter() - start
+            if failed:
+                self.failed += 1
+            else:
+                self.processed += 1
+
+    def stats(self, elapsed):
+        with self._lock:
+            capacity = self.workers * elapsed
+            return {
+                "workers": self.workers,
+                "busy": self.busy,
+                "queued": self.queue.qsize(),
+                "queue_capacity": self.queue.maxsize,
+                "processed": self.processed,
+                "failed": self.failed,
+                "busy_seconds": round(self.busy_seconds, 2),
+                "utilization": round(self.busy_seconds / capacity, 3) if capacity > 0 else 0.0,
+            }
+
+
+class StagedPipeline:
+    """Runs items through stages in order, each stage in its own threads.
+
+    Args:
+        stages: Stage objects, in processing order.
+        on_error: Optional callback(stage_name, item, exception) for items a
+            stage function raised on.
+    """
+
+    def __init__(self, stages, on_error=None):
+        if not stages:
+            raise ValueError("A pipeline needs at least one stage")
+        self.stages = list(stages)
+        self.on_error = on_error
+        self._started = None
+        self._finished = None
+
+    def run(self, items, stop_event=None):
+        """Feed items through all stages and wait until every stage is done.
+
+        Once stop_event is set no new items are fed and items still queued
+        are dropped without being processed.
+        """
+        self._started = time.perf_counter()
+        self._finished = None
+        threads = []
+        for index, stage in enumerate(self.stages):
+            next_stage = self.stages[index + 1] if index + 1 < len(self.stages) else None
+            remaining = [stage.workers]
+            remaining_lock = threading.Lock()
+            for n in range(stage.workers):
+                thread = threading.Thread(
+                    target=self._work,
+                    args=(stage, next_stage, stop_event, remaining, remaining_lock),
+                    name=f"pipeline-{stage.name}-{n}",
+                    daemon=True,
+                )
+                thread.start()
+                threads.append(thread)
+
+        first = self.stages[0]
+        try:
+            for item in items:
+                if stop_event is not None and stop_event.is_set():
+                    break
+                first.queue.put(item)
+        finally:
+            for _ in range(first.workers):
+                first.queue.put(_DONE)
+            for thread in threads:
+                thread.join()
+            self._finished = time.perf_counter()
+
+    def _work(self, stage, next_stage, stop_event, remaining, remaining_lock):
+        while True:
+            item = stage.queue.get()
+            if item is _DONE:
+                break
+            if stop_event is not None and stop_event.is_set():
+                continue
+            start = stage._begin()
+            try:
+                result = stage.func(item)
+            except Exception as e:
+                stage._end(start, failed=True)
+                logger.exception(f"Pipeline stage {stage.name} failed")
+                if self.on_error is not None:
+                    self.on_error(stage.name, item, e)
+                continue
+            stage._end(start, failed=False)
+            if next_stage is not None and result is not None:
+                next_stage.queue.put(result)
+        # The last worker of a stage to finish tells the next stage's workers
+        with remaining_lock:
+            remaining[0] -= 1
+            last = remaining[0] == 0
+        if last and next_stage is not None:
+            for _ in range(next_stage.workers):
+                next_stage.queue.put(_DONE)
+
+    def stats(self):
+        """Per-stage occupancy, keyed by stage name (see Stage.stats)."""
+        if self._started is None:
+            elapsed = 0.0
+        else:
+            elapsed = (self._finished or time.perf_counter()) - self._started
+        return {
+            "elapsed_seconds": round(elapsed, 2),
+            "stages": {stage.name: stage.stats(elapsed) for stage in self.stages},
+        }
@@ -0,0 +1,162 @@
+"""
+bench_color_context_memory.py
+
+Manual benchmark (NOT a pytest test - it builds a full-size scan and takes a
+while). Compares time and peak RSS of colour-splitting every line of a large
+page three ways:
+
+  before    what split_line_boundary_by_color() did before the page redness
+            map: every line masks its crop gray outside the polygon, converts
+            all of it to float64 HSL, runs CLAHE on it and scores its columns.
+  per-line  split_line_boundary_by_color() without a color_context, so every
+            line builds the redness map of just the bands it covers
+            (overlapping boundaries are converted several times).
+  page      one ColorAnalysisContext for the whole page, shared by all lines
+            (what transcribe_image_by_id does).
+
+Each mode runs in a fresh subprocess so the peak RSS of one does not hide the
+other; "split RSS MB" is how much the peak grew while splitting, on top of
+the loaded page. The page is a tiled copy of tests/test_img.png with red rubrics painted
+in, 6000x8000 by default, cut into overlapping full-width lines.
+
+Usage:
+
+    cd ritus-server
+    python3 tests/bench_color_context_memory.py
+    python3 tests/bench_color_context_memory.py --width 3000 --height 4000
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TESTS_DIR))
+
+
+def build_page(width, height):
+    import numpy as np
+    from PIL import Image as PILImage
+
+    tile = np.array(PILImage.open(os.path.join(TESTS_DIR, "test_img.png")).convert("RGB"))
+    reps_y = -(-height // tile.shape[0])
+    reps_x = -(-width // tile.shape[1])
+    page = np.tile(tile, (reps_y, reps_x, 1))[:height, :width].copy()
+    # Paint dark pixels of every fourth 300px block red, like rubrics
+    dark = page.sum(axis=2) < 300
+    for x in range(0, width, 1200):
+        block = dark[:, x:x + 300]
+        page[:, x:x + 300][block] = (170, 20, 20)
+    return PILImage.fromarray(page)
+
+
+def page_lines(image, strip_height=90, step=60):
+    from kraken.containers import BaselineLine
+
+    lines = []
+    for i, top in enumerate(range(0, image.height - strip_height, step)):
+        left, right = 5, image.width - 5
+        bottom = top + strip_height
+        lines.append(BaselineLine(
+            id=str(i),
+            baseline=[(left, bottom - 8), (right, bottom - 4)],
+            boundary=[(left, top + 3), (right, top), (right, bottom), (left, bottom - 3)],
+        ))
+    return lines
+
+
+def split_before(image, line, i, window_size=80, red_threshold=5.0):
+    """The per-line float64 analysis that the page redness map replaced."""
+    import cv2
+    import numpy as np
+    from image_processing import (_split_line_at_regions, column_redness_scores, find_color_regions,
+                                  rgb_to_hsl)
+
+    x_coords, y_coords = zip(*line.boundary)
+    left, top = max(0, min(x_coords) - 10), max(0, min(y_coords) - 10)
+    right, bottom = min(image.width, max(x_coords) + 10), min(image.height, max(y_coords) + 10)
+    color_array = np.array(image.crop((left, top, right, bottom)))
+    height, width = color_array.shape[:2]
+    mask = np.zeros((height, width), dtype=np.uint8)
+    cv2.fillPoly(mask, [np.array([(x - left, y - top) for x, y in line.boundary], dtype=np.int32)], 255)
+    color_array[mask == 0] = (128, 128, 128)
+
+    hsl = rgb_to_hsl(color_array)
+    l_scaled = (hsl[:, :, 2] * 255).astype(np.uint8)
+    l_enhanced = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8)).apply(l_scaled).astype(float) / 255.0
+    # One block as wide as the crop: the scoring was not blocked then
+    scores, _ = column_redness_scores(hsl[:, :, 0], hsl[:, :, 1], l_enhanced, block_width=width)
+    window = min(window_size, width)
+    denoised = np.convolve(scores, np.ones(window) / window, mode="same")
+    regions = find_color_regions(denoised, red_threshold)
+    return _split_line_at_regions(image, line, i, regions, left, top, width, height)
+
+
+def run_mode(mode, page_path):
+    from PIL import Image as PILImage
+    from image_processing import ColorAnalysisContext, split_line_boundary_by_color
+
+    image = PILImage.open(page_path)
+    image.load()
+    lines = page_lines(image)
+    baseline_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    start = time.perf_counter()
+    context = ColorAnalysisContext.for_lines(image, lines) if mode == "page" else None
+    pieces = 0
+    for i, line in enumerate(lines):
+        if mode == "before":
+            pieces += len(split_before(image, line, i))
+        else:
+            pieces += len(split_line_boundary_by_color(image, line, i, red_threshold=5.0, color_context=context))
+    elapsed = time.perf_counter() - start
+
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {
+        "mode": mode,
+        "lines": len(lines),
+        "pieces": pieces,
+        "seconds": round(elapsed, 2),
+        # ru_maxrss is in KiB on Linux
+        "peak_rss_mb": round(peak_rss / 1024, 1),
+        "split_rss_mb": round((peak_rss - baseline_rss) / 1024, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--width", type=int, default=6000)
+    parser.add_argument("--height", type=int, default=8000)
+    parser.add_argument("--mode", choices=["before", "per-line", "page"], help=argparse.SUPPRESS)
+    parser.add_argument("--page", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        print(json.dumps(run_mode(args.mode, args.page)))
+        return
+
+    # Build the page once and hand it to the children as a file, so building
+    # it does not count towards their peak RSS.
+    with tempfile.TemporaryDirectory() as tmp:
+        page_path = os.path.join(tmp, "page.png")
+        build_page(args.width, args.height).save(page_path)
+
+        print(f"Page {args.width}x{args.height}")
+        print(f"{'mode':<10} {'lines':>6} {'pieces':>7} {'seconds':>8} {'peak RSS MB':>12} {'split RSS MB':>13}")
+        for mode in ("before", "per-line", "page"):
+            output = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--mode", mode, "--page", page_path],
+                check=True, capture_output=True, text=True,
+            ).stdout
+            r = json.loads(output.strip().splitlines()[-1])
+            print(f"{r['mode']:<10} {r['lines']:>6} {r['pieces']:>7} {r['seconds']:>8} "
+                  f"{r['peak_rss_mb']:>12} {r['split_rss_mb']:>13}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""Compare two pipeline benchmark reports (run_bench.py output).
+
+    python3 tests/pipeline_benchmark/compare.py results.json baseline.json [--tolerance 0.1]
+
+Prints the median time of every stage in both reports and the change, and
+exits with status 1 if any stage - or the whole page - got slower than the
+tolerance allows. Stages under MIN_MS in both reports are shown but never
+count as regressions; at that size the difference is noise.
+"""
+
+import argparse
+import json
+import sys
+
+# Medians below this (in both reports) are too small to judge
+MIN_MS = 1.0
+
+
+def compare(report, baseline, tolerance=0.10):
+    """Rows of (stage, baseline ms, new ms, relative change, regressed) and whether anything regressed."""
+    rows = []
+    for stage in list(baseline["stages"]) + [s for s in report["stages"] if s not in baseline["stages"]]:
+        old = baseline["stages"].get(stage, {}).get("median_ms")
+        new = report["stages"].get(stage, {}).get("median_ms")
+        change = None
+        regressed = False
+        if old and new is not None:
+            change = (new - old) / old
+            regressed = change > tolerance and max(old, new) >= MIN_MS
+        rows.append((stage, old, new, change, regressed))
+
+    old_rate, new_rate = baseline.get("pages_per_second"), report.get("pages_per_second")
+    if old_rate and new_rate:
+        rows.append(("pages/sec", old_rate, new_rate, (new_rate - old_rate) / old_rate, False))
+    old_rss, new_rss = baseline.get("peak_rss_mb"), report.get("peak_rss_mb")
+    if old_rss and new_rss:
+        rows.append(("peak RSS MB", old_rss, new_rss, (new_rss - old_rss) / old_rss, False))
+    return rows, any(row[4] for row in rows)
+
+
+def print_comparison(rows, file=sys.stdout):
+    print(f"{'stage':<16} {'baseline':>12} {'new':>12} {'change':>9}", file=file)
+    for stage, old, new, change, regressed in rows:
+        old_text = f"{old:.2f}" if old is not None else "-"
+        new_text = f"{new:.2f}" if new is not None else "-"
+        change_text = f"{change:+.1%}" if change is not None else "-"
+        print(f"{stage:<16} {old_text:>12} {new_text:>12} {change_text:>9}{'  SLOWER' if regressed else ''}",
+              file=file)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("report")
+    parser.add_argument("baseline")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="Allowed slowdown per stage (0.10 = 10%%)")
+    args = parser.parse_args()
+
+    with open(args.report) as f:
+        report = json.load(f)
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    for key in ("segmenter", "recognizer", "device"):
+        if report["environment"].get(key) != baseline["environment"].get(key):
+            print(f"Warning: {key} differs ({baseline['environment'].get(key)} -> "
+                  f"{report['environment'].get(key)}); the numbers are not comparable", file=sys.stderr)
+    rows, regressed = compare(report, baseline, args.tolerance)
+    print_comparison(rows)
+    sys.exit(1 if regressed else 0)
+
+
+if __name__ == "__main__":
+    main()
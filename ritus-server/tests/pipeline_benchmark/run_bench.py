@@ -0,0 +1,323 @@
+"""Benchmark the OCR pipeline of transcribe_image_by_id on the bundled pages.
+
+Runs decode -> segmentation -> colour split -> recognition -> find/replace
+autofix -> saving the lines to SQLite for every page, several times, and
+writes per-stage latency, pages/sec, peak RSS and (with --allocations)
+allocation counts as JSON. Stage times come from the spans in metrics.py,
+so they are the same stages /api/metrics reports.
+
+The bundled PNGs are RGBA, which the colour split skips, so by default each
+page is converted to an RGB copy first - the mode of the IIIF JPEG scans the
+server mostly sees. --as-is runs the files unchanged.
+
+Real kraken models are used when they are present (blla from models/ or the
+one shipped with kraken, the recognition model from --model or the first
+other *.mlmodel in models/); otherwise the deterministic stubs in stubs.py
+stand in. --stub forces the stubs for both.
+
+    cd ritus-server
+    python3 tests/pipeline_benchmark/run_bench.py --output results.json
+    python3 tests/pipeline_benchmark/run_bench.py --baseline baseline.json
+
+With --baseline the run is compared against an earlier results file (see
+compare.py) and the exit status is 1 if a stage got slower than the
+tolerance allows.
+"""
+
+import argparse
+import glob
+import importlib.metadata
+import json
+import os
+import platform
+import resource
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+TESTS_DIR = os.path.dirname(HERE)
+SERVER_DIR = os.path.dirname(TESTS_DIR)
+sys.path.insert(0, SERVER_DIR)
+sys.path.insert(0, HERE)
+
+import metrics
+import page_transcription
+from batch_recognition import DEFAULT_BATCH_SIZE
+from compare import compare, print_comparison
+from transcription_autofix import apply_autofix
+
+# Stages in pipeline order, for the report
+STAGES = ("decode", "segment_network", "segment", "column_segment", "layout_reorder", "color_split", "recognition",
+          "autofix", "db_commit")
+
+
+def stage_order(stage):
+    return (STAGES.index(stage) if stage in STAGES else len(STAGES), stage)
+
+
+def default_pages():
+    pages = sorted(glob.glob(os.path.join(TESTS_DIR, "test_img*.png")))
+    real = os.path.join(TESTS_DIR, "rest_real.png")
+    if os.path.exists(real):
+        pages.append(real)
+    return pages
+
+
+def find_baseline_model():
+    path = os.path.join(SERVER_DIR, "models", "blla.mlmodel")
+    if os.path.exists(path):
+        return path
+    try:
+        import kraken
+    except ImportError:
+        return None
+    path = os.path.join(os.path.dirname(kraken.__file__), "blla.mlmodel")
+    return path if os.path.exists(path) else None
+
+
+def find_recognition_model(explicit):
+    if explicit:
+        return explicit
+    for path in sorted(glob.glob(os.path.join(SERVER_DIR, "models", "*.mlmodel"))):
+        if os.path.basename(path) != "blla.mlmodel":
+            return path
+    return None
+
+
+def setup_pipeline(args):
+    """Returns (baseline_model, ocr_models, model_name, description), patching in stubs where needed."""
+    from stubs import StubRegistry, stub_recognize, stub_segmentation_map
+
+    baseline_path = None if args.stub else find_baseline_model()
+    model_path = None if args.stub else find_recognition_model(args.model)
+
+    baseline_model = None
+    if baseline_path:
+        baseline_model = page_transcription.load_baseline_model(baseline_path, args.device)
+    else:
+        page_transcription.compute_segmentation_map = stub_segmentation_map
+
+    if model_path:
+        from kraken.lib.models import load_any
+        from model_registry import ModelRegistry
+        ocr_models = ModelRegistry(lambda name: load_any(model_path, device=args.device), capacity=1)
+        model_name = os.path.basename(model_path)
+    else:
+        page_transcription.recognize_page_lines = stub_recognize
+        ocr_models = StubRegistry()
+        model_name = "stub"
+
+    return baseline_model, ocr_models, model_name, {
+        "segmenter": os.path.basename(baseline_path) if baseline_path else "stub",
+        "recognizer": model_name,
+    }
+
+
+def setup_database():
+    """An in-memory SQLite database with the server's tables, or None without Flask-SQLAlchemy."""
+    try:
+        from flask import Flask
+        from models import db, Image, Project, User
+    except ImportError:
+        return None
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite://"
+    db.init_app(app)
+    context = app.app_context()
+    context.push()
+    db.create_all()
+    user = User(username="bench", password_hash="x")
+    project = Project(name="bench", owner=user)
+    db.session.add_all([user, project])
+    db.session.commit()
+    return project
+
+
+def save_lines(project, page_path, text, lines, model_name):
+    from models import db, Image, TranscriptionLine
+    image = Image.query.filter_by(project_id=project.id, original=page_path).first()
+    if image is None:
+        image = Image(project_id=project.id, name=os.path.basename(page_path), original=page_path)
+        db.session.add(image)
+        db.session.flush()
+    image.transcribed_text = text.strip()
+    TranscriptionLine.replace_for_image(image.id, lines, model_name)
+    db.session.commit()
+
+
+def run_page(path, pipeline, project, args):
+    baseline_model, ocr_models, model_name = pipeline
+    with metrics.collect_timings() as timings:
+        start = time.perf_counter()
+        text, lines, _ = page_transcription.transcribe_page(
+            path, baseline_model, ocr_models, model_name, args.device,
+            red_threshold=args.red_threshold, enhanced_multi_column=args.enhanced_multi_column,
+            batch_size=args.batch_size,
+        )
+        with metrics.span("autofix"):
+            text = apply_autofix(text)
+        if project is not None:
+            with metrics.span("db_commit"):
+                save_lines(project, path, text, lines, model_name)
+        total = time.perf_counter() - start
+    return dict(timings, total=total), len(lines)
+
+
+def rgb_copies(pages, directory):
+    """RGB PNG copies of pages that are in another mode; RGB pages are used as they are."""
+    from PIL import Image as PILImage
+
+    result = []
+    for path in pages:
+        with PILImage.open(path) as image:
+            if image.mode == "RGB":
+                result.append(path)
+                continue
+            copy = os.path.join(directory, os.path.basename(path))
+            image.convert("RGB").save(copy)
+        result.append(copy)
+    return result
+
+
+def count_allocations(path, pipeline, project, args):
+    """Peak traced bytes and blocks still allocated after one more run of the page.
+
+    tracemalloc sees Python and numpy allocations but not torch's.
+    """
+    tracemalloc.start()
+    try:
+        run_page(path, pipeline, project, args)
+        _, peak = tracemalloc.get_traced_memory()
+        blocks = sum(stat.count for stat in tracemalloc.take_snapshot().statistics("filename"))
+    finally:
+        tracemalloc.stop()
+    return {"peak_traced_mb": round(peak / 2 ** 20, 2), "blocks_after_run": blocks}
+
+
+def peak_rss_mb():
+    # ru_maxrss is in KiB on Linux and in bytes on macOS
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(maxrss / (2 ** 20 if sys.platform == "darwin" else 2 ** 10), 1)
+
+
+def environment(args, pipeline_description):
+    info = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "device": args.device,
+        "repeat": args.repeat,
+        "batch_size": args.batch_size,
+        "rgb_pages": not args.as_is,
+    }
+    info.update(pipeline_description)
+    for package in ("kraken", "torch", "numpy", "opencv-python-headless", "Pillow"):
+        try:
+            info[package] = importlib.metadata.version(package)
+        except importlib.metadata.PackageNotFoundError:
+            info[package] = None
+    try:
+        import torch
+        info["torch_threads"] = torch.get_num_threads()
+    except ImportError:
+        pass
+    return info
+
+
+def summarise(samples):
+    ordered = sorted(samples)
+    return {
+        "median_ms": round(statistics.median(ordered) * 1000, 2),
+        "min_ms": round(ordered[0] * 1000, 2),
+        "max_ms": round(ordered[-1] * 1000, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("pages", nargs="*", help="Page images (default: tests/test_img*.png and rest_real.png)")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per page, after one warm-up run")
+    parser.add_argument("--stub", action="store_true", help="Use the stub segmenter and recognizer")
+    parser.add_argument("--model", default=None, help="Recognition model (default: first non-blla model in models/)")
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--threads", type=int, default=None, help="torch.set_num_threads() before running")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--red-threshold", type=float, default=5.0)
+    parser.add_argument("--enhanced-multi-column", action="store_true")
+    parser.add_argument("--as-is", action="store_true", help="Don't convert the pages to RGB first")
+    parser.add_argument("--allocations", action="store_true",
+                        help="One extra tracemalloc run per page (kept out of the timings)")
+    parser.add_argument("--output", default=None, help="Write the JSON report here (default: stdout)")
+    parser.add_argument("--baseline", default=None, help="Earlier report to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="Allowed slowdown per stage (0.10 = 10%%)")
+    args = parser.parse_args()
+
+    if args.threads:
+        import torch
+        torch.set_num_threads(args.threads)
+
+    pages = args.pages or default_pages()
+    scratch = tempfile.mkdtemp(prefix="pipeline-bench-")
+    if not args.as_is:
+        pages = rgb_copies(pages, scratch)
+    baseline_model, ocr_models, model_name, description = setup_pipeline(args)
+    pipeline = (baseline_model, ocr_models, model_name)
+    project = setup_database()
+
+    report_pages = []
+    stage_samples = {}
+    timed_seconds = 0.0
+    for path in pages:
+        run_page(path, pipeline, project, args)  # warm-up: model load, caches, first allocations
+        runs = []
+        for _ in range(args.repeat):
+            timings, pieces = run_page(path, pipeline, project, args)
+            runs.append(timings)
+            timed_seconds += timings["total"]
+            for stage, seconds in timings.items():
+                stage_samples.setdefault(stage, []).append(seconds)
+        entry = {
+            "page": os.path.basename(path),
+            "line_pieces": pieces,
+            "stages": {stage: summarise([run.get(stage, 0.0) for run in runs])
+                       for stage in sorted(set().union(*runs), key=stage_order)},
+        }
+        if args.allocations:
+            entry["allocations"] = count_allocations(path, pipeline, project, args)
+        report_pages.append(entry)
+        print(f"{entry['page']}: {entry['stages']['total']['median_ms']:.0f} ms/page", file=sys.stderr)
+
+    shutil.rmtree(scratch, ignore_errors=True)
+    page_runs = len(pages) * args.repeat
+    report = {
+        "environment": environment(args, description),
+        "pages": report_pages,
+        # Per-stage summaries over every timed run of every page
+        "stages": {stage: summarise(samples) for stage, samples in sorted(stage_samples.items(),
+                                                                          key=lambda item: stage_order(item[0]))},
+        "pages_per_second": round(page_runs / timed_seconds, 3) if timed_seconds else None,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        rows, regressed = compare(report, baseline, args.tolerance)
+        print_comparison(rows, file=sys.stderr)
+        sys.exit(1 if regressed else 0)
+
+
+if __name__ == "__main__":
+    main()
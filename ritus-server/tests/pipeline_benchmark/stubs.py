@@ -0,0 +1,105 @@
+"""Deterministic stand-ins for blla and the recognition model.
+
+They let the benchmark run the rest of the pipeline (decode, colour split,
+autofix, persistence) on a machine without the kraken models, and make runs
+comparable across machines: the same page always gives the same lines and
+the same text. The work they do scales with the page/line size, so the
+stages around them still see realistic inputs.
+"""
+
+import contextlib
+import hashlib
+
+import numpy as np
+
+from kraken.containers import BaselineLine, Segmentation
+
+# A page row counts as text when at least this share of its pixels is dark
+_INK_SHARE = 0.02
+_DARK = 128
+_WORDS = ("dominus", "vobiscum", "oremus", "deus", "qui", "per", "omnia", "saecula", "amen", "gloria")
+
+
+def stub_segment(image, baseline_model=None, device=None, text_direction="horizontal-tb", max_side=0):
+    """Lines from the horizontal ink profile of a grayscale PIL image.
+
+    Same signature as page_transcription.segment_image().
+    """
+    gray = np.asarray(image)
+    dark = gray < _DARK
+    rows = dark.mean(axis=1) >= _INK_SHARE
+    lines = []
+    top = None
+    for y, is_text in enumerate(list(rows) + [False]):
+        if is_text and top is None:
+            top = y
+        elif not is_text and top is not None:
+            if y - top >= 4:
+                columns = np.flatnonzero(dark[top:y].any(axis=0))
+                x0, x1 = int(columns[0]), int(columns[-1])
+                baseline_y = top + int(round((y - top) * 0.8))
+                lines.append(BaselineLine(
+                    id=f"stub-{len(lines)}",
+                    baseline=[(x0, baseline_y), (x1, baseline_y)],
+                    boundary=[(x0, top), (x1, top), (x1, y - 1), (x0, y - 1)],
+                    tags={"type": "default"},
+                ))
+            top = None
+    return Segmentation(
+        type="baselines", imagename="", text_direction=text_direction, script_detection=False,
+        lines=lines, regions={}, line_orders=[],
+    )
+
+
+class StubSegmentationMap:
+    """SegmentationMap stand-in; vectorizing runs stub_segment() on the (cropped) image."""
+
+    def __init__(self, image):
+        self.image = image
+
+    def crop(self, box):
+        return StubSegmentationMap(self.image.crop(box))
+
+    def vectorize(self, text_direction="horizontal-tb"):
+        return stub_segment(self.image, text_direction=text_direction)
+
+
+def stub_segmentation_map(image, baseline_model=None, device=None, max_side=0):
+    """Replaces page_transcription.compute_segmentation_map()."""
+    return StubSegmentationMap(image)
+
+
+class StubRecord:
+    """Just enough of kraken's ocr_record for page_transcription."""
+
+    def __init__(self, prediction, confidences):
+        self.prediction = prediction
+        self.confidences = confidences
+
+    def __str__(self):
+        return self.prediction
+
+
+def stub_recognize(network, image, seg, lines, batch_size=1, on_line=None):
+    """Pseudo-text derived from each line's pixels; replaces recognize_page_lines()."""
+    gray = np.asarray(image)
+    results = []
+    for index, line in enumerate(lines):
+        # Colour-split pieces can have float coordinates
+        xs, ys = zip(*((int(x), int(y)) for x, y in line.boundary))
+        crop = gray[max(0, min(ys)):max(ys) + 1, max(0, min(xs)):max(xs) + 1]
+        digest = hashlib.sha256(crop.tobytes()).digest()
+        words = [_WORDS[b % len(_WORDS)] for b in digest[:max(1, crop.shape[1] // 120)]]
+        text = " ".join(words)
+        results.append([StubRecord(text, [0.5 + (b % 50) / 100.0 for b in digest[:len(text)]])])
+        if on_line is not None:
+            on_line(index, results[-1])
+    return results
+
+
+class StubRegistry:
+    """ModelRegistry stand-in handing out a placeholder model."""
+
+    @contextlib.contextmanager
+    def acquire(self, name):
+        yield name
@@ -0,0 +1,158 @@
+"""
+segmentation_scale_report.py
+
+Manual accuracy/speed report for downscaled segmentation (NOT a pytest test -
+it needs the blla model, takes minutes, and its numbers depend on the
+machine). Use it to pick ``segmentation_max_side`` in domain_config.json.
+
+For every sample page it segments the full-resolution image once and then a
+copy capped at each max side (page_transcription.segment_image), and reports
+per cap:
+
+  - segmentation time and speed-up over full resolution,
+  - line counts, and the share of full-resolution lines that have a line
+    at the cap whose boundary overlaps it with IoU >= 0.5,
+  - with --model, the similarity (difflib ratio) of the transcribed text at
+    the cap to the full-resolution text.
+
+A cap is safe when the matched share stays near 100% and the text
+similarity near 1.0 on representative pages.
+
+Usage
+-----
+    cd ritus-server
+    python3 tests/segmentation_scale_report.py page1.png page2.png \\
+        --caps 1200 1800 2400 3200 --model models/some_model.mlmodel
+
+Without page arguments the test_img*.png pages in this directory (and
+rest_real.png, if present) are used. --baseline-model defaults to
+models/blla.mlmodel, falling back to the model shipped with kraken.
+"""
+
+import argparse
+import difflib
+import glob
+import os
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SERVER_DIR = os.path.dirname(HERE)
+sys.path.insert(0, SERVER_DIR)
+
+from shapely.geometry import Polygon
+
+from kraken.lib.models import load_any
+
+from model_registry import ModelRegistry
+from page_image import PageImage
+from page_transcription import load_baseline_model, segment_image, transcribe_page
+
+DEFAULT_CAPS = (1200, 1800, 2400, 3200)
+
+
+def default_pages():
+    pages = sorted(glob.glob(os.path.join(HERE, "test_img*.png")))
+    real = os.path.join(HERE, "rest_real.png")
+    if os.path.exists(real):
+        pages.append(real)
+    return pages
+
+
+def default_baseline_model():
+    path = os.path.join(SERVER_DIR, "models", "blla.mlmodel")
+    if os.path.exists(path):
+        return path
+    import kraken
+    return os.path.join(os.path.dirname(kraken.__file__), "blla.mlmodel")
+
+
+def _polygon(line):
+    try:
+        polygon = Polygon(line.boundary).buffer(0)
+    except Exception:
+        return None
+    return polygon if not polygon.is_empty else None
+
+
+def matched_share(reference_lines, lines, min_iou=0.5):
+    """Share of reference_lines that some line in lines overlaps with IoU >= min_iou."""
+    if not reference_lines:
+        return 1.0
+    candidates = [p for p in (_polygon(line) for line in lines) if p is not None]
+    matched = 0
+    for line in reference_lines:
+        reference = _polygon(line)
+        if reference is None:
+            continue
+        for candidate in candidates:
+            if not reference.intersects(candidate):
+                continue
+            union = reference.union(candidate).area
+            if union and reference.intersection(candidate).area / union >= min_iou:
+                matched += 1
+                break
+    return matched / float(len(reference_lines))
+
+
+def timed_segmentation(page, baseline_model, device, max_side):
+    start = time.perf_counter()
+    seg = segment_image(page.gray, baseline_model, device, "horizontal-tb", max_side=max_side)
+    return seg, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("pages", nargs="*", help="Page images (default: the test_img*.png samples)")
+    parser.add_argument("--caps", nargs="+", type=int, default=list(DEFAULT_CAPS), help="Max sides to compare")
+    parser.add_argument("--baseline-model", default=None, help="blla model (default: models/blla.mlmodel)")
+    parser.add_argument("--model", default=None, help="Recognition model; enables the text similarity column")
+    parser.add_argument("--device", default="cpu")
+    args = parser.parse_args()
+
+    pages = args.pages or default_pages()
+    baseline_model = load_baseline_model(args.baseline_model or default_baseline_model(), args.device)
+    ocr_models = None
+    if args.model:
+        ocr_models = ModelRegistry(lambda name: load_any(args.model, device=args.device), capacity=1)
+
+    totals = {cap: {"seconds": 0.0, "full_seconds": 0.0, "matched": [], "similarity": []} for cap in args.caps}
+    for path in pages:
+        page = PageImage.open(path)
+        print(f"\n{os.path.basename(path)} ({page.width}x{page.height})")
+        full_seg, full_seconds = timed_segmentation(page, baseline_model, args.device, 0)
+        full_text = None
+        if ocr_models is not None:
+            full_text, _, _ = transcribe_page(path, baseline_model, ocr_models, "model", args.device, page=page)
+        print(f"  {'full':>6}: {len(full_seg.lines):4d} lines  {full_seconds:6.2f}s")
+
+        for cap in args.caps:
+            seg, seconds = timed_segmentation(page, baseline_model, args.device, cap)
+            share = matched_share(full_seg.lines, seg.lines)
+            totals[cap]["seconds"] += seconds
+            totals[cap]["full_seconds"] += full_seconds
+            totals[cap]["matched"].append(share)
+            report = f"  {cap:>6}: {len(seg.lines):4d} lines  {seconds:6.2f}s  matched {share:6.1%}"
+            if full_text is not None:
+                text, _, _ = transcribe_page(
+                    path, baseline_model, ocr_models, "model", args.device, page=page, segmentation_max_side=cap,
+                )
+                similarity = difflib.SequenceMatcher(None, full_text, text).ratio()
+                totals[cap]["similarity"].append(similarity)
+                report += f"  text similarity {similarity:.3f}"
+            print(report)
+
+    print("\nSummary over", len(pages), "page(s)")
+    for cap in args.caps:
+        total = totals[cap]
+        speedup = total["full_seconds"] / total["seconds"] if total["seconds"] else float("nan")
+        matched = sum(total["matched"]) / len(total["matched"]) if total["matched"] else float("nan")
+        line = f"  {cap:>6}: speed-up x{speedup:4.2f}  mean matched {matched:6.1%}"
+        if total["similarity"]:
+            line += f"  mean text similarity {sum(total['similarity']) / len(total['similarity']):.3f}"
+            line += f"  worst {min(total['similarity']):.3f}"
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Tests for the fuzzy word matching of batch_analysis.py: best_matches() finds
+what process.extractOne() finds word by word, and annotate_text_tokens() /
+refine_text_tokens() give repeated words and merged pairs the same results.
+
+Skipped when Flask-SQLAlchemy isn't installed. Run with:
+
+    python3 -m pytest tests/test_batch_analysis.py
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+pytest.importorskip("flask_sqlalchemy")
+
+from rapidfuzz import fuzz, process
+
+import batch_analysis
+from batch_analysis import annotate_text_tokens, best_matches, build_phrases_concordance, refine_text_tokens
+
+PHRASES = {
+    1: "Per omnia saecula saeculorum",
+    2: "Dominus vobiscum et cum spiritu tuo",
+    3: "Oremus Gratias agamus Domino Deo nostro",
+    4: "Benedicamus Domino Deo gratias",
+}
+TEXT = "Per omnia secula seculorum Dominus vobiscum et cum spiritu tvo Ore mus gratias agamus Domino xyz et Dominus"
+
+
+def tokens(text):
+    return [{"page_name": "p1", "original_word": word, "content_data": {}} for word in text.split()]
+
+
+def test_best_matches_agree_with_extract_one(monkeypatch):
+    _, by_word = build_phrases_concordance(PHRASES)
+    choices = list(by_word)
+    words = TEXT.split() + ["", "Domini", "saeculorum"]
+    monkeypatch.setattr(batch_analysis, "CDIST_CHUNK_CELLS", 2 * len(choices))  # Two words per cdist call
+    done = []
+
+    matches = best_matches(words, choices, 75, workers=2, on_chunk=lambda n, total: done.append((n, total)))
+
+    for word in words:
+        expected = process.extractOne(word, choices, scorer=fuzz.ratio, score_cutoff=75)
+        assert matches.get(word) == (expected[:2] if expected else None)
+    distinct = len(set(words))
+    assert done[-1] == (distinct, distinct) and len(done) == (distinct + 1) // 2
+
+
+def test_repeated_words_get_the_same_annotation():
+    _, by_word = build_phrases_concordance(PHRASES)
+    annotated = annotate_text_tokens(tokens(TEXT), by_word, 75)
+
+    dominus = [token for token in annotated if token["original_word"] == "Dominus"]
+    assert len(dominus) == 2
+    assert {token["corcordance_id"] for token in dominus} == {by_word["Dominus"]["id"]}
+    assert all(token["corcordance_similarity"] == 100 for token in dominus)
+    assert next(token for token in annotated if token["original_word"] == "xyz")["corcordance_id"] is None
+
+
+def test_split_word_is_merged():
+    _, by_word = build_phrases_concordance(PHRASES)
+    refined = refine_text_tokens(annotate_text_tokens(tokens(TEXT), by_word, 75), by_word, 75)
+
+    words = [token["original_word"] for token in refined]
+    assert "Oremus" in words and "Ore" not in words
+    oremus = refined[words.index("Oremus")]
+    assert (oremus["corcordance_id"], oremus["corcordance_similarity"]) == (by_word["Oremus"]["id"], 100)
+    assert [token["word_number"] for token in refined] == [str(n) for n in range(1, len(refined) + 1)]
@@ -0,0 +1,131 @@
+"""
+Tests for batch_recognition.py: batched recognition must produce exactly
+the text kraken's own one-line-at-a-time `rpred` produces.
+
+Unlike the other tests in this directory these need torch and kraken, so
+they are skipped when those aren't installed. No model file is needed: a
+small randomly-initialised recognition network is built from a VGSL spec,
+which is enough to compare the two code paths output-for-output. Run with:
+
+    python3 -m pytest tests/test_batch_recognition.py
+"""
+
+import os
+import random
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("kraken")
+
+from PIL import Image, ImageDraw
+
+from kraken import rpred
+from kraken.containers import BaselineLine, Segmentation
+from kraken.lib import vgsl
+from kraken.lib.codec import PytorchCodec
+from kraken.lib.models import TorchSeqRecognizer
+
+from batch_recognition import recognize_lines
+
+
+def make_network():
+    torch.manual_seed(0)
+    chars = "abcdefghijklmnopqrstuvwxyz ¬"
+    nn = vgsl.TorchVGSLModel(
+        f"[1,48,0,1 Cr3,3,32 Mp2,2 Cr3,3,64 Mp2,2 S1(1x12)1,3 Lbx100 Do O1c{len(chars) + 1}]"
+    )
+    nn.add_codec(PytorchCodec(chars))
+    nn.init_weights()
+    nn.eval()
+    return TorchSeqRecognizer(nn, device="cpu")
+
+
+def make_page(widths):
+    """A white page with one line of random dark 'glyphs' per entry in widths."""
+    rng = random.Random(1)
+    image = Image.new("L", (max(widths) + 60, 60 * len(widths) + 20), 255)
+    draw = ImageDraw.Draw(image)
+    lines = []
+    for i, width in enumerate(widths):
+        top = 20 + 60 * i
+        x = 30
+        while x < 30 + width - 12:
+            w = rng.randint(4, 12)
+            draw.rectangle((x, top + rng.randint(5, 15), x + w, top + 35), fill=rng.randint(0, 80))
+            x += w + rng.randint(3, 10)
+        lines.append(BaselineLine(
+            id=f"l{i}",
+            baseline=[(30, top + 35), (30 + width, top + 35)],
+            boundary=[(30, top), (30 + width, top), (30 + width, top + 45), (30, top + 45)],
+        ))
+    return image, lines
+
+
+@pytest.mark.parametrize("batch_size", [1, 3, 16])
+def test_batched_text_matches_rpred(batch_size):
+    network = make_network()
+    image, lines = make_page([400, 90, 250, 600, 40, 310, 120])
+    seg = Segmentation(type="baselines", imagename="page", text_direction="horizontal-lr",
+                       script_detection=False, lines=list(lines))
+
+    expected = []
+    for line in lines:
+        seg.lines = [line]
+        expected.extend(str(record) for record in rpred.rpred(network, image, seg))
+
+    records = recognize_lines(network, image, seg, lines, batch_size=batch_size)
+
+    assert [str(record) for record in records] == expected
+
+
+def test_results_keep_input_order_and_line_identity():
+    network = make_network()
+    image, lines = make_page([500, 60, 300])
+    seg = Segmentation(type="baselines", imagename="page", text_direction="horizontal-lr",
+                       script_detection=False, lines=list(lines))
+
+    records = recognize_lines(network, image, seg, lines, batch_size=8)
+
+    assert [record.id for record in records] == ["l0", "l1", "l2"]
+
+
+def test_blank_line_gives_empty_record():
+    network = make_network()
+    image, lines = make_page([300])
+    blank = BaselineLine(
+        id="blank",
+        baseline=[(30, image.height - 5), (200, image.height - 5)],
+        boundary=[(30, image.height - 15), (200, image.height - 15), (200, image.height - 2), (30, image.height - 2)],
+    )
+    seg = Segmentation(type="baselines", imagename="page", text_direction="horizontal-lr",
+                       script_detection=False, lines=[])
+
+    records = recognize_lines(network, image, seg, [blank] + lines, batch_size=4)
+
+    assert str(records[0]) == ""
+    assert len(records) == 2
+
+
+def test_records_are_reported_as_batches_finish():
+    network = make_network()
+    image, lines = make_page([500, 60, 300, 200, 90])
+    blank = BaselineLine(
+        id="blank",
+        baseline=[(30, image.height - 5), (200, image.height - 5)],
+        boundary=[(30, image.height - 15), (200, image.height - 15), (200, image.height - 2), (30, image.height - 2)],
+    )
+    seg = Segmentation(type="baselines", imagename="page", text_direction="horizontal-lr",
+                       script_detection=False, lines=[])
+    reported = []
+
+    records = recognize_lines(network, image, seg, lines + [blank], batch_size=2, on_records=reported.append)
+
+    # The blank line first, then batches of at most two, widest lines first
+    assert [index for index, _ in reported[0]] == [5]
+    assert [len(batch) for batch in reported[1:]] == [2, 2, 1]
+    assert [index for batch in reported[1:] for index, _ in batch] == [0, 2, 3, 4, 1]
+    assert {index: record for batch in reported for index, record in batch} == dict(enumerate(records))
@@ -0,0 +1,66 @@
+"""
+Tests for the start and resume points of IIIF downloads in download_iiif.py:
+an append starts after the project's images, and a job resumes after its
+last saved page but never before the page it was started from.
+
+The job row tests use a temporary SQLite database; skipped when
+Flask-SQLAlchemy isn't installed. Run with:
+
+    python3 -m pytest tests/test_download_iiif.py
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from download_iiif import choose_start_page, resume_page
+
+
+@pytest.mark.parametrize("image_count, confirm, cancelled_at, expected", [
+    (0, None, None, 1),
+    (12, None, None, None),  # the user is asked first
+    (12, "append", None, 13),
+    (12, "restart", None, 1),
+    (12, None, 7, 8),  # a cancelled download resumes
+    (12, "append", 7, 13),
+])
+def test_start_page(image_count, confirm, cancelled_at, expected):
+    assert choose_start_page(image_count, confirm, cancelled_at) == expected
+
+
+def test_resume_page_never_goes_before_the_start_page():
+    assert resume_page(13, None) == 13
+    assert resume_page(13, 0) == 13
+    assert resume_page(13, 20) == 21
+    assert resume_page(None, None) == 1
+
+
+def test_append_without_a_job_row_resumes_after_the_images(tmp_path):
+    pytest.importorskip("flask_sqlalchemy")
+    from flask import Flask
+
+    from models import db, IiifDownloadJob, Image, Project, User
+
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{tmp_path / 'iiif.db'}"
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        user = User(username="u", password_hash="x")
+        project = Project(name="p", owner=user, iiif_url="https://example.org/manifest.json")
+        db.session.add_all([user, project])
+        db.session.flush()
+        # Uploaded by hand or left after a reset: images, but no download job
+        db.session.add_all(Image(project_id=project.id, name=f"{n}.jpg", original=f"uploads/{n}.jpg")
+                           for n in range(12))
+        db.session.commit()
+
+        start_page = choose_start_page(Image.query.filter_by(project_id=project.id).count(), "append")
+        db.session.add(IiifDownloadJob(project_id=project.id, start_page=start_page))
+        db.session.commit()
+
+        record = IiifDownloadJob.query.filter_by(project_id=project.id).one()
+        assert resume_page(record.start_page, record.current_page) == 13
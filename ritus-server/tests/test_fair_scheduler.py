@@ -0,0 +1,190 @@
+"""
+Tests for fair_scheduler.py: OCR slots go round-robin to the projects with
+pages waiting, within the per-project and per-user caps, and a small
+project finishes early next to a big one. Interactive pages go first and
+batch pages lend them their slot between line batches.
+
+Run with:
+
+    python3 -m pytest tests/test_fair_scheduler.py
+"""
+
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fair_scheduler import BATCH, INTERACTIVE, FairShareScheduler
+
+
+def wait_for(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.005)
+    return False
+
+
+def waiting(scheduler, project_id):
+    return scheduler.stats()["projects"].get(project_id, {}).get("waiting", 0)
+
+
+def start_waiters(scheduler, project_id, count, grants, user_id=None, priority=BATCH):
+    """count threads that each acquire a slot for project_id and record the grant."""
+    threads = []
+    for _ in range(count):
+        def take():
+            scheduler.acquire(project_id, user_id, priority=priority)
+            grants.append(project_id)
+
+        thread = threading.Thread(target=take, daemon=True)
+        thread.start()
+        threads.append(thread)
+
+    def queued():
+        stats = scheduler.stats()
+        if priority == INTERACTIVE:
+            return stats["interactive"]["waiting"]
+        return stats["projects"].get(project_id, {}).get("waiting", 0)
+
+    assert wait_for(lambda: queued() + grants.count(project_id) == count)
+    return threads
+
+
+def test_free_slots_alternate_between_waiting_projects():
+    scheduler = FairShareScheduler(slots=1)
+    assert scheduler.acquire("big")
+    grants = []
+    start_waiters(scheduler, "big", 3, grants)
+    start_waiters(scheduler, "small", 2, grants)
+
+    for released in range(5):
+        scheduler.release(grants[-1] if grants else "big")
+        assert wait_for(lambda: len(grants) == released + 1)
+    assert grants == ["big", "small", "big", "small", "big"]
+
+
+def test_project_cap_passes_slots_to_the_next_project():
+    scheduler = FairShareScheduler(slots=3, project_slots=2)
+    grants = []
+    start_waiters(scheduler, "big", 3, grants)
+    assert wait_for(lambda: grants == ["big", "big"])
+    assert waiting(scheduler, "big") == 1
+
+    start_waiters(scheduler, "small", 1, grants)
+    assert wait_for(lambda: grants == ["big", "big", "small"])
+    assert scheduler.stats()["in_use"] == 3
+
+
+def test_user_cap_counts_all_projects_of_the_user():
+    scheduler = FairShareScheduler(slots=4, user_slots=2)
+    grants = []
+    start_waiters(scheduler, "a1", 2, grants, user_id=1)
+    start_waiters(scheduler, "a2", 2, grants, user_id=1)
+    start_waiters(scheduler, "b", 2, grants, user_id=2)
+
+    assert wait_for(lambda: len(grants) == 4)
+    assert sorted(grants) == ["a1", "a1", "b", "b"]
+    assert waiting(scheduler, "a2") == 2
+
+    scheduler.release("a1", 1)
+    assert wait_for(lambda: grants[-1] == "a2")
+
+
+def test_stop_event_withdraws_a_waiting_page():
+    scheduler = FairShareScheduler(slots=1)
+    assert scheduler.acquire("big")
+    stop_event = threading.Event()
+    result = []
+    thread = threading.Thread(target=lambda: result.append(scheduler.acquire("small", stop_event=stop_event)))
+    thread.start()
+    assert wait_for(lambda: waiting(scheduler, "small") == 1)
+
+    stop_event.set()
+    thread.join(5)
+    assert result == [False]
+    assert waiting(scheduler, "small") == 0
+    scheduler.release("big")
+    assert scheduler.stats()["in_use"] == 0
+
+
+def test_small_project_finishes_while_a_big_one_runs():
+    scheduler = FairShareScheduler(slots=2)
+    finished = {}
+
+    def transcribe(project_id, pages, threads=2):
+        remaining = list(range(pages))
+        lock = threading.Lock()
+
+        def worker():
+            while True:
+                with lock:
+                    if not remaining:
+                        return
+                    remaining.pop()
+                with scheduler.slot(project_id):
+                    time.sleep(0.005)
+
+        workers = [threading.Thread(target=worker) for _ in range(threads)]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        finished[project_id] = time.monotonic()
+
+    big = threading.Thread(target=transcribe, args=("big", 200))
+    big.start()
+    time.sleep(0.05)
+    small = threading.Thread(target=transcribe, args=("small", 10))
+    small.start()
+    small.join(10)
+    big.join(30)
+
+    assert finished["small"] < finished["big"]
+    stats = scheduler.stats()
+    assert stats["in_use"] == 0
+    assert stats["projects"]["small"]["granted"] == 10
+
+
+def test_interactive_pages_go_before_waiting_batch_pages():
+    scheduler = FairShareScheduler(slots=1, project_slots=1)
+    assert scheduler.acquire("big")
+    grants = []
+    start_waiters(scheduler, "big", 2, grants)
+    start_waiters(scheduler, "page", 1, grants, priority=INTERACTIVE)
+
+    scheduler.release("big")
+    assert wait_for(lambda: grants == ["page"])
+    scheduler.release("page", priority=INTERACTIVE)
+    assert wait_for(lambda: grants == ["page", "big"])
+
+    stats = scheduler.stats()
+    assert stats["wait_seconds"][INTERACTIVE]["count"] == 1
+    assert stats["wait_seconds"][BATCH]["count"] == 2
+
+
+def test_batch_page_lends_its_slot_and_gets_it_back_first():
+    scheduler = FairShareScheduler(slots=1)
+    assert scheduler.acquire("big")
+    assert scheduler.yield_to_interactive("big") is False
+
+    grants = []
+    start_waiters(scheduler, "other", 1, grants)
+    start_waiters(scheduler, "page", 1, grants, priority=INTERACTIVE)
+    resumed = threading.Event()
+    thread = threading.Thread(target=lambda: scheduler.yield_to_interactive("big") and resumed.set())
+    thread.start()
+
+    assert wait_for(lambda: grants == ["page"])
+    assert not resumed.is_set()
+    scheduler.release("page", priority=INTERACTIVE)
+    assert resumed.wait(5)
+    # The lent slot came back to the interrupted page, not to "other"
+    assert grants == ["page"]
+    assert scheduler.stats()["preemptions"] == 1
+
+    scheduler.release("big")
+    assert wait_for(lambda: grants == ["page", "other"])
@@ -0,0 +1,389 @@
+"""
+Tests for the red/black colour splitting in image_processing.py.
+
+The vectorised column scoring and region detection must give exactly the
+same red/black regions as the original per-column/per-pixel loops (kept in
+image_processing.py as the *_reference functions). These need numpy, cv2 and
+kraken (image_processing imports them), so they are skipped when those
+aren't installed. Run with:
+
+    python3 -m pytest tests/test_image_processing.py
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+np = pytest.importorskip("numpy")
+cv2 = pytest.importorskip("cv2")
+pytest.importorskip("kraken")
+
+from PIL import Image as PILImage
+
+from kraken.containers import BaselineLine
+
+import image_processing
+from image_processing import (
+    ColorAnalysisContext,
+    column_redness_scores,
+    column_redness_scores_reference,
+    find_color_regions,
+    find_color_regions_reference,
+    pixel_redness,
+    rgb_to_hsl,
+    split_line_boundary_by_color,
+)
+from page_image import PageImage
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+TEST_IMAGES = ["test_img.png", "test_img2.png", "test_img3.png"]
+
+
+def load_rgb(name):
+    return PILImage.open(os.path.join(TESTS_DIR, name)).convert("RGB")
+
+
+def rubricate(image):
+    """The test pages are black-only; recolour the ink in a few vertical bands
+    rubric-red so the comparison also covers real red/black splits."""
+    array = np.array(image)
+    ink = array.max(axis=2) < 140
+    bands = np.zeros(array.shape[:2], dtype=bool)
+    for start in range(40, image.width, 260):
+        bands[:, start:start + 110] = True
+    array[ink & bands] = (178, 34, 34)
+    return PILImage.fromarray(array)
+
+
+def strip_lines(image, strip_height=40, step=45):
+    """Overlapping full-width 'lines' covering the whole page, with a slanted
+    boundary so the polygon mask is not just the bounding box."""
+    lines = []
+    for i, top in enumerate(range(0, image.height - strip_height, step)):
+        left, right = 5, image.width - 5
+        bottom = top + strip_height
+        lines.append(BaselineLine(
+            id=str(i),
+            baseline=[(left, bottom - 8), (right, bottom - 4)],
+            boundary=[(left, top + 3), (right, top), (right, bottom), (left, bottom - 3)],
+        ))
+    return lines
+
+
+@pytest.mark.parametrize("name", TEST_IMAGES)
+def test_column_scores_match_reference(name):
+    hsl = rgb_to_hsl(np.array(rubricate(load_rgb(name)))[:200])
+    h, s, l = hsl[:, :, 0], hsl[:, :, 1], hsl[:, :, 2]
+
+    scores, peaks = column_redness_scores(h, s, l)
+    ref_scores, ref_peaks = column_redness_scores_reference(h, s, l)
+
+    np.testing.assert_array_equal(scores, ref_scores)
+    np.testing.assert_array_equal(peaks, ref_peaks)
+
+    blocked_scores, blocked_peaks = column_redness_scores(h, s, l, block_width=7)
+    np.testing.assert_array_equal(blocked_scores, ref_scores)
+    np.testing.assert_array_equal(blocked_peaks, ref_peaks)
+
+
+def test_regions_match_reference_on_edge_cases():
+    rng = np.random.default_rng(0)
+    cases = [
+        np.array([]),
+        np.zeros(3),
+        np.full(12, 9.0),
+        np.array([0, 0, 9, 9, 9, 9, 9, 0, 9, 0, 0, 0, 0, 0, 9, 9, 9, 9, 9, 9], dtype=float),
+        rng.uniform(0, 10, 500),
+        np.repeat(rng.uniform(0, 10, 60), rng.integers(1, 12, 60)),
+    ]
+    for redness in cases:
+        for threshold in (0.0, 5.0, 9.0, 20.0):
+            assert find_color_regions(redness, threshold) == find_color_regions_reference(redness, threshold)
+
+
+@pytest.mark.parametrize("name", TEST_IMAGES)
+@pytest.mark.parametrize("red_threshold", [1.0, 5.0])
+@pytest.mark.parametrize("rubricated", [False, True])
+def test_split_matches_reference_implementation(monkeypatch, name, red_threshold, rubricated):
+    image = rubricate(load_rgb(name)) if rubricated else load_rgb(name)
+    lines = strip_lines(image)
+
+    def split_all():
+        result = []
+        for i, line in enumerate(lines):
+            result.append([
+                (piece.color if hasattr(piece, "color") else None, piece.boundary)
+                for piece in split_line_boundary_by_color(image, line, i, red_threshold=red_threshold)
+            ])
+        return result
+
+    vectorised = split_all()
+    monkeypatch.setattr(image_processing, "find_color_regions", find_color_regions_reference)
+    reference = split_all()
+
+    assert vectorised == reference
+
+
+def page_redness(image, band_height=64):
+    """The page's whole redness map at once: HSL of the page, CLAHE per band, pixel_redness()."""
+    hsl = rgb_to_hsl(np.array(image))
+    l_scaled = (hsl[:, :, 2] * 255).astype(np.uint8)
+    clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, band_height // 8))
+    lightnesses = np.vstack([clahe.apply(l_scaled[y:y + band_height])
+                             for y in range(0, image.height, band_height)]).astype(float) / 255.0
+    return pixel_redness(hsl[:, :, 0], hsl[:, :, 1], lightnesses).astype(np.float32)
+
+
+@pytest.mark.parametrize("name", TEST_IMAGES)
+def test_context_redness_matches_whole_page_map(name):
+    image = rubricate(load_rgb(name))
+    context = ColorAnalysisContext(image, band_height=48)
+    left, top, right, bottom = 37, 61, image.width - 20, 230  # spans several bands
+
+    np.testing.assert_array_equal(context.redness(left, top, right, bottom),
+                                  page_redness(image, 48)[top:bottom, left:right])
+
+
+def test_context_keeps_bands_within_budget():
+    image = load_rgb("test_img.png")
+    band_bytes = image.width * 16 * 4
+    context = ColorAnalysisContext(image, band_height=16, max_bytes=3 * band_bytes)
+
+    for top in range(0, image.height - 16, 16):
+        context.redness(0, top, image.width, top + 16)
+    assert len(context._bands) == 3
+
+    converted = context.bands_converted
+    context.redness(0, image.height - 40, image.width, image.height - 20)
+    assert context.bands_converted == converted  # still cached
+
+
+def test_overlapping_lines_convert_each_band_once():
+    image = rubricate(load_rgb("test_img.png"))
+    lines = strip_lines(image)  # every row is in two lines
+    context = ColorAnalysisContext.for_lines(image, lines, prefilter=False)
+
+    for i, line in enumerate(lines):
+        split_line_boundary_by_color(image, line, i, red_threshold=5.0, color_context=context)
+    last_row = max(y for line in lines for _, y in line.boundary) + 10
+    assert context.bands_converted == -(-min(last_row, image.height) // context.band_height)
+
+
+def test_context_skips_non_rgb_images():
+    image = PILImage.open(os.path.join(TESTS_DIR, "test_img.png")).convert("RGBA")
+    line = strip_lines(image)[3]
+    assert split_line_boundary_by_color(image, line, 3, red_threshold=1.0) == [line]
+
+
+@pytest.mark.parametrize("name", TEST_IMAGES)
+def test_shared_context_matches_per_line_split(name):
+    image = rubricate(load_rgb(name))
+    lines = strip_lines(image, step=70)
+    context = ColorAnalysisContext.for_lines(image, lines, band_height=64)
+
+    for i, line in enumerate(lines):
+        shared = split_line_boundary_by_color(image, line, i, red_threshold=5.0, color_context=context)
+        alone = split_line_boundary_by_color(image, line, i, red_threshold=5.0)
+        assert [(p.color, p.boundary) for p in shared] == [(p.color, p.boundary) for p in alone]
+
+
+def map_line_regions(redness_map, line, window_size=80, red_threshold=5.0):
+    """Red/black regions of a line from a whole-page redness map: its polygon's column means, denoised."""
+    xs, ys = zip(*line.boundary)
+    height_px, width_px = redness_map.shape
+    left, top = max(0, min(xs) - 10), max(0, min(ys) - 10)
+    right, bottom = min(width_px, max(xs) + 10), min(height_px, max(ys) + 10)
+    height, width = bottom - top, right - left
+    mask = np.zeros((height, width), dtype=np.uint8)
+    cv2.fillPoly(mask, [np.array([(x - left, y - top) for x, y in line.boundary], dtype=np.int32)], 255)
+    crop = redness_map[top:bottom, left:right].astype(float)
+    scores = np.array([crop[:, x][mask[:, x] != 0].sum() / height * 100 for x in range(width)])
+    window = min(window_size, width)
+    denoised = np.convolve(scores, np.ones(window) / window, mode="same")
+    return find_color_regions_reference(denoised, red_threshold), left, top, width, height
+
+
+@pytest.mark.parametrize("name", TEST_IMAGES)
+@pytest.mark.parametrize("red_threshold", [1.0, 5.0])
+@pytest.mark.parametrize("prefilter", [False, True])
+def test_split_matches_whole_page_redness_map(name, red_threshold, prefilter):
+    image = rubricate(load_rgb(name))
+    lines = strip_lines(image)
+    context = ColorAnalysisContext.for_lines(image, lines, prefilter=prefilter)
+    redness_map = page_redness(image)
+
+    for i, line in enumerate(lines):
+        regions, left, top, width, height = map_line_regions(redness_map, line, red_threshold=red_threshold)
+        expected = image_processing._split_line_at_regions(image, line, i, regions, left, top, width, height)
+        split = split_line_boundary_by_color(image, line, i, red_threshold=red_threshold, color_context=context)
+        assert [(p.color, p.boundary) for p in split] == [(p.color, p.boundary) for p in expected]
+
+
+@pytest.mark.parametrize("name", TEST_IMAGES)
+def test_page_image_split_matches_pil_split(name):
+    image = rubricate(load_rgb(name))
+    page = PageImage(image.copy())
+    lines = strip_lines(image, step=70)
+    context = ColorAnalysisContext.for_lines(page, lines, band_height=64)
+
+    for i, line in enumerate(lines):
+        from_page = split_line_boundary_by_color(page, line, i, red_threshold=5.0, color_context=context)
+        from_pil = split_line_boundary_by_color(image, line, i, red_threshold=5.0)
+        assert [(p.color, p.boundary) for p in from_page] == [(p.color, p.boundary) for p in from_pil]
+
+
+def tinted_page(rng, background, strokes):
+    """A 600x400 page in a background colour with dark ink and some strokes of random reddish colours."""
+    array = np.empty((400, 600, 3), dtype=np.uint8)
+    array[:] = background
+    for row in range(40, 400, 45):
+        array[row:row + 14, 30:570:4] = (40, 35, 30)
+    for _ in range(strokes):
+        y, x = int(rng.integers(0, 380)), int(rng.integers(0, 560))
+        h, w = int(rng.integers(1, 20)), int(rng.integers(1, 60))
+        red = int(rng.integers(90, 256))
+        array[y:y + h, x:x + w] = (red, int(rng.integers(0, red)), int(rng.integers(0, red)))
+    return PILImage.fromarray(array)
+
+
+def random_lines(rng, image, count=25):
+    lines = []
+    for i in range(count):
+        x0, y0 = int(rng.integers(0, image.width - 80)), int(rng.integers(0, image.height - 30))
+        x1, y1 = min(image.width - 1, x0 + int(rng.integers(6, 500))), min(image.height - 1, y0 + int(rng.integers(5, 60)))
+        lines.append(BaselineLine(
+            id=str(i),
+            baseline=[(x0, y1 - 4), (x1, y1 - 2)],
+            boundary=[(x0, y0 + 2), (x1, y0), (x1, y1), (x0, y1 - 2)],
+        ))
+    return lines
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_prefilter_bound_is_never_below_the_real_redness(monkeypatch, seed):
+    rng = np.random.default_rng(seed)
+    backgrounds = [(255, 255, 255), (235, 222, 190), (236, 205, 190), (200, 170, 160)]
+    denoised_peaks = []
+    real_regions = image_processing.find_color_regions
+
+    def recording_regions(denoised_redness, red_threshold, *args, **kwargs):
+        denoised_peaks.append(float(np.max(denoised_redness)) if len(denoised_redness) else 0.0)
+        return real_regions(denoised_redness, red_threshold, *args, **kwargs)
+
+    monkeypatch.setattr(image_processing, "find_color_regions", recording_regions)
+    for background in backgrounds:
+        image = tinted_page(rng, background, strokes=int(rng.integers(0, 12)))
+        context = ColorAnalysisContext.for_lines(image, random_lines(rng, image), prefilter=False)
+        for i, line in enumerate(random_lines(rng, image)):
+            x_coords, y_coords = zip(*line.boundary)
+            left, top = max(0, min(x_coords) - 10), max(0, min(y_coords) - 10)
+            right, bottom = min(image.width, max(x_coords) + 10), min(image.height, max(y_coords) + 10)
+            if not context.contains(left, top, right, bottom):
+                continue
+            denoised_peaks.clear()
+            split_line_boundary_by_color(image, line, i, red_threshold=5.0, color_context=context)
+            bound = context.redness_bound(left, top, right, bottom, 80)
+            assert bound * image_processing.PREFILTER_MARGIN >= denoised_peaks[0] * (1 - 1e-9)
+
+
+@pytest.mark.parametrize("seed", range(3))
+@pytest.mark.parametrize("red_threshold", [0.5, 5.0, 40.0])
+def test_prefilter_never_changes_the_split(seed, red_threshold):
+    rng = np.random.default_rng(100 + seed)
+    pages = [rubricate(load_rgb("test_img.png")), load_rgb("test_img2.png"),
+             tinted_page(rng, (235, 222, 190), strokes=6), tinted_page(rng, (236, 205, 190), strokes=3)]
+    skipped = analysed = 0
+    for image in pages:
+        lines = strip_lines(image, step=70) + random_lines(rng, image)
+        fast = ColorAnalysisContext.for_lines(image, lines)
+        full = ColorAnalysisContext.for_lines(image, lines, prefilter=False)
+        for i, line in enumerate(lines):
+            with_prefilter = split_line_boundary_by_color(image, line, i, red_threshold=red_threshold,
+                                                          color_context=fast)
+            without = split_line_boundary_by_color(image, line, i, red_threshold=red_threshold, color_context=full)
+            assert [(p.color, p.boundary, p.baseline) for p in with_prefilter] == \
+                   [(p.color, p.boundary, p.baseline) for p in without]
+        skipped += fast.lines_prefiltered
+        analysed += fast.lines_analysed
+    # Both paths were exercised
+    assert skipped and analysed
+
+
+def test_black_only_page_needs_no_colour_analysis():
+    image = load_rgb("test_img3.png")
+    lines = strip_lines(image)
+    context = ColorAnalysisContext.for_lines(image, lines)
+
+    for i, line in enumerate(lines):
+        assert {p.color for p in split_line_boundary_by_color(image, line, i, color_context=context)} == {"black"}
+    assert context.lines_prefiltered == len(lines) and context.lines_analysed == 0
+    assert context.bands_converted == 0
+
+
+def line_polygon(rng, left, right, top, height, vertices):
+    """A kraken-like line boundary: a wavy top edge left to right, a wavy bottom edge back."""
+    xs = np.linspace(left, right, vertices)
+    upper = top + rng.uniform(0, height / 3, vertices)
+    lower = top + height - rng.uniform(0, height / 3, vertices)
+    return [(float(x), float(y)) for x, y in zip(xs, upper)] + \
+        [(float(x), float(y)) for x, y in zip(xs[::-1], lower[::-1])]
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_slab_clip_matches_shapely(seed):
+    geometry = pytest.importorskip("shapely.geometry")
+    rng = np.random.default_rng(seed)
+    for _ in range(40):
+        boundary = line_polygon(rng, 0, rng.uniform(50, 900), rng.uniform(0, 20), rng.uniform(20, 80),
+                                int(rng.integers(2, 30)))
+        polygon = geometry.Polygon(boundary)
+        edges = np.sort(rng.choice(np.arange(-20, 920), int(rng.integers(2, 12)), replace=False))
+        for x0, x1, clipped in zip(edges[:-1], edges[1:], image_processing.clip_polygon_to_slabs(boundary, edges)):
+            expected = polygon.intersection(geometry.box(x0, -1, x1, 200))
+            if expected.area < 1e-6:
+                assert len(clipped) == 0
+                continue
+            result = geometry.Polygon(clipped)
+            assert result.is_valid
+            assert result.symmetric_difference(expected).area < 1e-6 * max(1.0, expected.area)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_baseline_clip_matches_shapely(seed):
+    geometry = pytest.importorskip("shapely.geometry")
+    rng = np.random.default_rng(seed)
+    for _ in range(40):
+        xs = np.sort(rng.uniform(0, 900, int(rng.integers(2, 12))))
+        baseline = [(float(x), float(y)) for x, y in zip(xs, rng.uniform(40, 60, len(xs)))]
+        if rng.random() < 0.3:
+            baseline = baseline[::-1]
+        edges = np.sort(rng.uniform(-20, 920, int(rng.integers(2, 12))))
+        for x0, x1, clipped in zip(edges[:-1], edges[1:], image_processing.clip_polyline_to_slabs(baseline, edges)):
+            expected = geometry.LineString(baseline).intersection(geometry.box(x0, 0, x1, 100))
+            if expected.is_empty or expected.length == 0:
+                assert len(clipped) <= 1
+                continue
+            assert np.all((clipped[:, 0] >= x0) & (clipped[:, 0] <= x1))
+            assert geometry.LineString(clipped).length == pytest.approx(expected.length)
+            # Same direction as the original baseline
+            assert (clipped[-1, 0] - clipped[0, 0]) * (baseline[-1][0] - baseline[0][0]) > 0
+
+
+@pytest.mark.parametrize("name", TEST_IMAGES)
+def test_split_pieces_tile_the_line_boundary(name):
+    geometry = pytest.importorskip("shapely.geometry")
+    image = rubricate(load_rgb(name))
+    context = ColorAnalysisContext(image)
+    for i, line in enumerate(strip_lines(image)):
+        outline = geometry.Polygon(line.boundary)
+        left, _, right, _ = outline.bounds
+        pieces = split_line_boundary_by_color(image, line, i, color_context=context)
+        # Regions entirely in the crop's padding keep their rectangle
+        polygons = [geometry.Polygon(piece.boundary) for piece in pieces]
+        polygons = [polygon for polygon in polygons if polygon.bounds[2] > left and polygon.bounds[0] < right]
+        assert all(polygon.is_valid for polygon in polygons)
+        assert sum(polygon.area for polygon in polygons) == pytest.approx(outline.area)
+        assert sum(outline.intersection(polygon).area for polygon in polygons) == pytest.approx(outline.area)
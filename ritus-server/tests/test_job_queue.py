@@ -0,0 +1,306 @@
+"""
+Tests for job_queue.py: jobs in the QueuedJob table are run by worker
+threads, retried, serialised per concurrency key, cancelled, and picked up
+again when the process that ran them stopped renewing their lease.
+
+Uses a temporary SQLite database; skipped when Flask-SQLAlchemy isn't
+installed. Run with:
+
+    python3 -m pytest tests/test_job_queue.py
+"""
+
+import os
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+pytest.importorskip("flask_sqlalchemy")
+
+from flask import Flask
+
+from job_queue import JobFailed, JobQueue
+from models import db, Project, QueuedJob, User
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{tmp_path / 'jobs.db'}"
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        user = User(username="u", password_hash="x")
+        db.session.add_all([user, Project(name="p", owner=user)])
+        db.session.commit()
+        yield app
+
+
+@pytest.fixture
+def make_queue(app):
+    queues = []
+
+    def make(**options):
+        options = {"lease_seconds": 1, "heartbeat_seconds": 0.05, "poll_seconds": 0.02,
+                   "retry_delay_seconds": 0, **options}
+        queue = JobQueue(app, **options)
+        queues.append(queue)
+        return queue
+
+    yield make
+    for queue in queues:
+        queue.stop(timeout=5)
+
+
+def job_row(app, job_id):
+    with app.app_context():
+        row = db.session.get(QueuedJob, job_id)
+        db.session.expunge(row)
+        return row
+
+
+def wait_for(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def test_job_runs_with_its_payload(app, make_queue):
+    queue = make_queue()
+    seen = []
+    queue.register("echo", lambda job, stop_event: seen.append((job.project_id, job.payload, job.attempt)))
+    job_id = queue.enqueue("echo", {"page": 3}, project_id=1)
+    queue.start()
+
+    assert wait_for(lambda: job_row(app, job_id).status == "completed")
+    assert seen == [(1, {"page": 3}, 1)]
+    assert job_row(app, job_id).lease_token is None
+
+
+def test_failed_attempts_are_retried_until_max_attempts(app, make_queue):
+    queue = make_queue()
+    attempts = []
+    statuses = []
+
+    def flaky(job, stop_event):
+        attempts.append(job.attempt)
+        if job.attempt < 3:
+            raise RuntimeError("connection reset")
+
+    queue.register("flaky", flaky, on_status=lambda job, status, message: statuses.append(status), max_attempts=3)
+    job_id = queue.enqueue("flaky")
+    queue.start()
+
+    assert wait_for(lambda: job_row(app, job_id).status == "completed")
+    assert attempts == [1, 2, 3]
+    assert statuses == ["queued", "queued"]
+
+
+def test_job_failed_without_retry_ends_the_job(app, make_queue):
+    queue = make_queue()
+    reported = []
+
+    def broken(job, stop_event):
+        raise JobFailed("no manifest", retry=False)
+
+    queue.register("broken", broken, on_status=lambda job, status, message: reported.append((status, message)))
+    job_id = queue.enqueue("broken")
+    queue.start()
+
+    assert wait_for(lambda: job_row(app, job_id).status == "failed")
+    row = job_row(app, job_id)
+    assert (row.attempts, row.error_message) == (1, "no manifest")
+    assert wait_for(lambda: reported == [("failed", "no manifest")])
+
+
+def test_jobs_sharing_a_concurrency_key_run_one_at_a_time(app, make_queue):
+    queue = make_queue(workers=4)
+    active = []
+    overlaps = []
+    order = []
+    lock = threading.Lock()
+
+    def work(job, stop_event):
+        with lock:
+            if active:
+                overlaps.append(job.id)
+            active.append(job.id)
+            order.append(job.payload["n"])
+        time.sleep(0.05)
+        with lock:
+            active.remove(job.id)
+
+    queue.register("download", work)
+    ids = [queue.enqueue("download", {"n": n}, concurrency_key="iiif:example.org") for n in range(4)]
+    queue.start()
+
+    assert wait_for(lambda: all(job_row(app, i).status == "completed" for i in ids))
+    assert overlaps == []
+    assert order == [0, 1, 2, 3]
+
+
+def test_capped_kind_leaves_workers_to_the_other_kinds(app, make_queue):
+    queue = make_queue(workers=4)
+    release = threading.Event()
+    running = []
+    queue.register("batch_transcribe", lambda job, stop_event: (running.append(job.id), release.wait(10)),
+                   max_running=3)
+    queue.register("iiif_download", lambda job, stop_event: None)
+    batches = [queue.enqueue("batch_transcribe", concurrency_key=f"batch_transcribe:{n}") for n in range(4)]
+    download = queue.enqueue("iiif_download", concurrency_key="iiif:example.org")
+    queue.start()
+
+    assert wait_for(lambda: job_row(app, download).status == "completed")
+    assert len(running) == 3
+    assert [job_row(app, i).status for i in batches].count("queued") == 1
+    release.set()
+    assert wait_for(lambda: all(job_row(app, i).status == "completed" for i in batches))
+
+
+def test_cancel_stops_a_running_job_and_drops_a_queued_one(app, make_queue):
+    queue = make_queue(workers=1)
+    started = threading.Event()
+
+    def wait_until_stopped(job, stop_event):
+        started.set()
+        assert stop_event.wait(5)
+
+    queue.register("long", wait_until_stopped)
+    running_id = queue.enqueue("long", project_id=1)
+    queue.start()
+    assert started.wait(5)
+    queued_id = queue.enqueue("long", project_id=1)
+
+    assert queue.cancel("long", 1) == 2
+    assert job_row(app, queued_id).status == "cancelled"
+    assert wait_for(lambda: job_row(app, running_id).status == "cancelled")
+
+
+def test_orphaned_job_is_claimed_again(app, make_queue):
+    # Left "running" by a process that died on the job's first attempt
+    stale = datetime.utcnow() - timedelta(minutes=5)
+    orphan = QueuedJob(kind="resume", status="running", attempts=1, max_attempts=3, lease_token="dead",
+                       lease_expires_at=stale, heartbeat_at=stale, payload="{}")
+    db.session.add(orphan)
+    db.session.commit()
+    queue = make_queue()
+    attempts = []
+    queue.register("resume", lambda job, stop_event: attempts.append(job.attempt))
+    queue.start()
+
+    assert wait_for(lambda: job_row(app, orphan.id).status == "completed")
+    assert attempts == [2]
+
+
+def test_orphan_out_of_attempts_is_marked_failed(app, make_queue):
+    stale = datetime.utcnow() - timedelta(minutes=5)
+    orphan = QueuedJob(kind="once", status="running", attempts=1, max_attempts=1, lease_token="dead",
+                       lease_expires_at=stale, payload="{}")
+    db.session.add(orphan)
+    db.session.commit()
+    queue = make_queue()
+    reported = []
+    ran = []
+    queue.register("once", lambda job, stop_event: ran.append(job.id),
+                   on_status=lambda job, status, message: reported.append(status))
+    queue.start()
+
+    assert wait_for(lambda: job_row(app, orphan.id).status == "failed")
+    assert "Interrupted" in job_row(app, orphan.id).error_message
+    assert ran == []
+    assert wait_for(lambda: reported == ["failed"])
+
+
+def test_heartbeat_keeps_a_long_job_leased(app, make_queue):
+    queue = make_queue(workers=2, lease_seconds=0.3)
+    runs = []
+
+    def slow(job, stop_event):
+        runs.append(job.attempt)
+        time.sleep(1.0)
+
+    queue.register("slow", slow)
+    job_id = queue.enqueue("slow")
+    queue.start()
+
+    assert wait_for(lambda: job_row(app, job_id).status == "completed")
+    # The second worker never took it over as an orphan
+    assert runs == [1]
+
+
+def test_stop_puts_running_jobs_back_without_using_an_attempt(app, make_queue):
+    queue = make_queue(workers=1)
+    started = threading.Event()
+
+    def wait_until_stopped(job, stop_event):
+        started.set()
+        stop_event.wait(5)
+
+    queue.register("long", wait_until_stopped)
+    job_id = queue.enqueue("long")
+    queue.start()
+    assert started.wait(5)
+    queue.stop(timeout=5)
+
+    row = job_row(app, job_id)
+    assert (row.status, row.attempts, row.lease_token) == ("queued", 0, None)
+
+
+def test_only_the_runner_slot_holder_runs_jobs(app, make_queue):
+    first = make_queue(runner_slots=1)
+    second = make_queue(runner_slots=1)
+    ran = []
+    for queue in (first, second):
+        queue.register("echo", lambda job, stop_event, queue=queue: ran.append(queue))
+    first.start()
+    assert wait_for(lambda: first.is_runner)
+    second.start()
+    job_id = second.enqueue("echo")
+
+    assert wait_for(lambda: job_row(app, job_id).status == "completed")
+    assert ran == [first]
+    assert not second.is_runner
+    assert [runner["holder"] for runner in second.runner_states()] == [first.holder]
+
+
+def test_runner_slot_and_state_pass_to_the_next_process(app, make_queue):
+    first = make_queue(runner_slots=1)
+    second = make_queue(runner_slots=1)
+    started = []
+    second.on_runner_start = lambda: started.append(second.holder)
+    second.state_provider = lambda: {"pipelines": {"1": {"ocr": {"busy": 1}}}}
+    first.start()
+    assert wait_for(lambda: first.is_runner)
+    second.start()
+
+    first.stop(timeout=5)
+    assert wait_for(lambda: second.is_runner)
+    assert started == [second.holder]
+    assert wait_for(lambda: [r["state"] for r in first.runner_states()] == [{"pipelines": {"1": {"ocr": {"busy": 1}}}}])
+
+
+def test_cancel_in_another_process_stops_the_running_job(app, make_queue):
+    runner = make_queue(runner_slots=1, heartbeat_seconds=10, cancel_poll_seconds=0.05)
+    web = make_queue(runner_slots=1)
+    started = threading.Event()
+
+    def wait_until_stopped(job, stop_event):
+        started.set()
+        assert stop_event.wait(5)
+
+    for queue in (runner, web):
+        queue.register("long", wait_until_stopped)
+    runner.start()
+    job_id = web.enqueue("long", project_id=1)
+    assert started.wait(5)
+
+    # The web process only flags the row; the runner notices between heartbeats
+    assert web.cancel("long", 1) == 1
+    assert wait_for(lambda: job_row(app, job_id).status == "cancelled", timeout=2)
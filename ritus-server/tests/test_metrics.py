@@ -0,0 +1,78 @@
+"""
+Tests for metrics.py: stage spans must end up in the histogram once per
+collection, and the export must be valid Prometheus text.
+
+Dependency-free. Run with:
+
+    python3 -m pytest tests/test_metrics.py
+"""
+
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import metrics
+from metrics import MetricsRegistry
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = MetricsRegistry()
+    histogram = registry.histogram("t_seconds", "Test.", ("stage",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 5.0):
+        histogram.observe(value, stage="segment")
+
+    text = registry.render()
+    assert '# TYPE t_seconds histogram' in text
+    assert 't_seconds_bucket{stage="segment",le="0.1"} 1' in text
+    assert 't_seconds_bucket{stage="segment",le="1.0"} 2' in text
+    assert 't_seconds_bucket{stage="segment",le="+Inf"} 3' in text
+    assert 't_seconds_sum{stage="segment"} 5.55' in text
+    assert 't_seconds_count{stage="segment"} 3' in text
+
+
+def test_counter_labels_are_escaped():
+    registry = MetricsRegistry()
+    counter = registry.counter("loads_total", "Test.", ("model",))
+    counter.inc(model='odd "name"')
+    counter.inc(2, model='odd "name"')
+    assert 'loads_total{model="odd \\"name\\""} 3' in registry.render()
+
+
+def test_spans_are_summed_per_collection():
+    before = metrics.STAGE_SECONDS.count(stage="test_stage")
+    with metrics.collect_timings() as timings:
+        for _ in range(3):
+            with metrics.span("test_stage"):
+                pass
+        metrics.record_timings({"test_stage": 1.0})
+        assert metrics.STAGE_SECONDS.count(stage="test_stage") == before
+
+    assert set(timings) == {"test_stage"} and timings["test_stage"] >= 1.0
+    assert metrics.STAGE_SECONDS.count(stage="test_stage") == before + 1
+
+    with metrics.span("test_stage"):
+        pass
+    assert metrics.STAGE_SECONDS.count(stage="test_stage") == before + 2
+
+
+def test_collections_do_not_leak_between_threads():
+    seen = {}
+
+    def other_thread():
+        with metrics.span("other_thread_stage"):
+            pass
+        seen["count"] = metrics.STAGE_SECONDS.count(stage="other_thread_stage")
+
+    with metrics.collect_timings() as timings:
+        thread = threading.Thread(target=other_thread)
+        thread.start()
+        thread.join()
+
+    assert "other_thread_stage" not in timings
+    assert seen["count"] == 1
+
+
+def test_timing_header_lists_slowest_first():
+    assert metrics.timing_header({"decode": 0.0105, "segment": 1.5}) == "segment=1500.0ms, decode=10.5ms"
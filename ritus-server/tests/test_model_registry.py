@@ -0,0 +1,136 @@
+"""
+Tests for model_registry.py: the LRU pool of loaded recognition models.
+
+Dependency-free: models are plain objects produced by a fake loader, so these
+run without kraken/torch installed. Run with:
+
+    python3 -m pytest tests/test_model_registry.py
+"""
+
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from model_registry import ModelRegistry, estimate_model_bytes
+
+
+class FakeModel:
+    def __init__(self, name, nbytes=0):
+        self.name = name
+        self.nbytes = nbytes
+
+
+class FakeLoader:
+    def __init__(self, sizes=None, delay=0.0):
+        self.sizes = sizes or {}
+        self.delay = delay
+        self.calls = []
+
+    def __call__(self, name):
+        self.calls.append(name)
+        if self.delay:
+            time.sleep(self.delay)
+        if name == "broken":
+            raise IOError("cannot read model")
+        return FakeModel(name, self.sizes.get(name, 0))
+
+
+def make_registry(**kwargs):
+    loader = FakeLoader(sizes=kwargs.pop("sizes", None), delay=kwargs.pop("delay", 0.0))
+    return ModelRegistry(loader, size_of=lambda model: model.nbytes, **kwargs), loader
+
+
+def use(registry, name):
+    with registry.acquire(name) as model:
+        return model
+
+
+def test_loaded_model_is_reused():
+    registry, loader = make_registry(capacity=2)
+    first = use(registry, "a")
+    assert use(registry, "a") is first
+    assert loader.calls == ["a"]
+    stats = registry.stats()
+    assert (stats["hits"], stats["misses"]) == (1, 1)
+
+
+def test_alternating_models_within_capacity_do_not_reload():
+    registry, loader = make_registry(capacity=2)
+    for _ in range(5):
+        use(registry, "tridis")
+        use(registry, "catmus")
+    assert loader.calls == ["tridis", "catmus"]
+
+
+def test_least_recently_used_model_is_evicted():
+    registry, loader = make_registry(capacity=2)
+    use(registry, "a")
+    use(registry, "b")
+    use(registry, "a")
+    use(registry, "c")
+    assert registry.loaded_models() == ["a", "c"]
+    assert registry.stats()["evictions"] == 1
+
+
+def test_byte_budget_evicts_until_it_fits():
+    registry, _ = make_registry(capacity=10, max_bytes=100, sizes={"a": 40, "b": 40, "c": 50})
+    use(registry, "a")
+    use(registry, "b")
+    use(registry, "c")
+    assert registry.loaded_models() == ["b", "c"]
+    assert registry.stats()["loaded_bytes"] == 90
+
+
+def test_model_in_use_is_never_evicted():
+    registry, loader = make_registry(capacity=1)
+    with registry.acquire("a") as a:
+        use(registry, "b")
+        assert "a" in registry.loaded_models()
+        with registry.acquire("a") as again:
+            assert again is a
+    # Released: the pool shrinks back to its capacity
+    assert len(registry.loaded_models()) == 1
+    assert loader.calls == ["a", "b"]
+
+
+def test_concurrent_requests_load_a_model_once():
+    registry, loader = make_registry(capacity=2, delay=0.05)
+    results = []
+
+    def worker():
+        results.append(use(registry, "a"))
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert loader.calls == ["a"]
+    assert all(model is results[0] for model in results)
+    assert registry.stats()["models"] == [{"name": "a", "bytes": 0, "in_use": 0}]
+
+
+def test_failed_load_propagates_and_is_counted():
+    registry, _ = make_registry()
+    with pytest.raises(IOError):
+        use(registry, "broken")
+    assert registry.loaded_models() == []
+    assert registry.stats()["load_failures"] == 1
+
+
+def test_preload_skips_failures():
+    registry, loader = make_registry(capacity=2)
+    registry.preload(["a", "broken", "b"])
+    assert registry.loaded_models() == ["a", "b"]
+    use(registry, "a")
+    assert loader.calls == ["a", "broken", "b"]
+
+
+def test_estimate_model_bytes_without_parameters_is_zero():
+    assert estimate_model_bytes(object()) == 0
@@ -0,0 +1,58 @@
+"""
+Tests for page_image.py: a PageImage must hand out the same pixels, grayscale
+image and file hash as decoding the file with PIL directly, and its crops
+must be views rather than copies.
+
+Run with:
+
+    python3 -m pytest tests/test_page_image.py
+"""
+
+import hashlib
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+np = pytest.importorskip("numpy")
+
+from PIL import Image as PILImage
+
+from page_image import PageImage
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+TEST_IMAGE = os.path.join(TESTS_DIR, "test_img.png")
+
+
+def test_open_matches_pil_decoding():
+    page = PageImage.open(TEST_IMAGE)
+    image = PILImage.open(TEST_IMAGE)
+
+    assert page.size == image.size
+    assert page.mode == image.mode
+    np.testing.assert_array_equal(page.pixels, np.asarray(image))
+    np.testing.assert_array_equal(np.asarray(page.gray), np.asarray(image.convert("L")))
+    with open(TEST_IMAGE, "rb") as f:
+        assert page.sha256 == hashlib.sha256(f.read()).hexdigest()
+
+
+def test_crops_are_clipped_views():
+    page = PageImage(PILImage.open(TEST_IMAGE).convert("RGB"))
+    crop = page.crop_pixels((-5, 10, page.width + 5, 40))
+
+    assert np.shares_memory(crop, page.pixels)
+    assert crop.shape == (30, page.width, 3)
+    assert not crop.flags.writeable
+    assert page.crop_gray((0, 10, 50, 40)).size == (50, 30)
+
+
+def test_color_round_trips():
+    image = PILImage.open(TEST_IMAGE).convert("RGB")
+    page = PageImage(image.copy())
+    assert page.color.mode == "RGB"
+    np.testing.assert_array_equal(np.asarray(page.color), np.asarray(image))
+
+    palette = image.convert("P")
+    assert PageImage(palette).color.mode == "P"
@@ -0,0 +1,387 @@
+"""
+Tests for page_transcription.py (the OCR part of transcribe_image_by_id) and
+the worker processes of ocr_workers.py that run it.
+
+These need kraken (page_transcription imports it), so they are skipped when
+it isn't installed. No model file is needed. Run with:
+
+    python3 -m pytest tests/test_page_transcription.py
+"""
+
+import contextlib
+import os
+import queue
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+pytest.importorskip("kraken")
+pytest.importorskip("cv2")
+
+from PIL import Image as PILImage
+
+from kraken.containers import BaselineLine, Region, Segmentation
+
+import metrics
+import ocr_workers
+import page_transcription
+from ocr_workers import OcrWorkerPool
+from page_image import PageImage
+from page_transcription import (
+    LINE_WRAP_HYPHEN, _assemble_text, _attach_recognition, _same_line_set,
+    segment_detected_columns_independently, should_ignore_line,
+)
+from segmentation_map import SegmentationMapCache
+
+
+def piece(color, x0=0, x1=100):
+    line = BaselineLine(id=f"{color}{x0}", baseline=[(x0, 20), (x1, 20)], boundary=[(x0, 0), (x1, 0), (x1, 30), (x0, 30)])
+    line.color = color
+    return line
+
+
+def assemble(*segments):
+    """segments: (line index, color, text or None for a failed line)."""
+    units = [(i, piece(color)) for i, color, _ in segments]
+    records = [None if text is None else [text] for _, _, text in segments]
+    return _assemble_text(units, records)
+
+
+def test_red_runs_are_tagged_and_merged():
+    text = assemble(
+        (0, "red", "Oratio"), (0, "black", "Deus qui"),
+        (1, "red", "Per"), (1, "red", "Dominum"), (2, "black", "Amen"),
+    )
+    assert text == "<red> Oratio</red> Deus qui <red> Per Dominum</red> Amen"
+
+
+def test_line_wrap_hyphen_joins_the_next_segment():
+    text = assemble((0, "black", "benedi" + LINE_WRAP_HYPHEN), (1, "black", "ctus es"))
+    assert text == "benedictus es"
+
+
+def test_trailing_hyphen_fragment_is_kept():
+    assert assemble((0, "black", "sanctifi" + LINE_WRAP_HYPHEN)) == "sanctifi"
+
+
+def test_failed_and_non_letter_segments_are_skipped():
+    text = assemble((0, "black", "Gloria"), (1, "black", None), (2, "black", "123 ."), (3, "black", "Patri"))
+    assert text == "Gloria Patri"
+
+
+def test_recognition_results_are_kept_on_the_pieces():
+    red, black = piece("red"), piece("black", 100, 200)
+    records = [type("Record", (), {"__str__": lambda self: " Deus ", "confidences": [0.5, 1.0]})()]
+    _attach_recognition([(0, red), (0, black)], [records, None])
+
+    assert (red.text, red.confidence) == ("Deus", 0.75)
+    assert (black.text, black.confidence) == (None, None)
+
+
+def test_short_edge_lines_are_ignored_only_when_asked():
+    marginal = piece("black", 5, 100)
+    body = piece("black", 100, 900)
+    assert should_ignore_line(marginal, 1000, True)
+    assert not should_ignore_line(body, 1000, True)
+    assert not should_ignore_line(marginal, 1000, False)
+
+
+class FakeSegmentationMap:
+    """SegmentationMap stand-in: vectorizes by calling a fake blla.segment on the (cropped) image."""
+
+    def __init__(self, segment, image):
+        self.segment = segment
+        self.image = image
+
+    def vectorize(self, text_direction="horizontal-tb"):
+        return self.segment(self.image, text_direction=text_direction)
+
+    def crop(self, box):
+        return FakeSegmentationMap(self.segment, self.image.crop(box))
+
+
+def fake_network(monkeypatch, segment, calls=None):
+    """Make transcribe_page()'s network pass return FakeSegmentationMaps, counting the runs in calls."""
+    def compute(image, baseline_model, device, max_side=0):
+        if calls is not None:
+            calls.append(image.size)
+        return FakeSegmentationMap(segment, image)
+    monkeypatch.setattr(page_transcription, "compute_segmentation_map", compute)
+
+
+def column_line(n, x0, x1, y):
+    return BaselineLine(id=f"c{n}", baseline=[(x0, y + 20), (x1, y + 20)],
+                        boundary=[(x0, y), (x1, y), (x1, y + 25), (x0, y + 25)])
+
+
+def two_columns(merged_rows=()):
+    """Eight rows of a left (x 50-450) and a right (x 550-950) column line; merged_rows span both instead."""
+    lines = []
+    for row in range(8):
+        y = 100 + 50 * row
+        if row in merged_rows:
+            lines.append(column_line(2 * row, 50, 950, y))
+        else:
+            lines.extend([column_line(2 * row, 50, 450, y), column_line(2 * row + 1, 550, 950, y)])
+    return lines
+
+
+def fake_column_blla(monkeypatch, calls):
+    """segment_image stand-in giving each column crop eight lines and recording the thread it ran on."""
+    def segment(image, baseline_model, device, text_direction="horizontal-tb", max_side=0):
+        calls.append(threading.current_thread().name)
+        time.sleep(0.05)
+        # Both crops are 500 px wide: their lines land where two_columns() has them
+        lines = [column_line(row, 50, 450, 100 + 50 * row) for row in range(8)]
+        return Segmentation(type="baselines", imagename="", text_direction=text_direction, script_detection=False,
+                            lines=lines, regions={}, line_orders=[])
+    monkeypatch.setattr(page_transcription, "segment_image", segment)
+
+
+def test_columns_blla_kept_apart_are_not_resegmented(monkeypatch):
+    calls = []
+    fake_column_blla(monkeypatch, calls)
+    memo = {}
+    page = PageImage(PILImage.new("RGB", (1000, 600), "white"))
+
+    assert segment_detected_columns_independently(page, two_columns(), None, "cpu", memo=memo) is None
+    assert calls == [] and memo == {"columns": "skipped"}
+
+
+@pytest.mark.parametrize("column_workers", [0, 2])
+def test_merged_columns_are_resegmented(monkeypatch, column_workers):
+    calls = []
+    fake_column_blla(monkeypatch, calls)
+    memo = {}
+    page = PageImage(PILImage.new("RGB", (1000, 600), "white"))
+
+    with metrics.collect_timings() as timings:
+        lines = segment_detected_columns_independently(
+            page, two_columns(merged_rows=(3,)), None, "cpu", column_workers=column_workers, memo=memo
+        )
+
+    assert len(calls) == 2
+    # Both columns' spans are in the page's timings, the pool thread's too
+    assert timings["column_segment"] >= 0.1
+    if column_workers:
+        # The right crop runs on the column pool while this thread does the left one
+        assert calls.count(threading.current_thread().name) == 1
+    else:
+        assert set(calls) == {threading.current_thread().name}
+    assert len(lines) == 16 and memo == {"columns": "changed"}
+    assert [line.id.rsplit(":", 1)[1] for line in lines] == ["left"] * 8 + ["right"] * 8
+    assert _same_line_set(two_columns(), lines)
+
+
+def test_column_crops_are_vectorized_from_the_page_map(monkeypatch):
+    network_runs = []
+    fake_column_blla(monkeypatch, network_runs)
+    crops = []
+
+    def vectorize_crop(image, text_direction="horizontal-tb"):
+        crops.append(image.size)
+        lines = [column_line(row, 50, 450, 100 + 50 * row) for row in range(8)]
+        return Segmentation(type="baselines", imagename="", text_direction=text_direction, script_detection=False,
+                            lines=lines, regions={}, line_orders=[])
+
+    image = PILImage.new("RGB", (1000, 600), "white")
+    lines = segment_detected_columns_independently(
+        PageImage(image), two_columns(merged_rows=(3,)), None, "cpu",
+        seg_map=FakeSegmentationMap(vectorize_crop, image.convert("L")),
+    )
+    assert network_runs == [] and sorted(crops) == [(500, 600), (500, 600)]
+    assert len(lines) == 16
+
+
+def test_same_line_set_matches_by_box_overlap():
+    lines = two_columns()
+    shifted = [column_line(n, x0 + 5, x1 + 5, y + 2) for n, (x0, x1, y) in enumerate(
+        (line.boundary[0][0], line.boundary[1][0], line.boundary[0][1]) for line in lines)]
+    assert _same_line_set(lines, list(reversed(shifted)))
+    assert not _same_line_set(lines, shifted[:-1])
+    assert not _same_line_set(two_columns(merged_rows=(3,)), two_columns(merged_rows=(4,)))
+
+
+class Registry:
+    """ModelRegistry stand-in; recognition itself is faked below."""
+
+    @contextlib.contextmanager
+    def acquire(self, name):
+        yield name
+
+
+def stored(lines, model, red_threshold, memo):
+    """What krakenServer.previous_transcription() would load for these lines."""
+    return {
+        "model": model,
+        "red_threshold": red_threshold,
+        "segmentation_digest": memo["segmentation_digest"],
+        "lines": [
+            {"order": n, "source_order": l.source_order, "baseline": l.baseline, "boundary": l.boundary,
+             "color": getattr(l, "color", None), "text": l.text, "confidence": l.confidence}
+            for n, l in enumerate(lines)
+        ],
+    }
+
+
+@pytest.fixture
+def incremental(monkeypatch, tmp_path):
+    """transcribe_page() on a three-line page with segmentation and recognition faked."""
+    path = tmp_path / "page.png"
+    PILImage.new("RGB", (1000, 300), "white").save(path)
+    rows = [(50, 950), (50, 950), (10, 120)]  # the last one is a short edge line
+
+    def fake_segment(im, model=None, device=None, text_direction=None):
+        lines = [
+            BaselineLine(id=f"l{i}", baseline=[(x0, 40 + 80 * i), (x1, 40 + 80 * i)],
+                         boundary=[(x0, 10 + 80 * i), (x1, 10 + 80 * i), (x1, 60 + 80 * i), (x0, 60 + 80 * i)])
+            for i, (x0, x1) in enumerate(rows)
+        ]
+        return Segmentation(type="baselines", imagename="", text_direction=text_direction, script_detection=False,
+                            lines=lines, regions={}, line_orders=[])
+
+    calls = {"split": 0, "recognised": []}
+    real_split = page_transcription.split_line_boundary_by_color
+
+    def counting_split(*args, **kwargs):
+        calls["split"] += 1
+        return real_split(*args, **kwargs)
+
+    def fake_recognize(network, image, seg, lines, batch_size=1, on_line=None):
+        calls["recognised"].extend(lines)
+        results = [[f"{network} line {line.source_order}"] for line in lines]
+        if on_line is not None:
+            # Batches finish in width order, not reading order
+            for index in reversed(range(len(lines))):
+                on_line(index, results[index])
+        return results
+
+    fake_network(monkeypatch, fake_segment)
+    monkeypatch.setattr(page_transcription, "split_line_boundary_by_color", counting_split)
+    monkeypatch.setattr(page_transcription, "recognize_page_lines", fake_recognize)
+
+    def run(model="m1", previous=None, **options):
+        calls["split"], calls["recognised"] = 0, []
+        return page_transcription.transcribe_page(str(path), None, Registry(), model, "cpu",
+                                                  previous=previous, **options)
+    return run, calls
+
+
+def test_unchanged_parameters_reuse_every_stage(incremental):
+    run, calls = incremental
+    text, lines, memo = run()
+    assert calls["split"] == 3 and len(calls["recognised"]) == 3
+
+    again, _, memo = run(previous=stored(lines, "m1", 5.0, memo))
+    assert again == text
+    assert (calls["split"], calls["recognised"]) == (0, [])
+    assert memo["split"] == {"computed": 0, "reused": 3}
+    assert memo["recognition"] == {"computed": 0, "reused": 3}
+
+
+def test_new_model_only_redoes_recognition(incremental):
+    run, calls = incremental
+    _, lines, memo = run()
+    text, _, memo = run(model="m2", previous=stored(lines, "m1", 5.0, memo))
+
+    assert calls["split"] == 0 and len(calls["recognised"]) == 3
+    assert text == "m2 line 0 m2 line 1 m2 line 2"
+
+
+def test_new_threshold_resplits_but_keeps_unchanged_pieces(incremental):
+    run, calls = incremental
+    _, lines, memo = run()
+    _, _, memo = run(red_threshold=7.0, previous=stored(lines, "m1", 5.0, memo))
+
+    assert calls["split"] == 3
+    assert calls["recognised"] == []  # a blank page splits the same way at any threshold
+    assert memo["recognition"] == {"computed": 0, "reused": 3}
+
+
+def test_progress_reports_every_piece_once_with_its_text(incremental):
+    run, _ = incremental
+    events = []
+    text, lines, memo = run(progress=lambda event, data: events.append((event, data)))
+
+    assert events[0][0] == "segmentation"
+    assert events[0][1]["line_count"] == 3
+    assert [line["source_order"] for line in events[0][1]["lines"]] == [0, 1, 2]
+    pieces = [data for event, data in events[1:]]
+    assert [event for event, _ in events[1:]] == ["line"] * len(lines)
+    assert sorted(piece["order"] for piece in pieces) == list(range(len(lines)))
+    for piece in pieces:
+        line = lines[piece["order"]]
+        assert (piece["text"], piece["source_order"], piece["total"]) == (line.text, line.source_order, len(lines))
+
+    # Reused pieces are reported right away, in reading order
+    events.clear()
+    run(model="m2", progress=lambda event, data: events.append((event, data)), ignore_edges=False,
+        previous=stored(lines, "m1", 5.0, memo))
+    assert [data["text"] for event, data in events[1:]] == ["m2 line 2", "m2 line 1", "m2 line 0"]
+    events.clear()
+    run(progress=lambda event, data: events.append((event, data)), previous=stored(lines, "m1", 5.0, memo))
+    assert [data["order"] for event, data in events[1:]] == [0, 1, 2]
+
+
+def test_worker_events_match_in_process_events(incremental, monkeypatch, tmp_path):
+    run, _ = incremental
+    in_process = []
+    run(ignore_edges=True, progress=lambda event, data: in_process.append((event, data)))
+
+    monkeypatch.setattr(ocr_workers, "_worker", {
+        "baseline_model": object(), "ocr_models": Registry(), "device": "cpu",
+        "segmentation_cache": None, "segmentation_maps": None,
+    })
+    events = queue.Queue()
+    ocr_workers._transcribe_in_worker(str(tmp_path / "page.png"), "m1", {"ignore_edges": True}, events)
+    forwarded = []
+    while not events.empty():
+        forwarded.append(events.get())
+
+    assert forwarded == in_process
+
+
+def test_ignore_edges_only_refilters(incremental):
+    run, calls = incremental
+    _, lines, memo = run(ignore_edges=True)
+    assert [l.source_order for l in lines] == [0, 1]
+
+    text, lines, memo = run(ignore_edges=False, previous=stored(lines, "m1", 5.0, memo))
+    assert calls["split"] == 1 and [l.source_order for l in calls["recognised"]] == [2]
+    assert text == "m1 line 0 m1 line 1 m1 line 2"
+
+
+def test_layout_option_changes_reuse_the_network_output(monkeypatch, tmp_path):
+    path = tmp_path / "page.png"
+    PILImage.new("RGB", (1000, 300), "white").save(path)
+    runs = []
+    fake_network(monkeypatch, lambda image, text_direction: Segmentation(
+        type="baselines", imagename="", text_direction=text_direction, script_detection=False,
+        lines=[], regions={}, line_orders=[],
+    ), runs)
+    maps = SegmentationMapCache(capacity=2)
+
+    memos = [
+        page_transcription.transcribe_page(str(path), None, Registry(), "m1", "cpu", segmentation_maps=maps,
+                                           **options)[2]
+        for options in ({}, {"enhanced_multi_column": True}, {"enhanced_multi_column": True, "column_gap_ratio": 0.06})
+    ]
+    assert runs == [(1000, 300)]
+    assert [memo["segmentation_map"] for memo in memos] == ["computed", "reused", "reused"]
+
+
+def test_worker_errors_reach_the_caller():
+    pool = OcrWorkerPool(1, {}, None)
+    try:
+        with pytest.raises(RuntimeError, match="Baseline model is not loaded"):
+            pool.transcribe("missing.png", "none.mlmodel")
+        events = []
+        with pytest.raises(RuntimeError, match="Baseline model is not loaded"):
+            pool.transcribe("missing.png", "none.mlmodel", progress=lambda event, data: events.append(event))
+        assert events == []
+    finally:
+        pool.shutdown()
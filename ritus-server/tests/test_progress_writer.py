@@ -0,0 +1,72 @@
+"""
+Tests for progress_writer.py: updates within the interval are coalesced into
+one write, state() writes at once together with the pending updates, and
+flush() writes what is left.
+
+Run with:
+
+    python3 -m pytest tests/test_progress_writer.py
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import progress_writer
+from progress_writer import ProgressWriter
+
+
+class Clock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+def writer(monkeypatch, interval_seconds=0.5):
+    clock = Clock()
+    monkeypatch.setattr(progress_writer.time, "monotonic", clock)
+    written = []
+    return ProgressWriter(written.append, interval_seconds), written, clock
+
+
+def test_updates_within_the_interval_are_coalesced(monkeypatch):
+    progress, written, clock = writer(monkeypatch)
+    for n in range(1, 1001):
+        progress.update(processed_rows=n, progress=n / 10)
+
+    assert written == [{"processed_rows": 1, "progress": 0.1}]
+    clock.now += 0.5
+    progress.update(processed_rows=1001)
+    assert written[-1] == {"processed_rows": 1001, "progress": 100.0}
+    assert (progress.updates, progress.writes) == (1001, 2)
+
+
+def test_state_is_written_at_once_with_pending_updates(monkeypatch):
+    progress, written, clock = writer(monkeypatch)
+    progress.update(progress=10)
+    progress.update(progress=20, processed_rows=5)
+    progress.state(status="cancelled")
+
+    assert written == [{"progress": 10}, {"progress": 20, "processed_rows": 5, "status": "cancelled"}]
+
+
+def test_flush_writes_only_pending_updates(monkeypatch):
+    progress, written, clock = writer(monkeypatch)
+    progress.update(progress=10)
+    progress.flush()
+    progress.update(progress=30)
+    progress.flush()
+    progress.flush()
+
+    assert written == [{"progress": 10}, {"progress": 30}]
+
+
+def test_zero_interval_writes_every_update(monkeypatch):
+    progress, written, clock = writer(monkeypatch, interval_seconds=0)
+    for n in range(3):
+        progress.update(current_image=n)
+
+    assert written == [{"current_image": 0}, {"current_image": 1}, {"current_image": 2}]
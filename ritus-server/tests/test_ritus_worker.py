@@ -0,0 +1,202 @@
+"""
+Tests for page_tasks.py and ritus_worker.py: page tasks are claimed under a
+lease by one worker at a time, taken over when a worker stops renewing its
+lease, shared between projects, go with their image or project, and a batch
+is transcribed by two worker processes on one database.
+
+Uses a temporary SQLite database and a stand-in for transcribe_page();
+skipped when Flask-SQLAlchemy isn't installed. Run with:
+
+    python3 -m pytest tests/test_ritus_worker.py
+"""
+
+import multiprocessing
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+pytest.importorskip("flask_sqlalchemy")
+
+from sqlalchemy import create_engine, update
+
+import page_tasks
+from models import db, Image, PageTask, Project, User
+from ritus_worker import PageWorker
+
+
+@pytest.fixture
+def db_url(tmp_path):
+    url = f"sqlite:///{tmp_path / 'tasks.db'}?timeout=20"
+    engine = create_engine(url)
+    db.metadata.create_all(engine)
+    engine.dispose()
+    return url
+
+
+@pytest.fixture
+def engine(db_url):
+    engine = create_engine(db_url)
+    yield engine
+    engine.dispose()
+
+
+def page(image_id, path="uploads/p.png"):
+    return {"image_id": image_id, "image_path": path, "model_name": "m.mlmodel", "options": {"red_threshold": 5.0},
+            "previous": None}
+
+
+def fake_transcribe(image_path, model_name, options, previous):
+    """Stands in for transcribe_page(): one line with the image file's content as text."""
+    time.sleep(0.02)
+    with open(image_path) as f:
+        text = f.read()
+    line = SimpleNamespace(source_order=0, baseline=[(0, 10), (50, 10)],
+                           boundary=[(0, 0), (50, 0), (50, 12), (0, 12)], color="black", text=text, confidence=0.9)
+    return text, [line], {"recognition": {"computed": 1, "reused": 0}}
+
+
+def expire_leases(engine):
+    with engine.begin() as conn:
+        conn.execute(update(PageTask.__table__).values(lease_expires_at=datetime.utcnow() - timedelta(minutes=5)))
+
+
+def test_each_task_goes_to_one_worker(engine):
+    page_tasks.add_tasks(engine, 1, 1, [page(10), page(11)])
+
+    first = page_tasks.claim_task(engine, "a")
+    second = page_tasks.claim_task(engine, "b")
+    assert (first.image_id, second.image_id) == (10, 11)
+    assert first.options == {"red_threshold": 5.0} and first.previous is None
+    assert page_tasks.claim_task(engine, "c") is None
+    assert page_tasks.stats(engine)["running_by_worker"] == {"a": 1, "b": 1}
+
+
+def test_claims_alternate_between_projects(engine):
+    page_tasks.add_tasks(engine, 1, 1, [page(n) for n in range(10, 14)])
+    page_tasks.add_tasks(engine, 2, 2, [page(20), page(21)])
+
+    claimed = [page_tasks.claim_task(engine, "w").project_id for _ in range(4)]
+    assert claimed == [1, 2, 1, 2]
+
+
+def test_expired_lease_is_taken_over_and_the_old_result_dropped(engine):
+    page_tasks.add_tasks(engine, 1, 1, [page(10)])
+    stale = page_tasks.claim_task(engine, "dead")
+    expire_leases(engine)
+
+    task = page_tasks.claim_task(engine, "alive")
+    assert (task.id, task.attempt) == (stale.id, 2)
+    assert not page_tasks.renew_lease(engine, stale)
+    assert not page_tasks.complete_task(engine, stale, {"text": "late"})
+    assert page_tasks.complete_task(engine, task, {"text": "t", "lines": [], "memo": {}})
+
+    [finished] = page_tasks.finished_tasks(engine, 1)
+    assert (finished.status, finished.result["text"], finished.worker) == ("done", "t", "alive")
+
+
+def test_failed_attempts_are_retried_then_reported(engine):
+    page_tasks.add_tasks(engine, 1, 1, [page(10)], max_attempts=2)
+    assert not page_tasks.fail_task(engine, page_tasks.claim_task(engine, "w"), "CUDA out of memory")
+    assert page_tasks.finished_tasks(engine, 1) == []
+    assert page_tasks.fail_task(engine, page_tasks.claim_task(engine, "w"), "CUDA out of memory")
+
+    [finished] = page_tasks.finished_tasks(engine, 1)
+    assert (finished.status, finished.error) == ("failed", "CUDA out of memory")
+
+
+def test_task_whose_last_worker_died_is_reported_failed(engine):
+    page_tasks.add_tasks(engine, 1, 1, [page(10)], max_attempts=1)
+    page_tasks.claim_task(engine, "dead")
+    expire_leases(engine)
+
+    assert page_tasks.claim_task(engine, "alive") is None
+    [finished] = page_tasks.finished_tasks(engine, 1)
+    assert (finished.status, finished.error) == ("failed", page_tasks.LOST_WORKER_MESSAGE)
+
+
+def test_cancelled_batch_drops_the_running_page(engine):
+    page_tasks.add_tasks(engine, 1, 1, [page(10), page(11)])
+    task = page_tasks.claim_task(engine, "w")
+
+    assert page_tasks.cancel_batch(engine, 1) == 2
+    assert not page_tasks.renew_lease(engine, task)
+    assert page_tasks.remaining_tasks(engine, 1) == 0
+
+
+def test_tasks_are_deleted_with_their_image_and_project(tmp_path):
+    from flask import Flask
+
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{tmp_path / 'app.db'}"
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        user = User(username="u", password_hash="x")
+        project = Project(name="p", owner=user)
+        db.session.add_all([user, project])
+        db.session.flush()
+        images = [Image(project_id=project.id, name=f"{n}", original=f"uploads/{n}.png") for n in range(3)]
+        db.session.add_all(images)
+        db.session.commit()
+        page_tasks.add_tasks(db.engine, 1, project.id, [page(image.id) for image in images])
+
+        db.session.delete(images[0])
+        db.session.commit()
+        assert sorted(task.image_id for task in PageTask.query.all()) == [images[1].id, images[2].id]
+
+        db.session.delete(project)
+        db.session.commit()
+        assert PageTask.query.count() == 0
+
+
+def test_worker_reads_images_under_uploads_root(engine, tmp_path):
+    (tmp_path / "uploads").mkdir()
+    (tmp_path / "uploads" / "p.png").write_text("kyrie eleison")
+    page_tasks.add_tasks(engine, 1, 1, [page(10), page(11, "uploads/missing.png")], max_attempts=1)
+
+    worker = PageWorker(engine, fake_transcribe, name="w", uploads_root=str(tmp_path))
+    assert worker.run(exit_when_idle=True) == 1
+
+    done, failed = page_tasks.finished_tasks(engine, 1)
+    assert done.result["text"] == "kyrie eleison"
+    assert done.result["lines"][0]["boundary"] == [[0, 0], [50, 0], [50, 12], [0, 12]]
+    assert page_tasks.result_lines(done.result)[0].text == "kyrie eleison"
+    assert failed.status == "failed" and "missing.png" in failed.error
+
+
+def _run_worker(db_url, name, uploads_root, started):
+    engine = create_engine(db_url)
+    started.wait(30)  # Neither process gets the whole batch just by starting first
+    PageWorker(engine, fake_transcribe, name=name, poll_seconds=0.05, uploads_root=uploads_root).run(
+        exit_when_idle=True
+    )
+
+
+def test_two_worker_processes_share_a_batch(db_url, engine, tmp_path):
+    (tmp_path / "uploads").mkdir()
+    pages = []
+    for n in range(20):
+        (tmp_path / "uploads" / f"{n}.png").write_text(f"page {n}")
+        pages.append(page(n, f"uploads/{n}.png"))
+    page_tasks.add_tasks(engine, 1, 1, pages)
+
+    context = multiprocessing.get_context("spawn")
+    started = context.Barrier(2)
+    workers = [context.Process(target=_run_worker, args=(db_url, f"w{n}", str(tmp_path), started))
+               for n in range(2)]
+    for process in workers:
+        process.start()
+    for process in workers:
+        process.join(60)
+        assert process.exitcode == 0
+
+    finished = page_tasks.finished_tasks(engine, 1, limit=100)
+    assert sorted(task.image_id for task in finished) == list(range(20))
+    assert all(task.result["text"] == f"page {task.image_id}" for task in finished)
+    assert {task.worker for task in finished} == {"w0", "w1"}
@@ -0,0 +1,143 @@
+"""
+Tests for segmentation_cache.py: cached segmentations must come back equal
+to what was stored, and any change to the key's inputs must miss.
+
+These need kraken (for its Segmentation/BaselineLine containers), so they are
+skipped when it isn't installed. No model file is needed. Run with:
+
+    python3 -m pytest tests/test_segmentation_cache.py
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("kraken")
+
+from kraken.containers import BaselineLine, Region, Segmentation
+
+from segmentation_cache import SegmentationCache, file_sha256, model_fingerprint
+
+
+def make_segmentation(imagename="page.png"):
+    lines = [
+        BaselineLine(
+            id=f"line-{i}",
+            baseline=[(10, 40 + 50 * i), (np.int64(400), 42 + 50 * i)],
+            boundary=[(10, 20 + 50 * i), (400, 20 + 50 * i), (400, 50 + 50 * i), (10, 50 + 50 * i)],
+            tags={"type": "default"},
+        )
+        for i in range(3)
+    ]
+    regions = {"text": [Region(id="r0", boundary=[(0, 0), (410, 0), (410, 200), (0, 200)])]}
+    return Segmentation(
+        type="baselines", imagename=imagename, text_direction="horizontal-lr",
+        script_detection=False, lines=lines, regions=regions, line_orders=[],
+    )
+
+
+@pytest.fixture
+def page(tmp_path):
+    path = tmp_path / "page.png"
+    path.write_bytes(b"not really a png, but hashable")
+    return str(path)
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return SegmentationCache(str(tmp_path / "cache"), "blla-fingerprint")
+
+
+def counting_segmenter(seg):
+    calls = []
+
+    def segment():
+        calls.append(1)
+        return seg
+    return segment, calls
+
+
+def test_second_lookup_is_served_from_disk(cache, page):
+    segment, calls = counting_segmenter(make_segmentation(page))
+
+    first = cache.segment(page, segment, "horizontal-tb")
+    second = cache.segment(page, segment, "horizontal-tb")
+
+    assert len(calls) == 1
+    assert second is not first
+    assert [(l.id, l.baseline, l.boundary, l.tags) for l in second.lines] == \
+        [(l.id, l.baseline, l.boundary, l.tags) for l in first.lines]
+    assert second.regions["text"][0].boundary == first.regions["text"][0].boundary
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_same_content_under_another_path_hits(cache, page, tmp_path):
+    segment, calls = counting_segmenter(make_segmentation(page))
+    cache.segment(page, segment, "horizontal-tb")
+
+    copy = tmp_path / "copy.png"
+    copy.write_bytes(open(page, "rb").read())
+    seg = cache.segment(str(copy), segment, "horizontal-tb")
+
+    assert len(calls) == 1
+    assert seg.imagename == str(copy)
+
+
+@pytest.mark.parametrize("options", [
+    ("horizontal-lr", False, 0.045),
+    ("horizontal-tb", True, 0.045),
+    ("horizontal-tb", True, 0.06),
+])
+def test_changed_options_miss(cache, page, options):
+    segment, calls = counting_segmenter(make_segmentation(page))
+    cache.segment(page, segment, "horizontal-tb", True, 0.03)
+    cache.segment(page, segment, *options)
+    assert len(calls) == 2
+
+
+def test_gap_ratio_is_ignored_without_multi_column(cache, page):
+    segment, calls = counting_segmenter(make_segmentation(page))
+    cache.segment(page, segment, "horizontal-tb", False, 0.045)
+    cache.segment(page, segment, "horizontal-tb", False, 0.06)
+    assert len(calls) == 1
+
+
+def test_changed_model_or_image_misses(tmp_path, page):
+    segment, calls = counting_segmenter(make_segmentation(page))
+    directory = str(tmp_path / "cache")
+    SegmentationCache(directory, "model-a").segment(page, segment, "horizontal-tb")
+    SegmentationCache(directory, "model-b").segment(page, segment, "horizontal-tb")
+    assert len(calls) == 2
+
+    with open(page, "ab") as f:
+        f.write(b"edited")
+    SegmentationCache(directory, "model-a").segment(page, segment, "horizontal-tb")
+    assert len(calls) == 3
+
+
+def test_max_side_is_part_of_the_key(cache, page):
+    segment, calls = counting_segmenter(make_segmentation(page))
+    cache.segment(page, segment, "horizontal-tb")
+    cache.segment(page, segment, "horizontal-tb", max_side=2000)
+    cache.segment(page, segment, "horizontal-tb", max_side=2000)
+    cache.segment(page, segment, "horizontal-tb", max_side=0)
+    assert len(calls) == 2
+
+
+def test_corrupt_entry_is_a_miss(cache, page):
+    segment, calls = counting_segmenter(make_segmentation(page))
+    cache.segment(page, segment, "horizontal-tb")
+    key = cache.key(file_sha256(page), "horizontal-tb", False, 0.045)
+    with open(cache._path(key), "w") as f:
+        f.write("{truncated")
+
+    cache.segment(page, segment, "horizontal-tb")
+    assert len(calls) == 2
+
+
+def test_model_fingerprint_is_file_hash(page):
+    assert model_fingerprint(page) == file_sha256(page)
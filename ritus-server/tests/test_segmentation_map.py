@@ -0,0 +1,128 @@
+"""
+Tests for segmentation_map.py: blla's network output kept as a
+SegmentationMap, vectorized for the whole page or for crops of it.
+
+The heatmaps are synthetic (two horizontal baselines in one text region),
+so no model file is needed, only kraken. Run with:
+
+    python3 -m pytest tests/test_segmentation_map.py
+"""
+
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+pytest.importorskip("kraken")
+
+from PIL import Image as PILImage
+
+import segmentation_map
+from segmentation_map import SegmentationMap, SegmentationMapCache, compute_segmentation_map
+
+
+class FakeModel:
+    """Just the metadata of a blla model that vectorization reads."""
+
+    model_type = "segmentation"
+    user_metadata = {
+        "class_mapping": {
+            "aux": {"_start_separator": 0, "_end_separator": 1},
+            "baselines": {"default": 2},
+            "regions": {"text": 3},
+        },
+    }
+    aux_layers = {}
+
+
+def two_line_map(scale=2.0):
+    """A 200x120 heatmap of two baselines (rows 40 and 90, x 20-180) in a text region."""
+    heatmap = np.zeros((4, 120, 200), dtype=np.float32)
+    image = np.full((120, 200), 255, dtype=np.uint8)
+    for y in (40, 90):
+        heatmap[2, y - 1:y + 2, 20:180] = 1
+        heatmap[0, y - 2:y + 3, 18:24] = 1
+        heatmap[1, y - 2:y + 3, 176:182] = 1
+        image[y - 15:y, 20:180:3] = 0
+    heatmap[3, 20:110, 10:190] = 1
+    return SegmentationMap(heatmap, image, (scale, scale), (int(200 * scale), int(120 * scale)), FakeModel())
+
+
+def baseline_rows(seg):
+    return sorted(round(sum(y for _, y in line.baseline) / len(line.baseline)) for line in seg.lines)
+
+
+def test_vectorized_lines_are_in_image_coordinates():
+    seg = two_line_map().vectorize()
+
+    assert baseline_rows(seg) == [79, 179]
+    for line in seg.lines:
+        xs = [x for x, _ in line.baseline]
+        assert min(xs) == pytest.approx(40, abs=4) and max(xs) == pytest.approx(360, abs=6)
+    assert seg.regions["text"][0].boundary[0] == (20, 40)
+
+
+def test_a_crop_is_vectorized_in_its_own_coordinates():
+    seg = two_line_map().crop((0, 100, 400, 240)).vectorize()
+
+    assert baseline_rows(seg) == [79]
+    assert all(0 <= y < 140 for line in seg.lines for _, y in line.boundary)
+
+
+def test_crops_between_heatmap_pixels_keep_the_offset():
+    seg_map = two_line_map(scale=2.5)
+    crop = seg_map.crop((101, 52, 301, 252))
+
+    # Heatmap columns from 40 (x 100) and rows from 20 (y 50) cover the box
+    assert crop.heatmap.shape == (4, 81, 81)
+    assert crop.size == (200, 200)
+    assert crop.offset == (-1.0, -2.0)
+    assert crop._to_image([(0, 0), (500, 500)]) == [(0, 0), (199, 199)]
+
+
+def test_downscaled_network_input_is_mapped_back(monkeypatch):
+    calls = []
+
+    def fake_network(image, mask, model, device):
+        calls.append(image.size)
+        width, height = image.size
+        return {"heatmap": np.zeros((4, height // 2, width // 2), dtype=np.float32),
+                "scal_im": np.zeros((height // 2, width // 2), dtype=np.uint8),
+                "scale": np.divide(image.size, (width // 2, height // 2))}
+
+    monkeypatch.setattr(segmentation_map.blla, "compute_segmentation_map", fake_network)
+
+    seg_map = compute_segmentation_map(PILImage.new("L", (1000, 3000), 255), FakeModel(), "cpu", max_side=1500)
+    assert calls == [(500, 1500)]
+    assert seg_map.size == (1000, 3000)
+    assert list(seg_map.scale) == [4.0, 4.0]
+
+    compute_segmentation_map(PILImage.new("L", (800, 1200), 255), FakeModel(), "cpu", max_side=1500)
+    compute_segmentation_map(PILImage.new("L", (800, 1200), 255), FakeModel(), "cpu", max_side=0)
+    assert calls[1:] == [(800, 1200), (800, 1200)]
+
+
+def test_map_cache_computes_each_page_once():
+    cache = SegmentationMapCache(capacity=2)
+    computed = []
+
+    def compute(name):
+        def run():
+            computed.append(name)
+            return two_line_map()
+        return run
+
+    first = cache.get("a", 0, compute("a"))
+    assert cache.get("a", 0, compute("a")) is first
+    cache.get("a", 1500, compute("a small"))
+    cache.get("b", 0, compute("b"))  # evicts ("a", 0), the least recently used
+    cache.get("a", 0, compute("a again"))
+    cache.get(None, 0, compute("unknown"))
+    cache.get(None, 0, compute("unknown"))
+
+    assert computed == ["a", "a small", "b", "a again", "unknown", "unknown"]
+    stats = cache.stats()
+    assert (stats["pages"], stats["hits"], stats["misses"]) == (2, 1, 4)
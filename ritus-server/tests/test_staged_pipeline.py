@@ -0,0 +1,104 @@
+"""
+Tests for staged_pipeline.py: every item must pass through every stage
+exactly once, failures and cancellation must not hang the pipeline, and the
+per-stage stats must add up.
+
+Dependency-free. Run with:
+
+    python3 -m pytest tests/test_staged_pipeline.py
+"""
+
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from staged_pipeline import Stage, StagedPipeline
+
+
+def test_items_pass_through_all_stages():
+    results = []
+    lock = threading.Lock()
+
+    def collect(item):
+        with lock:
+            results.append(item)
+
+    pipeline = StagedPipeline([
+        Stage("double", lambda x: x * 2, workers=3),
+        Stage("inc", lambda x: x + 1, workers=2),
+        Stage("collect", collect, workers=1),
+    ])
+    pipeline.run(range(100))
+
+    assert sorted(results) == [2 * x + 1 for x in range(100)]
+    stats = pipeline.stats()["stages"]
+    assert [stats[name]["processed"] for name in ("double", "inc", "collect")] == [100, 100, 100]
+    assert all(stage["busy"] == 0 and stage["queued"] == 0 for stage in stats.values())
+
+
+def test_none_drops_the_item():
+    seen = []
+    pipeline = StagedPipeline([
+        Stage("even", lambda x: x if x % 2 == 0 else None),
+        Stage("collect", seen.append),
+    ])
+    pipeline.run(range(10))
+    assert sorted(seen) == [0, 2, 4, 6, 8]
+
+
+def test_failures_are_reported_and_do_not_stop_the_rest():
+    errors = []
+    seen = []
+
+    def fragile(x):
+        if x == 3:
+            raise ValueError("bad page")
+        return x
+
+    pipeline = StagedPipeline(
+        [Stage("fragile", fragile, workers=2), Stage("collect", seen.append)],
+        on_error=lambda stage, item, error: errors.append((stage, item, str(error))),
+    )
+    pipeline.run(range(6))
+
+    assert sorted(seen) == [0, 1, 2, 4, 5]
+    assert errors == [("fragile", 3, "bad page")]
+    assert pipeline.stats()["stages"]["fragile"]["failed"] == 1
+
+
+def test_stop_event_drops_queued_items():
+    stop_event = threading.Event()
+    seen = []
+
+    def slow(x):
+        if x == 2:
+            stop_event.set()
+        time.sleep(0.01)
+        return x
+
+    pipeline = StagedPipeline([Stage("slow", slow), Stage("collect", seen.append)])
+    pipeline.run(range(50), stop_event=stop_event)
+
+    assert len(seen) < 50
+
+
+def test_slow_stage_shows_as_the_bottleneck():
+    pipeline = StagedPipeline([
+        Stage("fast", lambda x: x, workers=1),
+        Stage("slow", lambda x: time.sleep(0.01) or x, workers=1),
+    ])
+    pipeline.run(range(20))
+
+    stages = pipeline.stats()["stages"]
+    assert stages["slow"]["utilization"] > stages["fast"]["utilization"]
+    assert stages["slow"]["queue_capacity"] == 2
+
+
+def test_pipeline_needs_a_stage():
+    with pytest.raises(ValueError):
+        StagedPipeline([])
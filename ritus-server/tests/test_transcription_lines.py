@@ -0,0 +1,74 @@
+"""
+Tests for the TranscriptionLine table (models.py): a page's recognised lines
+are stored in reading order and replaced, not appended, on re-transcription.
+
+Uses an in-memory SQLite database; skipped when Flask-SQLAlchemy isn't
+installed. Run with:
+
+    python3 -m pytest tests/test_transcription_lines.py
+"""
+
+import os
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+pytest.importorskip("flask_sqlalchemy")
+
+from flask import Flask
+
+from models import db, Image, Project, TranscriptionLine, User
+
+
+@pytest.fixture
+def image_id():
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite://"
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        user = User(username="u", password_hash="x")
+        project = Project(name="p", owner=user)
+        image = Image(project=project, name="page", original="page.png")
+        db.session.add_all([user, project, image])
+        db.session.commit()
+        yield image.id
+
+
+def line(x0, color, text, confidence=0.9):
+    return SimpleNamespace(
+        baseline=[(x0, 20), (x0 + 100, 21)],
+        boundary=[(x0, 0), (x0 + 100, 0), (x0 + 100, 30), (x0, 30)],
+        color=color, text=text, confidence=confidence,
+    )
+
+
+def test_lines_are_stored_in_reading_order(image_id):
+    TranscriptionLine.replace_for_image(image_id, [line(200, "red", "Incipit"), line(0, "black", "liber")], "m1")
+    db.session.commit()
+
+    stored = [l.to_dict() for l in db.session.get(Image, image_id).lines]
+    assert [(l["order"], l["color"], l["text"], l["model"]) for l in stored] == \
+        [(0, "red", "Incipit", "m1"), (1, "black", "liber", "m1")]
+    assert stored[0]["baseline"] == [[200, 20], [300, 21]]
+    assert stored[0]["confidence"] == pytest.approx(0.9)
+
+
+def test_retranscription_replaces_lines(image_id):
+    TranscriptionLine.replace_for_image(image_id, [line(0, "black", "a"), line(0, "black", "b")], "m1")
+    TranscriptionLine.replace_for_image(image_id, [line(0, None, None, confidence=None)], "m2")
+    db.session.commit()
+
+    stored = [l.to_dict() for l in TranscriptionLine.query.filter_by(image_id=image_id)]
+    assert [(l["color"], l["text"], l["confidence"], l["model"]) for l in stored] == [("black", None, None, "m2")]
+
+
+def test_lines_go_with_their_image(image_id):
+    TranscriptionLine.replace_for_image(image_id, [line(0, "black", "a")], "m1")
+    db.session.commit()
+    db.session.delete(db.session.get(Image, image_id))
+    db.session.commit()
+    assert TranscriptionLine.query.count() == 0